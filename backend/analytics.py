@@ -0,0 +1,342 @@
+#!/usr/bin/env python3
+"""
+Precomputed attendance analytics for manager dashboards
+Dashboards used to read every attendance/{mess}/{date}/{meal}/students
+collection they chart. Instead, each completed day is rolled up once into
+
+  analytics/{mess}/daily/{YYYY-MM-DD}
+  analytics/{mess}/weekly/{YYYY-Www}   (ISO weeks)
+  analytics/{mess}/monthly/{YYYY-MM}
+
+and analytics/{mess} records how far the rollups go (updatedThrough).
+A rollup holds meal totals, per-meal 15-minute slot counts, a weekday x slot
+heatmap, per-weekday meal totals and a per-day series. Weekly and monthly
+rollups are re-derived from their daily documents whenever a day is added,
+so a repeated or concurrent update cannot count a day twice.
+
+Only the daily job (update_all, from scheduled_analytics) rolls days up; a
+backfill can read up to MAX_BACKFILL_DAYS of raw attendance, which does not
+belong in a request. report() serves a period from one rollup document,
+merging in today's scans for periods that include today. Both go through the shared cache:
+completed rollups for ANALYTICS_CACHE_SECONDS (default 300), today's
+partial counts for ANALYTICS_LIVE_SECONDS (default 60).
+"""
+
+import logging
+import threading
+from datetime import datetime, timedelta
+
+import ml_path  # noqa: F401 (puts ml_model on sys.path)
+import firestore_breaker
+from env_config import FIRESTORE_BATCH_LIMIT, env_float
+from shared_cache import get_cache
+
+logger = logging.getLogger(__name__)
+
+MEALS = ('breakfast', 'lunch', 'dinner')
+WEEKDAYS = ('Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun')
+PERIODS = ('day', 'week', 'month')
+COLLECTIONS = {'day': 'daily', 'week': 'weekly', 'month': 'monthly'}
+SLOT_MINUTES = 15
+# Most days rolled up in one update (first run, or after a long outage)
+MAX_BACKFILL_DAYS = 90
+
+
+def marked_at_datetime(value):
+    """Local naive datetime for a markedAt value (Timestamp, datetime or ISO string), or None"""
+    if hasattr(value, 'to_datetime'):
+        value = value.to_datetime()
+    elif isinstance(value, str):
+        try:
+            value = datetime.fromisoformat(value.replace('Z', '+00:00'))
+        except ValueError:
+            return None
+    if not isinstance(value, datetime):
+        return None
+    if value.tzinfo is not None:
+        value = value.astimezone(tz=None).replace(tzinfo=None)
+    return value
+
+
+def period_key(period, day):
+    """Document id of the period containing day"""
+    if period == 'week':
+        year, week, _ = day.isocalendar()
+        return f"{year}-W{week:02d}"
+    if period == 'month':
+        return day.strftime('%Y-%m')
+    return day.strftime('%Y-%m-%d')
+
+
+def period_days(period, day):
+    """First and last date of the period containing day"""
+    if period == 'week':
+        start = day - timedelta(days=day.weekday())
+        return start, start + timedelta(days=6)
+    if period == 'month':
+        start = day.replace(day=1)
+        following = (start + timedelta(days=32)).replace(day=1)
+        return start, following - timedelta(days=1)
+    return day, day
+
+
+# ----------------------------------------------------------------------
+# Rollups (plain dicts, stored as-is)
+# ----------------------------------------------------------------------
+
+def empty_rollup():
+    return {'days': 0, 'total': 0, 'meals': {}, 'slots': {}, 'heatmap': {}, 'weekdays': {}, 'series': {}}
+
+
+def day_rollup(date_str, meal_counts, slot_counts):
+    """
+    Rollup of one day
+    meal_counts: {meal: scans}; slot_counts: {meal: {'HH:MM': scans}}
+    """
+    weekday = WEEKDAYS[datetime.strptime(date_str, '%Y-%m-%d').weekday()]
+    total = sum(meal_counts.values())
+    rollup = empty_rollup()
+    if total == 0:
+        return rollup
+    heatmap = {}
+    for slots in slot_counts.values():
+        for slot, count in slots.items():
+            heatmap[slot] = heatmap.get(slot, 0) + count
+    rollup.update(
+        days=1,
+        total=total,
+        meals=dict(meal_counts),
+        slots={meal: dict(slots) for meal, slots in slot_counts.items() if slots},
+        heatmap={weekday: heatmap} if heatmap else {},
+        weekdays={weekday: {'days': 1, 'meals': dict(meal_counts)}},
+        series={date_str: {'total': total, 'meals': dict(meal_counts)}},
+    )
+    return rollup
+
+
+def _add(target, source):
+    for key, value in source.items():
+        if isinstance(value, dict):
+            _add(target.setdefault(key, {}), value)
+        else:
+            target[key] = target.get(key, 0) + value
+    return target
+
+
+def merge(*rollups):
+    """Sum of rollups over disjoint days"""
+    merged = empty_rollup()
+    for rollup in rollups:
+        _add(merged, rollup or {})
+    return merged
+
+
+def summarize(rollup):
+    """Averages, weekday profiles and peak slots derived from a rollup"""
+    days = rollup.get('days') or 0
+    peaks = {}
+    for meal, slots in rollup.get('slots', {}).items():
+        if slots:
+            slot = max(sorted(slots), key=slots.get)
+            peaks[meal] = {'slot': slot, 'count': slots[slot], 'average': round(slots[slot] / max(days, 1), 1)}
+    busiest = max(peaks.items(), key=lambda item: item[1]['count'], default=(None, None))
+    return {
+        'days': days,
+        'total': rollup.get('total', 0),
+        'meals': rollup.get('meals', {}),
+        'averages': {meal: round(count / days, 1) for meal, count in rollup.get('meals', {}).items()} if days else {},
+        'slots': rollup.get('slots', {}),
+        'heatmap': rollup.get('heatmap', {}),
+        'weekdays': {
+            weekday: {meal: round(count / profile['days'], 1) for meal, count in profile.get('meals', {}).items()}
+            for weekday, profile in rollup.get('weekdays', {}).items() if profile.get('days')
+        },
+        'peaks': peaks,
+        'peak': dict(busiest[1], meal=busiest[0]) if busiest[0] else None,
+        'series': [dict(value, date=date) for date, value in sorted(rollup.get('series', {}).items())],
+    }
+
+
+# ----------------------------------------------------------------------
+# Firestore
+# ----------------------------------------------------------------------
+
+class MessAnalytics:
+    """Maintains and serves the per-mess rollups"""
+
+    def __init__(self, db, shared_cache=None):
+        self.db = db
+        self.shared_cache = shared_cache or get_cache()
+        self.cache_seconds = env_float('ANALYTICS_CACHE_SECONDS', 300)
+        self.live_seconds = env_float('ANALYTICS_LIVE_SECONDS', 60)
+
+    def _mess_ref(self, mess_id):
+        return self.db.collection('analytics').document(mess_id)
+
+    def scan_counts(self, mess_id, date_str):
+        """({meal: scans}, {meal: {slot: scans}}) read from the raw attendance of a day"""
+        breaker = firestore_breaker.get_breaker()
+        date_col = self.db.collection('attendance').document(mess_id).collection(date_str)
+        meal_counts, slot_counts = {}, {}
+        for meal in MEALS:
+            students = date_col.document(meal).collection('students')
+            documents = breaker.call(lambda: list(students.stream()))
+            if not documents:
+                continue
+            meal_counts[meal] = len(documents)
+            slots = slot_counts.setdefault(meal, {})
+            for document in documents:
+                marked_at = marked_at_datetime((document.to_dict() or {}).get('markedAt'))
+                if marked_at is None:
+                    continue
+                slot = f"{marked_at.hour:02d}:{marked_at.minute // SLOT_MINUTES * SLOT_MINUTES:02d}"
+                slots[slot] = slots.get(slot, 0) + 1
+        return meal_counts, slot_counts
+
+    def update(self, mess_id, through=None):
+        """
+        Roll up completed days since updatedThrough (default: through yesterday)
+        Returns the number of days rolled up
+        """
+        through = through or (datetime.now() - timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0)
+        breaker = firestore_breaker.get_breaker()
+        meta = breaker.call(self._mess_ref(mess_id).get)
+        updated_through = (meta.to_dict() or {}).get('updatedThrough') if meta.exists else None
+
+        start = through - timedelta(days=MAX_BACKFILL_DAYS - 1)
+        if updated_through:
+            start = max(start, datetime.strptime(updated_through, '%Y-%m-%d') + timedelta(days=1))
+        if start > through:
+            return 0
+
+        daily = {}
+        day = start
+        while day <= through:
+            date_str = day.strftime('%Y-%m-%d')
+            rollup = day_rollup(date_str, *self.scan_counts(mess_id, date_str))
+            if rollup['days']:
+                daily[date_str] = rollup
+            day += timedelta(days=1)
+
+        writes = [(self._mess_ref(mess_id).collection('daily').document(date), rollup) for date, rollup in daily.items()]
+        for period in ('week', 'month'):
+            keys = {}
+            for date in daily:
+                keys.setdefault(period_key(period, datetime.strptime(date, '%Y-%m-%d')), date)
+            for key, date in keys.items():
+                rollup = self._derive(mess_id, period, datetime.strptime(date, '%Y-%m-%d'), daily)
+                writes.append((self._mess_ref(mess_id).collection(COLLECTIONS[period]).document(key), rollup))
+        writes.append((self._mess_ref(mess_id), {
+            'updatedThrough': through.strftime('%Y-%m-%d'),
+            'updatedAt': datetime.now().isoformat(),
+        }))
+
+        # Every write sets a complete document, so a retried commit is harmless
+        for offset in range(0, len(writes), FIRESTORE_BATCH_LIMIT):
+            batch = self.db.batch()
+            for ref, data in writes[offset:offset + FIRESTORE_BATCH_LIMIT]:
+                batch.set(ref, data)
+            breaker.call(batch.commit)
+        logger.info(f"Analytics for {mess_id}: rolled up {len(daily)} days through {through.strftime('%Y-%m-%d')}")
+        return len(daily)
+
+    def _derive(self, mess_id, period, day, fresh):
+        """Rollup of a week or month from its daily documents (fresh: {date: rollup} not yet written)"""
+        first, last = period_days(period, day)
+        daily_col = self._mess_ref(mess_id).collection('daily')
+        breaker = firestore_breaker.get_breaker()
+        rollups = []
+        cursor = first
+        while cursor <= last:
+            date_str = cursor.strftime('%Y-%m-%d')
+            if date_str in fresh:
+                rollups.append(fresh[date_str])
+            else:
+                document = breaker.call(daily_col.document(date_str).get)
+                if document.exists:
+                    rollups.append(document.to_dict())
+            cursor += timedelta(days=1)
+        return merge(*rollups)
+
+    def _stored(self, mess_id, period, key):
+        def load():
+            document = firestore_breaker.get_breaker().call(
+                self._mess_ref(mess_id).collection(COLLECTIONS[period]).document(key).get
+            )
+            return document.to_dict() if document.exists else None
+        return self.shared_cache.get_or_compute(
+            self.shared_cache.key('analytics', f"{mess_id}:{period}:{key}"), load, ttl=self.cache_seconds
+        )
+
+    def _updated_through(self, mess_id):
+        def load():
+            meta = firestore_breaker.get_breaker().call(self._mess_ref(mess_id).get)
+            return (meta.to_dict() or {}).get('updatedThrough') if meta.exists else None
+        return self.shared_cache.get_or_compute(
+            self.shared_cache.key('analytics-through', mess_id), load, ttl=self.cache_seconds
+        )
+
+    def _today(self, mess_id, now):
+        date_str = now.strftime('%Y-%m-%d')
+        return self.shared_cache.get_or_compute(
+            self.shared_cache.key('analytics-live', f"{mess_id}:{date_str}"),
+            lambda: day_rollup(date_str, *self.scan_counts(mess_id, date_str)),
+            ttl=self.live_seconds,
+        )
+
+    def report(self, mess_id, period='week', day=None, now=None):
+        """
+        Summary of the period containing day (default today), including today's scans so far
+        Completed days come from whatever update() has rolled up; report() never
+        rolls up itself, so updatedThrough in the result says how far that goes.
+        """
+        if period not in PERIODS:
+            raise ValueError(f"period must be one of {', '.join(PERIODS)}")
+        now = now or datetime.now()
+        day = day or now
+        if day.date() > now.date():
+            raise ValueError("date is in the future")
+        first, last = period_days(period, day.replace(hour=0, minute=0, second=0, microsecond=0))
+        key = period_key(period, day)
+
+        includes_today = first.date() <= now.date() <= last.date()
+        rollups = [] if period == 'day' and includes_today else [self._stored(mess_id, period, key)]
+        if includes_today:
+            rollups.append(self._today(mess_id, now))
+        report = summarize(merge(*rollups))
+        report.update(
+            messId=mess_id,
+            period=period,
+            key=key,
+            start=first.strftime('%Y-%m-%d'),
+            end=last.strftime('%Y-%m-%d'),
+            includesToday=includes_today,
+            updatedThrough=self._updated_through(mess_id),
+        )
+        return report
+
+    def update_all(self, mess_ids):
+        """Daily job: roll up completed days for every mess"""
+        results = {}
+        breaker = firestore_breaker.get_breaker()
+        for mess_id in mess_ids:
+            if breaker.is_open():
+                logger.warning(f"Firestore circuit open; skipping analytics from {mess_id}")
+                break
+            try:
+                results[mess_id] = self.update(mess_id)
+            except Exception as e:
+                logger.error(f"Analytics update failed for {mess_id}: {e}")
+        return results
+
+
+_analytics = None
+_analytics_lock = threading.Lock()
+
+def get_analytics(db):
+    """Process-wide MessAnalytics (db is used on first call)"""
+    global _analytics
+    with _analytics_lock:
+        if _analytics is None:
+            _analytics = MessAnalytics(db)
+    return _analytics
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+Request authorization for endpoints that expose attendance data
+Two kinds of credentials are accepted:
+
+  X-Admin-Token: <ADMIN_TOKEN>        operators (unusable when ADMIN_TOKEN is unset)
+  Authorization: Bearer <ID token>    a Firebase ID token, verified with firebase_admin
+
+Custom claims on the ID token decide what it may read:
+  admin: true or role: "admin"   everything
+  messIds: ["alder", ...]        analytics of those messes (managers)
+  enrollmentId: "21BCS001"       that student's own stats (any case)
+
+The Firebase app is initialized by the mess registry's Firestore client, so
+ID tokens cannot be verified without Firestore; the admin token still works.
+"""
+
+import os
+import hmac
+import logging
+
+logger = logging.getLogger(__name__)
+
+ADMIN_HEADER = 'X-Admin-Token'
+
+
+def has_admin_token(request):
+    """Whether the request carries the ADMIN_TOKEN value"""
+    token = os.environ.get('ADMIN_TOKEN')
+    supplied = request.headers.get(ADMIN_HEADER)
+    return bool(token and supplied and hmac.compare_digest(supplied, token))
+
+
+def _verify_id_token(id_token):
+    from firebase_admin import auth
+    return auth.verify_id_token(id_token)
+
+
+def id_token_claims(request):
+    """Claims of the request's verified Firebase ID token, or None"""
+    scheme, _, id_token = request.headers.get('Authorization', '').partition(' ')
+    if scheme.lower() != 'bearer' or not id_token.strip():
+        return None
+    try:
+        return _verify_id_token(id_token.strip())
+    except Exception as e:
+        logger.info(f"Rejected ID token: {e}")
+        return None
+
+
+def is_admin(claims):
+    return bool(claims) and (claims.get('admin') is True or claims.get('role') == 'admin')
+
+
+def authorize_mess(request, mess_id):
+    """
+    None when the request may read a mess's data, else (error body, status):
+    401 without valid credentials, 403 when they do not cover the mess
+    """
+    if has_admin_token(request):
+        return None
+    claims = id_token_claims(request)
+    if claims is None:
+        return {'error': 'Authentication required'}, 401
+    if is_admin(claims) or mess_id in (claims.get('messIds') or []):
+        return None
+    return {'error': 'Forbidden'}, 403
+
+
+def authorize_student(request, enrollment_id):
+    """None when the request may read a student's stats, else (error body, status) as for authorize_mess"""
+    if has_admin_token(request):
+        return None
+    claims = id_token_claims(request)
+    if claims is None:
+        return {'error': 'Authentication required'}, 401
+    own_id = str(claims.get('enrollmentId') or '').strip().lower()
+    if is_admin(claims) or (own_id and own_id == str(enrollment_id).strip().lower()):
+        return None
+    return {'error': 'Forbidden'}, 403
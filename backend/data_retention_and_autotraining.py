@@ -1,30 +1,48 @@
 """
 Auto-training and data retention service for SmartMess
 Runs periodically to:
-1. Train models every 7 days
+1. Retrain models when new data volume, drift or prediction error call for it
 2. Apply data retention policies
 3. Clean up old predictions, QR codes, etc.
 """
 
 import os
-import sys
 from datetime import datetime, timedelta
 import firebase_admin
 from firebase_admin import credentials, firestore
 import logging
 
+import retrain_policy
+from mess_registry import get_registry
+from prediction_log import PredictionLog, accuracy
+from analytics import MessAnalytics, marked_at_datetime
+from student_index import StudentIndex
+
 # Setup logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Add ml_model to path
-sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'ml_model'))
+import ml_path  # noqa: F401 (puts ml_model on sys.path)
+
+import profiling
+import firestore_metrics
+import firestore_breaker
+from shared_cache import get_cache
 
 try:
-    from train_tensorflow import train_mess_model_from_data
+    from train_tensorflow import train_mess_model_from_data, train_global_model_from_data, saved_trained_at
 except ImportError:
+    train_mess_model_from_data = None
+    train_global_model_from_data = None
+    saved_trained_at = None
     logger.warning("Could not import TensorFlow training module")
 
+try:
+    from mess_prediction_model import MessPredictionModel
+except ImportError:
+    MessPredictionModel = None
+    logger.warning("Could not import mess prediction model")
+
 class DataRetentionManager:
     """Manages data retention and cleanup policies"""
     
@@ -38,7 +56,7 @@ class DataRetentionManager:
             if not firebase_admin._apps:
                 firebase_admin.initialize_app(cred)
             
-            self.db = firestore.client()
+            self.db = firestore_metrics.instrument(firestore.client())
         except Exception as e:
             logger.error(f"Firebase init error: {e}")
             self.db = None
@@ -52,14 +70,15 @@ class DataRetentionManager:
         try:
             logger.info("Starting data retention cleanup...")
             
-            # 1. Delete QR codes older than 1 week
-            self._delete_old_qr_codes()
-            
-            # 2. Delete/Archive predictions older than 3 months
-            self._cleanup_old_predictions()
-            
-            # 3. Archive sessions older than 6 months
-            self._archive_old_sessions()
+            with firestore_metrics.job('retention', self.db):
+                # 1. Delete QR codes older than 1 week
+                self._delete_old_qr_codes()
+                
+                # 2. Delete/Archive predictions older than 3 months
+                self._cleanup_old_predictions()
+                
+                # 3. Archive sessions older than 6 months
+                self._archive_old_sessions()
             
             logger.info("Data retention cleanup completed")
             return True
@@ -92,12 +111,8 @@ class DataRetentionManager:
         try:
             cutoff_date = datetime.now() - timedelta(days=90)
             
-            # Get all messes
-            messes = self.db.collection('messes').stream()
-            
-            for mess in messes:
-                mess_id = mess.id
-                
+            # All messes, including inactive ones
+            for mess_id in get_registry(self.db).mess_ids():
                 # Delete old prediction records
                 pred_ref = self.db.collection('predictions').document(mess_id)
                 pred_dates = pred_ref.collections()
@@ -144,9 +159,21 @@ class DataRetentionManager:
 
 
 class AutoTrainerService:
-    """Automatically trains models every 7 days"""
+    """Retrains mess models when their streaming statistics call for it"""
+
+    # Most days of attendance folded into the statistics per check
+    STATS_MAX_DAYS = 14
+    # Days of served-prediction accuracy kept in model_metadata
+    ACCURACY_MAX_DAYS = 14
+    # Slot counts of completed days hardly change; jobs and instances share them
+    HISTORY_CACHE_SECONDS = 24 * 3600
+    # Days of attendance a full retrain learns from
+    TRAINING_DAYS = 30
+    # Older days loaded next to the new ones, so fine-tunes have buckets to replay
+    INCREMENTAL_REPLAY_DAYS = 7
     
     def __init__(self):
+        self.shared_cache = get_cache()
         try:
             if os.path.exists('serviceAccountKey.json'):
                 cred = credentials.Certificate('serviceAccountKey.json')
@@ -156,18 +183,22 @@ class AutoTrainerService:
             if not firebase_admin._apps:
                 firebase_admin.initialize_app(cred)
             
-            self.db = firestore.client()
+            self.db = firestore_metrics.instrument(firestore.client())
         except Exception as e:
             logger.error(f"Firebase init error: {e}")
             self.db = None
     
     def should_retrain(self, mess_id):
-        """Check if model should be retrained (hasn't been trained in 7 days)"""
+        """
+        Check if model should be retrained
+        Folds new attendance into the mess statistics first, then applies
+        the volume/drift/error thresholds from retrain_policy
+        """
         if not self.db:
             return False
         
         try:
-            # Get last training date from metadata
+            # Get last training date and statistics from metadata
             metadata_ref = self.db.collection('model_metadata').document(mess_id)
             metadata = metadata_ref.get()
             
@@ -175,20 +206,197 @@ class AutoTrainerService:
                 # Never trained - should train
                 return True
             
-            last_training = metadata.get('lastTrainedAt')
+            data = metadata.to_dict() or {}
+            last_training = data.get('lastTrainedAt')
             if last_training is None:
                 return True
-            
-            # Check if more than 7 days have passed
-            days_since_training = (datetime.now() - last_training).days
-            return days_since_training >= 7
+
+            stats = self.update_stats(mess_id, data)
+            should, reason = retrain_policy.retrain_decision(stats, last_training)
+            logger.info(f"Retrain check for {mess_id}: {'retrain' if should else 'skip'} ({reason})")
+            if should:
+                metadata_ref.set({'lastRetrainReason': reason}, merge=True)
+            return should
             
         except Exception as e:
             logger.error(f"Error checking retrain status: {e}")
             return False
-    
-    def retrain_model(self, mess_id):
-        """Retrain model for a specific mess"""
+
+    def update_stats(self, mess_id, metadata):
+        """Fold completed days since the last update into the mess statistics"""
+        stats = metadata.get('stats') or retrain_policy.new_stats()
+        yesterday = (datetime.now() - timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0)
+
+        start = yesterday - timedelta(days=self.STATS_MAX_DAYS - 1)
+        if stats.get('updatedThrough'):
+            start = max(start, datetime.strptime(stats['updatedThrough'], '%Y-%m-%d') + timedelta(days=1))
+        if start > yesterday:
+            return stats
+
+        served_model = None
+        if MessPredictionModel is not None:
+            served_model = MessPredictionModel(mess_id)
+
+        day = start
+        while day <= yesterday:
+            date_str = day.strftime('%Y-%m-%d')
+            slot_counts = self._slot_counts_for_day(mess_id, date_str)
+            if sum(slot_counts.values()) > 0:
+                predicted = None
+                if served_model is not None and served_model.model is not None:
+                    keys = list(slot_counts)
+                    slot_times = [
+                        day.replace(hour=int(key[:2]), minute=int(key[3:]))
+                        for key in keys
+                    ]
+                    counts = served_model.predict_counts(slot_times)
+                    predicted = {
+                        key: float(count)
+                        for key, count in zip(keys, counts)
+                        if count == count  # skip NaN
+                    }
+                retrain_policy.fold_day(stats, day, slot_counts, predicted)
+            stats['updatedThrough'] = date_str
+            day += timedelta(days=1)
+
+        self.db.collection('model_metadata').document(mess_id).set({'stats': stats}, merge=True)
+        return stats
+
+    def _slot_counts_for_day(self, mess_id, date_str, extra_keys=()):
+        """
+        Count scans per 15-minute slot for one completed day, zero-filling
+        every meal slot and any extra_keys (e.g. slots of a mess's own meal windows)
+        """
+        slot_counts = {key: 0 for key in extra_keys}
+        for meal in ['breakfast', 'lunch', 'dinner']:
+            for key in retrain_policy.meal_slot_keys(meal):
+                slot_counts.setdefault(key, 0)
+        counts = self.shared_cache.get_or_compute(
+            self.shared_cache.key('history', f"{mess_id}:{date_str}"),
+            lambda: self._scan_counts_for_day(mess_id, date_str),
+            ttl=self.HISTORY_CACHE_SECONDS,
+        )
+        for key, count in counts.items():
+            if key in slot_counts:
+                slot_counts[key] = count
+        return slot_counts
+
+    def _scan_counts_for_day(self, mess_id, date_str):
+        """{slot key: scans} for the slots of one day that had any"""
+        counts = {}
+        date_col = self.db.collection('attendance').document(mess_id).collection(date_str)
+        for meal in ['breakfast', 'lunch', 'dinner']:
+            for student in date_col.document(meal).collection('students').stream():
+                marked_at = marked_at_datetime((student.to_dict() or {}).get('markedAt'))
+                if marked_at is None:
+                    continue
+                key = retrain_policy.slot_key(marked_at)
+                counts[key] = counts.get(key, 0) + 1
+        return counts
+
+    def evaluate_served_predictions(self, mess_id, prediction_log=None):
+        """
+        Accuracy and bias of the predictions actually served, per completed day
+        Joins the prediction log with the day's slot counts and stores the
+        metrics in predictions/{mess}/{date}/accuracy and, for the last
+        ACCURACY_MAX_DAYS days, under servedAccuracy in model_metadata/{mess}
+        Returns {date: metrics} for the days evaluated
+        """
+        prediction_log = prediction_log or PredictionLog(db=self.db)
+        metadata_ref = self.db.collection('model_metadata').document(mess_id)
+        metadata = metadata_ref.get()
+        summary = ((metadata.to_dict() or {}) if metadata.exists else {}).get('servedAccuracy') or {}
+        yesterday = (datetime.now() - timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0)
+
+        day = yesterday - timedelta(days=self.ACCURACY_MAX_DAYS - 1)
+        if summary.get('updatedThrough'):
+            day = max(day, datetime.strptime(summary['updatedThrough'], '%Y-%m-%d') + timedelta(days=1))
+
+        evaluated = {}
+        while day <= yesterday:
+            date_str = day.strftime('%Y-%m-%d')
+            records = prediction_log.served_records(mess_id, date_str)
+            if records:
+                slot_counts = self._slot_counts_for_day(mess_id, date_str, {record['slot'] for record in records})
+                metrics = accuracy(records, slot_counts)
+                if metrics:
+                    evaluated[date_str] = metrics
+                    (self.db.collection('predictions').document(mess_id)
+                     .collection(date_str).document('accuracy').set({
+                         'messId': mess_id,
+                         'date': date_str,
+                         'metrics': metrics,
+                         'evaluatedAt': datetime.now(),
+                     }))
+                    logger.info(f"Served accuracy for {mess_id} on {date_str}: {metrics['all']}")
+            day += timedelta(days=1)
+
+        days = dict(summary.get('days') or {}, **evaluated)
+        metadata_ref.set({'servedAccuracy': {
+            'updatedThrough': yesterday.strftime('%Y-%m-%d'),
+            'days': {date: days[date] for date in sorted(days)[-self.ACCURACY_MAX_DAYS:]},
+        }}, merge=True)
+        return evaluated
+
+    def check_served_accuracy(self):
+        """Evaluate served predictions for every active mess"""
+        if not self.db:
+            logger.error("Firebase not initialized")
+            return {}
+
+        results = {}
+        try:
+            with firestore_metrics.job('served_accuracy', self.db):
+                prediction_log = PredictionLog(db=self.db)
+                breaker = firestore_breaker.get_breaker()
+                for mess_id in get_registry(self.db).mess_ids(active_only=True):
+                    if breaker.is_open():
+                        logger.warning(f"Firestore circuit open; skipping the remaining messes from {mess_id}")
+                        break
+                    try:
+                        results[mess_id] = self.evaluate_served_predictions(mess_id, prediction_log)
+                    except Exception as e:
+                        logger.error(f"Error evaluating served predictions for {mess_id}: {e}")
+        except Exception as e:
+            logger.error(f"Error in served accuracy check: {e}")
+        return results
+
+    def _load_training_data(self, mess_id, days=None):
+        """
+        Per-meal attendance counts for the last `days` days (today included)
+        Dates are enumerated rather than listed, and each meal is counted
+        with a count aggregation, so no attendance documents are read.
+        """
+        days = days or self.TRAINING_DAYS
+        today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+        breaker = firestore_breaker.get_breaker()
+        attendance_ref = self.db.collection('attendance').document(mess_id)
+        training_data = []
+        for offset in range(days - 1, -1, -1):
+            day = today - timedelta(days=offset)
+            date_col = attendance_ref.collection(day.strftime('%Y-%m-%d'))
+            for meal in ['breakfast', 'lunch', 'dinner']:
+                students = date_col.document(meal).collection('students')
+                result = breaker.call(lambda: students.count().get())
+                student_count = int(result[0][0].value)
+                if student_count > 0:
+                    training_data.append({
+                        'date': day,
+                        'meal': meal,
+                        'count': student_count,
+                    })
+        return training_data
+
+    def retrain_model(self, mess_id, incremental=False):
+        """
+        Retrain model for a specific mess
+        With incremental=True the saved model is fine-tuned on data since its
+        last training run (falling back to a full retrain when needed)
+        """
+        with firestore_metrics.job('retrain_model', self.db, mess=mess_id, incremental=incremental):
+            return self._retrain_model(mess_id, incremental)
+
+    def _retrain_model(self, mess_id, incremental):
         if not self.db:
             logger.error("Firebase not initialized")
             return False
@@ -196,54 +404,48 @@ class AutoTrainerService:
         try:
             logger.info(f"Starting model retrain for {mess_id}")
             
-            # Load attendance data for the past 30 days
-            cutoff_date = datetime.now() - timedelta(days=30)
-            training_data = []
-            
-            # Get all attendance records for past 30 days
-            attendance_ref = self.db.collection('attendance').document(mess_id)
-            date_collections = attendance_ref.collections()
-            
-            for date_col in date_collections:
-                try:
-                    col_date = datetime.strptime(date_col.id, '%Y-%m-%d')
-                    if col_date >= cutoff_date:
-                        # Get all meal data for this date
-                        for meal in ['breakfast', 'lunch', 'dinner']:
-                            meal_ref = date_col.document(meal)
-                            students_collection = meal_ref.collection('students')
-                            
-                            student_count = 0
-                            for student in students_collection.stream():
-                                student_count += 1
-                            
-                            if student_count > 0:
-                                training_data.append({
-                                    'date': col_date,
-                                    'meal': meal,
-                                    'count': student_count,
-                                })
-                except ValueError:
-                    pass
+            days = self.TRAINING_DAYS
+            trained_at = saved_trained_at(mess_id) if incremental and saved_trained_at else None
+            if trained_at is not None:
+                # A fine-tune only needs the days since the saved model
+                days = min(days, (datetime.now().date() - trained_at.date()).days + 1 + self.INCREMENTAL_REPLAY_DAYS)
+            training_data = self._load_training_data(mess_id, days)
             
             if not training_data:
                 logger.warning(f"No training data available for {mess_id}")
                 return False
             
+            if train_mess_model_from_data is None:
+                logger.error("TensorFlow training module unavailable")
+                return False
+
             # Train model (this calls the actual TensorFlow training)
             try:
-                # For now, just log that we would train
-                # In production, call: train_mess_model_from_data(mess_id, training_data)
-                logger.info(f"Would train {mess_id} model with {len(training_data)} records")
+                logger.info(f"Training {mess_id} model with {len(training_data)} records (incremental={incremental})")
+                mode = train_mess_model_from_data(mess_id, training_data, incremental=incremental,
+                                                  full_fallback=days >= self.TRAINING_DAYS)
+                if mode == 'full_required':
+                    logger.info(f"Cannot fine-tune {mess_id}; retraining on the last {self.TRAINING_DAYS} days")
+                    training_data = self._load_training_data(mess_id)
+                    mode = train_mess_model_from_data(mess_id, training_data)
+                if not mode:
+                    logger.warning(f"Training did not produce a model for {mess_id}")
+                    return False
                 
-                # Update metadata with new training date
-                self.db.collection('model_metadata').document(mess_id).set({
-                    'lastTrainedAt': datetime.now(),
-                    'recordsUsed': len(training_data),
-                    'status': 'trained',
-                }, merge=True)
+                metadata_ref = self.db.collection('model_metadata').document(mess_id)
+                update = {'recordsUsed': len(training_data), 'status': 'trained', 'trainingMode': mode}
+                if mode == 'full':
+                    # lastTrainedAt and the retrain policy's observation window
+                    # only move on full fits; fine-tunes run after every meal
+                    # and would keep the volume, drift and age triggers from firing
+                    metadata = metadata_ref.get()
+                    stats = (metadata.to_dict() or {}).get('stats') if metadata.exists else None
+                    update.update(lastTrainedAt=datetime.now(), stats=retrain_policy.reset_after_training(stats))
+                elif mode == 'incremental':
+                    update['lastIncrementalAt'] = datetime.now()
+                metadata_ref.set(update, merge=True)
                 
-                logger.info(f"Successfully retrained {mess_id}")
+                logger.info(f"Successfully retrained {mess_id} ({mode})")
                 return True
                 
             except Exception as e:
@@ -254,26 +456,67 @@ class AutoTrainerService:
             logger.error(f"Error retraining model for {mess_id}: {e}")
             return False
     
-    def check_and_retrain_all(self):
-        """Check all messes and retrain if needed"""
+    def check_and_retrain_all(self, incremental=False):
+        """
+        Check all messes and retrain if needed
+        Incremental runs are cheap, so they skip the retrain check and
+        fine-tune every mess
+        """
         if not self.db:
             logger.error("Firebase not initialized")
             return
         
         try:
-            messes = self.db.collection('messes').stream()
-            
-            for mess in messes:
-                mess_id = mess.id
-                if self.should_retrain(mess_id):
-                    logger.info(f"Retraining {mess_id}...")
-                    self.retrain_model(mess_id)
+            with profiling.profile('retrain_all', 'incremental' if incremental else None, training=True), \
+                    firestore_metrics.job('retrain_all', self.db, incremental=incremental):
+                breaker = firestore_breaker.get_breaker()
+                for mess_id in get_registry(self.db).mess_ids(active_only=True):
+                    if breaker.is_open():
+                        logger.warning(f"Firestore circuit open; skipping the remaining messes from {mess_id}")
+                        break
+                    if incremental or self.should_retrain(mess_id):
+                        logger.info(f"Retraining {mess_id}...")
+                        self.retrain_model(mess_id, incremental=incremental)
             
             logger.info("Auto-training check completed")
             
         except Exception as e:
             logger.error(f"Error in auto-training: {e}")
 
+    def retrain_global_model(self):
+        """Retrain the shared multi-mess model on every mess's recent data"""
+        if not self.db:
+            logger.error("Firebase not initialized")
+            return False
+        if train_global_model_from_data is None:
+            logger.error("TensorFlow training module unavailable")
+            return False
+
+        try:
+            with firestore_metrics.job('retrain_global', self.db):
+                records_by_mess = {}
+                capacities = {}
+                for mess_id, mess in get_registry(self.db).all(active_only=True).items():
+                    training_data = self._load_training_data(mess_id)
+                    if training_data:
+                        records_by_mess[mess_id] = training_data
+                        capacities[mess_id] = mess['capacity']
+
+                if not records_by_mess:
+                    logger.warning("No training data available for the global model")
+                    return False
+
+                logger.info(f"Training global model on {len(records_by_mess)} messes")
+                if not train_global_model_from_data(records_by_mess, capacities=capacities):
+                    logger.warning("Training did not produce a global model")
+                    return False
+                logger.info("Successfully retrained global model")
+                return True
+
+        except Exception as e:
+            logger.error(f"Error retraining global model: {e}")
+            return False
+
 
 # Scheduled task functions (for Cloud Functions or APScheduler)
 def scheduled_data_retention():
@@ -288,6 +531,55 @@ def scheduled_auto_training():
     trainer.check_and_retrain_all()
 
 
+def scheduled_global_training():
+    """Retrain the shared multi-mess model (call this daily when USE_GLOBAL_MODEL is on)"""
+    trainer = AutoTrainerService()
+    return trainer.retrain_global_model()
+
+
+def scheduled_served_accuracy():
+    """Measure the accuracy of served predictions (call this daily)"""
+    trainer = AutoTrainerService()
+    return trainer.check_served_accuracy()
+
+
+def scheduled_analytics():
+    """Roll up completed days of attendance for the manager dashboards (call this daily)"""
+    trainer = AutoTrainerService()
+    if not trainer.db:
+        logger.error("Firebase not initialized")
+        return {}
+    with firestore_metrics.job('analytics', trainer.db):
+        return MessAnalytics(trainer.db).update_all(get_registry(trainer.db).mess_ids(active_only=True))
+
+
+def scheduled_student_index(days=1):
+    """Re-index the last days of attendance per student, catching scans the listener missed (call this daily)"""
+    trainer = AutoTrainerService()
+    if not trainer.db:
+        logger.error("Firebase not initialized")
+        return {}
+    index = StudentIndex(trainer.db)
+    today = datetime.now()
+    seen = {}
+    with firestore_metrics.job('student_index', trainer.db):
+        for mess_id in get_registry(trainer.db).mess_ids(active_only=True):
+            for offset in range(days, 0, -1):
+                date_str = (today - timedelta(days=offset)).strftime('%Y-%m-%d')
+                try:
+                    seen[mess_id] = seen.get(mess_id, 0) + index.index_day(mess_id, date_str)
+                except Exception as e:
+                    logger.warning(f"Student index for {mess_id} on {date_str} failed: {e}")
+    logger.info(f"Student index reconciled {sum(seen.values())} scans in {len(seen)} messes")
+    return seen
+
+
+def scheduled_incremental_training():
+    """Fine-tune every mess model on new data (call this after each meal window)"""
+    trainer = AutoTrainerService()
+    trainer.check_and_retrain_all(incremental=True)
+
+
 if __name__ == '__main__':
     print("SmartMess Auto-Training and Data Retention Service")
     print("=" * 50)
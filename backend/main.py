@@ -1,6 +1,7 @@
 import os
-import sys
-from datetime import datetime, timedelta, time
+import threading
+import time as time_module
+from datetime import datetime, timedelta
 
 from flask import Flask, request, jsonify
 from flask_cors import CORS
@@ -23,7 +24,7 @@ CORS(
             "http://127.0.0.1:3000",
         ],
         "methods": ["GET", "POST", "OPTIONS"],
-        "allow_headers": ["Content-Type", "Authorization"],
+        "allow_headers": ["Content-Type", "Authorization", "X-Admin-Token"],
     }},
 )
 
@@ -31,95 +32,155 @@ CORS(
 # Optional ML import (NON-FATAL)
 # ------------------------------------------------------------
 
+import ml_path  # noqa: F401 (puts ml_model on sys.path)
+
+import profiling
+import firestore_breaker
+import shared_cache
+from mess_registry import get_registry
+from prediction_log import get_prediction_log
+from sharding import get_shard_router, FORWARDED_HEADER
+from analytics import get_analytics, PERIODS as ANALYTICS_PERIODS
+from student_index import get_student_index, start_listener as start_student_index_listener
+import api_auth
+from meal_slots import (
+    MEAL_WINDOWS, round_up_to_next_slot, get_current_meal,
+    generate_slots_for_meal, generate_fallback_predictions,
+)
+
 PredictionService = None
+start_online_ingestion = None
 try:
-    sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "ml_model"))
-    from prediction_model_tf import PredictionService  # type: ignore
+    from prediction_model_tf import PredictionService, start_online_ingestion  # type: ignore
 except Exception as e:
     print("[WARN] PredictionService unavailable:", e)
 
 # ------------------------------------------------------------
-# Constants
+# Mess registry (loaded on first use, kept fresh by a listener)
 # ------------------------------------------------------------
 
-MEAL_WINDOWS = {
-    "breakfast": (time(7, 30), time(9, 30)),
-    "lunch": (time(12, 0), time(14, 0)),
-    "dinner": (time(19, 30), time(21, 30)),
-}
+_registry_started = False
+
 
-SLOT_MINUTES = 15
+def get_mess_registry():
+    global _registry_started
+    registry = get_registry()
+    if not _registry_started:
+        _registry_started = True
+        registry.refresh()
+        registry.start_listener()
+    return registry
 
 # ------------------------------------------------------------
-# Helpers
+# Precomputed predictions (started on first use)
 # ------------------------------------------------------------
 
-def round_up_to_next_slot(dt: datetime) -> datetime:
-    minute = (dt.minute // SLOT_MINUTES) * SLOT_MINUTES
-    slot = dt.replace(minute=minute, second=0, microsecond=0)
-    if slot <= dt:
-        slot += timedelta(minutes=SLOT_MINUTES)
-    return slot
+_scheduler = None
+_scheduler_lock = threading.Lock()
 
 
-def get_current_meal():
-    now = datetime.now().time()
-    for meal, (start, end) in MEAL_WINDOWS.items():
-        if start <= now < end:
-            return meal
-    return None
+def get_scheduler():
+    """PredictionScheduler shared by all requests, or None without the ML stack"""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None and PredictionService is not None:
+            _scheduler = _create_scheduler()
+    return _scheduler
 
 
-def generate_slots_for_meal(meal_type: str, max_slots=6):
-    if meal_type not in MEAL_WINDOWS:
-        return []
+def _create_scheduler():
+    from prediction_scheduler import PredictionScheduler
+    registry = get_mess_registry()
+    db = registry.db if os.environ.get("PREDICTION_PUBLISH", "1") == "1" else None
+    scheduler = PredictionScheduler(
+        PredictionService(), MEAL_WINDOWS, db=db, registry=registry, owns=get_shard_router().owns
+    )
+    if os.environ.get("PREDICTION_SCHEDULER", "1") == "1":
+        scheduler.start()
+    return scheduler
 
-    now = datetime.now()
-    start_t, end_t = MEAL_WINDOWS[meal_type]
-
-    start_dt = now.replace(hour=start_t.hour, minute=start_t.minute, second=0, microsecond=0)
-    end_dt = now.replace(hour=end_t.hour, minute=end_t.minute, second=0, microsecond=0)
-
-    if now >= end_dt:
-        return []
-
-    cursor = max(round_up_to_next_slot(now), start_dt)
-
-    slots = []
-    while cursor < end_dt and len(slots) < max_slots:
-        slots.append(cursor)
-        cursor += timedelta(minutes=SLOT_MINUTES)
-
-    return slots
-
-
-def generate_fallback_predictions(meal_type, capacity=100):
-    slots = generate_slots_for_meal(meal_type)
-
-    base_pct = {
-        "breakfast": 25,
-        "lunch": 40,
-        "dinner": 45,
-    }.get(meal_type, 20)
-
-    predictions = []
-    for i, t in enumerate(slots):
-        pct = min(90, base_pct + i * 6)
-        predictions.append({
-            "time_slot": t.strftime("%I:%M %p"),
-            "time_24h": t.strftime("%H:%M"),
-            "predicted_crowd": int(capacity * pct / 100),
-            "crowd_percentage": float(pct),
-            "capacity": capacity,
-            "confidence": "low",
-            "recommendation": (
-                "Good time" if pct < 40 else
-                "Moderate crowd" if pct < 70 else
-                "Avoid if possible"
-            ),
-        })
+# ------------------------------------------------------------
+# Served-prediction log (buffered, flushed off the request path)
+# ------------------------------------------------------------
 
-    return predictions
+def log_served(mess_id, date, rows, source, model_version=None):
+    """Record served prediction rows for accuracy tracking; never fails a request"""
+    try:
+        get_prediction_log(get_mess_registry().db).record(mess_id, date, rows, source, model_version)
+    except Exception as e:
+        print("[WARN] Prediction log unavailable:", e)
+
+# ------------------------------------------------------------
+# Warm-up (models loaded and traced, caches filled before traffic)
+# ------------------------------------------------------------
+
+_warmup = {"pid": None, "state": "pending", "seconds": None, "error": None}
+_warmup_lock = threading.Lock()
+
+
+@app.before_request
+def start_warmup():
+    """
+    Warm up once per process in a background thread, started by the first
+    request (a /ready startup probe). gunicorn --preload forks workers after
+    import, so a thread started at import would not survive in them; the
+    Firestore listeners start here for the same reason.
+    """
+    with _warmup_lock:
+        if _warmup["pid"] == os.getpid():
+            return
+        _warmup.update(pid=os.getpid(), state="warming", seconds=None, error=None)
+    if os.environ.get("STUDENT_INDEX", "1") == "1":
+        threading.Thread(target=_run_student_index, name="student-index-listener", daemon=True).start()
+    if start_online_ingestion is not None:
+        threading.Thread(target=_run_online_ingestion, name="online-model-listener", daemon=True).start()
+    if os.environ.get("WARMUP", "1") != "1" or PredictionService is None:
+        _warmup["state"] = "ready"
+        return
+    threading.Thread(target=_run_warmup, name="warmup", daemon=True).start()
+
+
+def _run_student_index():
+    """Index this shard's new attendance scans per student as they arrive"""
+    try:
+        db = get_mess_registry().db
+        if db is not None:
+            start_student_index_listener(db, get_student_index(db), owns=get_shard_router().owns)
+    except Exception as e:
+        print("[ERROR] Student index listener not started:", e)
+
+
+def _run_online_ingestion():
+    """Feed this shard's new attendance scans into the online model"""
+    start_online_ingestion(owns=get_shard_router().owns)
+
+
+def _warmup_mess_ids(registry):
+    """This shard's active registered messes plus any listed in WARMUP_MESSES"""
+    mess_ids = registry.mess_ids(active_only=True) if registry.loaded else []
+    extra = [part.strip() for part in os.environ.get("WARMUP_MESSES", "").split(",") if part.strip()]
+    return get_shard_router().shard(list(dict.fromkeys(mess_ids + extra)))
+
+
+def _run_warmup():
+    started = time_module.perf_counter()
+    try:
+        registry = get_mess_registry()
+        scheduler = get_scheduler()
+        mess_ids = _warmup_mess_ids(registry)
+        scheduler.service.warm_up(mess_ids)
+        # Fill today's prediction cache (and the published documents)
+        for mess_id in mess_ids:
+            if registry.get(mess_id) is None:
+                scheduler.track(mess_id, 100)
+        scheduler.refresh()
+        _warmup["state"] = "ready"
+    except Exception as e:
+        # Requests are still served (lazily loaded or fallback); report the failure
+        print("[WARN] Warm-up failed:", e)
+        _warmup.update(state="failed", error=str(e))
+    _warmup["seconds"] = round(time_module.perf_counter() - started, 3)
+    print(f"[OK] Warm-up {_warmup['state']} in {_warmup['seconds']}s")
 
 # ------------------------------------------------------------
 # Health
@@ -129,9 +190,29 @@ def generate_fallback_predictions(meal_type, capacity=100):
 def health():
     return jsonify({
         "status": "ok",
+        "firestore": firestore_breaker.get_breaker().snapshot(),
+        "cache": shared_cache.get_cache().snapshot(),
+        "shard": get_shard_router().snapshot(),
         "timestamp": datetime.utcnow().isoformat(),
     })
 
+@app.route("/ready", methods=["GET"])
+def ready():
+    """
+    Readiness: 503 while models are loading and warming up, 200 afterwards
+    Reports per-mess state and load/warm-up durations
+    """
+    scheduler = _scheduler
+    is_ready = _warmup["state"] in ("ready", "failed")
+    return jsonify({
+        "ready": is_ready,
+        "state": _warmup["state"],
+        "seconds": _warmup["seconds"],
+        "error": _warmup["error"],
+        "messes": dict(scheduler.service.readiness) if scheduler else {},
+        "timestamp": datetime.utcnow().isoformat(),
+    }), 200 if is_ready else 503
+
 # ------------------------------------------------------------
 # Predict
 # ------------------------------------------------------------
@@ -142,11 +223,33 @@ def predict():
         return "", 204
 
     payload = request.get_json(silent=True) or {}
+    with profiling.profile("predict", payload.get("messId")):
+        return _predict(payload)
+
+
+def _predict(payload):
+    mess_id = str(payload.get("messId") or "").strip()
+    if not mess_id:
+        return jsonify({"error": "messId is required"}), 400
+
+    # Registered messes use their stored capacity and meal windows; the
+    # client's capacity only applies when no registry is available
+    registry = get_mess_registry()
+    mess = registry.get(mess_id)
+    if registry.loaded and (mess is None or not mess["active"]):
+        return jsonify({"error": f"Unknown mess: {mess_id}"}), 404
+    if mess is not None:
+        capacity = mess["capacity"]
+        windows = mess["meal_windows"]
+    else:
+        try:
+            capacity = int(payload.get("capacity") or 100)
+        except (TypeError, ValueError):
+            capacity = 100
+        windows = MEAL_WINDOWS
 
-    mess_id = payload.get("messId", "alder")
-    capacity = int(payload.get("capacity", 100))
-
-    meal_type = payload.get("mealType") or get_current_meal()
+    today = datetime.now().strftime("%Y-%m-%d")
+    meal_type = payload.get("mealType") or get_current_meal(windows)
     if not meal_type:
         return jsonify({
             "warning": "Outside meal hours",
@@ -154,28 +257,31 @@ def predict():
         }), 200
 
     # ----------------------------------------------------
-    # Try ML first (NO meal_type passed ❗)
+    # Precomputed ML predictions (cache read)
     # ----------------------------------------------------
-    if PredictionService is not None:
-        try:
-            service = PredictionService()
-            result = service.predict_next_slots(
-                mess_id=mess_id
-            )
-
-            if result and result.get("predictions"):
-                return jsonify({
-                    "source": "ml-model",
-                    "fallback": False,
-                    **result,
-                })
-        except Exception as e:
-            print("[WARN] ML prediction failed:", e)
+    router = get_shard_router()
+    try:
+        scheduler = get_scheduler()
+        forwarded = request.headers.get(FORWARDED_HEADER)
+        if router.owns(mess_id) or router.trusts(forwarded):
+            predictions = scheduler.predictions(mess_id, meal_type, capacity) if scheduler else None
+            if predictions:
+                log_served(mess_id, today, predictions, "ml-model", scheduler.model_version(mess_id))
+                return _ml_response(mess_id, meal_type, capacity, predictions)
+        else:
+            # An unverified forwarded request is not forwarded again (no loops)
+            response = _foreign_predict(router, scheduler, mess_id, meal_type, capacity, payload,
+                                        forward=not forwarded)
+            if response is not None:
+                return response
+    except Exception as e:
+        print("[WARN] ML prediction failed:", e)
 
     # ----------------------------------------------------
     # Fallback (guaranteed output)
     # ----------------------------------------------------
-    predictions = generate_fallback_predictions(meal_type, capacity)
+    predictions = generate_fallback_predictions(meal_type, capacity, windows=windows)
+    log_served(mess_id, today, predictions, "fallback")
 
     return jsonify({
         "source": "fallback",
@@ -189,10 +295,317 @@ def predict():
         "timestamp": datetime.utcnow().isoformat(),
     })
 
+def _ml_response(mess_id, meal_type, capacity, predictions, **extra):
+    return jsonify({
+        "source": "ml-model",
+        "fallback": False,
+        "messId": mess_id,
+        "mealType": meal_type,
+        "capacity": capacity,
+        "current_crowd": 0,
+        "current_percentage": 0.0,
+        "predictions": predictions,
+        **extra,
+        "timestamp": datetime.utcnow().isoformat(),
+    })
+
+
+def _foreign_predict(router, scheduler, mess_id, meal_type, capacity, payload, forward=True):
+    """
+    Serve a mess owned by another instance without loading its model: from
+    the owner's precomputed table, else by forwarding; None to fall back
+    """
+    from prediction_scheduler import upcoming_rows
+    now = datetime.now()
+    table = scheduler.table(mess_id, now) if scheduler else None
+    if table and table.get("capacity") == capacity:
+        predictions = upcoming_rows(table, meal_type, now)
+        if predictions:
+            router.counters["table_hits"] += 1
+            log_served(mess_id, table["date"], predictions, "ml-model", table.get("modelVersion"))
+            return _ml_response(mess_id, meal_type, capacity, predictions, servedBy=router.owner(mess_id))
+    forwarded = router.forward(mess_id, "/predict", payload) if forward else None
+    if forwarded is not None and forwarded[0] == 200:
+        return jsonify(forwarded[1])
+    return None
+
+# ------------------------------------------------------------
+# Forecast
+# ------------------------------------------------------------
+
+FORECAST_MAX_DAYS = 2
+FORECAST_MAX_MESSES = 50
+FORECAST_SLOTS_PER_MEAL = 8
+
+
+def _forecast_args():
+    """(mess ids, days, capacity) from the query string or the JSON body"""
+    if request.method == "POST":
+        body = request.get_json(silent=True) or {}
+        raw_ids = body.get("messIds") or body.get("messId") or []
+        days, capacity = body.get("days", 1), body.get("capacity")
+    else:
+        raw_ids = request.args.getlist("messId") + request.args.getlist("messIds")
+        days, capacity = request.args.get("days", 1), request.args.get("capacity")
+    if isinstance(raw_ids, str):
+        raw_ids = [raw_ids]
+    mess_ids = list(dict.fromkeys(
+        part.strip() for value in raw_ids for part in str(value).split(",") if part.strip()
+    ))
+    days = int(days)
+    try:
+        capacity = int(capacity or 100)
+    except (TypeError, ValueError):
+        capacity = 100
+    return mess_ids, days, capacity
+
+
+def _mess_forecast(mess_id, capacity, windows, payloads, days, now):
+    """Response entry for one mess: ML payloads when available, fallback otherwise"""
+    next_slot = round_up_to_next_slot(now)
+    cutoff = next_slot.strftime("%H:%M") if next_slot.date() == now.date() else "24:00"
+    forecast_days = []
+    for offset in range(days):
+        day = now + timedelta(days=offset)
+        if payloads:
+            meals = payloads[offset]["meals"]
+            if offset == 0:
+                meals = {meal: [row for row in rows if row["time_24h"] >= cutoff] for meal, rows in meals.items()}
+        else:
+            start = now if offset == 0 else datetime.combine(day.date(), time.min)
+            meals = {
+                meal: generate_fallback_predictions(
+                    meal, capacity, now=start, max_slots=FORECAST_SLOTS_PER_MEAL, windows=windows
+                )
+                for meal in windows
+            }
+        date = day.strftime("%Y-%m-%d")
+        forecast_days.append({
+            "date": date,
+            "meals": {meal: rows for meal, rows in meals.items() if rows},
+        })
+        log_served(
+            mess_id, date, [row for rows in meals.values() for row in rows],
+            "ml-model" if payloads else "fallback",
+            payloads[offset].get("modelVersion") if payloads else None,
+        )
+    return {
+        "messId": mess_id,
+        "capacity": capacity,
+        "source": "ml-model" if payloads else "fallback",
+        "fallback": not payloads,
+        "days": forecast_days,
+    }
+
+
+def _forward_forecasts(router, mess_ids, days, capacity):
+    """Forecast entries for foreign messes, one forwarded request per owner"""
+    by_owner = {}
+    for mess_id in mess_ids:
+        by_owner.setdefault(router.owner(mess_id), []).append(mess_id)
+    forecasts = {}
+    for group in by_owner.values():
+        forwarded = router.forward(group[0], "/forecast", {"messIds": group, "days": days, "capacity": capacity})
+        if forwarded is not None and forwarded[0] == 200:
+            forecasts.update({
+                mess_id: entry for mess_id, entry in (forwarded[1].get("forecasts") or {}).items()
+                if mess_id in group
+            })
+    return forecasts
+
+
+@app.route("/forecast", methods=["GET", "POST", "OPTIONS"])
+def forecast():
+    """
+    Slot predictions for every remaining meal today, and with days=2 for
+    tomorrow too, for one or more messes
+    GET /forecast?messId=alder,oak&days=2 or POST {"messIds": ["alder", "oak"], "days": 2}
+    Responses can be cached until the next slot boundary.
+    """
+    if request.method == "OPTIONS":
+        return "", 204
+
+    try:
+        mess_ids, days, capacity = _forecast_args()
+    except (TypeError, ValueError):
+        return jsonify({"error": "days must be an integer"}), 400
+    if not mess_ids:
+        return jsonify({"error": "messId is required"}), 400
+    if len(mess_ids) > FORECAST_MAX_MESSES:
+        return jsonify({"error": f"At most {FORECAST_MAX_MESSES} messes per request"}), 400
+    if not 1 <= days <= FORECAST_MAX_DAYS:
+        return jsonify({"error": f"days must be between 1 and {FORECAST_MAX_DAYS}"}), 400
+
+    registry = get_mess_registry()
+    capacities, windows, unknown = {}, {}, []
+    for mess_id in mess_ids:
+        mess = registry.get(mess_id)
+        if registry.loaded and (mess is None or not mess["active"]):
+            unknown.append(mess_id)
+            continue
+        capacities[mess_id] = mess["capacity"] if mess else capacity
+        windows[mess_id] = mess["meal_windows"] if mess else MEAL_WINDOWS
+    if unknown:
+        return jsonify({"error": f"Unknown mess: {', '.join(unknown)}"}), 404
+
+    now = datetime.now()
+    with profiling.profile("forecast", ",".join(mess_ids)):
+        router = get_shard_router()
+        forwarded = request.headers.get(FORWARDED_HEADER)
+        trusted = router.trusts(forwarded)
+        owned = {mess_id: cap for mess_id, cap in capacities.items() if trusted or router.owns(mess_id)}
+        foreign = [mess_id for mess_id in capacities if mess_id not in owned]
+        # An unverified forwarded request is not forwarded again; its foreign messes get the fallback
+        forecasts = _forward_forecasts(router, foreign, days, capacity) if foreign and not forwarded else {}
+
+        payloads = {}
+        try:
+            scheduler = get_scheduler()
+            payloads = scheduler.forecast(owned, days=days, now=now) if scheduler and owned else {}
+        except Exception as e:
+            print("[WARN] ML forecast failed:", e)
+
+        for mess_id in capacities:
+            if mess_id not in forecasts:
+                forecasts[mess_id] = _mess_forecast(
+                    mess_id, capacities[mess_id], windows[mess_id], payloads.get(mess_id), days, now
+                )
+        forecasts = {mess_id: forecasts[mess_id] for mess_id in capacities}
+
+    response = jsonify({
+        "days": days,
+        "forecasts": forecasts,
+        "timestamp": datetime.utcnow().isoformat(),
+    })
+    max_age = max(1, int((round_up_to_next_slot(now) - now).total_seconds()))
+    response.headers["Cache-Control"] = f"public, max-age={max_age}"
+    return response
+
+# ------------------------------------------------------------
+# Analytics
+# ------------------------------------------------------------
+
+@app.route("/analytics", methods=["GET", "OPTIONS"])
+def analytics():
+    """
+    Attendance rollup for a manager dashboard: meal totals, slot heatmap,
+    weekday profile and peaks for one day, week or month
+    GET /analytics?messId=alder&period=week&date=2026-05-01 (date defaults to today)
+    Requires the admin token or an ID token for the mess (see api_auth)
+    """
+    if request.method == "OPTIONS":
+        return "", 204
+
+    mess_id = (request.args.get("messId") or "").strip()
+    period = request.args.get("period", "week")
+    if not mess_id:
+        return jsonify({"error": "messId is required"}), 400
+    registry = get_mess_registry()  # initializes firebase_admin for ID token checks
+    denied = api_auth.authorize_mess(request, mess_id)
+    if denied:
+        return jsonify(denied[0]), denied[1]
+    if period not in ANALYTICS_PERIODS:
+        return jsonify({"error": f"period must be one of {', '.join(ANALYTICS_PERIODS)}"}), 400
+    try:
+        day = datetime.strptime(request.args["date"], "%Y-%m-%d") if request.args.get("date") else None
+    except ValueError:
+        return jsonify({"error": "date must be YYYY-MM-DD"}), 400
+
+    mess = registry.get(mess_id)
+    if registry.loaded and mess is None:
+        return jsonify({"error": f"Unknown mess: {mess_id}"}), 404
+    if registry.db is None:
+        return jsonify({"error": "Analytics unavailable without Firestore"}), 503
+
+    with profiling.profile("analytics", mess_id):
+        try:
+            report = get_analytics(registry.db).report(mess_id, period, day)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        except Exception as e:
+            print("[WARN] Analytics failed:", e)
+            return jsonify({"error": "Analytics unavailable"}), 503
+
+    response = jsonify(dict(report, timestamp=datetime.utcnow().isoformat()))
+    response.headers["Cache-Control"] = "private, max-age=60"
+    return response
+
+# ------------------------------------------------------------
+# Per-student attendance stats
+# ------------------------------------------------------------
+
+@app.route("/students/<enrollment_id>/stats", methods=["GET", "OPTIONS"])
+def student_stats(enrollment_id):
+    """
+    A student's attendance for one month from the per-student index:
+    per-meal counts, attended days and rates, and counts per mess
+    GET /students/21bcs001/stats?month=2026-05 (month defaults to the current one)
+    Requires the admin token or the student's own ID token (see api_auth)
+    """
+    if request.method == "OPTIONS":
+        return "", 204
+
+    db = get_mess_registry().db  # also initializes firebase_admin for ID token checks
+    denied = api_auth.authorize_student(request, enrollment_id)
+    if denied:
+        return jsonify(denied[0]), denied[1]
+
+    month = request.args.get("month") or datetime.now().strftime("%Y-%m")
+    try:
+        datetime.strptime(month, "%Y-%m")
+    except ValueError:
+        return jsonify({"error": "month must be YYYY-MM"}), 400
+
+    if db is None:
+        return jsonify({"error": "Student stats unavailable without Firestore"}), 503
+
+    with profiling.profile("student_stats"):
+        try:
+            stats = get_student_index(db).stats(enrollment_id, month)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        except Exception as e:
+            print("[WARN] Student stats failed:", e)
+            return jsonify({"error": "Student stats unavailable"}), 503
+
+    response = jsonify(dict(stats, timestamp=datetime.utcnow().isoformat()))
+    response.headers["Cache-Control"] = "private, max-age=30"
+    return response
+
+# ------------------------------------------------------------
+# Admin: sampling profiler
+# ------------------------------------------------------------
+
+@app.route("/admin/profiling", methods=["GET", "POST"])
+def admin_profiling():
+    """
+    Show or change the profiler settings of this process
+    POST {"sampleRate": 0.05, "training": true}; requires the ADMIN_TOKEN
+    value in the X-Admin-Token header (disabled when ADMIN_TOKEN is unset).
+    """
+    if not api_auth.has_admin_token(request):
+        return jsonify({"error": "Forbidden"}), 403
+
+    if request.method == "POST":
+        body = request.get_json(silent=True) or {}
+        try:
+            profiling.configure(
+                sample_rate=body.get("sampleRate"),
+                training=body.get("training"),
+            )
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+    return jsonify({
+        "settings": profiling.settings(),
+        "recent": profiling.recent_profiles(),
+    })
+
 # ------------------------------------------------------------
 # Entry
 # ------------------------------------------------------------
 
 if __name__ == "__main__":
+    start_warmup()
     port = int(os.environ.get("PORT", "8080"))
     app.run(host="0.0.0.0", port=port)
\ No newline at end of file
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+Meal windows, 15-minute slots and the capacity-based fallback predictions
+Kept apart from main.py so batch tools (e.g. ml_model/backtest.py) can use
+the fallback without importing the Flask app and initializing Firebase.
+"""
+
+from datetime import datetime, timedelta, time
+
+MEAL_WINDOWS = {
+    "breakfast": (time(7, 30), time(9, 30)),
+    "lunch": (time(12, 0), time(14, 0)),
+    "dinner": (time(19, 30), time(21, 30)),
+}
+
+SLOT_MINUTES = 15
+
+
+def round_up_to_next_slot(dt: datetime) -> datetime:
+    minute = (dt.minute // SLOT_MINUTES) * SLOT_MINUTES
+    slot = dt.replace(minute=minute, second=0, microsecond=0)
+    if slot <= dt:
+        slot += timedelta(minutes=SLOT_MINUTES)
+    return slot
+
+
+def get_current_meal(windows=None):
+    now = datetime.now().time()
+    for meal, (start, end) in (windows or MEAL_WINDOWS).items():
+        if start <= now < end:
+            return meal
+    return None
+
+
+def generate_slots_for_meal(meal_type: str, max_slots=6, now=None, windows=None):
+    windows = windows or MEAL_WINDOWS
+    if meal_type not in windows:
+        return []
+
+    now = now or datetime.now()
+    start_t, end_t = windows[meal_type]
+
+    start_dt = now.replace(hour=start_t.hour, minute=start_t.minute, second=0, microsecond=0)
+    end_dt = now.replace(hour=end_t.hour, minute=end_t.minute, second=0, microsecond=0)
+
+    if now >= end_dt:
+        return []
+
+    cursor = max(round_up_to_next_slot(now), start_dt)
+
+    slots = []
+    while cursor < end_dt and len(slots) < max_slots:
+        slots.append(cursor)
+        cursor += timedelta(minutes=SLOT_MINUTES)
+
+    return slots
+
+
+def generate_fallback_predictions(meal_type, capacity=100, now=None, max_slots=6, windows=None):
+    slots = generate_slots_for_meal(meal_type, max_slots=max_slots, now=now, windows=windows)
+
+    base_pct = {
+        "breakfast": 25,
+        "lunch": 40,
+        "dinner": 45,
+    }.get(meal_type, 20)
+
+    predictions = []
+    for i, t in enumerate(slots):
+        pct = min(90, base_pct + i * 6)
+        predictions.append({
+            "time_slot": t.strftime("%I:%M %p"),
+            "time_24h": t.strftime("%H:%M"),
+            "predicted_crowd": int(capacity * pct / 100),
+            "crowd_percentage": float(pct),
+            "capacity": capacity,
+            "confidence": "low",
+            "recommendation": (
+                "Good time" if pct < 40 else
+                "Moderate crowd" if pct < 70 else
+                "Avoid if possible"
+            ),
+        })
+
+    return predictions
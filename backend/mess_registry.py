@@ -0,0 +1,207 @@
+"""
+Cached registry of messes for the backend
+Loads the `messes` collection once and keeps it fresh with a snapshot
+listener (long-running API) or a TTL refresh (batch jobs), so request
+handlers and jobs can look up capacity, meal windows and the active flag
+without reading Firestore.
+
+Optional fields on a mess document:
+  capacity     int, default DEFAULT_CAPACITY
+  active       bool, default True
+  mealWindows  {"lunch": {"start": "12:00", "end": "14:00"}, ...} or
+               {"lunch": "12:00-14:00", ...}; meals not listed keep the
+               default window
+"""
+
+import os
+import threading
+import time as time_module
+import logging
+from datetime import time
+
+import ml_path  # noqa: F401 (puts ml_model on sys.path)
+import firestore_breaker
+from env_config import env_float
+from shared_cache import get_cache
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CAPACITY = 100
+DEFAULT_MEAL_WINDOWS = {
+    'breakfast': (time(7, 30), time(9, 30)),
+    'lunch': (time(12, 0), time(14, 0)),
+    'dinner': (time(19, 30), time(21, 30)),
+}
+DEFAULT_TTL_SECONDS = 300
+# Fields of a mess document that the registry uses (and shares via the cache)
+MESS_FIELDS = ('name', 'capacity', 'active', 'mealWindows')
+
+
+def _parse_time(value):
+    hour, minute = str(value).strip().split(':')[:2]
+    return time(int(hour), int(minute))
+
+
+def _parse_meal_windows(raw):
+    windows = dict(DEFAULT_MEAL_WINDOWS)
+    if not isinstance(raw, dict):
+        return windows
+    for meal, window in raw.items():
+        meal = str(meal).strip().lower()
+        if meal not in windows:
+            continue
+        try:
+            if isinstance(window, dict):
+                start, end = _parse_time(window['start']), _parse_time(window['end'])
+            else:
+                start, end = (_parse_time(part) for part in str(window).split('-'))
+        except (KeyError, ValueError, TypeError):
+            logger.warning(f"Ignoring invalid {meal} window: {window!r}")
+            continue
+        if start < end:
+            windows[meal] = (start, end)
+    return windows
+
+
+def mess_info(mess_id, data):
+    """Registry entry for one `messes` document"""
+    data = data or {}
+    try:
+        capacity = int(data.get('capacity') or DEFAULT_CAPACITY)
+    except (TypeError, ValueError):
+        capacity = DEFAULT_CAPACITY
+    return {
+        'id': mess_id,
+        'name': data.get('name') or mess_id,
+        'capacity': capacity if capacity > 0 else DEFAULT_CAPACITY,
+        'active': data.get('active', True) is not False,
+        'meal_windows': _parse_meal_windows(data.get('mealWindows')),
+    }
+
+
+def _mess_fields(data):
+    return {field: (data or {})[field] for field in MESS_FIELDS if field in (data or {})}
+
+
+def _init_firestore():
+    """Firestore client from serviceAccountKey.json or ADC (None when unavailable)"""
+    if os.environ.get('FIRESTORE_DISABLED', '').strip() == '1':
+        return None
+    try:
+        import firebase_admin
+        from firebase_admin import credentials, firestore
+        if not firebase_admin._apps:
+            if os.path.exists('serviceAccountKey.json'):
+                cred = credentials.Certificate('serviceAccountKey.json')
+            else:
+                cred = credentials.ApplicationDefault()
+            firebase_admin.initialize_app(cred)
+        return firestore.client()
+    except Exception as e:
+        logger.error(f"Firebase init error: {e}")
+        return None
+
+
+class MessRegistry:
+    """In-memory view of the `messes` collection"""
+
+    def __init__(self, db=None, ttl_seconds=None, shared_cache=None):
+        self.db = db
+        self.shared_cache = shared_cache or get_cache()
+        self.ttl_seconds = ttl_seconds if ttl_seconds is not None else env_float('MESS_REGISTRY_TTL', DEFAULT_TTL_SECONDS)
+        self._messes = {}
+        self._loaded_at = None
+        self._watch = None
+        self._lock = threading.Lock()
+
+    @property
+    def loaded(self):
+        """Whether the registry reflects Firestore (False: no database, accept any mess)"""
+        return self._loaded_at is not None
+
+    def refresh(self):
+        """
+        Re-read the whole `messes` collection
+        Instances share one read through the cache; entries live half the TTL
+        so that a registry refreshed from the cache is at most 1.5 TTLs old
+        """
+        if self.db is None:
+            return False
+        try:
+            messes = self.shared_cache.get_or_compute(
+                self.shared_cache.key('registry', 'messes'), self._load, ttl=self.ttl_seconds / 2
+            )
+        except Exception as e:
+            logger.error(f"Error loading messes: {e}")
+            return False
+        self._replace(messes)
+        return True
+
+    def _load(self):
+        documents = firestore_breaker.get_breaker().call(
+            lambda: list(self.db.collection('messes').stream())
+        )
+        return {doc.id: _mess_fields(doc.to_dict()) for doc in documents}
+
+    def _replace(self, messes):
+        # Swapping the dict keeps readers lock-free and consistent
+        self._messes = {mess_id: mess_info(mess_id, data) for mess_id, data in messes.items()}
+        self._loaded_at = time_module.monotonic()
+
+    def _ensure_fresh(self):
+        if self._watch is not None or self.db is None:
+            return
+        if self._loaded_at is None or time_module.monotonic() - self._loaded_at >= self.ttl_seconds:
+            with self._lock:
+                if self._loaded_at is None or time_module.monotonic() - self._loaded_at >= self.ttl_seconds:
+                    self.refresh()
+
+    def start_listener(self):
+        """Keep the registry current with a snapshot listener instead of TTL refreshes"""
+        if self.db is None or self._watch is not None:
+            return self._watch
+        try:
+            self._watch = self.db.collection('messes').on_snapshot(
+                lambda documents, changes, read_time: self._replace(
+                    {doc.id: _mess_fields(doc.to_dict()) for doc in documents}
+                )
+            )
+        except Exception as e:
+            logger.warning(f"Mess listener unavailable, using TTL refresh: {e}")
+        return self._watch
+
+    def get(self, mess_id):
+        """Entry for a mess, or None when it is not registered"""
+        self._ensure_fresh()
+        return self._messes.get(mess_id)
+
+    def all(self, active_only=False):
+        """{mess_id: entry} for every (active) mess"""
+        self._ensure_fresh()
+        return {
+            mess_id: info for mess_id, info in self._messes.items()
+            if info['active'] or not active_only
+        }
+
+    def mess_ids(self, active_only=False):
+        return list(self.all(active_only))
+
+    def capacity(self, mess_id, default=None):
+        info = self.get(mess_id)
+        return info['capacity'] if info else default
+
+    def meal_windows(self, mess_id):
+        info = self.get(mess_id)
+        return info['meal_windows'] if info else DEFAULT_MEAL_WINDOWS
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+def get_registry(db=None):
+    """Process-wide registry; the first caller's db (or a new client) is used"""
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = MessRegistry(db if db is not None else _init_firestore())
+    return _registry
@@ -0,0 +1,37 @@
+#!/usr/bin/env python3
+"""
+Puts the ml_model directory on sys.path
+Backend modules import this before any ml_model module (firestore_breaker,
+shared_cache, model_bundle, ...). ML_MODEL_DIR wins when set (the Docker
+image copies ml_model to /ml_model); otherwise the usual checkout layouts
+are tried.
+"""
+
+import os
+import sys
+
+
+def resolve_ml_model_dir():
+    env_path = os.environ.get('ML_MODEL_DIR')
+    candidates = []
+    if env_path:
+        candidates.append(env_path)
+    base_dir = os.path.dirname(os.path.abspath(__file__))
+    candidates.extend([
+        os.path.join(base_dir, '..', 'ml_model'),
+        os.path.join(base_dir, 'ml_model'),
+        os.path.join(os.getcwd(), 'ml_model'),
+        '/ml_model',
+    ])
+    for path in candidates:
+        if path and os.path.isdir(path):
+            return os.path.abspath(path)
+    return None
+
+
+ML_MODEL_DIR = resolve_ml_model_dir()
+if ML_MODEL_DIR:
+    if ML_MODEL_DIR not in sys.path:
+        sys.path.insert(0, ML_MODEL_DIR)
+else:
+    print('[WARN] ml_model directory not found. Predictions may be unavailable.')
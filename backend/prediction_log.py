@@ -0,0 +1,286 @@
+#!/usr/bin/env python3
+"""
+Served-prediction log
+Records what /predict and /forecast actually returned (mess, slot, predicted
+count, source, model version) so that prediction quality can be measured
+against the attendance that followed.
+
+record() only appends to an in-memory ring buffer; a background thread drains
+it every PREDICTION_LOG_INTERVAL seconds (default 30), merges repeats of the
+same prediction and writes one document per mess and day per flush:
+
+  PREDICTION_LOG=firestore  predictions/{mess}/{date}/served-{time}-{pid}-{n}
+                            (the collection retention already cleans up)
+  PREDICTION_LOG=file       one JSON line per document in PREDICTION_LOG_FILE
+  PREDICTION_LOG=off        nothing is recorded
+
+The buffer holds PREDICTION_LOG_BUFFER responses (default 10000); when the
+sink falls behind the oldest are dropped and counted, never waited for.
+accuracy() joins the records of a day with its actual slot counts.
+"""
+
+import os
+import json
+import atexit
+import logging
+import threading
+from collections import deque
+from datetime import datetime
+
+import ml_path  # noqa: F401 (puts ml_model on sys.path)
+import firestore_breaker
+from env_config import FIRESTORE_BATCH_LIMIT, env_float
+
+logger = logging.getLogger(__name__)
+
+SERVED_PREFIX = 'served-'
+DEFAULT_FILE = 'served_predictions.jsonl'
+DEFAULT_INTERVAL = 30
+DEFAULT_BUFFER = 10000
+
+
+def version_label(version):
+    """'<model file>@<trained_at>' for PredictionService.model_version() (None without a model)"""
+    if version is None:
+        return None
+    path, trained_at = version
+    return f"{os.path.basename(path or '')}@{trained_at or 'unknown'}"
+
+
+class PredictionLog:
+    """
+    Ring buffer of served predictions with an asynchronous batched flush
+    sink: 'firestore' (needs db), 'file' or 'off'
+    """
+
+    def __init__(self, db=None, sink=None, path=None, capacity=None, interval=None):
+        self.sink = (sink or os.environ.get('PREDICTION_LOG', 'firestore')).lower()
+        if self.sink == 'firestore' and db is None:
+            logger.warning("Prediction log: no Firestore client, served predictions are not recorded")
+            self.sink = 'off'
+        self.db = db
+        self.path = path or os.environ.get('PREDICTION_LOG_FILE', DEFAULT_FILE)
+        self.interval = interval if interval is not None else env_float('PREDICTION_LOG_INTERVAL', DEFAULT_INTERVAL)
+        capacity = int(capacity or env_float('PREDICTION_LOG_BUFFER', DEFAULT_BUFFER))
+        self._buffer = deque(maxlen=max(1, capacity))
+        self._pending = []  # documents whose write failed, retried on the next flush
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread_pid = None
+        self._sequence = 0
+        self.counters = {'recorded': 0, 'dropped': 0, 'flushed': 0, 'documents': 0, 'errors': 0}
+
+    @property
+    def enabled(self):
+        return self.sink in ('firestore', 'file')
+
+    # ------------------------------------------------------------------
+    # Request path
+    # ------------------------------------------------------------------
+
+    def record(self, mess_id, date, rows, source, model_version=None, served_at=None):
+        """
+        Remember one served response: rows are its prediction rows
+        ({'time_24h', 'predicted_crowd', ...}) for date 'YYYY-MM-DD'.
+        Never blocks on I/O; rows are read later by the flush thread, so
+        they must not be modified afterwards.
+        """
+        if not self.enabled or not rows:
+            return
+        if len(self._buffer) == self._buffer.maxlen:
+            self.counters['dropped'] += 1
+        self._buffer.append((mess_id, date, rows, source, model_version, served_at or datetime.now()))
+        self.counters['recorded'] += 1
+        if self._thread_pid != os.getpid():
+            self._start()
+
+    # ------------------------------------------------------------------
+    # Flushing
+    # ------------------------------------------------------------------
+
+    def _start(self):
+        # Also restarts the thread in forked workers (gunicorn --preload)
+        with self._flush_lock:
+            if self._thread_pid == os.getpid():
+                return
+            self._thread_pid = os.getpid()
+        threading.Thread(target=self._run, name='prediction-log', daemon=True).start()
+        atexit.register(self.flush)
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Prediction log flush failed: {e}")
+
+    def _drain(self):
+        entries = []
+        while True:
+            try:
+                entries.append(self._buffer.popleft())
+            except IndexError:
+                return entries
+
+    def _documents(self, entries):
+        """Merge buffered responses into one document per (mess, date)"""
+        now = datetime.now()
+        merged = {}
+        for mess_id, date, rows, source, model_version, served_at in entries:
+            records = merged.setdefault((mess_id, date), {})
+            served = served_at.isoformat()
+            for row in rows:
+                slot = row.get('time_24h')
+                predicted = row.get('predicted_crowd')
+                if slot is None or predicted is None:
+                    continue
+                key = (slot, source, model_version, predicted)
+                record = records.get(key)
+                if record is None:
+                    lead = datetime.strptime(f"{date} {slot}", '%Y-%m-%d %H:%M') - served_at
+                    records[key] = {
+                        'slot': slot,
+                        'predicted': predicted,
+                        'source': source,
+                        'modelVersion': model_version,
+                        'served': 1,
+                        'firstServedAt': served,
+                        'lastServedAt': served,
+                        'maxLeadMinutes': round(lead.total_seconds() / 60, 1),
+                    }
+                else:
+                    record['served'] += 1
+                    record['lastServedAt'] = served
+        documents = []
+        for (mess_id, date), records in merged.items():
+            self._sequence += 1
+            documents.append({
+                'id': f"{SERVED_PREFIX}{now.strftime('%H%M%S')}-{os.getpid()}-{self._sequence}",
+                'messId': mess_id,
+                'date': date,
+                'flushedAt': now.isoformat(),
+                'records': sorted(records.values(), key=lambda record: record['slot']),
+            })
+        return documents
+
+    def flush(self):
+        """Write everything buffered so far; returns the number of documents written"""
+        with self._flush_lock:
+            entries = self._drain()
+            documents = self._pending + self._documents(entries)
+            self._pending = []
+            if not documents:
+                return 0
+            try:
+                if self.sink == 'firestore':
+                    self._write_firestore(documents)
+                elif self.sink == 'file':
+                    self._write_file(documents)
+            except Exception as e:
+                self.counters['errors'] += 1
+                # Keep them for the next flush, bounded like the buffer
+                self._pending = documents[-self._buffer.maxlen:]
+                logger.warning(f"Prediction log write failed, {len(self._pending)} documents kept: {e}")
+                return 0
+            self.counters['flushed'] += len(entries)
+            self.counters['documents'] += len(documents)
+            return len(documents)
+
+    def _write_firestore(self, documents):
+        breaker = firestore_breaker.get_breaker()
+        for start in range(0, len(documents), FIRESTORE_BATCH_LIMIT):
+            batch = self.db.batch()
+            for document in documents[start:start + FIRESTORE_BATCH_LIMIT]:
+                ref = (self.db.collection('predictions').document(document['messId'])
+                       .collection(document['date']).document(document['id']))
+                batch.set(ref, {key: value for key, value in document.items() if key != 'id'})
+            # Document ids are unique per flush, so a retried commit is idempotent
+            breaker.call(batch.commit)
+
+    def _write_file(self, documents):
+        with open(self.path, 'a', encoding='utf-8') as f:
+            for document in documents:
+                f.write(json.dumps(document, default=str) + '\n')
+
+    def snapshot(self):
+        return {
+            'sink': self.sink,
+            'buffered': len(self._buffer),
+            'pending': len(self._pending),
+            'counters': dict(self.counters),
+        }
+
+    # ------------------------------------------------------------------
+    # Reading back
+    # ------------------------------------------------------------------
+
+    def served_records(self, mess_id, date):
+        """All served-prediction records logged for a mess on a day"""
+        records = []
+        if self.sink == 'firestore':
+            date_col = self.db.collection('predictions').document(mess_id).collection(date)
+            documents = firestore_breaker.get_breaker().call(lambda: list(date_col.stream()))
+            for document in documents:
+                if document.id.startswith(SERVED_PREFIX):
+                    records.extend((document.to_dict() or {}).get('records', []))
+        elif self.sink == 'file' and os.path.exists(self.path):
+            with open(self.path, encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        document = json.loads(line)
+                    except ValueError:
+                        continue
+                    if document.get('messId') == mess_id and document.get('date') == date:
+                        records.extend(document.get('records', []))
+        return records
+
+
+def accuracy(records, slot_counts):
+    """
+    Join served-prediction records with actual slot counts
+    slot_counts: {'HH:MM': actual count}; slots missing from it are skipped.
+    Every served response counts, so the metrics describe what users saw.
+    Returns {source: {'predictions', 'served', 'mae', 'bias', 'mape'}} plus
+    'all'; bias is mean(predicted - actual), so positive means overestimated.
+    """
+    totals = {}
+    for record in records:
+        actual = slot_counts.get(record.get('slot'))
+        if actual is None:
+            continue
+        error = float(record['predicted']) - actual
+        weight = int(record.get('served') or 1)
+        for source in (record.get('source') or 'unknown', 'all'):
+            total = totals.setdefault(source, {'predictions': 0, 'served': 0, 'abs': 0.0, 'sum': 0.0,
+                                               'pct': 0.0, 'pct_served': 0})
+            total['predictions'] += 1
+            total['served'] += weight
+            total['abs'] += weight * abs(error)
+            total['sum'] += weight * error
+            if actual > 0:
+                total['pct'] += weight * abs(error) / actual
+                total['pct_served'] += weight
+    return {
+        source: {
+            'predictions': total['predictions'],
+            'served': total['served'],
+            'mae': round(total['abs'] / total['served'], 2),
+            'bias': round(total['sum'] / total['served'], 2),
+            'mape': round(100 * total['pct'] / total['pct_served'], 1) if total['pct_served'] else None,
+        }
+        for source, total in totals.items()
+    }
+
+
+_prediction_log = None
+_prediction_log_lock = threading.Lock()
+
+def get_prediction_log(db=None):
+    """Process-wide prediction log (db is used on first call)"""
+    global _prediction_log
+    with _prediction_log_lock:
+        if _prediction_log is None:
+            _prediction_log = PredictionLog(db=db)
+    return _prediction_log
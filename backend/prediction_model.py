@@ -2,95 +2,220 @@ import numpy as np
 from datetime import datetime, timedelta
 import json
 import os
+import time
 from pathlib import Path
 
+import pandas as pd
+
+import ml_path  # noqa: F401 (puts ml_model on sys.path)
+import model_bundle
+
+# Model files live next to this module unless PREDICTION_MODEL_DIR is set,
+# so the working directory of the process does not matter
+MODEL_DIR = os.environ.get('PREDICTION_MODEL_DIR') or os.path.dirname(os.path.abspath(__file__))
+
+# 96 fifteen-minute slots per day
+SLOTS_PER_DAY = 96
+
 class PredictionModel:
     """
     Prediction model for mess crowd prediction 
     Generates 15-minute interval predictions during meal times
+
+    Learned state is a dense table of scan counts indexed by
+    (mess index, day of week, slot of day), plus the number of distinct
+    dates seen per (mess, day of week) so lookups return per-day averages.
+    Mess IDs are interned to row indices via self.mess_index.
     """
     
     def __init__(self):
-        self.model_path = 'model_data.json'
-        self.historical_data = self._load_model()
+        self.model_path = os.path.join(MODEL_DIR, 'model_data.json')  # Legacy format, read-only
+        self.bundle_path = os.path.join(MODEL_DIR, 'model_data.bundle')
+        self.counts_path = os.path.join(MODEL_DIR, 'model_data.npy')  # Pre-bundle format, read-only
+        self.index_path = os.path.join(MODEL_DIR, 'model_data.npz')
+        self.mess_ids = []
+        self.mess_index = {}
+        self.slot_counts = np.zeros((0, 7, SLOTS_PER_DAY), dtype=np.float64)
+        self.day_counts = np.zeros((0, 7), dtype=np.int32)
+        self.trained = False
+        self._load_model()
         
+    def _set_messes(self, mess_ids):
+        self.mess_ids = [str(mess_id) for mess_id in mess_ids]
+        self.mess_index = {mess_id: i for i, mess_id in enumerate(self.mess_ids)}
+
     def _load_model(self):
-        """Load model data from file if exists"""
+        """Load model data from file if exists (bundle first, then older formats)"""
+        if os.path.exists(self.bundle_path):
+            try:
+                # Memory-mapped: lookups only touch the pages they need
+                bundle = model_bundle.read_bundle(self.bundle_path)
+                self._set_messes(bundle.metadata.get('mess_ids', []))
+                self.slot_counts = bundle.arrays['slot_counts']
+                self.day_counts = np.array(bundle.arrays['day_counts'], dtype=np.int32)
+                self.trained = bool(bundle.metadata.get('trained'))
+                return True
+            except (model_bundle.BundleError, KeyError) as e:
+                print(f"Warning: Could not load {self.bundle_path}: {e}")
+
+        if os.path.exists(self.counts_path) and os.path.exists(self.index_path):
+            try:
+                with np.load(self.index_path) as index:
+                    self._set_messes(index['mess_ids'].tolist())
+                    self.day_counts = index['day_counts'].astype(np.int32)
+                    self.trained = bool(index['trained'])
+                self.slot_counts = np.load(self.counts_path, mmap_mode='r')
+                return True
+            except Exception as e:
+                print(f"Warning: Could not load {self.counts_path}: {e}")
+
         if os.path.exists(self.model_path):
             with open(self.model_path, 'r') as f:
-                return json.load(f)
-        return {
-            'time_interval_averages': {},
-            'trained': False,
-        }
+                return self._load_legacy(json.load(f))
+        return False
+
+    def _load_legacy(self, data):
+        """
+        Load the old JSON format: {'time_interval_averages': {"{mess}_{hour}_{bucket}": count}}
+        Old entries have no day of week, so each one is used for every weekday
+        """
+        entries = []
+        for key, count in (data.get('time_interval_averages') or {}).items():
+            try:
+                mess_id, hour, bucket = key.rsplit('_', 2)
+                entries.append((mess_id, int(hour) * 4 + int(bucket), float(count)))
+            except (ValueError, TypeError):
+                continue
+
+        self._set_messes(dict.fromkeys(mess_id for mess_id, _, _ in entries))
+        self.slot_counts = np.zeros((len(self.mess_ids), 7, SLOTS_PER_DAY), dtype=np.float64)
+        self.day_counts = np.zeros((len(self.mess_ids), 7), dtype=np.int32)
+        for mess_id, slot, count in entries:
+            if 0 <= slot < SLOTS_PER_DAY:
+                row = self.mess_index[mess_id]
+                self.slot_counts[row, :, slot] = count
+                self.day_counts[row, :] = 1
+        self.trained = bool(data.get('trained', bool(entries)))
+        return True
     
     def _save_model(self):
-        """Save model data to file"""
-        with open(self.model_path, 'w') as f:
-            json.dump(self.historical_data, f)
-    
-    def train(self, scan_data):
+        """Save model data to one checksummed file, replaced atomically"""
+        model_bundle.write_bundle(
+            self.bundle_path,
+            arrays={'slot_counts': self.slot_counts, 'day_counts': self.day_counts},
+            metadata={'mess_ids': self.mess_ids, 'trained': self.trained},
+        )
+
+    @staticmethod
+    def _scan_times(scan_data):
+        """
+        Wall-clock scan times as datetime64[m] (NaT where unusable)
+        'ts' floats are Unix timestamps shown in local time; ISO strings keep
+        their own clock time, as datetime.fromisoformat() did in the old loop
+        """
+        n = len(scan_data)
+        stamps = np.full(n, np.datetime64('NaT'), dtype='datetime64[m]')
+        float_rows, float_values = [], []
+        str_rows, str_values = [], []
+        dt_rows, dt_values = [], []
+
+        # Only pick the source field per scan here; parsing happens in bulk below
+        for i, scan in enumerate(scan_data):
+            ts = scan.get('ts')
+            timestamp_str = scan.get('timestamp')
+            if isinstance(ts, float):
+                float_rows.append(i)
+                float_values.append(ts)
+            elif isinstance(timestamp_str, str):
+                str_rows.append(i)
+                str_values.append(timestamp_str)
+            elif isinstance(ts, str):
+                str_rows.append(i)
+                str_values.append(ts)
+            elif isinstance(ts, datetime):
+                dt_rows.append(i)
+                dt_values.append(ts.replace(tzinfo=None))
+
+        if float_rows:
+            seconds = np.array(float_values, dtype=np.float64)
+            ok = np.isfinite(seconds)
+            # Local UTC offset per distinct 15-minute block instead of per scan
+            blocks, inverse = np.unique(np.floor_divide(seconds[ok], 900).astype(np.int64), return_inverse=True)
+            offsets = np.array([time.localtime(int(block) * 900).tm_gmtoff for block in blocks], dtype=np.int64)
+            local_minutes = np.floor_divide(np.floor(seconds[ok]).astype(np.int64) + offsets[inverse], 60)
+            stamps[np.array(float_rows)[ok]] = local_minutes.astype('datetime64[m]')
+        if str_rows:
+            # Keep date, hour and minute only: the hour is read in the string's own clock
+            wall_clock = pd.Series(str_values, dtype=object).str.slice(0, 16)
+            parsed = pd.to_datetime(wall_clock, format='ISO8601', errors='coerce')
+            stamps[str_rows] = parsed.to_numpy(dtype='datetime64[m]')
+        if dt_rows:
+            stamps[dt_rows] = np.array(dt_values, dtype='datetime64[m]')
+        return stamps
+
+    def train(self, scan_data, save=True):
         """
         Train the model with historical attendance data
         scan_data: list of dicts with 'ts' (timestamp float) and 'messId'
+        save=False keeps the result in memory only (e.g. for backtests)
         """
         if not scan_data:
             print("✗ No training data provided")
             return False
         
-        time_interval_counts = {}
-        
-        for scan in scan_data:
-            try:
-                # Get timestamp - could be float or string
-                ts = scan.get('ts')
-                timestamp_str = scan.get('timestamp')
-                
-                # Try to parse timestamp
-                dt = None
-                if isinstance(ts, float):
-                    # Unix timestamp
-                    dt = datetime.fromtimestamp(ts)
-                elif isinstance(timestamp_str, str):
-                    # ISO format string
-                    dt = datetime.fromisoformat(timestamp_str.replace('Z', '+00:00'))
-                elif isinstance(ts, str):
-                    # String timestamp
-                    dt = datetime.fromisoformat(ts.replace('Z', '+00:00'))
-                else:
-                    # Assume it's a datetime object
-                    dt = ts
-                
-                if dt is None:
-                    continue
-                
-                # Extract hour and 15-minute bucket
-                hour = dt.hour
-                minute_bucket = (dt.minute // 15)  # 0, 1, 2, or 3
-                mess_id = scan.get('messId', 'unknown')
-                
-                # Create key: messId_hour_minuteBucket (e.g., mess1_12_2 for 12:30-12:45)
-                key = f"{mess_id}_{hour}_{minute_bucket}"
-                
-                if key not in time_interval_counts:
-                    time_interval_counts[key] = 0
-                time_interval_counts[key] += 1
-            except Exception as e:
-                print(f"Warning: Error processing attendance record: {e}")
-                continue
-        
-        if len(time_interval_counts) < 3:
+        stamps = self._scan_times(scan_data)
+        valid = ~np.isnat(stamps)
+        skipped = len(scan_data) - int(valid.sum())
+        if skipped:
+            print(f"Warning: Skipped {skipped} attendance records without a usable timestamp")
+
+        mess_ids = np.array([str(scan.get('messId', 'unknown')) for scan in scan_data], dtype=object)[valid]
+        mess_codes, unique_messes = pd.factorize(mess_ids, sort=False)
+
+        minutes = stamps[valid].astype(np.int64)
+        days = np.floor_divide(minutes, 1440)
+        slots = (minutes - days * 1440) // 15
+        day_of_week = (days + 3) % 7  # 1970-01-01 was a Thursday; Monday = 0
+
+        n_mess = len(unique_messes)
+        cells = (mess_codes * 7 + day_of_week) * SLOTS_PER_DAY + slots
+        slot_counts = np.bincount(cells, minlength=n_mess * 7 * SLOTS_PER_DAY)
+        slot_counts = slot_counts.reshape(n_mess, 7, SLOTS_PER_DAY).astype(np.float64)
+
+        # Distinct dates per (mess, day of week) turn totals into per-day averages
+        day_counts = np.zeros((n_mess, 7), dtype=np.int32)
+        if len(days):
+            span = int(days.max() - days.min()) + 1
+            mess_days = np.unique(mess_codes.astype(np.int64) * span + (days - days.min()))
+            day_mess = mess_days // span
+            day_of_week_seen = (mess_days % span + days.min() + 3) % 7
+            np.add.at(day_counts, (day_mess, day_of_week_seen), 1)
+
+        data_points = int(np.count_nonzero(slot_counts.sum(axis=1)))
+        if data_points < 3:
             print("✗ Insufficient training data (need at least 3 data points)")
             return False
         
-        # Store averages
-        self.historical_data['time_interval_averages'] = time_interval_counts
-        self.historical_data['trained'] = True
-        self._save_model()
+        self._set_messes(unique_messes)
+        self.slot_counts = slot_counts
+        self.day_counts = day_counts
+        self.trained = True
+        if save:
+            self._save_model()
         
         print(f"✓ Model trained with {len(scan_data)} samples")
-        print(f"✓ Generated {len(time_interval_counts)} 15-minute interval data points")
+        print(f"✓ Generated {data_points} 15-minute interval data points")
         return True
+
+    def slot_average(self, mess_id, day_of_week, slot, default=None):
+        """Average scans per day for a mess slot, or default when never observed"""
+        row = self.mess_index.get(mess_id)
+        if row is None or not self.day_counts[row, day_of_week]:
+            return default
+        total = self.slot_counts[row, day_of_week, slot]
+        if not total:
+            return default
+        return float(total) / int(self.day_counts[row, day_of_week])
     
     def predict_next_slots_15min(self, mess_id, current_time, current_count, capacity, meal_info, db):
         """
@@ -229,12 +354,9 @@ class PredictionModel:
             if temp_time.hour * 60 + temp_time.minute >= meal_end_minutes:
                 break
             
-            hour = temp_time.hour
-            minute_bucket = (temp_time.minute // 15)
-            
             # Look up historical data for this time slot
-            key = f"{mess_id}_{hour}_{minute_bucket}"
-            base_count = self.historical_data.get('time_interval_averages', {}).get(key, current_count)
+            slot = temp_time.hour * 4 + temp_time.minute // 15
+            base_count = self.slot_average(mess_id, temp_time.weekday(), slot, default=current_count)
             
             # Add slight variation based on trend
             predicted_count = int(base_count * (0.85 + np.random.random() * 0.3))
@@ -8,34 +8,15 @@ Supports mess isolation for predictions
 import os
 import sys
 import json
+import time
+import atexit
+import threading
 from datetime import datetime, timedelta
 import numpy as np
 
-def _resolve_ml_model_dir():
-    env_path = os.environ.get('ML_MODEL_DIR')
-    candidates = []
-    if env_path:
-        candidates.append(env_path)
-    base_dir = os.path.dirname(os.path.abspath(__file__))
-    candidates.extend([
-        os.path.join(base_dir, '..', 'ml_model'),
-        os.path.join(base_dir, 'ml_model'),
-        os.path.join(os.getcwd(), 'ml_model'),
-        '/ml_model',
-    ])
-    for path in candidates:
-        if path and os.path.isdir(path):
-            return os.path.abspath(path)
-    return None
-
-# Add ml_model to path to import mess_prediction_model
-_ML_MODEL_DIR = _resolve_ml_model_dir()
-if _ML_MODEL_DIR:
-    sys.path.insert(0, _ML_MODEL_DIR)
-else:
-    print('[WARN] ml_model directory not found. Predictions may be unavailable.')
-
-from mess_prediction_model import MessPredictionModel, create_or_load_mess_model
+import ml_path  # noqa: F401 (puts ml_model on sys.path)
+from mess_prediction_model import MessPredictionModel, create_or_load_mess_model, get_global_model, refresh_global_model
+from online_model import get_online_model, online_mode, start_attendance_listener
 
 class PredictionService:
     """
@@ -45,6 +26,12 @@ class PredictionService:
     
     def __init__(self):
         self.models_cache = {}
+        # Held while models_cache and the global model are swapped (see reload_models)
+        self._lock = threading.Lock()
+        # mess_id -> warm-up status (see warm_up)
+        self.readiness = {}
+        # ONLINE_MODEL=blend|replace mixes the per-scan online estimate into predictions
+        self.online_model = get_online_model() if online_mode() != 'off' else None
 
     def _fallback_predictions(self, current_time, current_count, capacity):
         """Generate simple fallback predictions when no model is available."""
@@ -106,15 +93,52 @@ class PredictionService:
         Get or load the prediction model for a specific mess
         Caches loaded models in memory
         """
-        if mess_id not in self.models_cache:
+        # reload_models() swaps in a new dict, so keep using the one read here
+        cache = self.models_cache
+        model = cache.get(mess_id)
+        if model is None:
             model = create_or_load_mess_model(mess_id)
-            if model:
-                self.models_cache[mess_id] = model
-            else:
+            if not model:
                 return None
-        
-        return self.models_cache[mess_id]
+            model.online_model = self.online_model
+            cache[mess_id] = model
+        return model
+
+    def reload_models(self):
+        """
+        Forget every loaded model, and the global one when a new version
+        was published, so the next request loads the current versions.
+        Requests already holding a model finish with it.
+        """
+        with self._lock:
+            refresh_global_model()
+            self.models_cache = {}
     
+    def warm_up(self, mess_ids):
+        """
+        Load each mess's model and run one inference through it, so the first
+        request pays neither for loading nor for graph tracing
+        Returns {mess_id: status}: state is 'ready', 'no_model' (served by the
+        fallback) or 'error', with load and warm-up durations in seconds
+        """
+        for mess_id in mess_ids:
+            status = {'state': 'loading'}
+            self.readiness[mess_id] = status
+            started = time.perf_counter()
+            try:
+                model = self.get_prediction_model(mess_id)
+                status['load_seconds'] = round(time.perf_counter() - started, 3)
+                if model is None:
+                    status['state'] = 'no_model'
+                    continue
+                status['warmup_seconds'] = round(model.warm_up(), 3)
+                status['model'] = 'global' if model.global_model is not None else model.metadata.get('backend', 'keras')
+                status['state'] = 'ready'
+            except Exception as e:
+                status['state'] = 'error'
+                status['error'] = str(e)
+        return {mess_id: self.readiness[mess_id] for mess_id in mess_ids}
+
     def predict_next_slots(self, mess_id, current_time, current_count, capacity):
         """
         Generate predictions for the next 15-minute slots for a specific mess
@@ -160,6 +184,47 @@ class PredictionService:
             'model_info': model.get_model_info()
         }
     
+    def predict_counts_for_messes(self, mess_ids, slot_times, capacities=None):
+        """
+        Raw crowd counts for several messes at once
+        Messes served by the global model share one forward pass; the rest
+        use their own model. Returns {mess_id: float32 array (NaN = no prediction)}
+        """
+        capacities = capacities or {}
+        results = {}
+        global_ids = []
+        for mess_id in mess_ids:
+            model = self.get_prediction_model(mess_id)
+            if model is not None and model.global_model is not None:
+                global_ids.append(mess_id)
+            elif model is not None:
+                results[mess_id] = model.predict_counts(slot_times)
+            else:
+                results[mess_id] = np.full(len(slot_times), np.nan, dtype=np.float32)
+
+        if global_ids:
+            counts = get_global_model().predict_counts(
+                global_ids, slot_times, [capacities.get(mess_id) for mess_id in global_ids]
+            )
+            if self.online_model is not None:
+                counts = [self.online_model.blend(mess_id, slot_times, mess_counts)
+                          for mess_id, mess_counts in zip(global_ids, counts)]
+            results.update(zip(global_ids, counts))
+        return results
+
+    def model_version(self, mess_id):
+        """
+        Identifies the model serving a mess (None without one); changes when
+        a retrained model is loaded
+        """
+        model = self.get_prediction_model(mess_id)
+        if model is None:
+            return None
+        if model.global_model is not None:
+            # predict_counts_for_messes serves these from the live global model
+            model = get_global_model()
+        return (model.model_path, model.metadata.get('trained_at'))
+
     def get_model_info(self, mess_id):
         """Get information about the trained model for a mess"""
         model = self.get_prediction_model(mess_id)
@@ -170,6 +235,29 @@ class PredictionService:
         return model.get_model_info()
 
 
+def start_online_ingestion(owns=None):
+    """
+    Start feeding attendance scans into the online model (ONLINE_MODEL != off)
+    owns: optional predicate on mess ids; other shards' scans are skipped
+    Returns the Firestore watch handle, or None when disabled or unavailable
+    """
+    if online_mode() == 'off':
+        return None
+    try:
+        from train_tensorflow import _init_firestore_client
+        db = _init_firestore_client()
+        if db is None:
+            return None
+        model = get_online_model()
+        watch = start_attendance_listener(db, model, owns=owns)
+        atexit.register(model.snapshot)
+        print("[OK] Online model listening for attendance scans")
+        return watch
+    except Exception as e:
+        print(f"[WARN] Online model ingestion unavailable: {e}")
+        return None
+
+
 # Global prediction service instance
 _prediction_service = None
 
@@ -0,0 +1,356 @@
+#!/usr/bin/env python3
+"""
+Precomputed meal predictions
+Predictions only change at slot boundaries, so instead of running the model
+per request a background thread recomputes every mess's predictions for the
+day shortly before each 15-minute meal slot. Each run is one batched pass
+(PredictionService.predict_counts_for_messes). The results go to an
+in-process cache that /predict reads, and to one Firestore document per mess,
+predictions/{mess}/{date}/latest, that clients can subscribe to.
+"""
+
+import os
+import threading
+import logging
+from datetime import datetime, timedelta
+
+import ml_path  # noqa: F401 (puts ml_model on sys.path)
+import firestore_breaker
+from env_config import FIRESTORE_BATCH_LIMIT, env_float
+from shared_cache import get_cache
+from prediction_log import version_label
+
+logger = logging.getLogger(__name__)
+
+SLOT_MINUTES = 15
+# Slots per meal returned to clients (a 2-hour meal has 8)
+MAX_SLOTS = 8
+# How long before each slot boundary the next horizon is computed
+DEFAULT_LEAD_SECONDS = 60
+PREDICTION_DOCUMENT = 'latest'
+
+
+def _lead_seconds():
+    return max(0.0, env_float('PREDICTION_LEAD_SECONDS', DEFAULT_LEAD_SECONDS))
+
+
+def upcoming_rows(payload, meal_type, now):
+    """Rows of a meal from the next slot boundary (or meal start) on, as on the on-demand path"""
+    next_slot = now.replace(minute=now.minute // SLOT_MINUTES * SLOT_MINUTES, second=0, microsecond=0)
+    if next_slot <= now:
+        next_slot += timedelta(minutes=SLOT_MINUTES)
+    if next_slot.date() != now.date():
+        return []
+    cutoff = next_slot.strftime('%H:%M')
+    return [row for row in payload['meals'].get(meal_type, []) if row['time_24h'] >= cutoff]
+
+
+class PredictionScheduler:
+    """
+    Keeps today's predictions for every known mess precomputed
+    service: a PredictionService; meal_windows: default {meal: (start time, end time)}
+    db: optional Firestore client to publish to
+    registry: optional MessRegistry supplying messes, capacities and meal windows
+    shared_cache: SharedCache for computed payloads (default: the process cache)
+    owns: optional predicate limiting scheduled messes to this instance's shard
+    """
+
+    def __init__(self, service, meal_windows, db=None, lead_seconds=None, registry=None, shared_cache=None,
+                 owns=None):
+        self.service = service
+        self.shared_cache = shared_cache or get_cache()
+        self.owns = owns or (lambda mess_id: True)
+        self.meal_windows = meal_windows
+        self.db = db
+        self.registry = registry
+        self.lead = timedelta(seconds=_lead_seconds() if lead_seconds is None else lead_seconds)
+        self.capacities = {}  # mess_id -> capacity used for its predictions
+        self.cache = {}  # mess_id -> (date, payload); payload is None when the mess has no model
+        self.forecasts = {}  # (mess_id, later date) -> ((model version, capacity), payload)
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _windows(self, mess_id):
+        if self.registry is not None and self.registry.get(mess_id) is not None:
+            return self.registry.meal_windows(mess_id)
+        return self.meal_windows
+
+    def _all_windows(self):
+        windows = [self.meal_windows]
+        if self.registry is not None:
+            windows.extend(info['meal_windows'] for info in self.registry.all(active_only=True).values())
+        return windows
+
+    def _sync_registry(self):
+        """Track every active registered mess of this shard at its registered capacity"""
+        if self.registry is None or not self.registry.loaded:
+            return
+        active = {
+            mess_id: info for mess_id, info in self.registry.all(active_only=True).items()
+            if self.owns(mess_id)
+        }
+        with self._lock:
+            for mess_id in [mess_id for mess_id in self.capacities if mess_id not in active]:
+                del self.capacities[mess_id]
+        for mess_id, info in active.items():
+            self.track(mess_id, info['capacity'])
+
+    def meal_slots(self, day, windows=None):
+        """{meal: [slot start datetimes]} for one date"""
+        slots = {}
+        for meal, (start, end) in (windows or self.meal_windows).items():
+            cursor = datetime.combine(day.date(), start)
+            end_dt = datetime.combine(day.date(), end)
+            slots[meal] = []
+            while cursor < end_dt and len(slots[meal]) < MAX_SLOTS:
+                slots[meal].append(cursor)
+                cursor += timedelta(minutes=SLOT_MINUTES)
+        return slots
+
+    def track(self, mess_id, capacity):
+        """Include a mess in scheduled runs; True when its capacity changed"""
+        with self._lock:
+            changed = self.capacities.get(mess_id) != capacity
+            self.capacities[mess_id] = capacity
+            return changed
+
+    def _compute_days(self, mess_ids, days, capacities, versions, now):
+        """Payloads for every mess on every day, in one batched model pass"""
+        from mess_prediction_model import format_slot_predictions
+
+        # Messes can have their own meal windows; predict the union of their slots once
+        slots_by_key = {
+            (mess_id, day.strftime('%Y-%m-%d')): self.meal_slots(day, self._windows(mess_id))
+            for mess_id in mess_ids for day in days
+        }
+        slot_times = sorted({slot for slots in slots_by_key.values() for meal in slots.values() for slot in meal})
+        position = {slot: i for i, slot in enumerate(slot_times)}
+        counts = self.service.predict_counts_for_messes(mess_ids, slot_times, capacities)
+
+        payloads = {}
+        for (mess_id, date), slots in slots_by_key.items():
+            mess_counts = counts.get(mess_id)
+            if mess_counts is None or all(count != count for count in mess_counts):
+                payloads[(mess_id, date)] = None
+                continue
+            capacity = capacities.get(mess_id) or 100
+            meals = {}
+            for meal, meal_times in slots.items():
+                meals[meal] = format_slot_predictions(
+                    meal_times, [mess_counts[position[slot]] for slot in meal_times], capacity, label=mess_id
+                )
+            payloads[(mess_id, date)] = {
+                'messId': mess_id,
+                'date': date,
+                'capacity': capacity,
+                'meals': meals,
+                'modelVersion': versions[mess_id],
+                'computedAt': now.isoformat(),
+            }
+        return payloads
+
+    def _predict_days(self, mess_ids, days, capacities, now):
+        """
+        {(mess_id, date): payload} for every mess on every day; payload is
+        None when the mess has no model. Payloads come from the shared cache,
+        keyed by model version and capacity, so instances compute each one
+        once per slot; misses are computed in one batched pass.
+        """
+        versions = {mess_id: version_label(self.service.model_version(mess_id)) for mess_id in mess_ids}
+        keys = {
+            (mess_id, day.strftime('%Y-%m-%d')): self.shared_cache.key(
+                'predictions', f"{mess_id}:{day.strftime('%Y-%m-%d')}:{capacities.get(mess_id) or 100}",
+                version=versions[mess_id],
+            )
+            for mess_id in mess_ids for day in days
+        }
+        # Online blending and the schedule both move on at the next slot boundary
+        next_slot = now.replace(minute=now.minute // SLOT_MINUTES * SLOT_MINUTES, second=0, microsecond=0)
+        next_slot += timedelta(minutes=SLOT_MINUTES)
+        ttl = max(1.0, (next_slot - now).total_seconds())
+
+        def compute(items):
+            computed = self._compute_days(
+                sorted({mess_id for mess_id, _ in items}),
+                [datetime.strptime(date, '%Y-%m-%d') for date in sorted({date for _, date in items})],
+                capacities, versions, now,
+            )
+            return {item: computed[item] for item in items}
+        return self.shared_cache.get_or_compute_many(keys, compute, ttl=ttl)
+
+    def refresh(self, mess_ids=None, now=None):
+        """Recompute today's predictions for the given (default: all tracked) messes"""
+        now = now or datetime.now()
+        if mess_ids is None:
+            self._sync_registry()
+        with self._lock:
+            capacities = dict(self.capacities)
+        mess_ids = list(capacities) if mess_ids is None else list(mess_ids)
+        if not mess_ids:
+            return {}
+
+        date = now.strftime('%Y-%m-%d')
+        payloads = {
+            mess_id: payload
+            for (mess_id, _), payload in self._predict_days(mess_ids, [now], capacities, now).items()
+        }
+        with self._lock:
+            for mess_id, payload in payloads.items():
+                self.cache[mess_id] = (date, payload)
+        self._publish({mess_id: payload for mess_id, payload in payloads.items() if payload})
+        self._share_table(payloads, now)
+        return payloads
+
+    def forecast(self, capacities, days=1, now=None):
+        """
+        Predictions for every meal of today and the following days
+        capacities: {mess_id: capacity}. Returns {mess_id: [payload per day]}
+        (None for messes without a model). Today's payloads are the
+        scheduled ones; later days are computed for all messes in one pass
+        and cached until the model serving the mess changes (a retrained
+        model is picked up) or its capacity does.
+        """
+        now = now or datetime.now()
+        dates = [(now + timedelta(days=offset)).strftime('%Y-%m-%d') for offset in range(days)]
+        today = dates[0]
+        versions = {mess_id: self.service.model_version(mess_id) for mess_id in capacities}
+
+        stale_today = []
+        for mess_id, capacity in capacities.items():
+            capacity_changed = self.track(mess_id, capacity)
+            with self._lock:
+                cached = self.cache.get(mess_id)
+            if capacity_changed or cached is None or cached[0] != today:
+                stale_today.append(mess_id)
+        with self._lock:
+            for key in [key for key in self.forecasts if key[1] < today]:
+                del self.forecasts[key]
+            stale_later = {
+                (mess_id, date) for mess_id in capacities for date in dates[1:]
+                if self.forecasts.get((mess_id, date), (None,))[0] != (versions[mess_id], capacities[mess_id])
+            }
+
+        if stale_today or stale_later:
+            mess_ids = sorted(set(stale_today) | {mess_id for mess_id, _ in stale_later})
+            days_needed = sorted({date for _, date in stale_later} | ({today} if stale_today else set()))
+            computed = self._predict_days(
+                mess_ids, [datetime.strptime(date, '%Y-%m-%d') for date in days_needed], capacities, now
+            )
+            with self._lock:
+                for mess_id in stale_today:
+                    self.cache[mess_id] = (today, computed[(mess_id, today)])
+                for key in stale_later:
+                    self.forecasts[key] = ((versions[key[0]], capacities[key[0]]), computed[key])
+            self._publish({mess_id: computed[(mess_id, today)] for mess_id in stale_today if computed[(mess_id, today)]})
+            self._share_table({mess_id: computed[(mess_id, today)] for mess_id in stale_today}, now)
+
+        result = {}
+        with self._lock:
+            for mess_id in capacities:
+                payloads = [self.cache[mess_id][1]] + [self.forecasts[(mess_id, date)][1] for date in dates[1:]]
+                result[mess_id] = None if any(payload is None for payload in payloads) else payloads
+        return result
+
+    def _publish(self, payloads):
+        """Write each payload to predictions/{mess}/{date}/latest in batched commits"""
+        if self.db is None or not payloads:
+            return
+        try:
+            items = list(payloads.items())
+            for start in range(0, len(items), FIRESTORE_BATCH_LIMIT):
+                batch = self.db.batch()
+                for mess_id, payload in items[start:start + FIRESTORE_BATCH_LIMIT]:
+                    ref = (self.db.collection('predictions').document(mess_id)
+                           .collection(payload['date']).document(PREDICTION_DOCUMENT))
+                    batch.set(ref, payload)
+                # Batched sets are idempotent, so the breaker may retry them
+                firestore_breaker.get_breaker().call(batch.commit)
+        except Exception as e:
+            logger.warning(f"Publishing predictions failed: {e}")
+
+    def _share_table(self, payloads, now):
+        """
+        Today's payloads under a version-free key for the rest of the day, so
+        instances that do not own a mess can answer for it (see table())
+        """
+        ttl = max(1.0, (datetime.combine(now.date() + timedelta(days=1), datetime.min.time()) - now).total_seconds())
+        for mess_id, payload in payloads.items():
+            if payload:
+                self.shared_cache.set(self._table_key(mess_id, payload['date']), payload, ttl=ttl)
+
+    def _table_key(self, mess_id, date):
+        return self.shared_cache.key('prediction-table', f"{mess_id}:{date}")
+
+    def table(self, mess_id, now=None):
+        """Today's payload last computed for a mess by any instance, or None"""
+        now = now or datetime.now()
+        return self.shared_cache.get(self._table_key(mess_id, now.strftime('%Y-%m-%d')))
+
+    def predictions(self, mess_id, meal_type, capacity, now=None):
+        """
+        Upcoming slots of a meal from the cache (computed on a miss)
+        Returns the prediction rows, or None when the mess has no model
+        """
+        now = now or datetime.now()
+        date = now.strftime('%Y-%m-%d')
+        capacity_changed = self.track(mess_id, capacity)
+        with self._lock:
+            cached = self.cache.get(mess_id)
+        if capacity_changed or cached is None or cached[0] != date:
+            payload = self.refresh([mess_id], now=now).get(mess_id)
+        else:
+            payload = cached[1]
+        if payload is None:
+            return None
+        return upcoming_rows(payload, meal_type, now)
+
+    def model_version(self, mess_id):
+        """Version label of the model behind the cached predictions for a mess"""
+        with self._lock:
+            cached = self.cache.get(mess_id)
+        return cached[1].get('modelVersion') if cached and cached[1] else None
+
+    def next_run(self, now):
+        """When to compute the horizon for the next meal slot boundary"""
+        candidates = [
+            slot - self.lead
+            for windows in self._all_windows()
+            for day in (now, now + timedelta(days=1))
+            for meal_times in self.meal_slots(day, windows).values()
+            for slot in meal_times
+            if slot - self.lead > now
+        ]
+        return min(candidates, default=now + timedelta(days=1))
+
+    def _is_meal_start(self, now):
+        target = now + self.lead
+        slot = target.replace(minute=target.minute // SLOT_MINUTES * SLOT_MINUTES, second=0, microsecond=0)
+        return any(
+            slot.time() == start
+            for windows in self._all_windows()
+            for start, _ in windows.values()
+        )
+
+    def _run(self):
+        while not self._stop.is_set():
+            now = datetime.now()
+            if self._is_meal_start(now):
+                # Pick up models retrained after the previous meal
+                self.service.reload_models()
+            try:
+                self.refresh(now=now)
+            except Exception as e:
+                logger.error(f"Scheduled prediction run failed: {e}")
+            delay = (self.next_run(datetime.now()) - datetime.now()).total_seconds()
+            self._stop.wait(max(delay, 1.0))
+
+    def start(self):
+        """Run scheduled refreshes in a daemon thread"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='prediction-scheduler', daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
@@ -0,0 +1,217 @@
+"""
+Retrain policy for SmartMess mess models
+Keeps cheap streaming statistics per mess and decides when a retrain
+is worth the compute:
+1. Volume  - enough new scans have arrived since the last training run
+2. Drift   - per-weekday slot mean counts moved away from their baseline
+3. Error   - the served model's predictions no longer match actual counts
+
+The statistics are plain dicts so they can be stored as-is in the
+model_metadata/{mess} document.
+"""
+
+import math
+from datetime import datetime
+
+import ml_path  # noqa: F401 (puts ml_model on sys.path)
+from env_config import env_float
+
+# Below this many new scans a retrain can't change much, whatever the drift
+MIN_NEW_RECORDS = env_float('RETRAIN_MIN_NEW_RECORDS', 200)
+# Retrain on volume alone once this many new scans have arrived
+VOLUME_RECORDS = env_float('RETRAIN_VOLUME_RECORDS', 5000)
+# Mean per-slot shift, in baseline standard deviations
+SLOT_SHIFT_THRESHOLD = env_float('RETRAIN_SLOT_SHIFT', 1.5)
+# Served-model MAE relative to the mean actual slot count
+MAX_RELATIVE_ERROR = env_float('RETRAIN_MAX_RELATIVE_ERROR', 0.5)
+# Safety net: retrain anyway after this many days
+MAX_AGE_DAYS = env_float('RETRAIN_MAX_AGE_DAYS', 30)
+
+# Meal windows as (start, end) minutes of the day; slots start every 15 minutes
+MEAL_WINDOWS = {
+    'breakfast': (7 * 60 + 30, 9 * 60 + 30),
+    'lunch': (12 * 60, 14 * 60),
+    'dinner': (19 * 60 + 30, 21 * 60 + 30),
+}
+
+# Observations of a slot before it has a usable baseline
+MIN_BASELINE_DAYS = 3
+# The newest observations of a slot stay out of its baseline this long, so a
+# change shows up against the old level before the baseline starts absorbing it
+BASELINE_LAG_DAYS = 3
+# The baseline follows the last this many observations before the lag (rolling Welford)
+BASELINE_DAYS = 8
+# Weight of the newest day in the recent per-slot and error averages
+RECENT_ALPHA = 0.3
+# Slots are keyed by weekday and time since STATS_VERSION 2
+STATS_VERSION = 2
+WEEKDAYS = ('Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun')
+
+
+def new_stats():
+    """Empty statistics for a mess"""
+    return {
+        'version': STATS_VERSION,
+        'newRecords': 0,
+        'updatedThrough': None,
+        'slots': {},
+        'errorMae': None,
+        'actualMean': None,
+    }
+
+
+def slot_key(dt):
+    """Slot key for a datetime, e.g. '12:30' (meal windows never overlap)"""
+    return f"{dt.hour:02d}:{(dt.minute // 15) * 15:02d}"
+
+
+def weekday_slot_key(day, key):
+    """Statistics key of a slot on a given day, e.g. 'Sat 12:30'"""
+    return f"{WEEKDAYS[day.weekday()]} {key}"
+
+
+def meal_slot_keys(meal_type):
+    """All slot keys of a meal window"""
+    start, end = MEAL_WINDOWS[meal_type]
+    return [f"{minute // 60:02d}:{minute % 60:02d}" for minute in range(start, end, 15)]
+
+
+def _ewma(previous, value):
+    if previous is None:
+        return float(value)
+    return float(RECENT_ALPHA * value + (1 - RECENT_ALPHA) * previous)
+
+
+def _new_slot():
+    return {'n': 0, 'mean': 0.0, 'm2': 0.0, 'lagged': [], 'recent': None, 'recentDays': 0}
+
+
+def _update_baseline(slot, count):
+    """
+    Welford update of a slot baseline over its last BASELINE_DAYS observations
+    Once the window is full, each observation replaces 1/BASELINE_DAYS of it
+    (the exponentially weighted form of Welford's update)
+    """
+    delta = count - slot['mean']
+    if slot['n'] < BASELINE_DAYS:
+        slot['n'] += 1
+        slot['mean'] += delta / slot['n']
+        slot['m2'] += delta * (count - slot['mean'])
+        return
+    weight = 1.0 / slot['n']
+    variance = (1 - weight) * (slot['m2'] / (slot['n'] - 1) + weight * delta * delta)
+    slot['mean'] += weight * delta
+    slot['m2'] = variance * (slot['n'] - 1)
+
+
+def fold_day(stats, day, slot_counts, predicted_counts=None):
+    """
+    Fold one completed day into the statistics
+    day: the date folded in; slots are compared with the same weekday only
+    slot_counts: {slot_key: actual count} for every meal slot of the day
+    predicted_counts: optional {slot_key: count predicted by the served model}
+    """
+    if stats.get('version') != STATS_VERSION:
+        # Slots of older statistics were not split by weekday
+        stats['slots'] = {}
+        stats['version'] = STATS_VERSION
+    stats['newRecords'] = int(stats.get('newRecords', 0)) + int(sum(slot_counts.values()))
+    slots = stats.setdefault('slots', {})
+
+    for key, count in slot_counts.items():
+        slot = slots.setdefault(weekday_slot_key(day, key), _new_slot())
+        slot['recent'] = _ewma(slot.get('recent'), count)
+        slot['recentDays'] = int(slot.get('recentDays', 0)) + 1
+        lagged = slot.setdefault('lagged', [])
+        lagged.append(count)
+        while len(lagged) > BASELINE_LAG_DAYS:
+            _update_baseline(slot, lagged.pop(0))
+
+    if slot_counts:
+        day_mean = sum(slot_counts.values()) / len(slot_counts)
+        stats['actualMean'] = _ewma(stats.get('actualMean'), day_mean)
+
+    if predicted_counts:
+        errors = [
+            abs(predicted_counts[key] - count)
+            for key, count in slot_counts.items()
+            if predicted_counts.get(key) is not None
+        ]
+        if errors:
+            stats['errorMae'] = _ewma(stats.get('errorMae'), sum(errors) / len(errors))
+
+    return stats
+
+
+def slot_shift(stats):
+    """Mean absolute shift of recent slot means from their baselines, in stds"""
+    shifts = []
+    for slot in (stats.get('slots') or {}).values():
+        if slot.get('recent') is None or slot.get('recentDays', 0) < 2 or slot.get('n', 0) < MIN_BASELINE_DAYS:
+            continue
+        std = math.sqrt(slot['m2'] / (slot['n'] - 1))
+        shifts.append(abs(slot['recent'] - slot['mean']) / max(std, 1.0))
+    if not shifts:
+        return 0.0
+    return sum(shifts) / len(shifts)
+
+
+def relative_error(stats):
+    """Served-model MAE relative to the mean actual slot count"""
+    error = stats.get('errorMae')
+    if error is None:
+        return 0.0
+    return error / max(stats.get('actualMean') or 0.0, 1.0)
+
+
+def retrain_decision(stats, last_trained_at, now=None):
+    """
+    Decide whether a mess needs retraining
+    Returns (should_retrain, reason)
+    """
+    if last_trained_at is None:
+        return True, 'never trained'
+
+    now = now or datetime.now()
+    if last_trained_at.tzinfo is not None:
+        last_trained_at = last_trained_at.astimezone(tz=None).replace(tzinfo=None)
+    age_days = (now - last_trained_at).total_seconds() / 86400
+    if age_days >= MAX_AGE_DAYS:
+        return True, f'model is {age_days:.0f} days old'
+
+    stats = stats or new_stats()
+    new_records = int(stats.get('newRecords', 0))
+    if new_records < MIN_NEW_RECORDS:
+        return False, f'only {new_records} new records'
+    if new_records >= VOLUME_RECORDS:
+        return True, f'{new_records} new records'
+
+    shift = slot_shift(stats)
+    if shift > SLOT_SHIFT_THRESHOLD:
+        return True, f'slot means shifted by {shift:.2f} std'
+
+    error = relative_error(stats)
+    if error > MAX_RELATIVE_ERROR:
+        return True, f'served predictions off by {error:.0%}'
+
+    return False, f'stable (shift {shift:.2f} std, error {error:.0%})'
+
+
+def reset_after_training(stats):
+    """
+    Start a fresh observation window after a retrain
+    The retrained model has seen the recent data, so the baseline restarts
+    from the observations still held back from it
+    """
+    stats = stats or new_stats()
+    for slot in (stats.get('slots') or {}).values():
+        lagged = slot.get('lagged') or []
+        if lagged:
+            slot.update(n=0, mean=0.0, m2=0.0, lagged=[])
+            for count in lagged:
+                _update_baseline(slot, count)
+        slot['recent'] = None
+        slot['recentDays'] = 0
+    stats['newRecords'] = 0
+    stats['errorMae'] = None
+    return stats
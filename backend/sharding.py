@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+"""
+Mess-affinity sharding of models across backend instances
+A consistent-hash ring over instance ids assigns every mess to one owner.
+Each instance loads, warms and schedules only the messes it owns, so its
+memory grows with its share of the messes rather than with all of them.
+Adding or removing an instance moves only the messes on the ring arcs it
+takes over or gives up (about 1/N of them).
+
+Configuration (sharding is off unless both are set):
+  SHARD_INSTANCES    id=url pairs, e.g. "a=https://mess-a.example.com,b=https://mess-b.example.com"
+  SHARD_INSTANCE_ID  this instance's id
+  SHARD_VNODES       points per instance on the ring (default 160)
+  SHARD_FORWARD_TIMEOUT  seconds for a forwarded request (default 2)
+  SHARD_SECRET       secret shared by all instances, to sign forwarded requests
+
+Requests for a foreign mess are answered from the owner's precomputed table
+in the shared cache when available, otherwise forwarded to the owner (once:
+forwarded requests carry FORWARDED_HEADER and are never forwarded again).
+The header holds the sender's id and an HMAC of it under SHARD_SECRET; only
+a valid one makes an instance serve a mess it does not own, so a client
+cannot set the header to make any instance load a foreign mess.
+"""
+
+import os
+import bisect
+import hashlib
+import hmac
+import logging
+import threading
+
+try:
+    import requests
+except ImportError:
+    requests = None
+
+import ml_path  # noqa: F401 (puts ml_model on sys.path)
+from env_config import env_float
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_VNODES = 160
+DEFAULT_FORWARD_TIMEOUT = 2.0
+FORWARDED_HEADER = 'X-Shard-Forwarded'
+
+
+def _hash(value):
+    return int.from_bytes(hashlib.blake2b(value.encode(), digest_size=8).digest(), 'big')
+
+
+def parse_instances(raw):
+    """{instance id: base url} from 'id=url,id=url' (a bare id has no url)"""
+    instances = {}
+    for part in (raw or '').split(','):
+        part = part.strip()
+        if not part:
+            continue
+        instance_id, _, url = part.partition('=')
+        instances[instance_id.strip()] = url.strip().rstrip('/') or None
+    return instances
+
+
+class HashRing:
+    """Consistent-hash ring with virtual nodes"""
+
+    def __init__(self, instances, vnodes=DEFAULT_VNODES):
+        self.instances = sorted(instances)
+        self.vnodes = max(1, int(vnodes))
+        points = sorted(
+            (_hash(f"{instance}#{i}"), instance)
+            for instance in self.instances for i in range(self.vnodes)
+        )
+        self._hashes = [point for point, _ in points]
+        self._owners = [instance for _, instance in points]
+
+    def owner(self, key):
+        """Instance owning key (None on an empty ring)"""
+        if not self._hashes:
+            return None
+        index = bisect.bisect(self._hashes, _hash(key)) % len(self._hashes)
+        return self._owners[index]
+
+    def assignments(self, keys):
+        """{key: owner} for many keys"""
+        return {key: self.owner(key) for key in keys}
+
+
+def forward_signature(secret, instance_id):
+    """FORWARDED_HEADER value for instance_id: 'id:hex HMAC-SHA256 of id'"""
+    digest = hmac.new(secret.encode(), instance_id.encode(), hashlib.sha256).hexdigest()
+    return f"{instance_id}:{digest}"
+
+
+class ShardRouter:
+    """Which instance serves a mess, and forwarding to it"""
+
+    def __init__(self, instances=None, instance_id=None, vnodes=None, timeout=None, secret=None):
+        if instances is None:
+            instances = parse_instances(os.environ.get('SHARD_INSTANCES'))
+        self.instance_id = instance_id or os.environ.get('SHARD_INSTANCE_ID') or None
+        vnodes = int(vnodes or env_float('SHARD_VNODES', DEFAULT_VNODES))
+        self.timeout = float(timeout or env_float('SHARD_FORWARD_TIMEOUT', DEFAULT_FORWARD_TIMEOUT))
+        self.secret = secret or os.environ.get('SHARD_SECRET') or None
+        self.instances = dict(instances)
+        self.enabled = bool(self.instance_id and len(self.instances) > 1)
+        if self.instance_id and self.instances and self.instance_id not in self.instances:
+            logger.warning(f"Shard instance {self.instance_id} is not in SHARD_INSTANCES; sharding off")
+            self.enabled = False
+        if self.enabled and not self.secret:
+            logger.warning("SHARD_SECRET is not set; forwarded requests cannot be authenticated")
+        self.ring = HashRing(self.instances, vnodes)
+        self.counters = {'forwarded': 0, 'forward_errors': 0, 'table_hits': 0}
+
+    def owner(self, mess_id):
+        return self.ring.owner(mess_id) if self.enabled else self.instance_id
+
+    def owns(self, mess_id):
+        """Whether this instance serves mess_id (always True without sharding)"""
+        return not self.enabled or self.ring.owner(mess_id) == self.instance_id
+
+    def shard(self, mess_ids):
+        """The mess ids this instance owns"""
+        return [mess_id for mess_id in mess_ids if self.owns(mess_id)]
+
+    def trusts(self, header):
+        """Whether a FORWARDED_HEADER value is signed by another instance"""
+        if not header or not self.secret:
+            return False
+        sender = header.partition(':')[0]
+        if sender == self.instance_id or sender not in self.instances:
+            return False
+        return hmac.compare_digest(header, forward_signature(self.secret, sender))
+
+    def forward(self, mess_id, path, payload):
+        """
+        POST payload to the owner of mess_id; returns (status, JSON body),
+        or None when the owner has no url or does not answer in time
+        """
+        url = self.instances.get(self.owner(mess_id))
+        if not url or requests is None:
+            return None
+        try:
+            response = requests.post(
+                f"{url}{path}", json=payload, timeout=self.timeout,
+                headers={FORWARDED_HEADER: forward_signature(self.secret or '', self.instance_id)},
+            )
+            body = response.json()
+        except Exception as e:
+            self.counters['forward_errors'] += 1
+            logger.warning(f"Forwarding {path} for {mess_id} to {url} failed: {e}")
+            return None
+        self.counters['forwarded'] += 1
+        return response.status_code, body
+
+    def snapshot(self):
+        return {
+            'enabled': self.enabled,
+            'instance': self.instance_id,
+            'instances': sorted(self.instances),
+            'counters': dict(self.counters),
+        }
+
+
+_router = None
+_router_lock = threading.Lock()
+
+def get_shard_router():
+    """Process-wide router from SHARD_INSTANCES / SHARD_INSTANCE_ID"""
+    global _router
+    with _router_lock:
+        if _router is None:
+            _router = ShardRouter()
+    return _router
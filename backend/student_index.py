@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+"""
+Per-student attendance index
+Attendance is partitioned by mess/date/meal, so one student's history
+would otherwise take a scan of every partition. The index keeps one small
+document per student and month:
+
+  student_index/{enrollmentId}/months/{YYYY-MM}
+    messes  {mess_id: {meal: bitmap}}   bit d-1 set = attended on day d
+    meals   {meal: bitmap}              union over messes
+    counts  {meal: days attended}, total, days (days with any meal)
+
+Scans reach the index through a Firestore listener on the API process
+(STUDENT_INDEX=1, the default; only messes of this instance's shard) and
+are flushed every STUDENT_INDEX_INTERVAL seconds (default 10). Each month
+document is read, merged and written in one transaction, so writers flushing
+the same student at once (several instances, the daily job) cannot drop each
+other's bits. Setting a bit is idempotent, so scans seen twice (several
+instances, replays) do no harm.
+index_day() rebuilds a day from the raw attendance; the daily job runs it
+for yesterday to pick up anything the listener missed.
+"""
+
+import os
+import atexit
+import logging
+import threading
+from calendar import monthrange
+from datetime import datetime
+
+import ml_path  # noqa: F401 (puts ml_model on sys.path)
+import firestore_breaker
+import scan_listener
+from env_config import env_float
+from shared_cache import get_cache
+
+logger = logging.getLogger(__name__)
+
+MEALS = ('breakfast', 'lunch', 'dinner')
+DEFAULT_INTERVAL = 10
+
+
+def normalize_enrollment_id(value):
+    """Index key for an enrollment id, as the app normalizes it (None for anonymous scans)"""
+    value = str(value or '').strip().lower()
+    if not value or value.startswith('anon-'):
+        return None
+    return value
+
+
+def attended_days(bitmap):
+    """Days of the month set in a bitmap"""
+    return [day + 1 for day in range(31) if bitmap >> day & 1]
+
+
+def merge_bits(stored, messes):
+    """{mess_id: {meal: bitmap}} with every bit of both"""
+    merged = {mess_id: dict(meals) for mess_id, meals in (stored or {}).items()}
+    for mess_id, meals in messes.items():
+        target = merged.setdefault(mess_id, {})
+        for meal, bitmap in meals.items():
+            target[meal] = target.get(meal, 0) | bitmap
+    return merged
+
+
+def _run_transaction(db, update):
+    """Run update(transaction) in a Firestore transaction, retried by Firestore on contention"""
+    from google.cloud import firestore
+    return firestore.transactional(update)(db.transaction())
+
+
+def month_document(enrollment_id, month, messes):
+    """Complete index document for {mess_id: {meal: bitmap}}"""
+    meals = {}
+    for mess_meals in messes.values():
+        for meal, bitmap in mess_meals.items():
+            meals[meal] = meals.get(meal, 0) | bitmap
+    any_meal = 0
+    for bitmap in meals.values():
+        any_meal |= bitmap
+    return {
+        'enrollmentId': enrollment_id,
+        'month': month,
+        'messes': messes,
+        'meals': meals,
+        'counts': {meal: bitmap.bit_count() for meal, bitmap in meals.items()},
+        'total': sum(bitmap.bit_count() for bitmap in meals.values()),
+        'days': any_meal.bit_count(),
+        'updatedAt': datetime.now().isoformat(),
+    }
+
+
+def month_stats(document, month, now=None):
+    """API summary of an index document (None: no attendance that month)"""
+    now = now or datetime.now()
+    year, month_number = (int(part) for part in month.split('-'))
+    days_in_month = monthrange(year, month_number)[1]
+    if (year, month_number) == (now.year, now.month):
+        days_elapsed = now.day
+    elif (year, month_number) < (now.year, now.month):
+        days_elapsed = days_in_month
+    else:
+        days_elapsed = 0
+    document = document or {}
+    meals = {}
+    for meal in MEALS:
+        bitmap = (document.get('meals') or {}).get(meal, 0)
+        count = bitmap.bit_count()
+        meals[meal] = {
+            'count': count,
+            'days': attended_days(bitmap),
+            'rate': round(count / days_elapsed, 3) if days_elapsed else None,
+        }
+    return {
+        'month': month,
+        'daysInMonth': days_in_month,
+        'daysElapsed': days_elapsed,
+        'daysAttended': document.get('days', 0),
+        'total': document.get('total', 0),
+        'meals': meals,
+        'messes': {
+            mess_id: {meal: bitmap.bit_count() for meal, bitmap in mess_meals.items()}
+            for mess_id, mess_meals in (document.get('messes') or {}).items()
+        },
+    }
+
+
+class StudentIndex:
+    """Buffers scans as bits and merges them into the month documents"""
+
+    def __init__(self, db, interval=None, shared_cache=None):
+        self.db = db
+        self.interval = interval if interval is not None else env_float('STUDENT_INDEX_INTERVAL', DEFAULT_INTERVAL)
+        self.shared_cache = shared_cache or get_cache()
+        self.cache_seconds = env_float('STUDENT_STATS_CACHE_SECONDS', 30)
+        self._pending = {}  # (enrollment id, month) -> {mess_id: {meal: bitmap}}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._thread_pid = None
+        self.counters = {'observed': 0, 'flushed_documents': 0, 'errors': 0}
+
+    def _ref(self, enrollment_id, month):
+        return self.db.collection('student_index').document(enrollment_id).collection('months').document(month)
+
+    def observe(self, mess_id, date_str, meal, enrollment_id):
+        """Record one scan; False when it cannot be indexed"""
+        enrollment_id = normalize_enrollment_id(enrollment_id)
+        if enrollment_id is None or meal not in MEALS:
+            return False
+        try:
+            day = datetime.strptime(date_str, '%Y-%m-%d')
+        except (TypeError, ValueError):
+            return False
+        with self._lock:
+            messes = self._pending.setdefault((enrollment_id, day.strftime('%Y-%m')), {})
+            meals = messes.setdefault(mess_id, {})
+            meals[meal] = meals.get(meal, 0) | 1 << (day.day - 1)
+            self.counters['observed'] += 1
+        return True
+
+    def _merge_pending(self, pending):
+        with self._lock:
+            for key, messes in pending.items():
+                self._pending[key] = merge_bits(self._pending.get(key), messes)
+
+    def _write(self, enrollment_id, month, messes):
+        """Merge bits into one month document inside a transaction"""
+        ref = self._ref(enrollment_id, month)
+
+        def update(transaction):
+            current = ref.get(transaction=transaction)
+            stored = (current.to_dict() or {}).get('messes') if current.exists else None
+            transaction.set(ref, month_document(enrollment_id, month, merge_bits(stored, messes)))
+        firestore_breaker.get_breaker().call(_run_transaction, self.db, update)
+
+    def flush(self):
+        """Merge buffered bits into Firestore; returns the number of documents written"""
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+            failed = {}
+            error = None
+            for (enrollment_id, month), messes in pending.items():
+                try:
+                    self._write(enrollment_id, month, messes)
+                except Exception as e:
+                    failed[(enrollment_id, month)] = messes
+                    error = e
+            if failed:
+                # Bits only ever get set, so retrying them later is safe
+                self.counters['errors'] += 1
+                self._merge_pending(failed)
+                logger.warning(f"Student index flush failed, {len(failed)} documents kept: {error}")
+            written = len(pending) - len(failed)
+            self.counters['flushed_documents'] += written
+            return written
+
+    def _run(self):
+        stop = threading.Event()
+        while not stop.wait(self.interval):
+            self.flush()
+
+    def start(self):
+        """Flush in a daemon thread (once per process)"""
+        if self._thread_pid != os.getpid():
+            self._thread_pid = os.getpid()
+            threading.Thread(target=self._run, name='student-index', daemon=True).start()
+            atexit.register(self.flush)
+        return self
+
+    def index_day(self, mess_id, date_str):
+        """Index every scan of one day from the raw attendance; returns the scans seen"""
+        breaker = firestore_breaker.get_breaker()
+        date_col = self.db.collection('attendance').document(mess_id).collection(date_str)
+        seen = 0
+        for meal in MEALS:
+            students = date_col.document(meal).collection('students')
+            for document in breaker.call(lambda: list(students.stream())):
+                enrollment_id = (document.to_dict() or {}).get('enrollmentId') or document.id
+                seen += self.observe(mess_id, date_str, meal, enrollment_id)
+        self.flush()
+        return seen
+
+    def stats(self, enrollment_id, month, now=None):
+        """Monthly stats for a student from one document read (cached briefly)"""
+        enrollment_id = normalize_enrollment_id(enrollment_id)
+        if enrollment_id is None:
+            raise ValueError("enrollmentId is required")
+
+        def load():
+            document = firestore_breaker.get_breaker().call(self._ref(enrollment_id, month).get)
+            return document.to_dict() if document.exists else None
+        document = self.shared_cache.get_or_compute(
+            self.shared_cache.key('student-stats', f"{enrollment_id}:{month}"), load, ttl=self.cache_seconds
+        )
+        return dict(month_stats(document, month, now), enrollmentId=enrollment_id)
+
+    def snapshot(self):
+        with self._lock:
+            return {'pending': len(self._pending), 'counters': dict(self.counters)}
+
+
+def start_listener(db, index, owns=None, since=None):
+    """
+    Feed new attendance scans into the index via a Firestore listener
+    owns: optional predicate on mess ids (this instance's shard)
+    Raises when the scan query cannot run (see scan_listener).
+    Returns the watch handle; call .unsubscribe() to stop.
+    """
+    def _on_scan(mess_id, date_str, meal, document_id, data):
+        index.observe(mess_id, date_str, meal, data.get('enrollmentId') or document_id)
+
+    watch = scan_listener.listen(db, _on_scan, since=since, owns=owns)
+    index.start()
+    return watch
+
+
+_index = None
+_index_lock = threading.Lock()
+
+def get_student_index(db):
+    """Process-wide StudentIndex (db is used on first call)"""
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = StudentIndex(db)
+    return _index
@@ -1,3 +1,4 @@
+import 'dart:async';
 import 'package:flutter/foundation.dart';
 import 'package:smart_mess/services/prediction_service.dart';
 import 'package:smart_mess/models/prediction_model.dart';
@@ -7,6 +8,7 @@ class PredictionProvider extends ChangeNotifier {
   PredictionResult? _prediction;
   bool _isLoading = false;
   String? _error;
+  StreamSubscription<PredictionResult?>? _subscription;
 
   PredictionResult? get prediction => _prediction;
   bool get isLoading => _isLoading;
@@ -40,4 +42,35 @@ class PredictionProvider extends ChangeNotifier {
       notifyListeners();
     }
   }
+
+  /// Follow the predictions the backend publishes to Firestore instead of
+  /// polling; falls back to one /predict call while none are published.
+  void subscribe(
+    String messId, {
+    String? mealType,
+    int? capacity,
+  }) {
+    _subscription?.cancel();
+    if (messId.isEmpty) return;
+    _subscription = _predictionService
+        .watchPrediction(messId, mealType: mealType)
+        .listen((result) {
+      if (result == null) {
+        fetchPrediction(messId, mealType: mealType, capacity: capacity);
+        return;
+      }
+      _prediction = result;
+      _error = null;
+      _isLoading = false;
+      notifyListeners();
+    }, onError: (_) {
+      fetchPrediction(messId, mealType: mealType, capacity: capacity);
+    });
+  }
+
+  @override
+  void dispose() {
+    _subscription?.cancel();
+    super.dispose();
+  }
 }
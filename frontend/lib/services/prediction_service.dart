@@ -1,4 +1,5 @@
 import 'package:http/http.dart' as http;
+import 'package:cloud_firestore/cloud_firestore.dart';
 import 'dart:convert';
 import 'package:flutter/foundation.dart' show kIsWeb;
 import 'package:smart_mess/models/prediction_model.dart';
@@ -100,6 +101,60 @@ class PredictionService {
     }
   }
 
+  static const Map<String, List<int>> _mealWindows = {
+    'breakfast': [7 * 60 + 30, 9 * 60 + 30],
+    'lunch': [12 * 60, 14 * 60],
+    'dinner': [19 * 60 + 30, 21 * 60 + 30],
+  };
+
+  String? _currentMeal(DateTime now) {
+    final minutes = now.hour * 60 + now.minute;
+    for (final entry in _mealWindows.entries) {
+      if (minutes >= entry.value[0] && minutes < entry.value[1]) {
+        return entry.key;
+      }
+    }
+    return null;
+  }
+
+  String _twoDigits(int value) => value.toString().padLeft(2, '0');
+
+  /// Live predictions published by the backend scheduler to
+  /// predictions/{messId}/{date}/latest. Emits the upcoming slots of the
+  /// meal (default: the current one) whenever the document changes, or null
+  /// when nothing has been published yet; callers can then use getPrediction.
+  Stream<PredictionResult?> watchPrediction(String messId, {String? mealType}) {
+    final now = DateTime.now();
+    final date = '${now.year}-${_twoDigits(now.month)}-${_twoDigits(now.day)}';
+    return FirebaseFirestore.instance
+        .collection('predictions')
+        .doc(messId)
+        .collection(date)
+        .doc('latest')
+        .snapshots()
+        .map((snapshot) {
+      final data = snapshot.data();
+      final meal = _normalizeMealType(mealType) ?? _currentMeal(DateTime.now());
+      if (data == null || meal == null) return null;
+      final meals = data['meals'];
+      final rows = meals is Map ? meals[meal] : null;
+      if (rows is! List) return null;
+
+      // Slots from the next 15-minute boundary, as /predict returns them
+      final current = DateTime.now();
+      final nextSlot = (current.hour * 60 + current.minute) ~/ 15 * 15 + 15;
+      final cutoff = '${_twoDigits(nextSlot ~/ 60)}:${_twoDigits(nextSlot % 60)}';
+      final upcoming = rows
+          .whereType<Map>()
+          .where((row) => (row['time_24h'] ?? '').toString().compareTo(cutoff) >= 0)
+          .toList();
+      return PredictionResult.fromJson({
+        'messId': messId,
+        'predictions': upcoming,
+      });
+    });
+  }
+
   @Deprecated('Backend no longer exposes /train. Use getPrediction instead.')
   Future<bool> trainModel(
     String messId, {
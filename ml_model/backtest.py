@@ -0,0 +1,360 @@
+#!/usr/bin/env python3
+"""
+Rolling-origin backtest for mess crowd models
+Replays history day by day: for each test day, every model is fit on the
+slot buckets before that day and scored on that day's actual slot counts
+(bucketed exactly like prepare_data). Folds run in parallel processes.
+
+Compared models:
+  keras         - the MessCrowdRegressor network
+  slot_average, ridge, gbt - classical backends from model_backends
+  legacy        - backend/prediction_model.py PredictionModel (slot averages)
+  fallback      - backend/meal_slots.py generate_fallback_predictions (the /predict fallback)
+
+Usage:
+  python backtest.py alder oak --days 14 --refit-every 1 --workers 4
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+import numpy as np
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend')
+
+MODELS = ('keras', 'slot_average', 'ridge', 'gbt', 'legacy', 'fallback')
+MEAL_NAMES = {0: 'breakfast', 1: 'lunch', 2: 'dinner'}
+# Slot starts scored for each meal, as minutes of the day (every model covers these)
+MEAL_SLOTS = {
+    0: (7 * 60 + 30, 9 * 60 + 30),
+    1: (12 * 60, 14 * 60),
+    2: (19 * 60 + 30, 21 * 60 + 30),
+}
+# A fold needs at least this many days of history before its test day
+MIN_TRAIN_DAYS = 3
+
+
+def bucket_history(mess_id, records):
+    """
+    Slot buckets and scan times for one mess
+    records: attendance record dicts, or columns such as
+    synthetic_data.to_columns() ({'markedAt': array, ...})
+    Returns {'X', 'y', 'slot_starts', 'scan_times'} as NumPy arrays
+    """
+    from train_tensorflow import MessCrowdRegressor, _parse_marked_at
+
+    regressor = MessCrowdRegressor(mess_id)
+    if isinstance(records, dict):
+        X, y, slot_starts = regressor._bucket_arrays_columnar(records)
+        marked_at = np.asarray(records['markedAt'])
+        if marked_at.dtype.kind != 'M':
+            marked_at = np.array([value for value in marked_at if value], dtype=object)
+    else:
+        X, y, slot_starts = regressor._bucket_arrays(regressor._bucket_counts(records))
+        marked_at = np.array([record.get('markedAt') for record in records if record.get('markedAt')], dtype=object)
+    scan_times = _parse_marked_at(marked_at) if len(marked_at) else np.array([], dtype='datetime64[m]')
+    return {'X': X, 'y': y, 'slot_starts': slot_starts, 'scan_times': scan_times[~np.isnat(scan_times)]}
+
+
+def test_days(slot_starts, days):
+    """The last `days` days with data that have MIN_TRAIN_DAYS of history before them"""
+    all_days = np.unique(slot_starts.astype('datetime64[D]'))
+    if len(all_days) <= MIN_TRAIN_DAYS:
+        return []
+    return list(all_days[MIN_TRAIN_DAYS:][-days:])
+
+
+def _scored_mask(X):
+    """Slots inside the meal windows (the inclusive 14:00 lunch bucket is not served)"""
+    minute_of_day = X[:, 0].astype(np.int64) * 60 + X[:, 3].astype(np.int64)
+    mask = np.zeros(len(X), dtype=bool)
+    for meal_code, (start, end) in MEAL_SLOTS.items():
+        mask |= (X[:, 2] == meal_code) & (minute_of_day >= start) & (minute_of_day < end)
+    return mask
+
+
+def _fit_models(mess_id, X_train, y_train, slot_starts_train, scan_times_train, models, capacity=100):
+    """Fit every requested model; returns ({name: predict(X, slot_starts)}, {name: fit seconds})"""
+    from train_tensorflow import MessCrowdRegressor
+    import model_backends
+
+    predictors = {}
+    fit_seconds = {}
+
+    if 'keras' in models:
+        from sklearn.preprocessing import StandardScaler
+        from mess_prediction_model import compiled_predict
+        started = time.perf_counter()
+        regressor = MessCrowdRegressor(mess_id)
+        scaler = StandardScaler().fit(X_train)
+        network = regressor.create_model(X_train.shape[1])
+        regressor._fit(network, scaler.transform(X_train).astype(np.float32), y_train,
+                       slot_starts_train, epochs=regressor.TRAIN_EPOCHS)
+        # Scored through the same compiled call as serving and backend selection;
+        # tracing it counts towards the fit, not the latency
+        network_call = compiled_predict(network, X_train[:1].astype(np.float32))
+        network_call(scaler.transform(X_train[:1]).astype(np.float32))
+        fit_seconds['keras'] = time.perf_counter() - started
+        predictors['keras'] = lambda X, _: np.asarray(
+            network_call(scaler.transform(X).astype(np.float32))).reshape(-1)
+
+    for name in model_backends.BACKENDS:
+        if name not in models:
+            continue
+        started = time.perf_counter()
+        backend = model_backends.create_backend(name).fit(X_train, y_train)
+        fit_seconds[name] = time.perf_counter() - started
+        predictors[name] = lambda X, _, backend=backend: backend.predict(X)
+
+    if 'legacy' in models:
+        if BACKEND_DIR not in sys.path:
+            sys.path.insert(0, BACKEND_DIR)
+        from prediction_model import PredictionModel
+
+        started = time.perf_counter()
+        legacy = PredictionModel()
+        scans = [{'ts': stamp, 'messId': mess_id} for stamp in scan_times_train.astype(object)]
+        trained = legacy.train(scans, save=False) if scans else False
+        fit_seconds['legacy'] = time.perf_counter() - started
+        if trained:
+            def _legacy_predict(X, _):
+                # Expected value of predict_next_slots (its jitter averages out)
+                day_of_week = X[:, 1].astype(np.int64)
+                slots = X[:, 0].astype(np.int64) * 4 + X[:, 3].astype(np.int64) // 15
+                return np.array([
+                    legacy.slot_average(mess_id, dow, slot, default=0.0)
+                    for dow, slot in zip(day_of_week, slots)
+                ])
+            predictors['legacy'] = _legacy_predict
+
+    if 'fallback' in models:
+        if BACKEND_DIR not in sys.path:
+            sys.path.insert(0, BACKEND_DIR)
+        from meal_slots import generate_fallback_predictions
+        fit_seconds['fallback'] = 0.0
+
+        def _fallback_predict(X, slot_starts):
+            # One call per meal from just before the meal opens, as /predict would
+            predicted = np.full(len(X), np.nan)
+            days = slot_starts.astype('datetime64[D]')
+            for day in np.unique(days):
+                day_start = day.astype(object)
+                for meal_code, (start, end) in MEAL_SLOTS.items():
+                    rows = np.flatnonzero((days == day) & (X[:, 2] == meal_code))
+                    if not len(rows):
+                        continue
+                    now = datetime.combine(day_start, datetime.min.time()) + timedelta(minutes=start - 1)
+                    by_slot = {
+                        p['time_24h']: p['predicted_crowd']
+                        for p in generate_fallback_predictions(
+                            MEAL_NAMES[meal_code], capacity=capacity,
+                            now=now, max_slots=(end - start) // 15)
+                    }
+                    for row in rows:
+                        key = f"{int(X[row, 0]):02d}:{int(X[row, 3]):02d}"
+                        predicted[row] = by_slot.get(key, np.nan)
+            return predicted
+        predictors['fallback'] = _fallback_predict
+
+    return predictors, fit_seconds
+
+
+def run_fold_chunk(task):
+    """
+    Fit once on history before the first day of the chunk, then score every
+    day in the chunk (refit_every > 1 reuses that fit for later days)
+    """
+    mess_id, history, chunk_days, models, capacity = task
+    X, y, slot_starts = history['X'], history['y'], history['slot_starts']
+    scan_times = history['scan_times']
+    first_day = chunk_days[0]
+
+    train = slot_starts < first_day.astype('datetime64[m]')
+    scan_train = scan_times < first_day.astype('datetime64[m]')
+    predictors, fit_seconds = _fit_models(
+        mess_id, X[train], y[train], slot_starts[train], scan_times[scan_train], models, capacity)
+
+    rows = []
+    timings = {name: {'fit_s': seconds, 'predict_s': 0.0, 'calls': 0} for name, seconds in fit_seconds.items()}
+    day_of_slot = slot_starts.astype('datetime64[D]')
+    for day in chunk_days:
+        test = (day_of_slot == day) & _scored_mask(X)
+        if not test.any():
+            continue
+        X_test, y_test = X[test], y[test]
+        for name, predict in predictors.items():
+            started = time.perf_counter()
+            predicted = np.maximum(np.asarray(predict(X_test, slot_starts[test]), dtype=np.float64), 0)
+            timings[name]['predict_s'] += time.perf_counter() - started
+            timings[name]['calls'] += 1
+            for meal_code, meal_name in MEAL_NAMES.items():
+                meal_rows = X_test[:, 2] == meal_code
+                if meal_rows.any():
+                    rows.append({
+                        'model': name,
+                        'mess_id': mess_id,
+                        'meal': meal_name,
+                        'day': str(day),
+                        'predicted': predicted[meal_rows].tolist(),
+                        'actual': y_test[meal_rows].tolist(),
+                    })
+    return rows, timings
+
+
+def _worker_init():
+    # One TensorFlow thread per worker so parallel folds don't oversubscribe the CPU
+    os.environ.setdefault('TRAIN_CPU_THREADS', '1')
+    import logging
+    logging.getLogger('tensorflow').setLevel(logging.ERROR)
+
+
+def summarize(rows, timings):
+    """MAE/MAPE per (model, mess, meal) plus mean fit time and latency per model"""
+    grouped = {}
+    for row in rows:
+        key = (row['model'], row['mess_id'], row['meal'])
+        predicted, actual = grouped.setdefault(key, ([], []))
+        predicted.extend(row['predicted'])
+        actual.extend(row['actual'])
+
+    metrics = []
+    for (model, mess_id, meal), (predicted, actual) in sorted(grouped.items()):
+        predicted = np.array(predicted, dtype=np.float64)
+        actual = np.array(actual, dtype=np.float64)
+        scored = ~np.isnan(predicted)
+        errors = np.abs(predicted[scored] - actual[scored])
+        nonzero = actual[scored] > 0
+        metrics.append({
+            'model': model,
+            'mess_id': mess_id,
+            'meal': meal,
+            'slots': int(scored.sum()),
+            'mae': float(errors.mean()) if len(errors) else None,
+            'mape': float(np.mean(errors[nonzero] / actual[scored][nonzero]) * 100) if nonzero.any() else None,
+        })
+
+    totals = {}
+    for chunk in timings:
+        for model, timing in chunk.items():
+            total = totals.setdefault(model, {'fit_s': 0.0, 'fits': 0, 'predict_s': 0.0, 'calls': 0})
+            total['fit_s'] += timing['fit_s']
+            total['fits'] += 1
+            total['predict_s'] += timing['predict_s']
+            total['calls'] += timing['calls']
+    model_timings = {
+        model: {
+            'mean_fit_s': total['fit_s'] / max(total['fits'], 1),
+            'mean_latency_ms': total['predict_s'] * 1000 / max(total['calls'], 1),
+        }
+        for model, total in totals.items()
+    }
+    return metrics, model_timings
+
+
+def run_backtest(history_by_mess, days=7, refit_every=1, models=MODELS, workers=None, capacities=None):
+    """
+    Rolling-origin backtest over the last `days` days of each mess
+    history_by_mess: {mess_id: bucket_history(...)}
+    Returns (metrics, model_timings, wall seconds)
+    """
+    capacities = capacities or {}
+    tasks = []
+    for mess_id, history in history_by_mess.items():
+        fold_days = test_days(history['slot_starts'], days)
+        for start in range(0, len(fold_days), max(1, refit_every)):
+            chunk = fold_days[start:start + max(1, refit_every)]
+            tasks.append((mess_id, history, chunk, tuple(models), capacities.get(mess_id, 100)))
+
+    if not tasks:
+        print("[WARN] Not enough history for any backtest fold")
+        return [], {}, 0.0
+
+    workers = workers or min(len(tasks), os.cpu_count() or 1)
+    print(f"[INFO] Backtesting {len(tasks)} folds on {workers} workers...")
+    started = time.perf_counter()
+    if workers > 1:
+        # spawn: TensorFlow is not fork-safe once initialised
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=_worker_init) as pool:
+            results = list(pool.map(run_fold_chunk, tasks))
+    else:
+        results = [run_fold_chunk(task) for task in tasks]
+    wall_time = time.perf_counter() - started
+
+    rows = [row for chunk_rows, _ in results for row in chunk_rows]
+    metrics, model_timings = summarize(rows, [timing for _, timing in results])
+    return metrics, model_timings, wall_time
+
+
+def print_report(metrics, model_timings, wall_time):
+    print("\n" + "=" * 70)
+    print(f"{'model':<13} {'mess':<12} {'meal':<10} {'slots':>6} {'MAE':>8} {'MAPE %':>8}")
+    print("-" * 70)
+    for row in metrics:
+        mae = f"{row['mae']:.2f}" if row['mae'] is not None else '-'
+        mape = f"{row['mape']:.1f}" if row['mape'] is not None else '-'
+        print(f"{row['model']:<13} {row['mess_id']:<12} {row['meal']:<10} {row['slots']:>6} {mae:>8} {mape:>8}")
+    print("-" * 70)
+    print(f"{'model':<13} {'fit s/fold':>12} {'latency ms':>12}")
+    for model, timing in sorted(model_timings.items()):
+        print(f"{model:<13} {timing['mean_fit_s']:>12.3f} {timing['mean_latency_ms']:>12.3f}")
+    print(f"\nBacktest wall time: {wall_time:.1f}s")
+    print("=" * 70)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Rolling-origin backtest for SmartMess crowd models')
+    parser.add_argument('mess_ids', nargs='*', default=['alder'])
+    parser.add_argument('--days', type=int, default=7, help='test days per mess')
+    parser.add_argument('--history-days', type=int, default=30, help='days of attendance to load')
+    parser.add_argument('--refit-every', type=int, default=1, help='reuse each fit for this many test days')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--models', default=','.join(MODELS))
+    parser.add_argument('--capacity', type=int, default=100, help='capacity passed to the fallback')
+    parser.add_argument('--dummy', action='store_true', help='use generated data instead of Firestore')
+    parser.add_argument('--seed', type=int, default=0, help='seed for generated data')
+    parser.add_argument('--output', help='write metrics JSON to this path')
+    args = parser.parse_args()
+
+    from train_tensorflow import load_firebase_data
+    import synthetic_data
+
+    history_by_mess = {}
+    generated = None
+    for mess_id in args.mess_ids:
+        records = [] if args.dummy else load_firebase_data(mess_id, days_back=args.history_days)
+        if not records:
+            print(f"[WARN] No Firebase data for {mess_id}; using generated data")
+            if generated is None:
+                generated = synthetic_data.generate_events(
+                    args.mess_ids, days=args.history_days,
+                    capacities={mess_id: args.capacity for mess_id in args.mess_ids}, seed=args.seed,
+                )
+            records = synthetic_data.to_columns(generated, mess_id)
+        history_by_mess[mess_id] = bucket_history(mess_id, records)
+
+    models = [name.strip() for name in args.models.split(',') if name.strip() in MODELS]
+    metrics, model_timings, wall_time = run_backtest(
+        history_by_mess,
+        days=args.days,
+        refit_every=args.refit_every,
+        models=models,
+        workers=args.workers,
+        capacities={mess_id: args.capacity for mess_id in args.mess_ids},
+    )
+    print_report(metrics, model_timings, wall_time)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'metrics': metrics, 'timings': model_timings, 'wall_time_s': wall_time}, f, indent=2)
+        print(f"[OK] Wrote {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
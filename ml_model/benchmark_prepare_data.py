@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""
+Benchmark the record-based and columnar prepare_data paths
+Usage: python benchmark_prepare_data.py [num_records]
+
+The columnar path is timed twice: on ISO-string timestamps (the format
+Firestore records carry) and on datetime64 timestamps (typed columns).
+"""
+
+import sys
+import time
+from datetime import datetime
+import numpy as np
+from train_tensorflow import MessCrowdRegressor
+
+
+def build_stamps(num_records, days=120, seed=7):
+    """Synthetic scan times spread over the meal windows of the last `days` days"""
+    rng = np.random.default_rng(seed)
+    meal_starts = np.array([7 * 60 + 30, 12 * 60, 19 * 60 + 30])
+    start_day = np.datetime64(datetime.now().date(), 'D') - days
+    day = start_day + rng.integers(0, days, num_records)
+    minute = meal_starts[rng.integers(0, 3, num_records)] + rng.integers(0, 120, num_records)
+    return day.astype('datetime64[s]') + (minute * 60 + rng.integers(0, 60, num_records)).astype('timedelta64[s]')
+
+
+def _time(label, func, num_records, repeats=3):
+    """Best-of-N wall time, so one-off allocation warm-up doesn't skew the result"""
+    elapsed = float('inf')
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = func()
+        elapsed = min(elapsed, time.perf_counter() - start)
+    print(f"  {label:<26}{elapsed:8.3f}s ({num_records / elapsed:,.0f} records/s)")
+    return result, elapsed
+
+
+def main():
+    num_records = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    stamps = build_stamps(num_records)
+    iso_strings = np.datetime_as_string(stamps, unit='s').astype(object)
+    records = [{'markedAt': marked_at} for marked_at in iso_strings]
+    regressor = MessCrowdRegressor('benchmark')
+
+    print(f"[BENCH] prepare_data on {num_records:,} records")
+    (X_rec, y_rec, _), record_s = _time('Record path:', lambda: regressor.prepare_data(records), num_records)
+    (X_str, y_str, _), string_s = _time(
+        'Columnar (ISO strings):', lambda: regressor.prepare_data_columnar({'markedAt': iso_strings}), num_records
+    )
+    (X_dt, y_dt, _), typed_s = _time(
+        'Columnar (datetime64):', lambda: regressor.prepare_data_columnar({'markedAt': stamps}), num_records
+    )
+
+    identical = all(
+        np.array_equal(X_rec, X) and np.array_equal(y_rec, y)
+        for X, y in ((X_str, y_str), (X_dt, y_dt))
+    )
+    print(f"  Speedup (ISO strings):    {record_s / string_s:8.1f}x")
+    print(f"  Speedup (datetime64):     {record_s / typed_s:8.1f}x")
+    print(f"  Identical:                {identical} ({len(y_rec)} slot buckets)")
+    return 0 if identical else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
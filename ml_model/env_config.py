@@ -0,0 +1,19 @@
+#!/usr/bin/env python3
+"""
+Settings shared by the ml_model and backend modules
+Numeric settings come from environment variables through env_float();
+a missing or malformed value falls back to the module's default.
+"""
+
+import os
+
+# Firestore batches accept at most 500 writes
+FIRESTORE_BATCH_LIMIT = 500
+
+
+def env_float(name, default):
+    """float value of environment variable name, or float(default) when unset or not a number"""
+    try:
+        return float(os.environ.get(name, default))
+    except (TypeError, ValueError):
+        return float(default)
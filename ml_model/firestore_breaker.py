@@ -0,0 +1,324 @@
+#!/usr/bin/env python3
+"""
+Circuit breaker for Firestore access
+Wraps Firestore calls so that a failing backend is left alone for a while
+instead of being retried on every request, and so that the process recovers
+on its own once Firestore (or the credentials) work again:
+
+  closed     calls go through; transient failures are retried with jittered
+             exponential backoff while the retry budget allows
+  open       calls fail fast with CircuitOpenError until the cooldown ends
+  half-open  after the cooldown a few probe calls go through; a success
+             closes the circuit, a failure opens it for a longer cooldown
+
+Failures are classified before they count:
+  auth       credential and permission errors; open the circuit at once for
+             FIRESTORE_AUTH_COOLDOWN seconds (default 60), never retried
+  transient  timeouts, unavailable, rate limits; open the circuit after
+             FIRESTORE_BREAKER_THRESHOLD (default 5) consecutive failures
+             for FIRESTORE_BREAKER_COOLDOWN seconds (default 5)
+  other      e.g. not found or invalid arguments; Firestore answered, so
+             these are raised as-is and count as a success for the circuit
+
+A CallTimeout (a call given up on while it may still be running) counts as
+a transient failure but is never retried: another attempt would only pile up
+more abandoned work.
+
+Cooldowns double with each consecutive opening, up to
+FIRESTORE_BREAKER_MAX_COOLDOWN (default 300), and are jittered to between
+half and all of that. Each call retries at most FIRESTORE_MAX_RETRIES times
+(default 2). Retries also draw on a budget shared by the process: every call
+adds FIRESTORE_RETRY_RATIO tokens (default 0.2, up to FIRESTORE_RETRY_BUDGET,
+default 10) and every retry spends one, so retries stay a small share of
+traffic while Firestore is degraded.
+
+    breaker = firestore_breaker.get_breaker()
+    documents = breaker.call(lambda: list(ref.stream()))
+
+snapshot() gives the state and counters for health checks and job metrics.
+"""
+
+import time
+import random
+import threading
+
+from env_config import env_float
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+AUTH = 'auth'
+TRANSIENT = 'transient'
+OTHER = 'other'
+
+# Matched against the lower-cased error message when the type is not conclusive
+AUTH_TOKENS = (
+    'invalid_grant',
+    'access_token_expired',
+    'invalid authentication credentials',
+    'unauthenticated',
+    'permission denied',
+    'permission_denied',
+    'missing or insufficient permissions',
+    'token must be',
+    'jwt',
+    '401',
+)
+TRANSIENT_TOKENS = (
+    'deadline exceeded',
+    'deadline_exceeded',
+    'timed out',
+    'timeout',
+    'unavailable',
+    'resource exhausted',
+    'resource_exhausted',
+    'too many requests',
+    'connection reset',
+    'connection refused',
+    'connection aborted',
+    '429',
+    '502',
+    '503',
+    '504',
+)
+
+try:
+    from google.api_core import exceptions as _api_exceptions
+    _AUTH_TYPES = (_api_exceptions.Unauthenticated, _api_exceptions.PermissionDenied)
+    _TRANSIENT_TYPES = (
+        _api_exceptions.DeadlineExceeded,
+        _api_exceptions.ServiceUnavailable,
+        _api_exceptions.TooManyRequests,
+        _api_exceptions.ResourceExhausted,
+        _api_exceptions.Aborted,
+        _api_exceptions.InternalServerError,
+        _api_exceptions.BadGateway,
+        _api_exceptions.GatewayTimeout,
+        _api_exceptions.RetryError,
+    )
+    _OTHER_TYPES = (_api_exceptions.GoogleAPICallError,)
+except ImportError:
+    _AUTH_TYPES, _TRANSIENT_TYPES, _OTHER_TYPES = (), (), ()
+
+try:
+    from google.auth import exceptions as _auth_exceptions
+    # RefreshError: the token could not be refreshed (revoked key, clock skew);
+    # TransportError: the token endpoint or metadata server was unreachable
+    _AUTH_TYPES += (_auth_exceptions.RefreshError, _auth_exceptions.DefaultCredentialsError)
+    _TRANSIENT_TYPES += (_auth_exceptions.TransportError,)
+except ImportError:
+    pass
+
+
+def classify(error):
+    """AUTH, TRANSIENT or OTHER for an exception raised by a Firestore call"""
+    if isinstance(error, CircuitOpenError):
+        return OTHER
+    if _AUTH_TYPES and isinstance(error, _AUTH_TYPES):
+        return AUTH
+    if isinstance(error, (TimeoutError, ConnectionError)) or (_TRANSIENT_TYPES and isinstance(error, _TRANSIENT_TYPES)):
+        return TRANSIENT
+    if _OTHER_TYPES and isinstance(error, _OTHER_TYPES):
+        return OTHER
+    message = str(error).lower()
+    if any(token in message for token in AUTH_TOKENS):
+        return AUTH
+    if any(token in message for token in TRANSIENT_TOKENS):
+        return TRANSIENT
+    return OTHER
+
+
+class CallTimeout(TimeoutError):
+    """A call abandoned after its time limit; transient, but not retried"""
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling Firestore while the circuit is open"""
+
+    def __init__(self, name, retry_in):
+        super().__init__(f"{name} circuit open (retry in {retry_in:.0f}s)")
+        self.retry_in = retry_in
+
+
+class CircuitBreaker:
+    """Closed / open / half-open breaker with backoff and a retry budget"""
+
+    def __init__(self, name='firestore', threshold=None, cooldown=None, max_cooldown=None,
+                 auth_cooldown=None, max_retries=None, clock=time.monotonic, sleep=time.sleep, rng=None):
+        self.name = name
+        self.threshold = max(1, int(threshold or env_float('FIRESTORE_BREAKER_THRESHOLD', 5)))
+        self.cooldown = cooldown if cooldown is not None else env_float('FIRESTORE_BREAKER_COOLDOWN', 5)
+        self.max_cooldown = max_cooldown if max_cooldown is not None else env_float('FIRESTORE_BREAKER_MAX_COOLDOWN', 300)
+        self.auth_cooldown = auth_cooldown if auth_cooldown is not None else env_float('FIRESTORE_AUTH_COOLDOWN', 60)
+        self.max_retries = int(max_retries if max_retries is not None else env_float('FIRESTORE_MAX_RETRIES', 2))
+        self.retry_delay = env_float('FIRESTORE_RETRY_DELAY', 0.2)
+        self.retry_ratio = env_float('FIRESTORE_RETRY_RATIO', 0.2)
+        self.retry_budget = env_float('FIRESTORE_RETRY_BUDGET', 10)
+        self.half_open_probes = max(1, int(env_float('FIRESTORE_BREAKER_PROBES', 1)))
+        self._clock = clock
+        self._sleep = sleep
+        self._random = rng or random.Random()
+        self._lock = threading.Lock()
+
+        self._state = CLOSED
+        self._failures = 0        # consecutive transient failures while closed
+        self._openings = 0        # consecutive openings, for the cooldown backoff
+        self._open_until = 0.0
+        self._probes = 0          # probe calls in flight while half-open
+        self._tokens = self.retry_budget
+        self._last_error = None
+        self.counters = {
+            'calls': 0, 'successes': 0, 'auth_failures': 0, 'transient_failures': 0,
+            'rejected': 0, 'retries': 0, 'openings': 0,
+        }
+
+    # ------------------------------------------------------------------
+    # State
+    # ------------------------------------------------------------------
+
+    def _current_state(self):
+        # Caller holds the lock; an elapsed cooldown moves open to half-open
+        if self._state == OPEN and self._clock() >= self._open_until:
+            self._state = HALF_OPEN
+            self._probes = 0
+        return self._state
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._current_state()
+
+    def is_open(self):
+        """Whether calls are currently being refused (no side effects)"""
+        return self.state == OPEN
+
+    def allow(self):
+        """Reserve a call; False while open or when half-open probes are taken"""
+        with self._lock:
+            state = self._current_state()
+            if state == CLOSED:
+                return True
+            if state == HALF_OPEN and self._probes < self.half_open_probes:
+                self._probes += 1
+                return True
+            self.counters['rejected'] += 1
+            return False
+
+    def retry_in(self):
+        """Seconds until the circuit half-opens (0 unless open)"""
+        with self._lock:
+            if self._current_state() != OPEN:
+                return 0.0
+            return max(0.0, self._open_until - self._clock())
+
+    def _open(self, kind):
+        # Caller holds the lock
+        self._openings += 1
+        base = self.auth_cooldown if kind == AUTH else self.cooldown
+        ceiling = max(self.max_cooldown, base)
+        delay = min(ceiling, base * 2 ** (self._openings - 1))
+        delay *= 0.5 + 0.5 * self._random.random()
+        self._state = OPEN
+        self._open_until = self._clock() + delay
+        self._failures = 0
+        self._probes = 0
+        self.counters['openings'] += 1
+        print(f"[WARN] {self.name} circuit open for {delay:.1f}s after {kind} failure: {self._last_error['message']}")
+
+    def record_success(self):
+        with self._lock:
+            if self._state != CLOSED:
+                print(f"[OK] {self.name} circuit closed")
+            self._state = CLOSED
+            self._failures = 0
+            self._openings = 0
+            self._probes = 0
+            self.counters['successes'] += 1
+
+    def record_failure(self, error):
+        """Count a failed call; returns its classification"""
+        kind = classify(error)
+        if kind == OTHER:
+            # Firestore answered (e.g. not found): the backend is healthy
+            self.record_success()
+            return kind
+        with self._lock:
+            self._last_error = {'kind': kind, 'message': str(error)[:200], 'at': time.time()}
+            self.counters[f'{kind}_failures'] += 1
+            state = self._current_state()
+            if state == OPEN:
+                return kind
+            self._failures += 1
+            if kind == AUTH or state == HALF_OPEN or self._failures >= self.threshold:
+                self._open(kind)
+        return kind
+
+    # ------------------------------------------------------------------
+    # Calls
+    # ------------------------------------------------------------------
+
+    def _spend_retry_token(self):
+        with self._lock:
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            self.counters['retries'] += 1
+            return True
+
+    def _backoff(self, attempt):
+        """Full-jitter exponential delay before retry number `attempt`"""
+        return self._random.uniform(0, self.retry_delay * 2 ** (attempt - 1))
+
+    def call(self, func, *args, **kwargs):
+        """
+        Run func through the breaker; transient failures other than
+        CallTimeout are retried.
+        Raises CircuitOpenError while open, otherwise the last error.
+        """
+        with self._lock:
+            self.counters['calls'] += 1
+            self._tokens = min(self.retry_budget, self._tokens + self.retry_ratio)
+        attempt = 0
+        while True:
+            if not self.allow():
+                raise CircuitOpenError(self.name, self.retry_in())
+            try:
+                result = func(*args, **kwargs)
+            except Exception as e:
+                kind = self.record_failure(e)
+                if (kind != TRANSIENT or isinstance(e, CallTimeout) or attempt >= self.max_retries
+                        or self.is_open() or not self._spend_retry_token()):
+                    raise
+                attempt += 1
+                self._sleep(self._backoff(attempt))
+                continue
+            self.record_success()
+            return result
+
+    def snapshot(self):
+        """State and counters, JSON-serializable"""
+        with self._lock:
+            state = self._current_state()
+            return {
+                'name': self.name,
+                'state': state,
+                'retry_in': round(max(0.0, self._open_until - self._clock()), 1) if state == OPEN else 0.0,
+                'consecutive_failures': self._failures,
+                'consecutive_openings': self._openings,
+                'retry_tokens': round(self._tokens, 2),
+                'last_error': dict(self._last_error) if self._last_error else None,
+                'counters': dict(self.counters),
+            }
+
+
+_breaker = None
+_breaker_lock = threading.Lock()
+
+def get_breaker():
+    """Process-wide Firestore breaker"""
+    global _breaker
+    with _breaker_lock:
+        if _breaker is None:
+            _breaker = CircuitBreaker()
+    return _breaker
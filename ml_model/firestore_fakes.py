@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+In-memory stand-in for the Firestore client, shared by the tests
+Documents live in a plain {path: data} dict, so tests can seed and inspect
+them directly. Only the calls the SmartMess code makes are implemented.
+"""
+
+
+class FakeSnapshot:
+    def __init__(self, store, path):
+        self.reference = FakeDocumentRef(store, path)
+        self.id = path.rsplit('/', 1)[-1]
+        self.exists = path in store
+
+    def to_dict(self):
+        return dict(self.reference.store[self.reference.path]) if self.exists else None
+
+
+class FakeDocumentRef:
+    def __init__(self, store, path):
+        self.store = store
+        self.path = path
+        self.id = path.rsplit('/', 1)[-1]
+
+    def collection(self, name):
+        return FakeCollectionRef(self.store, f"{self.path}/{name}")
+
+    def get(self, transaction=None):
+        return FakeSnapshot(self.store, self.path)
+
+    def set(self, data, merge=False):
+        if merge and self.path in self.store:
+            data = dict(self.store[self.path], **data)
+        self.store[self.path] = data
+
+    def delete(self):
+        self.store.pop(self.path, None)
+
+
+class FakeCollectionRef:
+    def __init__(self, store, path):
+        self.store = store
+        self.path = path
+        self.id = path.rsplit('/', 1)[-1]
+
+    def document(self, document_id):
+        return FakeDocumentRef(self.store, f"{self.path}/{document_id}")
+
+    def where(self, *args):
+        return self
+
+    def count(self):
+        return FakeAggregation(sum(1 for _ in self.stream()))
+
+    def stream(self, timeout=None):
+        prefix = self.path + '/'
+        for path in sorted(self.store):
+            if path.startswith(prefix) and '/' not in path[len(prefix):]:
+                yield FakeSnapshot(self.store, path)
+
+
+class FakeAggregation:
+    """Count aggregation; get() returns results shaped like Firestore's"""
+
+    class Result:
+        def __init__(self, value):
+            self.value = value
+
+    def __init__(self, value):
+        self.value = value
+
+    def get(self):
+        return [[FakeAggregation.Result(self.value)]]
+
+
+class FakeBatch:
+    def __init__(self):
+        self.writes = []
+
+    def set(self, reference, data):
+        self.writes.append((reference, data))
+
+    def commit(self):
+        for reference, data in self.writes:
+            reference.set(data)
+
+
+class FakeClient:
+    def __init__(self, store):
+        self.store = store
+
+    def collection(self, name):
+        return FakeCollectionRef(self.store, name)
+
+    def batch(self):
+        return FakeBatch()
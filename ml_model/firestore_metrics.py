@@ -0,0 +1,462 @@
+#!/usr/bin/env python3
+"""
+Firestore I/O accounting for batch jobs
+instrument(db) wraps a Firestore client so that every read, write, delete,
+stream, count aggregation and subcollection listing made through it (and through the references,
+queries, snapshots and batches it hands out) is counted. Counts, bytes and
+latency are broken down by collection path pattern, e.g.
+attendance/{mess}/{date}/lunch/students, and by mess.
+
+Nothing is collected outside a job:
+
+    db = firestore_metrics.instrument(firestore.client())
+    with firestore_metrics.job('retrain_model', db, mess='alder'):
+        ...
+
+prints a summary line and a JSON record when the job ends; set
+FIRESTORE_METRICS_FILE to also append the records to a JSON-lines file, and
+FIRESTORE_METRICS=0 to skip instrumentation entirely.
+
+Bytes are the estimated Firestore storage size of the documents the job
+deserialized (to_dict), using Firestore's size rules. Each record also
+carries the state of the Firestore circuit breaker when the job ended.
+"""
+
+import os
+import re
+import json
+import time
+import threading
+import functools
+from contextlib import contextmanager
+from datetime import datetime
+
+import firestore_breaker
+
+# Top-level collections whose first document id is a mess id
+MESS_COLLECTIONS = {'attendance', 'predictions', 'model_metadata', 'messes'}
+# Document ids kept literally in patterns (meals, fixed documents)
+LITERAL_IDS = {'breakfast', 'lunch', 'dinner', 'latest'}
+READ_OPS = ('stream', 'get', 'count')
+# Count aggregations are billed one read per this many index entries
+COUNT_ENTRIES_PER_READ = 1000
+WRITE_OPS = ('set', 'update', 'create')
+# Query builders that return a query over the same collection
+QUERY_METHODS = {
+    'where', 'order_by', 'limit', 'limit_to_last', 'offset', 'select',
+    'start_at', 'start_after', 'end_at', 'end_before',
+}
+SUMMARY_PATTERNS = 5
+
+_DATE = re.compile(r'^\d{4}-\d{2}-\d{2}$')
+
+
+def enabled():
+    return os.environ.get('FIRESTORE_METRICS', '1').strip() != '0'
+
+
+def path_pattern(path):
+    """(pattern, mess_id) for a document or collection path"""
+    if path.startswith('**/'):
+        return path, None
+    parts = path.split('/')
+    mess_id = None
+    pattern = []
+    for i, part in enumerate(parts):
+        if _DATE.match(part):
+            pattern.append('{date}')
+        elif i % 2 == 0 or part in LITERAL_IDS:
+            pattern.append(part)
+        elif i == 1 and parts[0] in MESS_COLLECTIONS:
+            mess_id = part
+            pattern.append('{mess}')
+        else:
+            pattern.append('{id}')
+    return '/'.join(pattern), mess_id
+
+
+def value_size(value):
+    """Firestore storage size of a field value"""
+    if value is None or isinstance(value, bool):
+        return 1
+    if isinstance(value, (int, float, datetime)):
+        return 8
+    if isinstance(value, str):
+        return len(value.encode('utf-8')) + 1
+    if isinstance(value, bytes):
+        return len(value)
+    if isinstance(value, dict):
+        return sum(len(str(key).encode('utf-8')) + 1 + value_size(item) for key, item in value.items())
+    if isinstance(value, (list, tuple)):
+        return sum(value_size(item) for item in value)
+    return 16  # geo points, references
+
+
+def document_size(path, data):
+    """Firestore storage size of a document: name + fields + 32 bytes overhead"""
+    name = sum(len(part.encode('utf-8')) + 1 for part in path.split('/')) + 16
+    return name + value_size(data or {}) + 32
+
+
+class IOStats:
+    """Firestore I/O of one job, keyed by (operation, path pattern, mess)"""
+
+    def __init__(self, name, labels=None):
+        self.name = name
+        self.labels = labels or {}
+        self.started = time.monotonic()
+        self.rows = {}  # (op, pattern, mess) -> [calls, docs, bytes, seconds, max_seconds]
+
+    def add(self, op, pattern, mess_id, calls=1, docs=0, nbytes=0, seconds=0.0):
+        row = self.rows.get((op, pattern, mess_id))
+        if row is None:
+            row = self.rows[(op, pattern, mess_id)] = [0, 0, 0, 0.0, 0.0]
+        row[0] += calls
+        row[1] += docs
+        row[2] += nbytes
+        row[3] += seconds
+        row[4] = max(row[4], seconds)
+
+    def totals(self):
+        totals = {'reads': 0, 'writes': 0, 'deletes': 0, 'streams': 0, 'calls': 0, 'bytes': 0, 'seconds': 0.0}
+        for (op, _, _), (calls, docs, nbytes, seconds, _) in self.rows.items():
+            if op in READ_OPS:
+                totals['reads'] += docs
+            elif op in WRITE_OPS:
+                totals['writes'] += docs
+            elif op == 'delete':
+                totals['deletes'] += docs
+            if op == 'stream':
+                totals['streams'] += calls
+            totals['calls'] += calls
+            totals['bytes'] += nbytes
+            totals['seconds'] += seconds
+        totals['seconds'] = round(totals['seconds'], 4)
+        return totals
+
+    def summary(self):
+        """JSON-serializable record: totals, per-pattern rows (most documents first) and per-mess totals"""
+        patterns = [
+            {
+                'op': op, 'pattern': pattern, 'mess': mess_id,
+                'calls': calls, 'docs': docs, 'bytes': nbytes,
+                'seconds': round(seconds, 4), 'max_ms': round(max_seconds * 1000, 2),
+            }
+            for (op, pattern, mess_id), (calls, docs, nbytes, seconds, max_seconds) in self.rows.items()
+        ]
+        patterns.sort(key=lambda row: (row['docs'], row['seconds']), reverse=True)
+
+        by_mess = {}
+        for row in patterns:
+            mess = by_mess.setdefault(row['mess'] or '-', {'reads': 0, 'writes': 0, 'deletes': 0, 'bytes': 0})
+            if row['op'] in READ_OPS:
+                mess['reads'] += row['docs']
+            elif row['op'] in WRITE_OPS:
+                mess['writes'] += row['docs']
+            elif row['op'] == 'delete':
+                mess['deletes'] += row['docs']
+            mess['bytes'] += row['bytes']
+
+        return {
+            'job': self.name,
+            'labels': self.labels,
+            'finished_at': datetime.now().isoformat(),
+            'wall_seconds': round(time.monotonic() - self.started, 3),
+            'totals': self.totals(),
+            'patterns': patterns,
+            'messes': by_mess,
+            'breaker': firestore_breaker.get_breaker().snapshot(),
+        }
+
+
+def report(stats):
+    """Print a job's summary and append it to FIRESTORE_METRICS_FILE"""
+    summary = stats.summary()
+    totals = summary['totals']
+    labels = ''.join(f" {key}={value}" for key, value in summary['labels'].items())
+    print(
+        f"[FIRESTORE] {summary['job']}{labels}: {totals['reads']} reads, {totals['writes']} writes, "
+        f"{totals['deletes']} deletes, {totals['streams']} streams, {totals['bytes'] / 1024:.1f} KB, "
+        f"{totals['seconds']:.2f}s in Firestore ({summary['wall_seconds']:.2f}s wall)"
+    )
+    for row in summary['patterns'][:SUMMARY_PATTERNS]:
+        print(
+            f"[FIRESTORE]   {row['op']:<11}{row['docs']:>8} docs{row['calls']:>7} calls"
+            f"{row['seconds'] * 1000:>10.1f} ms  {row['pattern']}"
+        )
+    breaker = summary['breaker']
+    if breaker['state'] != firestore_breaker.CLOSED:
+        print(f"[FIRESTORE]   circuit {breaker['state']}, retry in {breaker['retry_in']:.0f}s")
+    record = json.dumps(summary, sort_keys=True, default=str)
+    print(f"[FIRESTORE] {record}")
+
+    path = os.environ.get('FIRESTORE_METRICS_FILE')
+    if path:
+        try:
+            with open(path, 'a') as f:
+                f.write(record + '\n')
+        except OSError as e:
+            print(f"[WARN] Could not write Firestore metrics to {path}: {e}")
+    return summary
+
+
+def _join(base, name):
+    return f"{base}/{name}" if base else name
+
+
+def _unwrap(reference):
+    return reference._target if isinstance(reference, _Reference) else reference
+
+
+class _Reference:
+    """Collection, document or query proxy that accounts for its I/O"""
+
+    def __init__(self, target, path, client):
+        self._target = target
+        self._path = path
+        self._client = client
+
+    @property
+    def path(self):
+        return self._path
+
+    def collection(self, collection_id):
+        return _Reference(self._target.collection(collection_id), _join(self._path, collection_id), self._client)
+
+    def document(self, *document_path):
+        ref = self._target.document(*document_path)
+        return _Reference(ref, ref.path, self._client)
+
+    def __getattr__(self, name):
+        attr = getattr(self._target, name)
+        if not callable(attr):
+            return attr
+        if name in QUERY_METHODS:
+            @functools.wraps(attr)
+            def query(*args, **kwargs):
+                return _Reference(attr(*args, **kwargs), self._path, self._client)
+            return query
+        if name == 'stream':
+            # wraps() keeps the signature, which callers inspect for `timeout`
+            @functools.wraps(attr)
+            def stream(*args, **kwargs):
+                return self._client._stream(attr, self._path, args, kwargs)
+            return stream
+        if name == 'get':
+            @functools.wraps(attr)
+            def get(*args, **kwargs):
+                return self._client._get(attr, self._path, args, kwargs)
+            return get
+        if name in WRITE_OPS or name == 'delete':
+            @functools.wraps(attr)
+            def write(*args, **kwargs):
+                return self._client._timed(name, self._path, 1, attr, args, kwargs)
+            return write
+        if name == 'count':
+            @functools.wraps(attr)
+            def count(*args, **kwargs):
+                return _Aggregation(attr(*args, **kwargs), self._path, self._client)
+            return count
+        if name == 'collections':
+            @functools.wraps(attr)
+            def collections(*args, **kwargs):
+                return self._client._collections(attr, self._path, args, kwargs)
+            return collections
+        return attr
+
+    def __eq__(self, other):
+        return self._target == _unwrap(other)
+
+    def __hash__(self):
+        return hash(self._target)
+
+
+class _Aggregation:
+    """Count aggregation proxy; get() is billed by the index entries counted, not documents read"""
+
+    def __init__(self, target, path, client):
+        self._target = target
+        self._path = path
+        self._client = client
+
+    def get(self, *args, **kwargs):
+        started = time.perf_counter()
+        entries = 0
+        try:
+            result = self._target.get(*args, **kwargs)
+            entries = sum(int(aggregate.value) for results in result for aggregate in results)
+            return result
+        finally:
+            reads = max(1, -(-entries // COUNT_ENTRIES_PER_READ))
+            self._client.record('count', self._path, docs=reads, seconds=time.perf_counter() - started)
+
+    def __getattr__(self, name):
+        return getattr(self._target, name)
+
+
+class _Snapshot:
+    """Document snapshot proxy; to_dict() counts the deserialized bytes"""
+
+    def __init__(self, target, op, path, client):
+        self._target = target
+        self._op = op
+        self._path = path  # the stream's collection, or the document read
+        self._client = client
+
+    @property
+    def reference(self):
+        ref = self._target.reference
+        return _Reference(ref, ref.path, self._client)
+
+    def to_dict(self):
+        data = self._target.to_dict()
+        if data is not None:
+            size = document_size(self._target.reference.path, data)
+            self._client.record(self._op, self._path, calls=0, nbytes=size)
+        return data
+
+    def __getattr__(self, name):
+        return getattr(self._target, name)
+
+
+class _Batch:
+    """Write batch proxy; writes are counted per path pattern when committed"""
+
+    def __init__(self, target, client):
+        self._target = target
+        self._client = client
+        self._writes = []
+
+    def _add(self, op, reference, args, kwargs):
+        self._writes.append((op, _unwrap(reference).path))
+        getattr(self._target, op)(_unwrap(reference), *args, **kwargs)
+        return self
+
+    def set(self, reference, *args, **kwargs):
+        return self._add('set', reference, args, kwargs)
+
+    def update(self, reference, *args, **kwargs):
+        return self._add('update', reference, args, kwargs)
+
+    def create(self, reference, *args, **kwargs):
+        return self._add('create', reference, args, kwargs)
+
+    def delete(self, reference, *args, **kwargs):
+        return self._add('delete', reference, args, kwargs)
+
+    def commit(self, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return self._target.commit(*args, **kwargs)
+        finally:
+            self._client.record('commit', '(batch)', docs=len(self._writes), seconds=time.perf_counter() - started)
+            for op, path in self._writes:
+                self._client.record(op, path, calls=0, docs=1)
+            self._writes = []
+
+    def __getattr__(self, name):
+        return getattr(self._target, name)
+
+
+class InstrumentedClient(_Reference):
+    """Firestore client proxy; I/O is recorded into every active job"""
+
+    def __init__(self, db):
+        super().__init__(db, '', self)
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def collection_group(self, collection_id):
+        return _Reference(self._target.collection_group(collection_id), f"**/{collection_id}", self)
+
+    def batch(self):
+        return _Batch(self._target.batch(), self)
+
+    def record(self, op, path, calls=1, docs=0, nbytes=0, seconds=0.0):
+        if not self._collectors:
+            return
+        pattern, mess_id = path_pattern(path)
+        with self._lock:
+            for stats in self._collectors:
+                stats.add(op, pattern, mess_id, calls, docs, nbytes, seconds)
+
+    def _timed(self, op, path, docs, method, args, kwargs):
+        started = time.perf_counter()
+        try:
+            return method(*args, **kwargs)
+        finally:
+            self.record(op, path, docs=docs, seconds=time.perf_counter() - started)
+
+    def _stream(self, method, path, args, kwargs):
+        docs = 0
+        seconds = 0.0
+        try:
+            started = time.perf_counter()
+            iterator = iter(method(*args, **kwargs))
+            seconds += time.perf_counter() - started
+            while True:
+                # Only time spent inside Firestore counts, not the caller's loop body
+                started = time.perf_counter()
+                try:
+                    snapshot = next(iterator)
+                except StopIteration:
+                    break
+                finally:
+                    seconds += time.perf_counter() - started
+                docs += 1
+                yield _Snapshot(snapshot, 'stream', path, self)
+        finally:
+            self.record('stream', path, docs=docs, seconds=seconds)
+
+    def _get(self, method, path, args, kwargs):
+        started = time.perf_counter()
+        result = None
+        try:
+            result = method(*args, **kwargs)
+        finally:
+            # A document read is billed even when the document is missing
+            docs = len(result) if isinstance(result, list) else 1
+            self.record('get', path, docs=docs, seconds=time.perf_counter() - started)
+        if isinstance(result, list):
+            return [_Snapshot(snapshot, 'get', path, self) for snapshot in result]
+        return _Snapshot(result, 'get', path, self) if result is not None else None
+
+    def _collections(self, method, path, args, kwargs):
+        started = time.perf_counter()
+        collections = list(method(*args, **kwargs))
+        self.record('list', path or '(root)', docs=len(collections), seconds=time.perf_counter() - started)
+        return [_Reference(collection, _join(path, collection.id), self) for collection in collections]
+
+    def add_collector(self, stats):
+        with self._lock:
+            self._collectors.append(stats)
+
+    def remove_collector(self, stats):
+        with self._lock:
+            self._collectors.remove(stats)
+
+
+def instrument(db):
+    """Wrap a Firestore client for accounting (None and wrapped clients pass through)"""
+    if db is None or isinstance(db, InstrumentedClient) or not enabled():
+        return db
+    return InstrumentedClient(db)
+
+
+@contextmanager
+def job(name, db, **labels):
+    """
+    Account the Firestore I/O made through `db` while the block runs and
+    report it at the end. Yields the IOStats, or None when `db` is not
+    instrumented. Jobs may nest; each sees all I/O made during it.
+    """
+    if not isinstance(db, InstrumentedClient):
+        yield None
+        return
+    stats = IOStats(name, labels)
+    db.add_collector(stats)
+    try:
+        yield stats
+    finally:
+        db.remove_collector(stats)
+        report(stats)
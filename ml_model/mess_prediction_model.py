@@ -6,15 +6,234 @@ Generates predictions for a specific mess only
 
 import os
 import json
+import time
+import threading
 from datetime import datetime, timedelta
 import numpy as np
 import joblib
 import tensorflow as tf
+import model_bundle
+
+MODELS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'models')
+GLOBAL_MODEL_NAME = 'global'
+
+
+def _slot_features(slot_times):
+    """[hour, day_of_week, meal_type, slot_minute] rows for in-meal slots, and their positions"""
+    rows = []
+    index = []
+    for i, slot_time in enumerate(slot_times):
+        _, meal_code = MessPredictionModel.get_meal_type(slot_time.hour, slot_time.minute)
+        if meal_code < 0:
+            continue
+        rows.append([slot_time.hour, slot_time.weekday(), meal_code, (slot_time.minute // 15) * 15])
+        index.append(i)
+    return np.array(rows, dtype=np.float32).reshape(-1, 4), index
+
+
+def compiled_predict(model, example):
+    """
+    Keras model call as a tf.function with a fixed input signature
+    example: inputs (array or dict of arrays) fixing dtypes and feature widths;
+    the batch dimension is left open. Unlike model.predict this builds no data
+    pipeline per call and is traced once, on the first call, for every batch size.
+    """
+    signature = tf.nest.map_structure(
+        lambda array: tf.TensorSpec([None] + list(array.shape[1:]), tf.as_dtype(array.dtype)), example
+    )
+    return tf.function(lambda inputs: model(inputs, training=False), input_signature=[signature])
+
+
+# Fixed slots run through a model on warm-up: one per meal on a Monday
+WARMUP_SLOTS = [datetime(2024, 1, 1, 8, 0), datetime(2024, 1, 1, 12, 30), datetime(2024, 1, 1, 20, 0)]
+
+
+def format_slot_predictions(slot_times, counts, capacity, label=''):
+    """
+    API rows for predicted counts at slot start times (NaN counts are skipped)
+    Later slots get a slight upward trend, as the /predict response always had
+    """
+    predictions = []
+    slot_num = 0
+    for temp_time, predicted_count in zip(slot_times, counts):
+        if predicted_count != predicted_count:  # NaN: no prediction for this slot
+            continue
+        try:
+            predicted_count = int(predicted_count)
+            
+            # Add some randomness based on trend
+            trend_factor = 1.0 + (slot_num * 0.02)  # Slight increase over time
+            predicted_count = int(predicted_count * trend_factor)
+            predicted_count = min(predicted_count, capacity)
+            
+            crowd_percentage = (predicted_count / capacity) * 100
+            
+            time_slot = temp_time.strftime('%I:%M %p')
+            
+            predictions.append({
+                'time_slot': time_slot,
+                'time_24h': temp_time.strftime('%H:%M'),
+                'predicted_crowd': predicted_count,
+                'capacity': capacity,
+                'crowd_percentage': round(crowd_percentage, 1),
+                'recommendation': 'Avoid' if crowd_percentage > 70 else 'Moderate' if crowd_percentage > 40 else 'Good time',
+                'confidence': 'high'
+            })
+            
+        except Exception as e:
+            print(f"[WARN] Prediction error for {label} at {temp_time}: {e}")
+            continue
+        
+        slot_num += 1
+    
+    return predictions
+
+
+class GlobalPredictionModel:
+    """
+    Shared multi-mess model trained by GlobalCrowdRegressor
+    Loaded once per process; predicts any number of messes in one forward pass
+    """
+
+    def __init__(self):
+        self.model = None
+        self.scaler = None
+        self.metadata = {}
+        self.mess_index = {}
+        self.capacities = {}
+        self._predict_fn = None
+        # Bundle version loaded (None for loose files); see refresh_global_model
+        self.version = None
+        self.model_path = os.path.join(MODELS_DIR, f'{GLOBAL_MODEL_NAME}_model.keras')
+        self.scaler_path = os.path.join(MODELS_DIR, f'{GLOBAL_MODEL_NAME}_scaler.pkl')
+        self.metadata_path = os.path.join(MODELS_DIR, f'{GLOBAL_MODEL_NAME}_metadata.json')
+        self._load_model()
+
+    def _load_model(self):
+        """Load the global model, scaler and mess index (bundle first, then loose files)"""
+        try:
+            bundle = model_bundle.load_current(MODELS_DIR, GLOBAL_MODEL_NAME)
+            if bundle is not None:
+                metadata = bundle.metadata
+                model = model_bundle.keras_model(bundle)
+                scaler = model_bundle.standard_scaler(bundle)
+                self.model_path = bundle.path
+                version = bundle.version
+            elif (os.path.exists(self.model_path) and os.path.exists(self.scaler_path)
+                    and os.path.exists(self.metadata_path)):
+                with open(self.metadata_path, 'r') as f:
+                    metadata = json.load(f)
+                model = tf.keras.models.load_model(self.model_path)
+                scaler = joblib.load(self.scaler_path)
+                version = None
+            else:
+                return False
+        except Exception as e:
+            print(f"[ERROR] Error loading global model: {e}")
+            return False
+
+        if metadata.get('target') != 'capacity_share' or metadata.get('input_features', [])[-1:] != ['log_capacity']:
+            print("[WARN] Global model format not recognised. Retrain required.")
+            return False
+
+        self.model = model
+        self.scaler = scaler
+        self.metadata = metadata
+        self.version = version
+        self.mess_index = metadata.get('mess_index') or {}
+        self.capacities = metadata.get('capacities') or {}
+        print(f"[OK] Loaded global model ({len(self.mess_index)} messes)")
+        return True
+
+    def knows(self, mess_id):
+        """Whether the mess had its own embedding at training time"""
+        return mess_id in self.mess_index
+
+    def predict_counts(self, mess_ids, slot_times, capacities=None):
+        """
+        Predict raw crowd counts for every (mess, slot) pair in one forward pass
+        capacities: optional per-mess capacities (None entries use the trained one)
+        Returns a (len(mess_ids), len(slot_times)) float32 array; NaN outside meals
+        """
+        counts = np.full((len(mess_ids), len(slot_times)), np.nan, dtype=np.float32)
+        if self.model is None or not len(mess_ids):
+            return counts
+
+        features, index = _slot_features(slot_times)
+        if not index:
+            return counts
+
+        capacities = capacities or [None] * len(mess_ids)
+        mess_capacity = np.array([
+            float(capacity or self.capacities.get(mess_id) or 100)
+            for mess_id, capacity in zip(mess_ids, capacities)
+        ], dtype=np.float32)
+        # Unknown messes use the shared "average mess" embedding at index 0
+        mess_codes = np.array([self.mess_index.get(mess_id, 0) for mess_id in mess_ids], dtype=np.int32)
+
+        # Same transform as GlobalCrowdRegressor.capacity_feature, clipped to the
+        # trained range: the share-of-capacity target already scales linearly,
+        # so unseen capacities must not push the network off its training data
+        capacity_feature = np.log(np.maximum(mess_capacity, 1.0) / 100.0)
+        if self.capacities:
+            trained = np.log(np.maximum(np.array(list(self.capacities.values()), dtype=np.float32), 1.0) / 100.0)
+            capacity_feature = np.clip(capacity_feature, trained.min(), trained.max())
+
+        num_slots = len(index)
+        batch = np.column_stack([
+            np.tile(features, (len(mess_ids), 1)),
+            np.repeat(capacity_feature, num_slots),
+        ])
+        inputs = {
+            'features': self.scaler.transform(batch).astype(np.float32),
+            'mess': np.repeat(mess_codes, num_slots).reshape(-1, 1),
+        }
+        if self._predict_fn is None:
+            self._predict_fn = compiled_predict(self.model, inputs)
+        share = self._predict_fn(inputs).numpy().reshape(len(mess_ids), num_slots)
+        counts[:, index] = np.maximum(share * mess_capacity[:, None], 0)
+        return counts
+
+
+_global_model = None
+_global_model_lock = threading.Lock()
+
+def get_global_model():
+    """Process-wide global model (loaded on first use)"""
+    global _global_model
+    with _global_model_lock:
+        if _global_model is None:
+            _global_model = GlobalPredictionModel()
+        return _global_model
+
+
+def refresh_global_model():
+    """
+    Drop the process-wide global model when its bundle's current pointer has
+    moved (a retrain or rollback), so the next get_global_model() loads the
+    live version; returns True when it was dropped
+    """
+    global _global_model
+    with _global_model_lock:
+        if _global_model is None:
+            return False
+        if model_bundle.current_version(MODELS_DIR, GLOBAL_MODEL_NAME) == _global_model.version:
+            return False
+        _global_model = None
+        return True
+
+
+def _global_model_mode():
+    """USE_GLOBAL_MODEL: 'auto' (per-mess model first), '1' (always) or '0' (never)"""
+    return os.environ.get('USE_GLOBAL_MODEL', 'auto').strip().lower()
+
 
 class MessPredictionModel:
     """
     Loads and uses mess-specific trained models
     Ensures predictions are mess-isolated
+    Falls back to the shared global model (see USE_GLOBAL_MODEL) when the
+    mess has no model of its own; the per-mess API stays the same.
     """
     
     def __init__(self, mess_id):
@@ -22,34 +241,79 @@ class MessPredictionModel:
         self.model = None
         self.scaler = None
         self.metadata = {}
+        self.global_model = None
+        self.backend = None
+        self._predict_fn = None
+        # Optional OnlineSlotModel blended into predict_counts (set by PredictionService)
+        self.online_model = None
         
         # Use absolute paths for model files
-        ml_model_dir = os.path.dirname(os.path.abspath(__file__))
-        models_dir = os.path.join(ml_model_dir, 'models')
-        
-        self.model_path = os.path.join(models_dir, f'{mess_id}_model.keras')
-        self.scaler_path = os.path.join(models_dir, f'{mess_id}_scaler.pkl')
-        self.metadata_path = os.path.join(models_dir, f'{mess_id}_metadata.json')
+        self.model_path = os.path.join(MODELS_DIR, f'{mess_id}_model.keras')
+        self.scaler_path = os.path.join(MODELS_DIR, f'{mess_id}_scaler.pkl')
+        self.metadata_path = os.path.join(MODELS_DIR, f'{mess_id}_metadata.json')
         
         # Load model and scaler
-        self._load_model()
+        mode = _global_model_mode()
+        if mode in ('1', 'true', 'yes') or not (mode in ('0', 'false', 'no') or self._load_model()):
+            self._use_global_model()
+
+    def _use_global_model(self):
+        """Serve this mess from the shared global model if one is trained"""
+        global_model = get_global_model()
+        if global_model.model is None:
+            return False
+        self.global_model = global_model
+        self.model = global_model.model
+        self.scaler = global_model.scaler
+        self.metadata = global_model.metadata
+        self.model_path = global_model.model_path
+        if not global_model.knows(self.mess_id):
+            print(f"[INFO] {self.mess_id} not in global model; using the average mess profile")
+        return True
     
+    def _load_bundle(self):
+        """Load the live model bundle for this mess; False when none was published"""
+        try:
+            bundle = model_bundle.load_current(MODELS_DIR, self.mess_id)
+        except model_bundle.BundleError as e:
+            print(f"[WARN] {e}; trying loose model files")
+            return False
+        if bundle is None:
+            return False
+
+        name = bundle.metadata.get('backend', 'keras')
+        if name != 'keras':
+            self.backend = model_bundle.unpickle_blob(bundle.blobs['backend'])
+            self.model = self.backend
+        else:
+            self.model = model_bundle.keras_model(bundle)
+            self.scaler = model_bundle.standard_scaler(bundle)
+        self.metadata = bundle.metadata
+        self.model_path = bundle.path
+        print(f"[OK] Loaded {name} bundle {bundle.version} for {self.mess_id}")
+        return True
+
     def _load_model(self):
         """Load trained model and scaler from disk"""
         try:
-            if os.path.exists(self.model_path):
-                self.model = tf.keras.models.load_model(self.model_path)
-                print(f"[OK] Loaded model for {self.mess_id}")
-            else:
-                print(f"[WARN] Model not found for {self.mess_id}: {self.model_path}")
-                return False
-            
-            if os.path.exists(self.scaler_path):
-                self.scaler = joblib.load(self.scaler_path)
-                print(f"[OK] Loaded scaler for {self.mess_id}")
-            else:
-                print(f"[WARN] Scaler not found for {self.mess_id}")
-                return False
+            from_bundle = self._load_bundle()
+            if from_bundle and self.backend is not None:
+                return True
+            if not from_bundle:
+                # Pre-bundle Keras models only; classical backends are always bundled
+                if os.path.exists(self.model_path):
+                    self.model = tf.keras.models.load_model(self.model_path)
+                    print(f"[OK] Loaded model for {self.mess_id}")
+                else:
+                    print(f"[WARN] Model not found for {self.mess_id}: {self.model_path}")
+                    return False
+
+                if os.path.exists(self.scaler_path):
+                    self.scaler = joblib.load(self.scaler_path)
+                    print(f"[OK] Loaded scaler for {self.mess_id}")
+                else:
+                    print(f"[WARN] Scaler not found for {self.mess_id}")
+                    return False
 
             expected_features = 4
             scaler_features = getattr(self.scaler, 'n_features_in_', None)
@@ -65,7 +329,7 @@ class MessPredictionModel:
                 self.scaler = None
                 return False
             
-            if os.path.exists(self.metadata_path):
+            if not from_bundle and os.path.exists(self.metadata_path):
                 with open(self.metadata_path, 'r') as f:
                     self.metadata = json.load(f)
                 print(f"[OK] Loaded metadata for {self.mess_id}")
@@ -76,7 +340,8 @@ class MessPredictionModel:
             print(f"[ERROR] Error loading model for {self.mess_id}: {e}")
             return False
     
-    def get_meal_type(self, hour, minute=0):
+    @staticmethod
+    def get_meal_type(hour, minute=0):
         """
         Get meal type based on hour and minute
         Breakfast: 7:30-9:30 (inclusive start, exclusive end), 
@@ -92,13 +357,51 @@ class MessPredictionModel:
         else:
             return None, -1
     
+    def predict_counts(self, slot_times, capacity=None):
+        """
+        Predict raw crowd counts for a batch of slot start times
+        Runs a single forward pass; slots outside meal hours come back as NaN
+        capacity is only used by the global model (default: capacity at training)
+        """
+        counts = self._model_counts(slot_times, capacity)
+        if self.online_model is not None:
+            counts = self.online_model.blend(self.mess_id, slot_times, counts)
+        return counts
+
+    def _model_counts(self, slot_times, capacity=None):
+        if self.global_model is not None:
+            return self.global_model.predict_counts([self.mess_id], slot_times, [capacity])[0]
+
+        counts = np.full(len(slot_times), np.nan, dtype=np.float32)
+        if self.model is None or not len(slot_times):
+            return counts
+
+        features, index = _slot_features(slot_times)
+        if index:
+            if self.backend is not None:
+                predicted = self.backend.predict(features)
+            else:
+                features_scaled = self.scaler.transform(features).astype(np.float32)
+                if self._predict_fn is None:
+                    self._predict_fn = compiled_predict(self.model, features_scaled)
+                predicted = self._predict_fn(features_scaled).numpy().reshape(-1)
+            counts[index] = np.maximum(predicted, 0)
+        return counts
+
+    def warm_up(self):
+        """
+        Run one inference over WARMUP_SLOTS so the compiled predict function
+        is traced before the first request; returns the seconds it took
+        """
+        started = time.perf_counter()
+        self._model_counts(WARMUP_SLOTS)
+        return time.perf_counter() - started
+
     def predict_next_slots_15min(self, current_time, current_count, capacity, db=None):
         """
         Generate predictions for next 15-minute slots
         Returns predictions only for this mess
         """
-        predictions = []
-        
         if self.model is None:
             return []
         
@@ -119,65 +422,36 @@ class MessPredictionModel:
         meal_start_hour, meal_start_min, meal_end_hour, meal_end_min = meal_times[meal_type]
         meal_end_minutes = meal_end_hour * 60 + meal_end_min
         
-        # Generate predictions for upcoming 15-minute slots
-        slot_num = 0
+        # Upcoming 15-minute slots in the current meal window
+        slot_times = []
         temp_time = current_time.replace(minute=(current_time.minute // 15) * 15, second=0, microsecond=0)
         
-        while temp_time.hour * 60 + temp_time.minute < meal_end_minutes and slot_num < 8:
+        while temp_time.hour * 60 + temp_time.minute < meal_end_minutes and len(slot_times) < 8:
             # Move to next 15-minute interval
             temp_time = temp_time + timedelta(minutes=15)
             temp_minutes = temp_time.hour * 60 + temp_time.minute
             
             if temp_minutes >= meal_end_minutes:
                 break
-            
-            try:
-                # Create feature vector: [hour, day_of_week, meal_type, slot_minute]
-                hour = temp_time.hour
-                day_of_week = temp_time.weekday()
-                slot_minute = (temp_time.minute // 15) * 15
-                
-                features = np.array([[hour, day_of_week, meal_code, slot_minute]], dtype=np.float32)
-                
-                # Scale features
-                features_scaled = self.scaler.transform(features)
-                
-                # Predict
-                predicted_count = self.model.predict(features_scaled, verbose=0)[0][0]
-                predicted_count = max(0, int(predicted_count))
-                
-                # Add some randomness based on trend
-                trend_factor = 1.0 + (slot_num * 0.02)  # Slight increase over time
-                predicted_count = int(predicted_count * trend_factor)
-                predicted_count = min(predicted_count, capacity)
-                
-                crowd_percentage = (predicted_count / capacity) * 100
-                
-                time_slot = temp_time.strftime('%I:%M %p')
-                
-                predictions.append({
-                    'time_slot': time_slot,
-                    'time_24h': temp_time.strftime('%H:%M'),
-                    'predicted_crowd': predicted_count,
-                    'capacity': capacity,
-                    'crowd_percentage': round(crowd_percentage, 1),
-                    'recommendation': 'Avoid' if crowd_percentage > 70 else 'Moderate' if crowd_percentage > 40 else 'Good time',
-                    'confidence': 'high'
-                })
-                
-            except Exception as e:
-                print(f"[WARN] Prediction error for {self.mess_id} at {temp_time}: {e}")
-                continue
-            
-            slot_num += 1
-        
-        return predictions
+            slot_times.append(temp_time)
+
+        # One forward pass for all slots
+        try:
+            counts = self.predict_counts(slot_times, capacity=capacity)
+        except Exception as e:
+            print(f"[WARN] Prediction error for {self.mess_id} at {current_time}: {e}")
+            return []
+
+        return format_slot_predictions(slot_times, counts, capacity, label=self.mess_id)
     
     def get_model_info(self):
         """Return information about the loaded model"""
         return {
             'mess_id': self.mess_id,
             'model_loaded': self.model is not None,
+            'global_model': self.global_model is not None,
+            'backend': self.metadata.get('backend', 'keras'),
+            'online_model': self.online_model is not None and self.online_model.has_data(self.mess_id),
             'metadata': self.metadata,
             'model_path': self.model_path
         }
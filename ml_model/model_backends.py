@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+"""
+Classical model backends for mess crowd prediction
+Cheap alternatives to the Keras MLP for the 4-feature slot problem.
+Every backend fits and predicts on raw [hour, day_of_week, meal_type,
+slot_minute] rows (no scaler) and is pickled into the model bundle.
+"""
+
+import os
+import time
+import numpy as np
+from env_config import env_float
+
+# Backend used when training: 'auto' scores every backend and keeps the
+# cheapest accurate one; 'keras' or a BACKENDS name forces that backend
+DEFAULT_BACKEND = 'auto'
+# A backend is accurate enough when its holdout MAE is within this share of the best
+DEFAULT_MAE_TOLERANCE = 0.05
+# Rows per latency probe: one /predict call scores up to 8 upcoming slots
+LATENCY_BATCH = 8
+LATENCY_REPEATS = 20
+
+
+def _slot_of_day(X):
+    return (X[:, 0].astype(np.int64) * 4 + X[:, 3].astype(np.int64) // 15) % 96
+
+
+class SlotAverageBackend:
+    """Seasonal average count per (day of week, slot of day)"""
+
+    name = 'slot_average'
+
+    def fit(self, X, y):
+        day_of_week = X[:, 1].astype(np.int64) % 7
+        slot = _slot_of_day(X)
+        sums = np.zeros((7, 96), dtype=np.float64)
+        counts = np.zeros((7, 96), dtype=np.float64)
+        np.add.at(sums, (day_of_week, slot), y)
+        np.add.at(counts, (day_of_week, slot), 1)
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            self.table = sums / counts
+            # Slots never seen on a weekday fall back to the all-days slot mean
+            self.slot_mean = sums.sum(axis=0) / counts.sum(axis=0)
+        self.global_mean = float(np.mean(y)) if len(y) else 0.0
+        return self
+
+    def predict(self, X):
+        day_of_week = X[:, 1].astype(np.int64) % 7
+        slot = _slot_of_day(X)
+        predicted = self.table[day_of_week, slot]
+        predicted = np.where(np.isnan(predicted), self.slot_mean[slot], predicted)
+        return np.where(np.isnan(predicted), self.global_mean, predicted)
+
+
+class RidgeBackend:
+    """Ridge regression on one-hot slot of day and day of week (an additive profile)"""
+
+    name = 'ridge'
+
+    def __init__(self, alpha=1.0):
+        from sklearn.linear_model import Ridge
+        from sklearn.pipeline import make_pipeline
+        from sklearn.preprocessing import OneHotEncoder
+        self.pipeline = make_pipeline(
+            OneHotEncoder(categories=[list(range(96)), list(range(7))], handle_unknown='ignore'),
+            Ridge(alpha=alpha),
+        )
+
+    @staticmethod
+    def _design(X):
+        return np.column_stack([_slot_of_day(X), X[:, 1].astype(np.int64) % 7])
+
+    def fit(self, X, y):
+        self.pipeline.fit(self._design(X), y)
+        return self
+
+    def predict(self, X):
+        return self.pipeline.predict(self._design(X))
+
+
+class GradientBoostingBackend:
+    """Histogram gradient-boosted trees on the raw features"""
+
+    name = 'gbt'
+
+    def __init__(self, max_iter=200):
+        from sklearn.ensemble import HistGradientBoostingRegressor
+        self.regressor = HistGradientBoostingRegressor(max_iter=max_iter, random_state=0)
+
+    def fit(self, X, y):
+        self.regressor.fit(X, y)
+        return self
+
+    def predict(self, X):
+        return self.regressor.predict(X)
+
+
+BACKENDS = {
+    SlotAverageBackend.name: SlotAverageBackend,
+    RidgeBackend.name: RidgeBackend,
+    GradientBoostingBackend.name: GradientBoostingBackend,
+}
+
+
+def configured_backend():
+    """MODEL_BACKEND: 'auto', 'keras' or a BACKENDS name"""
+    name = os.environ.get('MODEL_BACKEND', DEFAULT_BACKEND).strip().lower()
+    if name in ('auto', 'keras') or name in BACKENDS:
+        return name
+    print(f"[WARN] Unknown MODEL_BACKEND={name!r}; using {DEFAULT_BACKEND}")
+    return DEFAULT_BACKEND
+
+
+def mae_tolerance():
+    return env_float('BACKEND_MAE_TOLERANCE', DEFAULT_MAE_TOLERANCE)
+
+
+def create_backend(name):
+    return BACKENDS[name]()
+
+
+def measure_latency_ms(predict, X, repeats=LATENCY_REPEATS):
+    """Median wall time of predict() on one serving-sized batch, in milliseconds"""
+    batch = X[:LATENCY_BATCH]
+    predict(batch)  # warm up
+    timings = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        predict(batch)
+        timings.append(time.perf_counter() - started)
+    return float(np.median(timings) * 1000)
+
+
+def score_backend(name, X_train, y_train, X_holdout, y_holdout):
+    """Fit a backend on the training split; return (backend, holdout MAE, latency ms, fit seconds)"""
+    backend = create_backend(name)
+    started = time.perf_counter()
+    backend.fit(X_train, y_train)
+    fit_seconds = time.perf_counter() - started
+    predicted = np.maximum(backend.predict(X_holdout), 0)
+    mae = float(np.mean(np.abs(predicted - y_holdout)))
+    return backend, mae, measure_latency_ms(backend.predict, X_holdout), fit_seconds
+
+
+def select_backend(scores, tolerance=None):
+    """
+    Cheapest backend whose MAE is within tolerance of the best
+    scores: {name: {'mae': float, 'latency_ms': float}}
+    """
+    tolerance = mae_tolerance() if tolerance is None else tolerance
+    best_mae = min(score['mae'] for score in scores.values())
+    accurate = [name for name, score in scores.items() if score['mae'] <= best_mae * (1 + tolerance) + 1e-9]
+    return min(accurate, key=lambda name: scores[name]['latency_ms'])
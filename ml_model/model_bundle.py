@@ -0,0 +1,308 @@
+#!/usr/bin/env python3
+"""
+Versioned single-file model bundles
+A bundle holds everything needed to serve a model - weight arrays, scaler
+parameters, metadata, feature schema and opaque blobs (e.g. a pickled
+classical backend) - behind one SHA-256 checksum.
+
+Layout on disk (models_dir/{name}/):
+  {version}.bundle   immutable, written to a temp file then renamed
+  current            text file naming the live version, swapped atomically
+
+File format:
+  magic (8) | format version (u32) | header length (u32) | sha256 (32)
+  | header JSON | padding to 64 bytes | array and blob data
+The checksum covers the header JSON and data. Loading memory-maps the file
+and returns zero-copy read-only array views.
+"""
+
+import io
+import os
+import json
+import mmap
+import struct
+import hashlib
+import tempfile
+from datetime import datetime
+import numpy as np
+from env_config import env_float
+
+MAGIC = b'SMBUNDLE'
+FORMAT_VERSION = 1
+_PREFIX = struct.Struct('<8sII32s')
+_ALIGN = 64
+BUNDLE_SUFFIX = '.bundle'
+CURRENT_POINTER = 'current'
+# Old versions kept next to the live one for rollback
+DEFAULT_KEEP = 5
+
+
+class BundleError(Exception):
+    """Raised for missing, truncated or corrupt bundles"""
+
+
+class Bundle:
+    """A loaded bundle: read-only arrays, raw blobs and metadata"""
+
+    def __init__(self, path, version, arrays, blobs, metadata):
+        self.path = path
+        self.version = version
+        self.arrays = arrays
+        self.blobs = blobs
+        self.metadata = metadata
+
+
+def _aligned(offset):
+    return (offset + _ALIGN - 1) // _ALIGN * _ALIGN
+
+
+def _fsync_dir(path):
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def atomic_write(path, write):
+    """
+    Write a file via a temp file in the same directory and os.replace()
+    write(f) receives the open binary file; readers never see a partial file
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-', suffix=os.path.basename(path))
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            write(f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise
+    _fsync_dir(directory)
+
+
+def write_bundle(path, arrays=None, metadata=None, blobs=None):
+    """Atomically write a bundle file; returns its checksum"""
+    arrays = {name: np.ascontiguousarray(value) for name, value in (arrays or {}).items()}
+    blobs = dict(blobs or {})
+
+    entries = []
+    offset = 0
+    for name, value in arrays.items():
+        offset = _aligned(offset)
+        entries.append({'name': name, 'kind': 'array', 'dtype': value.dtype.str,
+                        'shape': list(value.shape), 'offset': offset, 'nbytes': value.nbytes})
+        offset += value.nbytes
+    for name, value in blobs.items():
+        offset = _aligned(offset)
+        entries.append({'name': name, 'kind': 'blob', 'offset': offset, 'nbytes': len(value)})
+        offset += len(value)
+
+    header = json.dumps({'metadata': metadata or {}, 'entries': entries}, sort_keys=True).encode('utf-8')
+    data_start = _aligned(_PREFIX.size + len(header))
+
+    data = bytearray(offset)
+    for entry in entries:
+        value = arrays[entry['name']] if entry['kind'] == 'array' else blobs[entry['name']]
+        start = entry['offset']
+        data[start:start + entry['nbytes']] = value.tobytes() if entry['kind'] == 'array' else value
+
+    padding = b'\0' * (data_start - _PREFIX.size - len(header))
+    digest = hashlib.sha256()
+    digest.update(header)
+    digest.update(padding)
+    digest.update(data)
+    checksum = digest.digest()
+
+    def _write(f):
+        f.write(_PREFIX.pack(MAGIC, FORMAT_VERSION, len(header), checksum))
+        f.write(header)
+        f.write(padding)
+        f.write(data)
+
+    atomic_write(path, _write)
+    return checksum.hex()
+
+
+def read_bundle(path, verify=True):
+    """Memory-map a bundle and return a Bundle; raises BundleError when invalid"""
+    try:
+        with open(path, 'rb') as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError) as e:
+        raise BundleError(f"cannot open {path}: {e}")
+
+    if len(mapped) < _PREFIX.size:
+        raise BundleError(f"{path} is truncated")
+    magic, format_version, header_length, checksum = _PREFIX.unpack_from(mapped, 0)
+    if magic != MAGIC or format_version != FORMAT_VERSION:
+        raise BundleError(f"{path} is not a v{FORMAT_VERSION} model bundle")
+
+    body = memoryview(mapped)[_PREFIX.size:]
+    if verify and hashlib.sha256(body).digest() != checksum:
+        raise BundleError(f"checksum mismatch in {path}")
+
+    header = json.loads(bytes(body[:header_length]).decode('utf-8'))
+    data_start = _aligned(_PREFIX.size + header_length)
+    arrays = {}
+    blobs = {}
+    for entry in header['entries']:
+        start = data_start + entry['offset']
+        if start + entry['nbytes'] > len(mapped):
+            raise BundleError(f"{path} is truncated")
+        if entry['kind'] == 'array':
+            dtype = np.dtype(entry['dtype'])
+            if not entry['nbytes']:
+                arrays[entry['name']] = np.empty(entry['shape'], dtype=dtype)
+                continue
+            count = entry['nbytes'] // dtype.itemsize
+            arrays[entry['name']] = np.frombuffer(mapped, dtype=dtype, count=count, offset=start).reshape(entry['shape'])
+        else:
+            blobs[entry['name']] = bytes(mapped[start:start + entry['nbytes']])
+
+    version = os.path.basename(path)[:-len(BUNDLE_SUFFIX)] if path.endswith(BUNDLE_SUFFIX) else None
+    return Bundle(path, version, arrays, blobs, header['metadata'])
+
+
+# --- Versions and the current pointer ---
+
+def bundle_dir(models_dir, name):
+    return os.path.join(models_dir, name)
+
+
+def bundle_path(models_dir, name, version):
+    return os.path.join(bundle_dir(models_dir, name), f'{version}{BUNDLE_SUFFIX}')
+
+
+def list_versions(models_dir, name):
+    """Published versions, oldest first"""
+    directory = bundle_dir(models_dir, name)
+    if not os.path.isdir(directory):
+        return []
+    return sorted(
+        entry[:-len(BUNDLE_SUFFIX)] for entry in os.listdir(directory)
+        if entry.endswith(BUNDLE_SUFFIX) and not entry.startswith('.')
+    )
+
+
+def current_version(models_dir, name):
+    try:
+        with open(os.path.join(bundle_dir(models_dir, name), CURRENT_POINTER), 'r') as f:
+            return f.read().strip() or None
+    except OSError:
+        return None
+
+
+def set_current(models_dir, name, version):
+    """Point `current` at an existing version (also used for rollback)"""
+    if not os.path.exists(bundle_path(models_dir, name, version)):
+        raise BundleError(f"no bundle {version} for {name}")
+    atomic_write(
+        os.path.join(bundle_dir(models_dir, name), CURRENT_POINTER),
+        lambda f: f.write(version.encode('utf-8') + b'\n'),
+    )
+
+
+def rollback(models_dir, name):
+    """Point `current` at the version before it; returns that version or None"""
+    versions = list_versions(models_dir, name)
+    current = current_version(models_dir, name)
+    older = [version for version in versions if current is None or version < current]
+    if not older:
+        return None
+    set_current(models_dir, name, older[-1])
+    return older[-1]
+
+
+def publish(models_dir, name, arrays=None, metadata=None, blobs=None, keep=None):
+    """Write a new version, make it current and prune old ones; returns the version"""
+    version = datetime.now().strftime('%Y%m%dT%H%M%S%f')
+    write_bundle(bundle_path(models_dir, name, version), arrays, metadata, blobs)
+    set_current(models_dir, name, version)
+    prune(models_dir, name, keep)
+    return version
+
+
+def prune(models_dir, name, keep=None):
+    """Delete all but the newest `keep` versions (MODEL_BUNDLE_KEEP), never the current one"""
+    if keep is None:
+        keep = int(env_float('MODEL_BUNDLE_KEEP', DEFAULT_KEEP))
+    current = current_version(models_dir, name)
+    for version in list_versions(models_dir, name)[:-max(keep, 1)]:
+        if version != current:
+            try:
+                os.remove(bundle_path(models_dir, name, version))
+            except OSError:
+                pass
+
+
+def load_current(models_dir, name, verify=True):
+    """The live bundle for a model name, or None when none was published"""
+    version = current_version(models_dir, name)
+    if version is None:
+        return None
+    return read_bundle(bundle_path(models_dir, name, version), verify=verify)
+
+
+# --- Model helpers ---
+
+def keras_arrays(model):
+    """Weights as bundle arrays plus the architecture for metadata"""
+    arrays = {f'weight_{i:03d}': weight for i, weight in enumerate(model.get_weights())}
+    return arrays, model.to_json()
+
+
+def keras_model(bundle):
+    """Rebuild the Keras model stored in a bundle (None when it has none)"""
+    config = bundle.metadata.get('keras_config')
+    if not config:
+        return None
+    from tensorflow import keras
+    model = keras.models.model_from_json(config)
+    names = sorted(name for name in bundle.arrays if name.startswith('weight_'))
+    model.set_weights([bundle.arrays[name] for name in names])
+    return model
+
+
+def scaler_arrays(scaler):
+    return {
+        'scaler_mean': np.asarray(scaler.mean_, dtype=np.float64),
+        'scaler_scale': np.asarray(scaler.scale_, dtype=np.float64),
+    }
+
+
+def standard_scaler(bundle):
+    """Rebuild a fitted StandardScaler from its stored parameters"""
+    if 'scaler_mean' not in bundle.arrays:
+        return None
+    from sklearn.preprocessing import StandardScaler
+    scaler = StandardScaler()
+    scaler.mean_ = np.array(bundle.arrays['scaler_mean'])
+    scaler.scale_ = np.array(bundle.arrays['scaler_scale'])
+    scaler.var_ = scaler.scale_ ** 2
+    scaler.n_features_in_ = len(scaler.mean_)
+    scaler.n_samples_seen_ = int(bundle.metadata.get('training_samples') or 0)
+    return scaler
+
+
+def pickle_blob(value):
+    import joblib
+    buffer = io.BytesIO()
+    joblib.dump(value, buffer)
+    return buffer.getvalue()
+
+
+def unpickle_blob(data):
+    import joblib
+    return joblib.load(io.BytesIO(data))
@@ -0,0 +1,285 @@
+#!/usr/bin/env python3
+"""
+Online slot-average model updated per attendance scan
+Keeps an exponentially decayed estimate of arrivals per mess x weekday x
+15-minute slot, so predictions follow recent behaviour without batch
+training. Each scan is an O(1) update; completed days are folded into the
+decayed table once per day.
+
+Today's scans also scale today's predictions: the ratio of observed to
+expected arrivals over the last completed slots, so a busier than usual
+meal shows up one slot later.
+"""
+
+import os
+import time
+import threading
+from datetime import datetime
+import numpy as np
+import model_bundle
+import scan_listener
+from env_config import env_float
+
+MODELS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'models')
+SLOTS_PER_DAY = 96
+# Weight of a day's scans halves after this many days
+DEFAULT_HALF_LIFE_DAYS = 14.0
+# Below this many (decayed) observed days the mess has no online estimate:
+# 0.5 is one day of scans within the last half-life
+MIN_DAY_WEIGHT = 0.5
+# Today's ratio looks back over this many completed slots (one meal window)
+RATIO_WINDOW_SLOTS = 8
+# Pseudo-count that shrinks today's ratio towards 1 early in a meal
+RATIO_PRIOR = 5.0
+MAX_RATIO = 4.0
+DEFAULT_SNAPSHOT_SECONDS = 300
+DEFAULT_BLEND_WEIGHT = 0.5
+
+
+def online_mode():
+    """ONLINE_MODEL: 'off' (default), 'blend' with the trained model, or 'replace' it"""
+    mode = os.environ.get('ONLINE_MODEL', 'off').strip().lower()
+    return mode if mode in ('off', 'blend', 'replace') else 'off'
+
+
+def _as_local_datetime(when):
+    """Wall-clock datetime for a scan time (datetime, ISO string or Unix timestamp)"""
+    if isinstance(when, str):
+        when = datetime.fromisoformat(when.strip().replace('Z', '+00:00'))
+    elif isinstance(when, (int, float)):
+        when = datetime.fromtimestamp(when)
+    if when.tzinfo is not None:
+        when = when.astimezone().replace(tzinfo=None)
+    return when
+
+
+class OnlineSlotModel:
+    """
+    Decayed per-slot arrival averages for every mess
+    slot_sums[m, dow, slot] / day_weights[m, dow] is the expected number of
+    scans in that slot; both are kept decayed to day[m], the mess's current
+    date, whose scans accumulate in today[m] until the date rolls over.
+    """
+
+    def __init__(self, snapshot_path=None, half_life_days=None, snapshot_seconds=None):
+        half_life = half_life_days or env_float('ONLINE_HALF_LIFE_DAYS', DEFAULT_HALF_LIFE_DAYS)
+        self.half_life_days = half_life
+        self.decay = 0.5 ** (1.0 / half_life)
+        self.snapshot_path = snapshot_path or os.environ.get('ONLINE_SNAPSHOT_PATH') or \
+            os.path.join(MODELS_DIR, 'online_snapshot.bundle')
+        self.snapshot_seconds = snapshot_seconds if snapshot_seconds is not None else \
+            env_float('ONLINE_SNAPSHOT_SECONDS', DEFAULT_SNAPSHOT_SECONDS)
+
+        self.mess_ids = []
+        self.mess_index = {}
+        self.slot_sums = np.zeros((0, 7, SLOTS_PER_DAY), dtype=np.float64)
+        self.day_weights = np.zeros((0, 7), dtype=np.float64)
+        self.today = np.zeros((0, SLOTS_PER_DAY), dtype=np.float64)
+        self.day = np.zeros(0, dtype=np.int64)  # date.toordinal(); 0 = no scans yet
+        self._seen = []  # per mess: event keys already counted today
+        self._lock = threading.RLock()
+        self._dirty = False
+        self._last_snapshot = time.monotonic()
+        self.load()
+
+    def _row(self, mess_id):
+        row = self.mess_index.get(mess_id)
+        if row is None:
+            row = len(self.mess_ids)
+            self.mess_ids.append(mess_id)
+            self.mess_index[mess_id] = row
+            self.slot_sums = np.concatenate([self.slot_sums, np.zeros((1, 7, SLOTS_PER_DAY))])
+            self.day_weights = np.concatenate([self.day_weights, np.zeros((1, 7))])
+            self.today = np.concatenate([self.today, np.zeros((1, SLOTS_PER_DAY))])
+            self.day = np.append(self.day, 0)
+            self._seen.append(set())
+        return row
+
+    def _roll(self, row, day):
+        """Fold the mess's current day into the decayed table and start `day`"""
+        current = int(self.day[row])
+        if current:
+            dow = datetime.fromordinal(current).weekday()
+            self.slot_sums[row, dow] += self.today[row]
+            self.day_weights[row, dow] += 1.0
+            factor = self.decay ** (day - current)
+            self.slot_sums[row] *= factor
+            self.day_weights[row] *= factor
+        self.today[row] = 0.0
+        self.day[row] = day
+        self._seen[row] = set()
+
+    def observe(self, mess_id, when, key=None):
+        """
+        Count one attendance scan; returns False when `key` was already seen today
+        Late scans from earlier days are added (decayed) to the table but do not
+        count as an observed day.
+        """
+        when = _as_local_datetime(when)
+        day = when.toordinal()
+        slot = (when.hour * 60 + when.minute) // 15
+        with self._lock:
+            row = self._row(mess_id)
+            if day > self.day[row]:
+                self._roll(row, day)
+            if day == self.day[row]:
+                if key is not None:
+                    if key in self._seen[row]:
+                        return False
+                    self._seen[row].add(key)
+                self.today[row, slot] += 1.0
+            else:
+                self.slot_sums[row, when.weekday(), slot] += self.decay ** (int(self.day[row]) - day)
+            self._dirty = True
+        self.maybe_snapshot()
+        return True
+
+    def _table(self, row):
+        """Expected scans per (weekday, slot); unseen weekdays use the all-days slot mean"""
+        sums = self.slot_sums[row]
+        weights = self.day_weights[row]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            table = sums / weights[:, None]
+            slot_mean = sums.sum(axis=0) / weights.sum()
+        return np.where(weights[:, None] > 0, table, slot_mean)
+
+    def _today_ratio(self, row, now, table):
+        """Observed / expected scans over today's last completed slots, shrunk towards 1"""
+        end = (now.hour * 60 + now.minute) // 15
+        start = max(0, end - RATIO_WINDOW_SLOTS)
+        if end == start:
+            return 1.0
+        expected = float(table[now.weekday(), start:end].sum())
+        observed = float(self.today[row, start:end].sum())
+        ratio = (observed + RATIO_PRIOR) / (expected + RATIO_PRIOR)
+        return min(max(ratio, 1.0 / MAX_RATIO), MAX_RATIO)
+
+    def _current_row(self, mess_id, now):
+        """Row for a mess with its days rolled forward to `now` (None when unknown)"""
+        row = self.mess_index.get(mess_id)
+        if row is not None and now.toordinal() > self.day[row]:
+            self._roll(row, now.toordinal())
+        return row
+
+    def has_data(self, mess_id, now=None):
+        """Whether the mess has enough recent completed days for an estimate"""
+        with self._lock:
+            row = self._current_row(mess_id, now or datetime.now())
+            return row is not None and self.day_weights[row].sum() >= MIN_DAY_WEIGHT
+
+    def predict_counts(self, mess_id, slot_times, now=None):
+        """Expected scans per slot start time (float32, NaN when the mess has no history)"""
+        counts = np.full(len(slot_times), np.nan, dtype=np.float32)
+        now = now or datetime.now()
+        with self._lock:
+            row = self._current_row(mess_id, now)
+            if row is None or self.day_weights[row].sum() < MIN_DAY_WEIGHT:
+                return counts
+            table = self._table(row)
+            ratio = self._today_ratio(row, now, table)
+
+        today = now.toordinal()
+        for i, slot_time in enumerate(slot_times):
+            value = table[slot_time.weekday(), (slot_time.hour * 60 + slot_time.minute) // 15]
+            counts[i] = value * ratio if slot_time.toordinal() == today else value
+        return counts
+
+    def blend(self, mess_id, slot_times, counts, mode=None, now=None):
+        """
+        Combine trained-model counts with the online estimate
+        'blend' mixes them (ONLINE_BLEND_WEIGHT, default 0.5); 'replace' uses
+        the online estimate wherever it has one. Slots the trained model left
+        as NaN (outside meals) stay NaN.
+        """
+        mode = mode or online_mode()
+        if mode == 'off' or not self.has_data(mess_id, now):
+            return counts
+        weight = 1.0 if mode == 'replace' else env_float('ONLINE_BLEND_WEIGHT', DEFAULT_BLEND_WEIGHT)
+        online = self.predict_counts(mess_id, slot_times, now=now)
+        usable = ~np.isnan(online) & ~np.isnan(counts)
+        blended = np.array(counts, dtype=np.float32)
+        blended[usable] = (1.0 - weight) * counts[usable] + weight * online[usable]
+        return blended
+
+    def snapshot(self, path=None):
+        """Atomically write the current state to disk"""
+        path = path or self.snapshot_path
+        with self._lock:
+            arrays = {
+                'slot_sums': self.slot_sums.copy(),
+                'day_weights': self.day_weights.copy(),
+                'today': self.today.copy(),
+                'day': self.day.copy(),
+            }
+            metadata = {
+                'mess_ids': list(self.mess_ids),
+                'half_life_days': self.half_life_days,
+                'seen': [sorted(keys) for keys in self._seen],
+                'saved_at': datetime.now().isoformat(),
+            }
+            self._dirty = False
+            self._last_snapshot = time.monotonic()
+        model_bundle.write_bundle(path, arrays, metadata)
+
+    def maybe_snapshot(self):
+        """Snapshot when there are new scans and ONLINE_SNAPSHOT_SECONDS have passed"""
+        if self._dirty and time.monotonic() - self._last_snapshot >= self.snapshot_seconds:
+            try:
+                self.snapshot()
+            except OSError as e:
+                print(f"[WARN] Online model snapshot failed: {e}")
+
+    def load(self, path=None):
+        """Restore state from a snapshot; False when there is none"""
+        path = path or self.snapshot_path
+        if not os.path.exists(path):
+            return False
+        try:
+            bundle = model_bundle.read_bundle(path)
+        except model_bundle.BundleError as e:
+            print(f"[WARN] Ignoring online model snapshot: {e}")
+            return False
+        with self._lock:
+            self.mess_ids = list(bundle.metadata.get('mess_ids', []))
+            self.mess_index = {mess_id: i for i, mess_id in enumerate(self.mess_ids)}
+            self.slot_sums = np.array(bundle.arrays['slot_sums'])
+            self.day_weights = np.array(bundle.arrays['day_weights'])
+            self.today = np.array(bundle.arrays['today'])
+            self.day = np.array(bundle.arrays['day'])
+            self._seen = [set(keys) for keys in bundle.metadata.get('seen', [[] for _ in self.mess_ids])]
+        print(f"[OK] Loaded online model snapshot ({len(self.mess_ids)} messes)")
+        return True
+
+
+_online_model = None
+_online_model_lock = threading.Lock()
+
+def get_online_model():
+    """Process-wide online model (restored from its snapshot on first use)"""
+    global _online_model
+    with _online_model_lock:
+        if _online_model is None:
+            _online_model = OnlineSlotModel()
+    return _online_model
+
+
+def start_attendance_listener(db, model=None, since=None, owns=None):
+    """
+    Feed new attendance scans into the online model via a Firestore listener
+    Only scans marked since `since` (default: start of today) are replayed.
+    owns: optional predicate on mess ids (this instance's shard)
+    Returns the watch handle; call .unsubscribe() to stop.
+    """
+    model = model or get_online_model()
+
+    def _on_scan(mess_id, date_str, meal, document_id, data):
+        marked_at = data.get('markedAt')
+        if not marked_at:
+            return
+        key = f"attendance/{mess_id}/{date_str}/{meal}/students/{document_id}"
+        try:
+            model.observe(mess_id, marked_at, key)
+        except (ValueError, TypeError) as e:
+            print(f"[WARN] Skipping attendance scan {key}: {e}")
+
+    return scan_listener.listen(db, _on_scan, since=since, owns=owns)
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+Opt-in cProfile hooks for /predict and training runs
+Off by default. When enabled, profiled runs write a pstats file plus a text
+summary (top functions by cumulative time) to PROFILE_DIR, named
+{time}_{stage}_{mess}_{pid}.
+
+  PROFILE_SAMPLE_RATE  fraction of /predict requests to profile (default 0)
+  PROFILE_TRAINING     1 to profile every training / retrain run (default 0)
+  PROFILE_DIR          output directory (default ml_model/profiles)
+  PROFILE_MAX_FILES    newest profiles kept (default 200)
+
+The admin endpoint can change the rate and training flag at runtime
+(per process). With hooks disabled a profiled block costs one comparison.
+"""
+
+import io
+import os
+import re
+import random
+import pstats
+import cProfile
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+
+from env_config import env_float
+
+DEFAULT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'profiles')
+DEFAULT_MAX_FILES = 200
+SUMMARY_LINES = 40
+
+
+_settings = {
+    'sample_rate': min(max(env_float('PROFILE_SAMPLE_RATE', 0.0), 0.0), 1.0),
+    'training': os.environ.get('PROFILE_TRAINING', '0').strip() == '1',
+    'directory': os.environ.get('PROFILE_DIR') or DEFAULT_DIR,
+    'max_files': int(env_float('PROFILE_MAX_FILES', DEFAULT_MAX_FILES)),
+}
+# One profile at a time per process: cProfile cannot nest, and on Python
+# 3.12+ only one profiler may be enabled at once across threads
+_busy = threading.Lock()
+
+
+def settings():
+    return dict(_settings)
+
+
+def configure(sample_rate=None, training=None):
+    """
+    Change the request sample rate (0-1) and/or training flag at runtime
+    Raises ValueError (and changes nothing) unless sample_rate is a number
+    and training a bool; JSON strings such as "false" are rejected.
+    """
+    if sample_rate is not None:
+        if isinstance(sample_rate, bool) or not isinstance(sample_rate, (int, float)) or sample_rate != sample_rate:
+            raise ValueError("sampleRate must be a number between 0 and 1")
+    if training is not None and not isinstance(training, bool):
+        raise ValueError("training must be true or false")
+    if sample_rate is not None:
+        _settings['sample_rate'] = min(max(float(sample_rate), 0.0), 1.0)
+    if training is not None:
+        _settings['training'] = training
+    return settings()
+
+
+def _tag(value):
+    return re.sub(r'[^A-Za-z0-9_.+-]', '_', str(value or 'all'))[:60]
+
+
+@contextmanager
+def profile(stage, mess_id=None, training=False):
+    """
+    Profile the block when sampled: training runs follow PROFILE_TRAINING,
+    everything else PROFILE_SAMPLE_RATE. Yields the output path prefix or None.
+    """
+    rate = (1.0 if _settings['training'] else 0.0) if training else _settings['sample_rate']
+    if rate <= 0.0 or (rate < 1.0 and random.random() >= rate) or not _busy.acquire(blocking=False):
+        yield None
+        return
+
+    prefix = os.path.join(
+        _settings['directory'],
+        f"{datetime.now():%Y%m%dT%H%M%S%f}_{_tag(stage)}_{_tag(mess_id)}_{os.getpid()}",
+    )
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+        try:
+            yield prefix
+        finally:
+            profiler.disable()
+            try:
+                _write(profiler, prefix)
+            except OSError as e:
+                print(f"[WARN] Could not write profile {prefix}: {e}")
+    finally:
+        _busy.release()
+
+
+def _write(profiler, prefix):
+    os.makedirs(os.path.dirname(prefix), exist_ok=True)
+    profiler.dump_stats(prefix + '.prof')
+    summary = io.StringIO()
+    pstats.Stats(profiler, stream=summary).sort_stats('cumulative').print_stats(SUMMARY_LINES)
+    with open(prefix + '.txt', 'w') as f:
+        f.write(summary.getvalue())
+    _prune(os.path.dirname(prefix))
+
+
+def _prune(directory):
+    profiles = sorted(name for name in os.listdir(directory) if name.endswith('.prof'))
+    for name in profiles[:-max(_settings['max_files'], 1)]:
+        for suffix in ('.prof', '.txt'):
+            try:
+                os.remove(os.path.join(directory, name[:-len('.prof')] + suffix))
+            except OSError:
+                pass
+
+
+def recent_profiles(limit=20):
+    """Newest profile file names (for the admin endpoint)"""
+    directory = _settings['directory']
+    if not os.path.isdir(directory):
+        return []
+    return sorted((name for name in os.listdir(directory) if name.endswith('.prof')), reverse=True)[:limit]
@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+"""
+Firestore listener for new attendance scans
+One collection-group query over every attendance/{mess}/{date}/{meal}/students
+collection, filtered on markedAt. Firestore does not create collection-group
+indexes on its own, so the query needs the single-field index declared in
+frontend/firestore.indexes.json (deployed from frontend/):
+
+    firebase deploy --only firestore:indexes
+
+Without it the watch stream fails in its own thread after on_snapshot has
+returned, so listen() runs the query once first and raises right away.
+
+Cost: the listener reads every scan of every mess, also the ones another
+shard owns (owns() filters on the client), and replays the scans since
+`since` when it starts. Scoping by mess would take a listener per mess and
+meal, re-opened at midnight; one listener keeps that to one stream.
+"""
+
+from datetime import datetime
+
+import firestore_breaker
+
+
+def scans_query(db, since):
+    """Scans marked at or after `since`, across all messes"""
+    return db.collection_group('students').where('markedAt', '>=', since.isoformat())
+
+
+def scan_path(path):
+    """(mess_id, date_str, meal, document_id) of an attendance scan path, or None"""
+    parts = path.split('/')
+    if len(parts) != 6 or parts[0] != 'attendance' or parts[4] != 'students':
+        return None
+    return parts[1], parts[2], parts[3], parts[5]
+
+
+def listen(db, on_scan, since=None, owns=None):
+    """
+    Call on_scan(mess_id, date_str, meal, document_id, data) for each new scan
+    Scans marked since `since` (default: start of today) are replayed first.
+    owns: optional predicate on mess ids (this instance's shard)
+    Raises when the query cannot run (e.g. the index is missing).
+    Returns the watch handle; call .unsubscribe() to stop.
+    """
+    since = since or datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    query = scans_query(db, since)
+    try:
+        firestore_breaker.get_breaker().call(lambda: query.limit(1).get())
+    except Exception as e:
+        raise RuntimeError(
+            f"attendance scan query failed; is the students.markedAt collection-group index deployed? {e}"
+        ) from e
+
+    def _on_snapshot(documents, changes, read_time):
+        for change in changes:
+            if change.type.name != 'ADDED':
+                continue
+            scan = scan_path(change.document.reference.path)
+            if scan is None or (owns is not None and not owns(scan[0])):
+                continue
+            on_scan(*scan, change.document.to_dict() or {})
+
+    return query.on_snapshot(_on_snapshot)
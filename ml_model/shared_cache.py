@@ -0,0 +1,503 @@
+#!/usr/bin/env python3
+"""
+Cache shared by backend instances
+Several API instances otherwise each keep cold caches and recompute the same
+predictions. Values are JSON and live in one of two backends:
+
+  CACHE_BACKEND=local  in-process LRU with TTLs (default)
+  CACHE_BACKEND=redis  any server speaking the Redis protocol at CACHE_URL
+                       (redis://[:password@]host:port/db)
+
+get_or_compute() and get_or_compute_many() coalesce misses: within a
+process, concurrent callers for a key wait for the one computing it; across
+processes the first caller takes a short lock key (SET NX PX) and the others
+poll for its result for up to CACHE_LOCK_SECONDS (default 10) before
+computing it themselves.
+
+Keys are prefix:namespace:key, where a namespace can carry a version, e.g.
+predictions@alder_model.keras@2026-05-01T03:00 - a retrained model reads
+and writes new keys and the old ones simply expire.
+
+Cache errors never reach callers: a failing server reads as a miss, and
+the circuit breaker (name 'cache') stops calling it for a while.
+StandInServer is a small in-process Redis-protocol server for tests and
+local development.
+"""
+
+import os
+import json
+import time
+import uuid
+import socket
+import threading
+import socketserver
+from collections import OrderedDict
+from urllib.parse import urlparse
+
+from firestore_breaker import CircuitBreaker
+from env_config import env_float
+
+DEFAULT_PREFIX = 'smartmess'
+DEFAULT_MAX_ENTRIES = 10000
+DEFAULT_TIMEOUT = 0.25
+DEFAULT_LOCK_SECONDS = 10
+
+
+class CacheError(Exception):
+    """Error reply from the cache server"""
+
+
+# ----------------------------------------------------------------------
+# Backends: bytes in, bytes out
+# ----------------------------------------------------------------------
+
+class LocalBackend:
+    """Thread-safe in-process LRU with per-entry TTLs"""
+
+    def __init__(self, max_entries=None, clock=time.monotonic):
+        self.max_entries = int(max_entries or env_float('CACHE_MAX_ENTRIES', DEFAULT_MAX_ENTRIES))
+        self._clock = clock
+        self._data = OrderedDict()  # key -> (value, expires at or None)
+        self._lock = threading.Lock()
+
+    def _live(self, key):
+        # Caller holds the lock
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        if entry[1] is not None and entry[1] <= self._clock():
+            del self._data[key]
+            return None
+        self._data.move_to_end(key)
+        return entry[0]
+
+    def get(self, key):
+        with self._lock:
+            return self._live(key)
+
+    def get_many(self, keys):
+        with self._lock:
+            return [self._live(key) for key in keys]
+
+    def set(self, key, value, ttl=None, only_if_absent=False):
+        """Store value (ttl in seconds); with only_if_absent returns False when the key exists"""
+        with self._lock:
+            if only_if_absent and self._live(key) is not None:
+                return False
+            self._data[key] = (value, self._clock() + ttl if ttl else None)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+            return True
+
+    def delete(self, key):
+        with self._lock:
+            return self._data.pop(key, None) is not None
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+def _encode(*args):
+    parts = [b'*%d\r\n' % len(args)]
+    for arg in args:
+        if not isinstance(arg, bytes):
+            arg = str(arg).encode()
+        parts.append(b'$%d\r\n%s\r\n' % (len(arg), arg))
+    return b''.join(parts)
+
+
+def _read_reply(reader):
+    line = reader.readline()
+    if not line.endswith(b'\r\n'):
+        raise ConnectionError('cache connection closed')
+    kind, rest = line[:1], line[1:-2]
+    if kind == b'+':
+        return rest.decode()
+    if kind == b'-':
+        return CacheError(rest.decode())
+    if kind == b':':
+        return int(rest)
+    if kind == b'$':
+        length = int(rest)
+        if length < 0:
+            return None
+        data = reader.read(length + 2)
+        if len(data) != length + 2:
+            raise ConnectionError('cache connection closed')
+        return data[:-2]
+    if kind == b'*':
+        length = int(rest)
+        return None if length < 0 else [_read_reply(reader) for _ in range(length)]
+    raise ConnectionError(f'unexpected cache reply: {line[:40]!r}')
+
+
+class RespClient:
+    """Minimal Redis-protocol client; one connection per thread"""
+
+    def __init__(self, url, timeout=None):
+        parsed = urlparse(url)
+        self.host = parsed.hostname or 'localhost'
+        self.port = parsed.port or 6379
+        self.password = parsed.password
+        self.db = int(parsed.path.strip('/') or 0)
+        self.timeout = timeout if timeout is not None else env_float('CACHE_TIMEOUT', DEFAULT_TIMEOUT)
+        self._local = threading.local()
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            conn = (sock, sock.makefile('rb'))
+            self._local.conn = conn
+            if self.password:
+                self._roundtrip(conn, ('AUTH', self.password))
+            if self.db:
+                self._roundtrip(conn, ('SELECT', self.db))
+        return conn
+
+    def _roundtrip(self, conn, args):
+        sock, reader = conn
+        try:
+            sock.sendall(_encode(*args))
+            reply = _read_reply(reader)
+        except (OSError, ValueError) as e:
+            self.close()
+            if isinstance(e, (TimeoutError, ConnectionError)):
+                raise
+            raise ConnectionError(str(e)) from e
+        if isinstance(reply, CacheError):
+            raise reply
+        return reply
+
+    def execute(self, *args):
+        """Send one command and return its reply"""
+        try:
+            conn = self._connection()
+        except OSError as e:
+            self.close()
+            if isinstance(e, (TimeoutError, ConnectionError)):
+                raise
+            raise ConnectionError(str(e)) from e
+        return self._roundtrip(conn, args)
+
+    def close(self):
+        conn = getattr(self._local, 'conn', None)
+        self._local.conn = None
+        if conn is not None:
+            try:
+                conn[1].close()
+                conn[0].close()
+            except OSError:
+                pass
+
+
+class RedisBackend:
+    """Backend on a Redis-protocol server"""
+
+    def __init__(self, url, timeout=None):
+        self.url = url
+        self.client = RespClient(url, timeout)
+
+    def get(self, key):
+        return self.client.execute('GET', key)
+
+    def get_many(self, keys):
+        return self.client.execute('MGET', *keys) if keys else []
+
+    def set(self, key, value, ttl=None, only_if_absent=False):
+        args = ['SET', key, value]
+        if ttl:
+            args += ['PX', max(1, int(ttl * 1000))]
+        if only_if_absent:
+            args.append('NX')
+        return self.client.execute(*args) is not None
+
+    def delete(self, key):
+        return self.client.execute('DEL', key) > 0
+
+    def clear(self):
+        self.client.execute('FLUSHDB')
+
+
+# ----------------------------------------------------------------------
+# Cache
+# ----------------------------------------------------------------------
+
+class SharedCache:
+    """JSON values on a backend, with versioned namespaces and single-flight misses"""
+
+    def __init__(self, backend, prefix=None, lock_seconds=None, breaker=None):
+        self.backend = backend
+        self.prefix = prefix or os.environ.get('CACHE_PREFIX', DEFAULT_PREFIX)
+        self.lock_seconds = lock_seconds if lock_seconds is not None else env_float('CACHE_LOCK_SECONDS', DEFAULT_LOCK_SECONDS)
+        # A down server costs one timeout per cooldown, not one per request
+        self.breaker = breaker or CircuitBreaker('cache', max_retries=0)
+        self._inflight = {}  # key -> Event set when its computation finishes
+        self._lock = threading.Lock()
+        self.counters = {'hits': 0, 'misses': 0, 'computed': 0, 'coalesced': 0, 'errors': 0}
+
+    def key(self, namespace, key, version=None):
+        """Full key; a new version starts a fresh namespace"""
+        if version is not None:
+            namespace = f"{namespace}@{version}"
+        return f"{self.prefix}:{namespace}:{key}"
+
+    def _call(self, default, func, *args):
+        try:
+            return self.breaker.call(func, *args)
+        except Exception:
+            self._count('errors')
+            return default
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self.counters[name] += amount
+
+    # Values are wrapped so that a cached None differs from a miss
+    def get_many(self, keys):
+        """{key: value} for the keys found"""
+        keys = list(keys)
+        found = {}
+        for key, raw in zip(keys, self._call([None] * len(keys), self.backend.get_many, keys)):
+            if raw is None:
+                continue
+            try:
+                found[key] = json.loads(raw)['v']
+            except (ValueError, KeyError, TypeError):
+                continue
+        self._count('hits', len(found))
+        self._count('misses', len(keys) - len(found))
+        return found
+
+    def get(self, key, default=None):
+        return self.get_many([key]).get(key, default)
+
+    def set(self, key, value, ttl=None):
+        data = json.dumps({'v': value}, default=str, separators=(',', ':'))
+        return self._call(False, self.backend.set, key, data, ttl)
+
+    def delete(self, key):
+        return self._call(False, self.backend.delete, key)
+
+    def get_or_compute(self, key, compute, ttl=None):
+        """Cached value for key, computing it once (cluster-wide) on a miss"""
+        return self.get_or_compute_many({key: key}, lambda ids: {key: compute()}, ttl)[key]
+
+    def get_or_compute_many(self, keys, compute, ttl=None):
+        """
+        keys: {id: cache key}; compute(ids) returns {id: value} for the ids
+        this caller ends up computing (one batch for all of them)
+        Returns {id: value} for every id
+        """
+        found = self.get_many(keys.values())
+        results = {item: found[key] for item, key in keys.items() if key in found}
+        missing = [item for item in keys if item not in results]
+        if not missing:
+            return results
+
+        # Threads of this process wait for whichever thread owns a key
+        owned, local_waits = [], []
+        with self._lock:
+            for item in missing:
+                event = self._inflight.get(keys[item])
+                if event is None:
+                    self._inflight[keys[item]] = threading.Event()
+                    owned.append(item)
+                else:
+                    local_waits.append((item, event))
+
+        try:
+            # Across processes the lock key decides who computes
+            token = uuid.uuid4().hex
+            lock_ttl = max(self.lock_seconds, 1)
+            computing = [item for item in owned
+                         if self._call(True, self.backend.set, f"{keys[item]}:lock", token, lock_ttl, True)]
+            remote_waits = [item for item in owned if item not in computing]
+            if computing:
+                results.update(self._compute(keys, computing, compute, ttl))
+            if remote_waits:
+                results.update(self._await(keys, remote_waits))
+                late = [item for item in remote_waits if item not in results]
+                if late:
+                    results.update(self._compute(keys, late, compute, ttl))
+        finally:
+            with self._lock:
+                for item in owned:
+                    self._inflight.pop(keys[item]).set()
+
+        for item, event in local_waits:
+            event.wait(self.lock_seconds)
+        waited = [item for item, _ in local_waits]
+        if waited:
+            results.update(self._await(keys, waited, timeout=0))
+            late = [item for item in waited if item not in results]
+            if late:
+                results.update(self._compute(keys, late, compute, ttl))
+        return results
+
+    def _compute(self, keys, items, compute, ttl):
+        try:
+            values = compute(items)
+        finally:
+            for item in items:
+                # The lock only matters while computing; it also expires on its own
+                self._call(False, self.backend.delete, f"{keys[item]}:lock")
+        for item in items:
+            self.set(keys[item], values.get(item), ttl)
+        self._count('computed', len(items))
+        return {item: values.get(item) for item in items}
+
+    def _await(self, keys, items, timeout=None):
+        """Poll for values another process is computing"""
+        timeout = self.lock_seconds if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        delay = 0.02
+        results = {}
+        pending = list(items)
+        while pending:
+            found = self.get_many(keys[item] for item in pending)
+            for item in pending:
+                if keys[item] in found:
+                    results[item] = found[keys[item]]
+            pending = [item for item in pending if item not in results]
+            if not pending or time.monotonic() >= deadline or self.breaker.is_open():
+                break
+            time.sleep(min(delay, max(0.0, deadline - time.monotonic())))
+            delay = min(delay * 2, 0.5)
+        self._count('coalesced', len(results))
+        return results
+
+    def snapshot(self):
+        return {
+            'backend': type(self.backend).__name__,
+            'counters': dict(self.counters),
+            'breaker': self.breaker.snapshot()['state'],
+        }
+
+
+# ----------------------------------------------------------------------
+# Stand-in server
+# ----------------------------------------------------------------------
+
+class _StandInHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        store = self.server.store
+        while True:
+            try:
+                request = _read_reply(self.rfile)
+            except (ConnectionError, OSError, ValueError):
+                return
+            if not isinstance(request, list) or not request:
+                return
+            command = request[0].decode().upper()
+            args = request[1:]
+            try:
+                reply = self._dispatch(store, command, args)
+            except (ValueError, IndexError):
+                reply = CacheError('ERR syntax error')
+            self.wfile.write(self._encode_reply(reply))
+
+    @staticmethod
+    def _dispatch(store, command, args):
+        if command == 'PING':
+            return 'PONG'
+        if command in ('AUTH', 'SELECT'):
+            return 'OK'
+        if command == 'GET':
+            return store.get(args[0])
+        if command == 'MGET':
+            return store.get_many(args)
+        if command == 'SET':
+            ttl, only_if_absent = None, False
+            options = [arg.decode().upper() for arg in args[2:]]
+            for i, option in enumerate(options):
+                if option == 'PX':
+                    ttl = int(options[i + 1]) / 1000
+                elif option == 'EX':
+                    ttl = int(options[i + 1])
+                elif option == 'NX':
+                    only_if_absent = True
+            return 'OK' if store.set(args[0], args[1], ttl, only_if_absent) else None
+        if command == 'DEL':
+            return sum(store.delete(key) for key in args)
+        if command in ('FLUSHDB', 'FLUSHALL'):
+            store.clear()
+            return 'OK'
+        return CacheError(f"ERR unknown command '{command}'")
+
+    @classmethod
+    def _encode_reply(cls, reply):
+        if isinstance(reply, CacheError):
+            return b'-%s\r\n' % str(reply).encode()
+        if isinstance(reply, str):
+            return b'+%s\r\n' % reply.encode()
+        if isinstance(reply, int):
+            return b':%d\r\n' % reply
+        if reply is None:
+            return b'$-1\r\n'
+        if isinstance(reply, list):
+            return b'*%d\r\n' % len(reply) + b''.join(cls._encode_reply(item) for item in reply)
+        return b'$%d\r\n%s\r\n' % (len(reply), reply)
+
+
+class StandInServer(socketserver.ThreadingTCPServer):
+    """
+    Redis-protocol server on a LocalBackend (GET, MGET, SET EX/PX/NX, DEL,
+    FLUSHDB), for tests and local development
+        server = StandInServer().start()
+        cache = SharedCache(RedisBackend(server.url))
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host='127.0.0.1', port=0):
+        super().__init__((host, port), _StandInHandler)
+        self.store = LocalBackend()
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"redis://{host}:{port}/0"
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, name='cache-stand-in', daemon=True).start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_cache():
+    """Process-wide cache from CACHE_BACKEND / CACHE_URL"""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            backend_name = os.environ.get('CACHE_BACKEND', 'local').strip().lower()
+            if backend_name == 'redis':
+                backend = RedisBackend(os.environ.get('CACHE_URL', 'redis://localhost:6379/0'))
+            else:
+                backend = LocalBackend()
+            _cache = SharedCache(backend)
+            print(f"[INFO] Shared cache: {type(backend).__name__}")
+    return _cache
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Run a local Redis-protocol stand-in server')
+    parser.add_argument('--port', type=int, default=6379)
+    args = parser.parse_args()
+    server = StandInServer(port=args.port)
+    print(f"[OK] Cache stand-in listening on {server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
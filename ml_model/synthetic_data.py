@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+"""
+Vectorized synthetic attendance generator for scale tests
+generate_events() draws every scan for many messes over months as columnar
+NumPy arrays. Per (mess, day, meal) counts are Poisson draws around
+capacity x meal rate x weekday effect x exam-week surge. Arrival times
+within a meal follow a mixture of peaks plus a uniform background. The
+same seed gives the same events.
+
+The events convert to:
+  to_columns()              {'markedAt': datetime64} for prepare_data_columnar
+                            and backtest.bucket_history
+  to_records()              attendance record dicts, as load_firebase_data returns
+  to_firestore_documents()  (path, data) pairs for a Firestore stand-in, laid out
+                            like attendance/{mess}/{date}/{meal}/students/{id}
+
+Usage: python synthetic_data.py [num_messes] [days]
+"""
+
+import sys
+import time
+from datetime import date, datetime, timedelta
+import numpy as np
+
+MEAL_NAMES = ('breakfast', 'lunch', 'dinner')
+# Stride for student ids within one meal; co-prime with the population, so ids never repeat
+_STUDENT_STRIDE = 7919
+
+# window: (start, end) as 'HH:MM'; rate: mean share of capacity attending;
+# peaks: (minutes after the start, spread in minutes, weight); the remaining
+# weight (1 - sum of peak weights) arrives uniformly over the window
+DEFAULT_PROFILE = {
+    'meals': {
+        'breakfast': {'window': ('07:30', '09:30'), 'rate': 0.45, 'peaks': [(25, 15, 0.55), (80, 15, 0.25)]},
+        'lunch': {'window': ('12:00', '14:00'), 'rate': 0.75, 'peaks': [(20, 12, 0.5), (65, 20, 0.35)]},
+        'dinner': {'window': ('19:30', '21:30'), 'rate': 0.65, 'peaks': [(30, 20, 0.6), (85, 15, 0.2)]},
+    },
+    # Monday..Sunday multipliers
+    'weekday': [1.0, 1.0, 1.0, 1.0, 0.95, 0.7, 0.65],
+    # [{'start': 'YYYY-MM-DD', 'days': 7, 'multiplier': 1.3}, ...]
+    'exam_weeks': [],
+    # Lognormal sigma of each mess's overall scale and of each meal's count
+    'mess_spread': 0.15,
+    'meal_noise': 0.1,
+    # Share of scans marked manually instead of scanned
+    'manual_share': 0.3,
+    # Students per mess, as a multiple of capacity
+    'population_factor': 1.5,
+}
+
+
+def _minutes(value):
+    hour, minute = str(value).split(':')[:2]
+    return int(hour) * 60 + int(minute)
+
+
+def merge_profile(overrides=None):
+    """DEFAULT_PROFILE with top-level keys replaced and meals merged per meal"""
+    profile = dict(DEFAULT_PROFILE)
+    profile['meals'] = {meal: dict(config) for meal, config in DEFAULT_PROFILE['meals'].items()}
+    for key, value in (overrides or {}).items():
+        if key == 'meals':
+            for meal, config in value.items():
+                profile['meals'][meal].update(config)
+        else:
+            profile[key] = value
+    return profile
+
+
+def _coprime_population(size):
+    size = max(int(size), 1)
+    while np.gcd(size, _STUDENT_STRIDE) != 1:
+        size += 1
+    return size
+
+
+def generate_events(mess_ids, start=None, days=30, capacities=None, profile=None, seed=0):
+    """
+    Every scan for `mess_ids` over `days` days from `start` (default: the
+    last `days` days up to today), as columnar arrays:
+      mess_ids  list of mess ids; 'mess' holds indices into it
+      mess      int32       markedAt  datetime64[ms] (local wall clock)
+      meal      int8 index into MEAL_NAMES
+      student   int32, unique within a (mess, day, meal)
+      manual    bool
+    capacities: {mess_id: capacity} (default 100); seed=None draws a fresh stream
+    """
+    profile = merge_profile(profile)
+    rng = np.random.default_rng(seed)
+    mess_ids = list(mess_ids)
+    capacities = capacities or {}
+    if start is None:
+        start = date.today() - timedelta(days=days - 1)
+    elif isinstance(start, datetime):
+        start = start.date()
+    elif isinstance(start, str):
+        start = date.fromisoformat(start)
+
+    n_mess = len(mess_ids)
+    first_day = np.datetime64(start, 'D')
+    day_values = first_day + np.arange(days)
+    weekday = (day_values.astype(np.int64) + 3) % 7  # 1970-01-01 was a Thursday
+
+    # Expected scans per (mess, day, meal)
+    capacity = np.array([capacities.get(mess_id, 100) for mess_id in mess_ids], dtype=np.float64)
+    scale = capacity * rng.lognormal(0.0, profile['mess_spread'], n_mess)
+    day_effect = np.asarray(profile['weekday'], dtype=np.float64)[weekday]
+    for exam in profile['exam_weeks']:
+        exam_start = np.datetime64(exam['start'], 'D')
+        in_exam = (day_values >= exam_start) & (day_values < exam_start + int(exam.get('days', 7)))
+        day_effect = np.where(in_exam, day_effect * float(exam['multiplier']), day_effect)
+    rates = np.array([profile['meals'][meal]['rate'] for meal in MEAL_NAMES])
+    expected = scale[:, None, None] * day_effect[None, :, None] * rates[None, None, :]
+    expected *= rng.lognormal(0.0, profile['meal_noise'], expected.shape)
+
+    population = np.array([
+        _coprime_population(cap * profile['population_factor']) for cap in capacity
+    ], dtype=np.int64)
+    counts = np.minimum(rng.poisson(expected), population[:, None, None])
+
+    # One row per scan, meal-major so every meal is one contiguous slice
+    counts = np.ascontiguousarray(counts.transpose(2, 0, 1))  # (meal, mess, day)
+    flat_counts = counts.reshape(-1)
+    total = int(flat_counts.sum())
+    group_mess = np.tile(np.repeat(np.arange(n_mess, dtype=np.int32), days), 3)
+    group_day_ms = np.tile(day_values.astype('datetime64[ms]').astype(np.int64), 3 * n_mess)
+    mess = np.repeat(group_mess, flat_counts)
+    meal = np.repeat(np.arange(3, dtype=np.int8), counts.reshape(3, -1).sum(axis=1))
+
+    # Arrival time: a peak (normal) or the uniform background. Arrays are
+    # float32/int32 where the range allows: at tens of millions of rows the
+    # cost is mostly in allocating temporaries
+    marked_ms = np.repeat(group_day_ms, flat_counts)
+    meal_bounds = np.concatenate([[0], np.cumsum(counts.reshape(3, -1).sum(axis=1))])
+    for code, name in enumerate(MEAL_NAMES):
+        config = profile['meals'][name]
+        window_start, window_end = (_minutes(value) for value in config['window'])
+        duration = (window_end - window_start) * 60.0
+        lo, hi = meal_bounds[code], meal_bounds[code + 1]
+        choice = rng.random(hi - lo, dtype=np.float32)
+        offsets = rng.random(hi - lo, dtype=np.float32)
+        offsets *= duration
+        lower = 0.0
+        for centre, spread, weight in config['peaks']:
+            chosen = (choice >= lower) & (choice < lower + weight)
+            offsets[chosen] = rng.normal(centre * 60.0, spread * 60.0, int(np.count_nonzero(chosen)))
+            lower += weight
+        np.clip(offsets, 0, duration - 1, out=offsets)
+        offsets *= 1000.0
+        marked_ms[lo:hi] += offsets.astype(np.int64)
+        marked_ms[lo:hi] += window_start * 60_000
+    marked_at = marked_ms.view('datetime64[ms]')
+
+    # Distinct students within a meal: a random start walked with a co-prime stride
+    group_population = np.tile(np.repeat(population, days), 3)
+    wide = total >= 2 ** 31 or int(group_population.max()) * (_STUDENT_STRIDE + 1) >= 2 ** 31
+    index_type = np.int64 if wide else np.int32
+    student = np.arange(total, dtype=index_type)
+    student -= np.repeat((np.cumsum(flat_counts) - flat_counts).astype(index_type), flat_counts)
+    student *= _STUDENT_STRIDE
+    student += np.repeat(rng.integers(0, group_population).astype(index_type), flat_counts)
+    np.remainder(student, np.repeat(group_population.astype(index_type), flat_counts), out=student)
+    student = student.astype(np.int32, copy=False)
+    manual = rng.random(total, dtype=np.float32) < profile['manual_share']
+
+    return {
+        'mess_ids': mess_ids,
+        'mess': mess,
+        'markedAt': marked_at,
+        'meal': meal,
+        'student': student,
+        'manual': manual,
+    }
+
+
+def _select(events, mess_id):
+    if mess_id is None:
+        return np.arange(len(events['mess']))
+    return np.flatnonzero(events['mess'] == events['mess_ids'].index(mess_id))
+
+
+def to_columns(events, mess_id):
+    """Columns for MessCrowdRegressor.prepare_data_columnar / backtest.bucket_history"""
+    rows = _select(events, mess_id)
+    return {'markedAt': events['markedAt'][rows]}
+
+
+def _enrollment_ids(student):
+    return np.char.add('STUDENT_', np.char.zfill(student.astype(str), 6))
+
+
+def to_records(events, mess_id=None):
+    """Attendance record dicts (the load_firebase_data format)"""
+    rows = _select(events, mess_id)
+    marked_at = np.datetime_as_string(events['markedAt'][rows], unit='ms').tolist()
+    enrollment = _enrollment_ids(events['student'][rows]).tolist()
+    mess_ids = [events['mess_ids'][code] for code in events['mess'][rows].tolist()]
+    meals = [MEAL_NAMES[code] for code in events['meal'][rows].tolist()]
+    manual = events['manual'][rows].tolist()
+    return [
+        {
+            'enrollmentId': enrollment[i],
+            'markedAt': marked_at[i],
+            'studentName': f"Student {enrollment[i][8:]}",
+            'markedBy': 'manual' if manual[i] else 'scanned',
+            'messId': mess_ids[i],
+            'meal': meals[i],
+            'date': marked_at[i][:10],
+        }
+        for i in range(len(rows))
+    ]
+
+
+def to_firestore_documents(events, mess_id=None, chunk_size=100_000):
+    """
+    Lazily yield (path, data) for every scan, as the app writes them:
+    attendance/{mess}/{date}/{meal}/students/{enrollmentId}
+    """
+    rows = _select(events, mess_id)
+    for offset in range(0, len(rows), chunk_size):
+        chunk = rows[offset:offset + chunk_size]
+        for record in to_records(_subset(events, chunk)):
+            path = (f"attendance/{record['messId']}/{record['date']}/{record['meal']}"
+                    f"/students/{record['enrollmentId']}")
+            yield path, {
+                'enrollmentId': record['enrollmentId'],
+                'studentName': record['studentName'],
+                'markedAt': record['markedAt'],
+                'markedBy': record['markedBy'],
+            }
+
+
+def _subset(events, rows):
+    subset = {name: values[rows] for name, values in events.items() if name != 'mess_ids'}
+    subset['mess_ids'] = events['mess_ids']
+    return subset
+
+
+def main():
+    num_messes = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    days = int(sys.argv[2]) if len(sys.argv) > 2 else 180
+    mess_ids = [f"mess{i:03d}" for i in range(num_messes)]
+    capacities = {mess_id: 400 for mess_id in mess_ids}
+
+    started = time.perf_counter()
+    events = generate_events(mess_ids, days=days, capacities=capacities, seed=42)
+    elapsed = time.perf_counter() - started
+    total = len(events['mess'])
+    print(f"[OK] Generated {total:,} scans for {num_messes} messes over {days} days "
+          f"in {elapsed:.2f}s ({total / elapsed:,.0f} scans/s)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
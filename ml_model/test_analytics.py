@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+Test the attendance analytics: day rollups, week and month derivation,
+reports with today's scans merged in, and who may read them
+"""
+
+import os
+import sys
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend'))
+
+import analytics
+import api_auth
+from analytics import MessAnalytics, day_rollup, merge, summarize
+from shared_cache import LocalBackend, SharedCache
+from firestore_fakes import FakeClient
+
+# A Tuesday
+NOW = datetime(2026, 3, 3, 15, 0)
+
+
+def _scan(store, mess_id, date_str, meal, student, marked_at):
+    store[f'attendance/{mess_id}/{date_str}/{meal}/students/{student}'] = {'markedAt': marked_at}
+
+
+def _store():
+    store = {}
+    # Monday: 3 lunches (two in the 12:00 slot) and 1 breakfast; Tuesday (today): 2 lunches
+    for student, minute in (('s1', 5), ('s2', 10), ('s3', 40)):
+        _scan(store, 'alder', '2026-03-02', 'lunch', student, f'2026-03-02T12:{minute:02d}:00')
+    _scan(store, 'alder', '2026-03-02', 'breakfast', 's1', '2026-03-02T08:00:00')
+    _scan(store, 'alder', '2026-03-03', 'lunch', 's1', '2026-03-03T12:20:00')
+    _scan(store, 'alder', '2026-03-03', 'lunch', 's2', 'not a time')
+    return store
+
+
+def test_rollups_merge_and_summarize():
+    monday = day_rollup('2026-03-02', {'lunch': 3}, {'lunch': {'12:00': 2, '12:30': 1}})
+    tuesday = day_rollup('2026-03-03', {'lunch': 1, 'dinner': 4}, {'lunch': {'12:00': 1}, 'dinner': {'20:00': 4}})
+    assert day_rollup('2026-03-04', {}, {}) == analytics.empty_rollup()
+
+    summary = summarize(merge(monday, tuesday))
+    assert summary['days'] == 2 and summary['total'] == 8
+    assert summary['averages'] == {'lunch': 2.0, 'dinner': 2.0}
+    assert summary['slots']['lunch'] == {'12:00': 3, '12:30': 1}
+    assert summary['heatmap'] == {'Mon': {'12:00': 2, '12:30': 1}, 'Tue': {'12:00': 1, '20:00': 4}}
+    assert summary['weekdays']['Tue'] == {'lunch': 1.0, 'dinner': 4.0}
+    assert summary['peaks']['lunch'] == {'slot': '12:00', 'count': 3, 'average': 1.5}
+    assert summary['peak'] == {'slot': '20:00', 'count': 4, 'average': 2.0, 'meal': 'dinner'}
+    assert [point['date'] for point in summary['series']] == ['2026-03-02', '2026-03-03']
+
+
+def test_update_derives_week_and_month():
+    store = _store()
+    mess_analytics = MessAnalytics(FakeClient(store), shared_cache=SharedCache(LocalBackend()))
+    assert mess_analytics.update('alder', through=datetime(2026, 3, 2)) == 1
+    assert store['analytics/alder']['updatedThrough'] == '2026-03-02'
+    assert store['analytics/alder/daily/2026-03-02']['meals'] == {'lunch': 3, 'breakfast': 1}
+    assert store['analytics/alder/weekly/2026-W10']['total'] == 4
+    assert store['analytics/alder/monthly/2026-03']['slots']['lunch'] == {'12:00': 2, '12:30': 1}
+    # Nothing new to roll up
+    assert mess_analytics.update('alder', through=datetime(2026, 3, 2)) == 0
+
+
+def test_report_merges_today():
+    store = _store()
+    mess_analytics = MessAnalytics(FakeClient(store), shared_cache=SharedCache(LocalBackend()))
+    mess_analytics.update('alder', through=datetime(2026, 3, 2))
+    week = mess_analytics.report('alder', 'week', now=NOW)
+    assert week['key'] == '2026-W10' and week['start'] == '2026-03-02' and week['includesToday']
+    assert week['updatedThrough'] == '2026-03-02'
+    # Monday from its rollup; today's scans (one without a usable time) are live
+    assert week['total'] == 6 and week['meals'] == {'lunch': 5, 'breakfast': 1}
+    assert week['slots']['lunch'] == {'12:00': 2, '12:15': 1, '12:30': 1}
+
+    yesterday = mess_analytics.report('alder', 'day', day=datetime(2026, 3, 2), now=NOW)
+    assert yesterday['total'] == 4 and not yesterday['includesToday']
+    try:
+        mess_analytics.report('alder', 'year', now=NOW)
+        assert False, 'expected ValueError'
+    except ValueError:
+        pass
+
+
+def test_report_never_rolls_up():
+    store = _store()
+    mess_analytics = MessAnalytics(FakeClient(store), shared_cache=SharedCache(LocalBackend()))
+
+    def _update(mess_id, through=None):
+        raise AssertionError('report() must not roll up')
+    mess_analytics.update = _update
+    # Nothing rolled up yet: only today's live scans
+    week = mess_analytics.report('alder', 'week', now=NOW)
+    assert week['total'] == 2 and week['updatedThrough'] is None
+    assert not any(path.startswith('analytics/') for path in store)
+
+
+def test_endpoint_requires_credentials():
+    import main
+    client = main.app.test_client()
+    saved_token, saved_verify = os.environ.get('ADMIN_TOKEN'), api_auth._verify_id_token
+    os.environ['ADMIN_TOKEN'] = 'secret'
+    api_auth._verify_id_token = lambda id_token: {'bearer': {'messIds': ['alder']},
+                                                  'root': {'role': 'admin'}}[id_token]
+    try:
+        assert client.get('/analytics?messId=alder').status_code == 401
+        assert client.get('/analytics?messId=alder', headers={'Authorization': 'Bearer forged'}).status_code == 401
+        assert client.get('/analytics?messId=oak', headers={'Authorization': 'Bearer bearer'}).status_code == 403
+        # Authorized requests get as far as the data (no Firestore here: 503)
+        for headers in ({'Authorization': 'Bearer bearer'}, {'Authorization': 'Bearer root'},
+                        {'X-Admin-Token': 'secret'}):
+            assert client.get('/analytics?messId=alder', headers=headers).status_code in (200, 404, 503)
+    finally:
+        api_auth._verify_id_token = saved_verify
+        if saved_token is None:
+            os.environ.pop('ADMIN_TOKEN', None)
+        else:
+            os.environ['ADMIN_TOKEN'] = saved_token
+
+
+if __name__ == '__main__':
+    test_rollups_merge_and_summarize()
+    test_update_derives_week_and_month()
+    test_report_merges_today()
+    test_report_never_rolls_up()
+    test_endpoint_requires_credentials()
+    print("[OK] Analytics tests passed")
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""
+Test the rolling-origin backtest on generated history: fold boundaries,
+metrics and timings
+"""
+
+from datetime import date
+
+import numpy as np
+import backtest
+import synthetic_data
+
+START = date(2026, 3, 2)
+
+
+def _history(days=7):
+    events = synthetic_data.generate_events(['alder'], start=START, days=days, capacities={'alder': 40}, seed=4)
+    return backtest.bucket_history('alder', synthetic_data.to_columns(events, 'alder'))
+
+
+def test_folds_train_on_earlier_days_only():
+    history = _history()
+    fold_days = backtest.test_days(history['slot_starts'], 3)
+    assert [str(day) for day in fold_days] == ['2026-03-06', '2026-03-07', '2026-03-08']
+    assert backtest.test_days(history['slot_starts'][:10], 3) == []  # under MIN_TRAIN_DAYS of data
+
+    seen = []
+    fit_models = backtest._fit_models
+
+    def _recording(mess_id, X_train, y_train, slot_starts_train, scan_times_train, models, capacity=100):
+        seen.append((slot_starts_train.max(), scan_times_train.max()))
+        return fit_models(mess_id, X_train, y_train, slot_starts_train, scan_times_train, models, capacity)
+    backtest._fit_models = _recording
+    try:
+        rows, timings = backtest.run_fold_chunk(('alder', history, fold_days[1:], ('slot_average', 'fallback'), 40))
+    finally:
+        backtest._fit_models = fit_models
+
+    # One fit for the chunk, on history before its first day
+    assert len(seen) == 1 and all(stamp < fold_days[1].astype('datetime64[m]') for stamp in seen[0])
+    assert {row['day'] for row in rows} == {'2026-03-07', '2026-03-08'}
+    assert {row['model'] for row in rows} == {'slot_average', 'fallback'}
+    assert timings['slot_average']['calls'] == 2 and timings['fallback']['fit_s'] == 0.0
+
+
+def test_summarize_metrics():
+    rows = [
+        {'model': 'ridge', 'mess_id': 'alder', 'meal': 'lunch', 'day': '2026-03-07',
+         'predicted': [10.0, 4.0, np.nan], 'actual': [8.0, 0.0, 5.0]},
+        {'model': 'ridge', 'mess_id': 'alder', 'meal': 'lunch', 'day': '2026-03-08',
+         'predicted': [6.0], 'actual': [4.0]},
+    ]
+    timings = [{'ridge': {'fit_s': 0.2, 'predict_s': 0.003, 'calls': 1}},
+               {'ridge': {'fit_s': 0.4, 'predict_s': 0.001, 'calls': 1}}]
+    metrics, model_timings = backtest.summarize(rows, timings)
+    # NaN predictions are not scored; zero actuals stay out of MAPE
+    assert metrics == [{'model': 'ridge', 'mess_id': 'alder', 'meal': 'lunch', 'slots': 3,
+                        'mae': 8 / 3, 'mape': 37.5}]
+    assert np.isclose(model_timings['ridge']['mean_fit_s'], 0.3)
+    assert np.isclose(model_timings['ridge']['mean_latency_ms'], 2.0)
+
+
+def test_run_backtest_reports_every_model():
+    history = _history()
+    metrics, model_timings, wall_time = backtest.run_backtest(
+        {'alder': history}, days=2, refit_every=2, models=('keras', 'gbt', 'fallback'), workers=1)
+    assert {row['model'] for row in metrics} == {'keras', 'gbt', 'fallback'}
+    assert {row['meal'] for row in metrics} == {'breakfast', 'lunch', 'dinner'}
+    assert all(row['slots'] > 0 and row['mae'] is not None for row in metrics)
+    assert set(model_timings) == {'keras', 'gbt', 'fallback'} and wall_time > 0
+    assert backtest.run_backtest({'alder': _history(days=3)}, days=2, workers=1) == ([], {}, 0.0)
+
+
+if __name__ == '__main__':
+    test_folds_train_on_earlier_days_only()
+    test_summarize_metrics()
+    test_run_backtest_reports_every_model()
+    print("[OK] Backtest tests passed")
@@ -0,0 +1,264 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmarks for the prediction and training hot paths
+Each benchmark times a function on synthetic models and data and records its
+peak allocation (tracemalloc), then compares both against
+benchmark_baselines.json. A benchmark fails when its throughput drops more
+than BENCH_THROUGHPUT_TOLERANCE (default 0.5) or its peak allocation grows
+more than BENCH_ALLOCATION_TOLERANCE (default 0.25) from the baseline.
+
+Throughput is compared relative to a fixed calibration workload, so
+baselines recorded on one machine still apply on a faster or slower one.
+
+  python -m pytest -q test_benchmarks.py       check against the baselines
+  BENCH_UPDATE=1 python test_benchmarks.py     re-record the baselines
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import tracemalloc
+from contextlib import redirect_stdout
+from datetime import datetime
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend')
+sys.path.insert(0, BACKEND_DIR)
+
+import numpy as np
+import main
+from prediction_model import PredictionModel
+from prediction_model_tf import PredictionService
+from mess_prediction_model import MessPredictionModel
+from model_backends import SlotAverageBackend
+from train_tensorflow import MessCrowdRegressor
+from benchmark_prepare_data import build_stamps
+from env_config import env_float
+
+BASELINES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark_baselines.json')
+# Peak allocations below this many bytes of growth never fail (interpreter noise)
+ALLOCATION_SLACK_BYTES = 4096
+# Each timed repeat runs the function for at least this long
+MIN_REPEAT_SECONDS = 0.05
+REPEATS = 5
+TRAINING_RECORDS = 20_000
+MESS_ID = 'bench_synthetic'
+# A Monday lunch, partway into the 12:00 slot
+NOW = datetime(2025, 3, 3, 12, 7, 31)
+
+_calibration = None
+_fixtures = {}
+
+
+def _quiet(func):
+    """Run func with stdout discarded (training code prints progress)"""
+    def run():
+        with redirect_stdout(io.StringIO()):
+            return func()
+    return run
+
+
+def _calibrate():
+    """Calls/sec of a fixed pure-Python and numpy workload on this machine"""
+    global _calibration
+    if _calibration is None:
+        values = np.arange(4096, dtype=np.float64)
+
+        def workload():
+            total = 0
+            for i in range(2000):
+                total += i * i
+            return total + float(np.sqrt(values).sum())
+
+        _calibration = measure_throughput(workload)
+    return _calibration
+
+
+def measure_throughput(func):
+    """Best-of-REPEATS calls per second, after one warm-up call"""
+    func()
+    loops = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(loops):
+            func()
+        elapsed = time.perf_counter() - start
+        if elapsed >= MIN_REPEAT_SECONDS:
+            break
+        loops *= 2
+    best = elapsed
+    for _ in range(REPEATS - 1):
+        start = time.perf_counter()
+        for _ in range(loops):
+            func()
+        best = min(best, time.perf_counter() - start)
+    return loops / best
+
+
+def measure_peak_bytes(func):
+    """Peak bytes allocated during one call"""
+    func()
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        func()
+        return tracemalloc.get_traced_memory()[1] - before
+    finally:
+        tracemalloc.stop()
+
+
+def _load_baselines():
+    if not os.path.exists(BASELINES_PATH):
+        return {}
+    with open(BASELINES_PATH, 'r') as f:
+        return json.load(f)
+
+
+def _save_baseline(name, result):
+    baselines = _load_baselines()
+    baselines[name] = result
+    with open(BASELINES_PATH, 'w') as f:
+        json.dump(baselines, f, indent=2, sort_keys=True)
+        f.write('\n')
+
+
+def check(name, func):
+    """Benchmark func and compare it with its baseline (or record it with BENCH_UPDATE=1)"""
+    calls_per_sec = measure_throughput(func)
+    result = {
+        'calls_per_sec': round(calls_per_sec, 1),
+        'relative_throughput': round(calls_per_sec / _calibrate(), 6),
+        'peak_bytes': measure_peak_bytes(func),
+    }
+    print(f"[BENCH] {name:<48}{calls_per_sec:>12,.0f} calls/s{result['peak_bytes'] / 1024:>10.1f} KB peak")
+
+    if os.environ.get('BENCH_UPDATE', '0') == '1':
+        _save_baseline(name, result)
+        return result
+
+    baseline = _load_baselines().get(name)
+    if baseline is None:
+        print(f"[WARN] No baseline for {name}; run with BENCH_UPDATE=1 to record one")
+        return result
+
+    min_throughput = baseline['relative_throughput'] * (1.0 - env_float('BENCH_THROUGHPUT_TOLERANCE', 0.5))
+    assert result['relative_throughput'] >= min_throughput, (
+        f"{name} throughput regressed: {result['relative_throughput']:.6f} "
+        f"vs baseline {baseline['relative_throughput']:.6f} (relative to calibration)"
+    )
+    max_bytes = baseline['peak_bytes'] * (1.0 + env_float('BENCH_ALLOCATION_TOLERANCE', 0.25)) + ALLOCATION_SLACK_BYTES
+    assert result['peak_bytes'] <= max_bytes, (
+        f"{name} peak allocation regressed: {result['peak_bytes']} bytes vs baseline {baseline['peak_bytes']}"
+    )
+    return result
+
+
+# ----------------------------------------------------------------------
+# Synthetic fixtures
+# ----------------------------------------------------------------------
+
+def _training_stamps():
+    if 'stamps' not in _fixtures:
+        _fixtures['stamps'] = build_stamps(TRAINING_RECORDS, days=60, seed=11)
+    return _fixtures['stamps']
+
+
+def _attendance_records():
+    if 'records' not in _fixtures:
+        iso_strings = np.datetime_as_string(_training_stamps(), unit='s')
+        _fixtures['records'] = [{'markedAt': str(marked_at)} for marked_at in iso_strings]
+    return _fixtures['records']
+
+
+def _scan_data():
+    if 'scans' not in _fixtures:
+        seconds = _training_stamps().astype(np.int64).astype(np.float64)
+        messes = ('alder', 'oak', 'pine')
+        _fixtures['scans'] = [
+            {'ts': float(ts), 'messId': messes[i % 3]} for i, ts in enumerate(seconds)
+        ]
+    return _fixtures['scans']
+
+
+def _synthetic_model():
+    """MessPredictionModel served by a slot-average backend fitted on synthetic scans"""
+    if 'model' not in _fixtures:
+        X, y, _ = _quiet(lambda: MessCrowdRegressor(MESS_ID).prepare_data(_attendance_records()))()
+        with redirect_stdout(io.StringIO()):
+            model = MessPredictionModel(MESS_ID)
+        model.global_model = None
+        model.backend = SlotAverageBackend().fit(X, y)
+        model.model = model.backend
+        model.metadata = {'backend': 'slot_average'}
+        _fixtures['model'] = model
+    return _fixtures['model']
+
+
+# ----------------------------------------------------------------------
+# Benchmarks
+# ----------------------------------------------------------------------
+
+def test_round_up_to_next_slot():
+    check('round_up_to_next_slot', lambda: main.round_up_to_next_slot(NOW))
+
+
+def test_generate_slots_for_meal():
+    check('generate_slots_for_meal', lambda: main.generate_slots_for_meal('lunch', max_slots=8, now=NOW))
+
+
+def test_generate_fallback_predictions():
+    check('generate_fallback_predictions',
+          lambda: main.generate_fallback_predictions('lunch', 120, now=NOW, max_slots=8))
+
+
+def test_get_meal_type():
+    model = _synthetic_model()
+    times = [(hour, minute) for hour in range(24) for minute in (0, 15, 30, 45)]
+
+    def classify_day():
+        for hour, minute in times:
+            model.get_meal_type(hour, minute)
+
+    check('MessPredictionModel.get_meal_type[96]', classify_day)
+
+
+def test_predict_next_slots_15min():
+    model = _synthetic_model()
+    check('MessPredictionModel.predict_next_slots_15min',
+          lambda: model.predict_next_slots_15min(NOW, 30, 120))
+
+
+def test_service_predict_next_slots():
+    service = PredictionService()
+    service.models_cache[MESS_ID] = _synthetic_model()
+    check('PredictionService.predict_next_slots',
+          lambda: service.predict_next_slots(MESS_ID, NOW, 30, 120))
+
+
+def test_prepare_data():
+    regressor = MessCrowdRegressor(MESS_ID)
+    records = _attendance_records()
+    check(f'MessCrowdRegressor.prepare_data[{TRAINING_RECORDS}]', _quiet(lambda: regressor.prepare_data(records)))
+
+
+def test_prepare_data_columnar():
+    regressor = MessCrowdRegressor(MESS_ID)
+    columns = {'markedAt': np.array([record['markedAt'] for record in _attendance_records()], dtype=object)}
+    check(f'MessCrowdRegressor.prepare_data_columnar[{TRAINING_RECORDS}]',
+          _quiet(lambda: regressor.prepare_data_columnar(columns)))
+
+
+def test_prediction_model_train():
+    with redirect_stdout(io.StringIO()):
+        model = PredictionModel()
+    scans = _scan_data()
+    check(f'PredictionModel.train[{TRAINING_RECORDS}]', _quiet(lambda: model.train(scans, save=False)))
+
+
+if __name__ == '__main__':
+    for name, test in list(globals().items()):
+        if name.startswith('test_') and callable(test):
+            test()
+    print("[OK] Benchmarks passed")
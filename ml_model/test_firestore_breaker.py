@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""
+Test the Firestore circuit breaker state machine with a fake clock
+"""
+
+import threading
+
+import firestore_breaker
+from firestore_breaker import CallTimeout, CircuitBreaker, CircuitOpenError, CLOSED, OPEN, HALF_OPEN
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+def _breaker(clock, **kwargs):
+    return CircuitBreaker('test', threshold=3, cooldown=10, max_cooldown=40, auth_cooldown=30,
+                          clock=clock, sleep=clock.sleep, **kwargs)
+
+
+def _failing(error):
+    calls = []
+
+    def func():
+        calls.append(1)
+        raise error
+    return func, calls
+
+
+def test_classification():
+    assert firestore_breaker.classify(RuntimeError('401 invalid_grant: account not found')) == 'auth'
+    assert firestore_breaker.classify(TimeoutError('stream timed out')) == 'transient'
+    assert firestore_breaker.classify(RuntimeError('503 Service Unavailable')) == 'transient'
+    # A path mentioning model_metadata is not a credential problem
+    assert firestore_breaker.classify(KeyError('model_metadata/alder')) == 'other'
+
+
+def test_transient_failures_open_then_recover():
+    clock = _Clock()
+    breaker = _breaker(clock, max_retries=0)
+    func, calls = _failing(TimeoutError('deadline exceeded'))
+    for _ in range(3):
+        try:
+            breaker.call(func)
+        except TimeoutError:
+            pass
+    assert breaker.state == OPEN and len(calls) == 3
+
+    # Open: fails fast without calling Firestore
+    try:
+        breaker.call(func)
+        assert False, 'expected CircuitOpenError'
+    except CircuitOpenError:
+        pass
+    assert len(calls) == 3 and breaker.snapshot()['counters']['rejected'] == 1
+
+    # Half-open after the (jittered) cooldown; a failed probe reopens for longer
+    clock.now += 10
+    assert breaker.state == HALF_OPEN
+    try:
+        breaker.call(func)
+    except TimeoutError:
+        pass
+    assert breaker.state == OPEN and len(calls) == 4
+    assert breaker.retry_in() > 5
+
+    clock.now += 20
+    assert breaker.call(lambda: 'ok') == 'ok'
+    assert breaker.state == CLOSED and breaker.snapshot()['consecutive_openings'] == 0
+
+
+def test_auth_opens_at_once_and_retries_are_budgeted():
+    clock = _Clock()
+    breaker = _breaker(clock)
+    func, calls = _failing(RuntimeError('Unauthenticated: token must be a short-lived token'))
+    try:
+        breaker.call(func)
+    except RuntimeError:
+        pass
+    assert breaker.state == OPEN and len(calls) == 1
+    assert breaker.retry_in() >= 15
+
+    # Transient errors are retried (max_retries=2) until the budget runs out
+    clock.now += 30
+    breaker.record_success()
+    breaker._tokens = 1
+    func, calls = _failing(ConnectionError('connection reset'))
+    try:
+        breaker.call(func)
+    except ConnectionError:
+        pass
+    assert len(calls) == 2 and breaker.snapshot()['counters']['retries'] == 1
+
+
+def test_call_timeouts_are_not_retried():
+    clock = _Clock()
+    breaker = _breaker(clock)
+    func, calls = _failing(CallTimeout('stream timed out after 5s'))
+    for _ in range(3):
+        try:
+            breaker.call(func)
+        except CallTimeout:
+            pass
+    # One attempt per call, each counted towards opening the circuit
+    assert len(calls) == 3 and breaker.state == OPEN
+    assert breaker.snapshot()['counters']['retries'] == 0
+
+
+class _HangingCollection:
+    """stream() blocks until released"""
+
+    def __init__(self):
+        self.release = threading.Event()
+        self.streams = 0
+
+    def stream(self):
+        self.streams += 1
+        self.release.wait()
+        return iter([])
+
+
+def test_stalled_stream_blocks_new_readers():
+    import train_tensorflow
+    saved = firestore_breaker._breaker, train_tensorflow._STREAM_SUPPORTS_TIMEOUT, train_tensorflow._stalled_stream
+    clock = _Clock()
+    firestore_breaker._breaker = _breaker(clock)
+    train_tensorflow._STREAM_SUPPORTS_TIMEOUT = None
+    ref = _HangingCollection()
+    try:
+        assert train_tensorflow._safe_stream(ref, 0.05, 'alder') is None
+        assert train_tensorflow._safe_stream(ref, 0.05, 'alder') is None
+        # The second read failed fast instead of starting another reader
+        assert ref.streams == 1
+        assert firestore_breaker._breaker.snapshot()['counters']['transient_failures'] == 2
+
+        ref.release.set()
+        train_tensorflow._stalled_stream.join(1)
+        assert train_tensorflow._safe_stream(ref, 1, 'alder') == [] and ref.streams == 2
+    finally:
+        ref.release.set()
+        firestore_breaker._breaker, train_tensorflow._STREAM_SUPPORTS_TIMEOUT, train_tensorflow._stalled_stream = saved
+
+
+if __name__ == '__main__':
+    test_classification()
+    test_transient_failures_open_then_recover()
+    test_auth_opens_at_once_and_retries_are_budgeted()
+    test_call_timeouts_are_not_retried()
+    test_stalled_stream_blocks_new_readers()
+    print("[OK] Firestore breaker tests passed")
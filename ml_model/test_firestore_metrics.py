@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+"""
+Test Firestore I/O accounting against a small in-memory client
+"""
+
+import inspect
+import firestore_metrics
+from firestore_fakes import FakeClient
+
+
+def test_path_patterns():
+    assert firestore_metrics.path_pattern('attendance/alder/2025-03-03/lunch/students') == \
+        ('attendance/{mess}/{date}/lunch/students', 'alder')
+    assert firestore_metrics.path_pattern('sessions/abc123') == ('sessions/{id}', None)
+    assert firestore_metrics.path_pattern('**/students') == ('**/students', None)
+
+
+def test_job_counts_reads_writes_and_deletes():
+    store = {
+        f'attendance/alder/2025-03-03/lunch/students/{i}': {'markedAt': '2025-03-03T12:05:00', 'studentName': 'A'}
+        for i in range(5)
+    }
+    store['qr_codes/old'] = {'createdAt': 1}
+    db = firestore_metrics.instrument(FakeClient(store))
+
+    # Callers inspect stream() for a timeout parameter
+    students = db.collection('attendance').document('alder').collection('2025-03-03') \
+        .document('lunch').collection('students')
+    assert 'timeout' in inspect.signature(students.stream).parameters
+
+    students.stream()  # I/O outside a job is not recorded
+    with firestore_metrics.job('test', db, mess='alder') as stats:
+        records = [doc.to_dict() for doc in students.where('markedAt', '>=', '').stream(timeout=5)]
+        for doc in db.collection('qr_codes').stream():
+            doc.reference.delete()
+        db.collection('model_metadata').document('alder').get()
+        batch = db.batch()
+        batch.set(db.collection('predictions').document('alder').collection('2025-03-03').document('latest'), {'a': 1})
+        batch.commit()
+
+    assert len(records) == 5
+    summary = stats.summary()
+    totals = summary['totals']
+    assert (totals['reads'], totals['writes'], totals['deletes'], totals['streams']) == (7, 1, 1, 2)
+    assert totals['bytes'] > 0
+    top = summary['patterns'][0]
+    assert (top['op'], top['pattern'], top['docs']) == ('stream', 'attendance/{mess}/{date}/lunch/students', 5)
+    assert summary['messes']['alder'] == {'reads': 6, 'writes': 1, 'deletes': 0, 'bytes': totals['bytes']}
+    assert 'qr_codes/old' not in store
+    assert 'predictions/alder/2025-03-03/latest' in store
+
+
+if __name__ == '__main__':
+    test_path_patterns()
+    test_job_counts_reads_writes_and_deletes()
+    print("[OK] Firestore metrics tests passed")
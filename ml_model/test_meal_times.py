@@ -45,9 +45,11 @@ def test_meal_time_boundaries():
     passed = 0
     failed = 0
     
+    # get_meal_type only depends on the clock, so one model serves every case
+    model = MessPredictionModel('alder')
+    
     for hour, minute, expected_meal, description in test_cases:
         # Get meal type from the model's method
-        model = MessPredictionModel('alder')
         meal_type, meal_code = model.get_meal_type(hour, minute)
         
         status = "[PASS]" if meal_type == expected_meal else "[FAIL]"
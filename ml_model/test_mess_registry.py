@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+Test the mess registry: document parsing, shared loads and TTL refreshes
+"""
+
+import os
+import sys
+import time as time_module
+from datetime import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend'))
+
+from mess_registry import DEFAULT_CAPACITY, DEFAULT_MEAL_WINDOWS, MessRegistry, mess_info
+from shared_cache import LocalBackend, SharedCache
+from firestore_fakes import FakeClient
+
+
+def _db():
+    return FakeClient({
+        'messes/alder': {'name': 'Alder Hall', 'capacity': 40, 'mealWindows': {'lunch': '12:30-14:30'},
+                         'address': 'not shared'},
+        'messes/oak': {'active': False, 'capacity': 'lots'},
+    })
+
+
+def test_mess_info_defaults_and_windows():
+    info = mess_info('pine', {
+        'capacity': -5,
+        'mealWindows': {'Breakfast': {'start': '07:00', 'end': '08:00'}, 'dinner': '22:00-21:00',
+                        'lunch': 'noon', 'brunch': '10:00-11:00'},
+    })
+    assert info['name'] == 'pine' and info['capacity'] == DEFAULT_CAPACITY and info['active']
+    windows = info['meal_windows']
+    assert windows['breakfast'] == (time(7, 0), time(8, 0))
+    # Backwards and unparsable windows keep the defaults; unknown meals are ignored
+    assert windows['dinner'] == DEFAULT_MEAL_WINDOWS['dinner']
+    assert windows['lunch'] == DEFAULT_MEAL_WINDOWS['lunch']
+    assert set(windows) == set(DEFAULT_MEAL_WINDOWS)
+    assert mess_info('oak', {'active': False})['active'] is False
+
+
+def test_refresh_and_lookups():
+    registry = MessRegistry(_db(), shared_cache=SharedCache(LocalBackend()))
+    assert registry.refresh() and registry.loaded
+    assert registry.mess_ids() == ['alder', 'oak']
+    assert registry.mess_ids(active_only=True) == ['alder']
+    assert registry.capacity('alder') == 40 and registry.capacity('oak') == DEFAULT_CAPACITY
+    assert registry.capacity('pine', default=7) == 7
+    assert registry.meal_windows('alder')['lunch'] == (time(12, 30), time(14, 30))
+    assert registry.meal_windows('pine') is DEFAULT_MEAL_WINDOWS
+
+
+def test_instances_share_one_read():
+    cache = SharedCache(LocalBackend())
+    db = _db()
+    MessRegistry(db, shared_cache=cache).refresh()
+    db.store['messes/pine'] = {'capacity': 60}
+    # A second instance within the TTL reads the first one's load, not Firestore
+    other = MessRegistry(db, shared_cache=cache)
+    assert other.refresh() and 'pine' not in other.mess_ids()
+    cached = cache.get(cache.key('registry', 'messes'))
+    assert 'address' not in cached['alder']
+
+
+def test_ttl_refresh():
+    db = _db()
+    registry = MessRegistry(db, ttl_seconds=0.05, shared_cache=SharedCache(LocalBackend()))
+    assert registry.capacity('alder') == 40  # loaded on first use
+    db.store['messes/alder'] = {'capacity': 55}
+    assert registry.capacity('alder') == 40
+    time_module.sleep(0.06)
+    assert registry.capacity('alder') == 55
+
+    # Without a database nothing is loaded and every mess is unknown
+    empty = MessRegistry(None)
+    assert not empty.refresh() and not empty.loaded and empty.get('alder') is None
+
+
+if __name__ == '__main__':
+    test_mess_info_defaults_and_windows()
+    test_refresh_and_lookups()
+    test_instances_share_one_read()
+    test_ttl_refresh()
+    print("[OK] Mess registry tests passed")
@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+"""
+Test model bundles: round trip, publish/rollback and corrupt-file detection
+"""
+
+import os
+import tempfile
+import numpy as np
+import model_bundle
+
+
+def test_round_trip():
+    arrays = {'weights': np.arange(12, dtype=np.float32).reshape(3, 4), 'empty': np.zeros(0)}
+    with tempfile.TemporaryDirectory() as models_dir:
+        path = os.path.join(models_dir, 'm.bundle')
+        model_bundle.write_bundle(path, arrays, {'backend': 'keras'}, {'backend': b'\x00blob'})
+        bundle = model_bundle.read_bundle(path)
+        assert np.array_equal(bundle.arrays['weights'], arrays['weights'])
+        assert bundle.arrays['empty'].shape == (0,)
+        assert bundle.blobs['backend'] == b'\x00blob'
+        assert bundle.metadata == {'backend': 'keras'}
+
+
+def test_publish_and_rollback():
+    with tempfile.TemporaryDirectory() as models_dir:
+        first = model_bundle.publish(models_dir, 'alder', {'w': np.ones(2)}, {'n': 1})
+        second = model_bundle.publish(models_dir, 'alder', {'w': np.zeros(2)}, {'n': 2})
+        assert model_bundle.load_current(models_dir, 'alder').metadata == {'n': 2}
+
+        assert model_bundle.rollback(models_dir, 'alder') == first
+        assert model_bundle.load_current(models_dir, 'alder').metadata == {'n': 1}
+        model_bundle.set_current(models_dir, 'alder', second)
+
+        for _ in range(3):
+            model_bundle.publish(models_dir, 'alder', metadata={}, keep=2)
+        assert len(model_bundle.list_versions(models_dir, 'alder')) == 2
+        assert model_bundle.load_current(models_dir, 'missing') is None
+
+
+def test_corrupt_bundle_rejected():
+    with tempfile.TemporaryDirectory() as models_dir:
+        path = os.path.join(models_dir, 'm.bundle')
+        model_bundle.write_bundle(path, {'w': np.arange(100.0)})
+        with open(path, 'r+b') as f:
+            f.seek(-1, os.SEEK_END)
+            f.write(b'\xff')
+        try:
+            model_bundle.read_bundle(path)
+        except model_bundle.BundleError:
+            pass
+        else:
+            raise AssertionError("corrupt bundle was accepted")
+
+
+if __name__ == '__main__':
+    test_round_trip()
+    test_publish_and_rollback()
+    test_corrupt_bundle_rejected()
+    print("[OK] Model bundle tests passed")
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""
+Test the online slot-average model: decayed averages, today's ratio, snapshots
+and the attendance listener's shard filter
+"""
+
+import os
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+import numpy as np
+import online_model
+from online_model import OnlineSlotModel, start_attendance_listener
+
+
+def _feed(model, day, scans_per_slot):
+    """scans_per_slot: {minutes after 12:00: count}"""
+    for offset, count in scans_per_slot.items():
+        for i in range(count):
+            model.observe('alder', day + timedelta(minutes=offset, seconds=i), key=f'{day:%Y%m%d}-{offset}-{i}')
+
+
+def test_decayed_average_and_today_ratio():
+    with tempfile.TemporaryDirectory() as models_dir:
+        model = OnlineSlotModel(os.path.join(models_dir, 'online.bundle'), half_life_days=14, snapshot_seconds=3600)
+        monday = datetime(2025, 3, 3, 12, 0)
+        for week in range(3):
+            _feed(model, monday + timedelta(weeks=week), {0: 10, 15: 20, 30: 30})
+
+        next_monday = monday + timedelta(weeks=3)
+        slots = [next_monday + timedelta(minutes=m) for m in (0, 15, 30)]
+        usual = model.predict_counts('alder', slots, now=next_monday - timedelta(hours=1))
+        assert np.allclose(usual, [10, 20, 30])
+
+        # Twice the usual lunch rush in the first two slots lifts the rest of today
+        _feed(model, next_monday, {0: 20, 15: 40})
+        busy = model.predict_counts('alder', slots[2:], now=next_monday + timedelta(minutes=30))
+        assert busy[0] > 45
+
+        # Duplicate keys are ignored; unknown messes have no estimate
+        assert not model.observe('alder', next_monday, key=f'{next_monday:%Y%m%d}-0-0')
+        assert np.isnan(model.predict_counts('oak', slots)).all()
+
+        model.snapshot()
+        restored = OnlineSlotModel(model.snapshot_path)
+        assert np.array_equal(restored.slot_sums, model.slot_sums)
+        assert not restored.observe('alder', next_monday, key=f'{next_monday:%Y%m%d}-0-0')
+
+
+def test_blend_keeps_meal_mask():
+    with tempfile.TemporaryDirectory() as models_dir:
+        model = OnlineSlotModel(os.path.join(models_dir, 'online.bundle'))
+        monday = datetime(2025, 3, 3, 12, 0)
+        _feed(model, monday, {0: 10})
+        slots = [monday + timedelta(weeks=1), monday + timedelta(weeks=1, hours=3)]
+        counts = np.array([20.0, np.nan], dtype=np.float32)
+        now = slots[0] - timedelta(hours=1)
+        blended = model.blend('alder', slots, counts, mode='blend', now=now)
+        assert blended[0] == 15 and np.isnan(blended[1])
+        assert model.blend('alder', slots, counts, mode='replace', now=now)[0] == 10
+        assert model.blend('alder', slots, counts, mode='off', now=now)[0] == 20
+
+
+class _ListenerDb:
+    """collection_group(...).where(...).on_snapshot(callback) keeping the callback"""
+
+    def __init__(self, error=None):
+        self.error = error
+
+    def collection_group(self, name):
+        return self
+
+    def where(self, *args):
+        return self
+
+    def limit(self, count):
+        return self
+
+    def get(self):
+        if self.error:
+            raise self.error
+        return []
+
+    def on_snapshot(self, callback):
+        self.callback = callback
+        return self
+
+
+def _added(path, marked_at):
+    document = SimpleNamespace(reference=SimpleNamespace(path=path), to_dict=lambda: {'markedAt': marked_at})
+    return SimpleNamespace(type=SimpleNamespace(name='ADDED'), document=document)
+
+
+def test_listener_skips_other_shards():
+    with tempfile.TemporaryDirectory() as models_dir:
+        model = OnlineSlotModel(os.path.join(models_dir, 'online.bundle'))
+        db = _ListenerDb()
+        start_attendance_listener(db, model, owns=lambda mess_id: mess_id == 'alder')
+        marked_at = '2025-03-03T12:05:00'
+        db.callback(None, [
+            _added('attendance/alder/2025-03-03/lunch/students/s1', marked_at),
+            _added('attendance/oak/2025-03-03/lunch/students/s2', marked_at),
+        ], None)
+        assert list(model.mess_index) == ['alder']
+        assert model.today[model.mess_index['alder']].sum() == 1
+
+
+def test_listener_fails_without_the_index():
+    db = _ListenerDb(error=RuntimeError('The query requires a COLLECTION_GROUP_ASC index'))
+    try:
+        start_attendance_listener(db, OnlineSlotModel(os.path.join(tempfile.gettempdir(), 'unused.bundle')))
+        assert False, 'expected RuntimeError'
+    except RuntimeError as e:
+        assert 'markedAt collection-group index' in str(e)
+    assert not hasattr(db, 'callback')
+
+
+def test_get_online_model_creates_one_instance():
+    created = []
+
+    class _SlowModel:
+        def __init__(self):
+            time.sleep(0.05)  # snapshot restore
+            created.append(self)
+
+    saved = online_model._online_model, online_model.OnlineSlotModel
+    online_model._online_model, online_model.OnlineSlotModel = None, _SlowModel
+    try:
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(online_model.get_online_model())) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert len(created) == 1 and all(result is created[0] for result in results)
+    finally:
+        online_model._online_model, online_model.OnlineSlotModel = saved
+
+
+if __name__ == '__main__':
+    test_decayed_average_and_today_ratio()
+    test_blend_keeps_meal_mask()
+    test_listener_skips_other_shards()
+    test_listener_fails_without_the_index()
+    test_get_online_model_creates_one_instance()
+    print("[OK] Online model tests passed")
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+Test the served-prediction log: merged documents, both sinks and accuracy()
+"""
+
+import os
+import sys
+import tempfile
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend'))
+
+from prediction_log import PredictionLog, accuracy, version_label
+from firestore_fakes import FakeClient
+
+SERVED_AT = datetime(2026, 3, 2, 12, 10)
+ROWS = [{'time_24h': '12:15', 'predicted_crowd': 20}, {'time_24h': '12:30', 'predicted_crowd': 30},
+        {'time_24h': '12:45'}]
+
+
+def _log(**kwargs):
+    log = PredictionLog(**kwargs)
+    log._thread_pid = os.getpid()  # flushed by the test, not the background thread
+    return log
+
+
+def test_file_sink_merges_repeats():
+    with tempfile.TemporaryDirectory() as directory:
+        log = _log(sink='file', path=os.path.join(directory, 'served.jsonl'))
+        for _ in range(3):
+            log.record('alder', '2026-03-02', ROWS, 'scheduled', 'alder_model.keras@v1', served_at=SERVED_AT)
+        log.record('alder', '2026-03-02', ROWS[:1], 'on_demand', None, served_at=SERVED_AT)
+        assert log.flush() == 1 and log.flush() == 0
+
+        records = log.served_records('alder', '2026-03-02')
+        assert [(record['slot'], record['source'], record['served']) for record in records] == [
+            ('12:15', 'scheduled', 3), ('12:15', 'on_demand', 1), ('12:30', 'scheduled', 3)]
+        assert records[0]['maxLeadMinutes'] == 5.0
+        assert log.served_records('oak', '2026-03-02') == []
+        assert log.snapshot()['counters']['flushed'] == 4
+
+
+def test_firestore_sink_and_full_buffer():
+    store = {}
+    log = _log(db=FakeClient(store), sink='firestore', capacity=2)
+    for minute in range(3):
+        log.record('alder', '2026-03-02', ROWS, 'scheduled', served_at=SERVED_AT.replace(minute=minute))
+    assert log.snapshot()['counters']['dropped'] == 1
+    assert log.flush() == 1
+    [path] = store
+    assert path.startswith('predictions/alder/2026-03-02/served-')
+    assert sum(record['served'] for record in log.served_records('alder', '2026-03-02')) == 4
+
+    # Without a client there is nowhere to write
+    assert not PredictionLog(sink='firestore').enabled
+
+
+def test_accuracy_weights_served_responses():
+    records = [
+        {'slot': '12:15', 'predicted': 20, 'source': 'scheduled', 'served': 3},
+        {'slot': '12:30', 'predicted': 10, 'source': 'scheduled', 'served': 1},
+        {'slot': '12:30', 'predicted': 5, 'source': 'fallback'},
+        {'slot': '12:45', 'predicted': 8, 'source': 'fallback'},  # no actual count
+    ]
+    result = accuracy(records, {'12:15': 10, '12:30': 0})
+    assert result['scheduled'] == {'predictions': 2, 'served': 4, 'mae': 10.0, 'bias': 10.0, 'mape': 100.0}
+    assert result['fallback'] == {'predictions': 1, 'served': 1, 'mae': 5.0, 'bias': 5.0, 'mape': None}
+    assert result['all']['served'] == 5 and result['all']['mae'] == 9.0
+    assert accuracy([], {'12:15': 10}) == {}
+
+
+def test_version_label():
+    assert version_label(('/models/alder/20260301.bundle', '2026-03-01T03:00')) == '20260301.bundle@2026-03-01T03:00'
+    assert version_label(('alder_model.keras', None)) == 'alder_model.keras@unknown'
+    assert version_label(None) is None
+
+
+if __name__ == '__main__':
+    test_file_sink_merges_repeats()
+    test_firestore_sink_and_full_buffer()
+    test_accuracy_weights_served_responses()
+    test_version_label()
+    print("[OK] Prediction log tests passed")
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+Test the legacy PredictionModel slot table: per-day averages, bundle round trip and the old JSON format
+"""
+
+import os
+import sys
+import json
+import tempfile
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend'))
+
+from prediction_model import PredictionModel
+
+# Mondays, in local time
+WEEK_1 = datetime(2026, 3, 2, 12, 5)
+WEEK_2 = WEEK_1 + timedelta(weeks=1)
+
+
+def _model(models_dir):
+    model = PredictionModel()
+    model.bundle_path = os.path.join(models_dir, 'model_data.bundle')
+    model.model_path = os.path.join(models_dir, 'model_data.json')
+    return model
+
+
+def _scans():
+    scans = []
+    # alder: 4 scans in the 12:00 slot on one Monday, 2 on the next, in three timestamp forms
+    for minute in range(4):
+        scans.append({'ts': (WEEK_1 + timedelta(minutes=minute)).timestamp(), 'messId': 'alder'})
+    scans.append({'timestamp': WEEK_2.isoformat(), 'messId': 'alder'})
+    scans.append({'ts': WEEK_2 + timedelta(minutes=20), 'messId': 'alder'})  # 12:25, next slot
+    scans.append({'ts': WEEK_2 + timedelta(minutes=3), 'messId': 'alder'})
+    # oak: one Tuesday dinner scan; junk is skipped
+    scans.append({'ts': (WEEK_1 + timedelta(days=1, hours=8)).timestamp(), 'messId': 'oak'})
+    scans.append({'ts': None, 'messId': 'oak'})
+    return scans
+
+
+def test_slot_averages_per_day():
+    with tempfile.TemporaryDirectory() as models_dir:
+        model = _model(models_dir)
+        assert model.train(_scans(), save=False)
+        # (4 + 2) scans over 2 Mondays
+        assert model.slot_average('alder', 0, 48) == 3.0
+        assert model.slot_average('alder', 0, 49) == 0.5
+        assert model.slot_average('oak', 1, 80) == 1.0
+        assert model.slot_average('alder', 1, 48, default=7) == 7
+        assert model.slot_average('pine', 0, 48) is None
+        assert not os.path.exists(model.bundle_path)
+
+
+def test_bundle_round_trip():
+    with tempfile.TemporaryDirectory() as models_dir:
+        model = _model(models_dir)
+        assert model.train(_scans())
+        loaded = _model(models_dir)
+        assert loaded._load_model()
+        assert loaded.trained and loaded.mess_ids == ['alder', 'oak']
+        assert loaded.slot_average('alder', 0, 48) == 3.0
+
+
+def test_legacy_json_applies_to_every_weekday():
+    with tempfile.TemporaryDirectory() as models_dir:
+        with open(os.path.join(models_dir, 'model_data.json'), 'w') as f:
+            json.dump({'time_interval_averages': {'alder_12_2': 14, 'bad_key': 3}, 'trained': True}, f)
+        model = _model(models_dir)
+        assert model._load_model()
+        assert all(model.slot_average('alder', weekday, 12 * 4 + 2) == 14 for weekday in range(7))
+
+
+def test_too_little_data():
+    with tempfile.TemporaryDirectory() as models_dir:
+        model = _model(models_dir)
+        assert not model.train([{'ts': WEEK_1.timestamp(), 'messId': 'alder'}])
+        assert not model.trained
+
+
+if __name__ == '__main__':
+    test_slot_averages_per_day()
+    test_bundle_round_trip()
+    test_legacy_json_applies_to_every_weekday()
+    test_too_little_data()
+    print("[OK] PredictionModel tests passed")
@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+"""
+Test the prediction scheduler: cached payloads, upcoming rows, payloads
+shared between instances and the model reload at the start of each meal
+(including a newly published global model)
+"""
+
+import os
+import sys
+import tempfile
+import threading
+from datetime import datetime, time
+from types import SimpleNamespace
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend'))
+
+import mess_prediction_model
+import model_bundle
+import prediction_model_tf
+from prediction_model_tf import PredictionService
+from prediction_scheduler import PredictionScheduler
+from shared_cache import LocalBackend, SharedCache
+
+MEAL_WINDOWS = {'lunch': (time(12, 0), time(14, 0))}
+NOW = datetime(2026, 3, 2, 12, 10)
+
+
+class _Service:
+    """predict_counts_for_messes returning 10 per slot; counts its passes and reloads"""
+
+    def __init__(self, version='v1'):
+        self.version = version
+        self.passes = []
+        self.reloads = 0
+
+    def model_version(self, mess_id):
+        return (f'{mess_id}_model.keras', self.version)
+
+    def predict_counts_for_messes(self, mess_ids, slot_times, capacities=None):
+        self.passes.append(list(mess_ids))
+        return {mess_id: np.full(len(slot_times), 10, dtype=np.float32) for mess_id in mess_ids}
+
+    def reload_models(self):
+        self.reloads += 1
+
+
+def _scheduler(service, cache=None):
+    return PredictionScheduler(service, MEAL_WINDOWS, lead_seconds=60,
+                               shared_cache=cache or SharedCache(LocalBackend()))
+
+
+def test_refresh_caches_upcoming_rows():
+    service = _Service()
+    scheduler = _scheduler(service)
+    scheduler.track('alder', 40)
+    payloads = scheduler.refresh(now=NOW)
+    assert list(payloads) == ['alder'] and len(payloads['alder']['meals']['lunch']) == 8
+    assert payloads['alder']['modelVersion'] == 'alder_model.keras@v1'
+
+    rows = scheduler.predictions('alder', 'lunch', 40, now=NOW)
+    assert [row['time_24h'] for row in rows][:2] == ['12:15', '12:30']
+    assert len(service.passes) == 1  # served from the cache
+    # A new capacity recomputes
+    scheduler.predictions('alder', 'lunch', 80, now=NOW)
+    assert len(service.passes) == 2
+
+
+def test_instances_share_payloads():
+    cache = SharedCache(LocalBackend())
+    first, second = _Service(), _Service()
+    one, other = _scheduler(first, cache), _scheduler(second, cache)
+    one.track('alder', 40)
+    other.track('alder', 40)
+    assert one.refresh(now=NOW) == other.refresh(now=NOW)
+    assert len(first.passes) == 1 and second.passes == []
+
+    # A retrained model reads and writes new keys
+    second.version = 'v2'
+    assert other.refresh(now=NOW)['alder']['modelVersion'] == 'alder_model.keras@v2'
+    assert len(second.passes) == 1
+
+    # Instances that do not own the mess answer from today's shared table
+    reader = _scheduler(_Service(), cache)
+    assert reader.table('alder', now=NOW)['modelVersion'] == 'alder_model.keras@v2'
+    assert reader.table('oak', now=NOW) is None
+
+
+def test_forecast_reuses_later_days():
+    service = _Service()
+    scheduler = _scheduler(service)
+    result = scheduler.forecast({'alder': 40, 'oak': 60}, days=3, now=NOW)
+    assert [payload['date'] for payload in result['alder']] == ['2026-03-02', '2026-03-03', '2026-03-04']
+    assert result['oak'][0]['capacity'] == 60 and len(service.passes) == 1
+    scheduler.forecast({'alder': 40, 'oak': 60}, days=3, now=NOW)
+    assert len(service.passes) == 1
+
+
+def test_meal_start_reloads_models():
+    service = _Service()
+    scheduler = _scheduler(service)
+    assert scheduler._is_meal_start(datetime(2026, 3, 2, 11, 59))
+    assert not scheduler._is_meal_start(datetime(2026, 3, 2, 12, 14))
+
+    scheduler._is_meal_start = lambda now: True
+    scheduler.refresh = lambda now=None: scheduler._stop.set()
+    scheduler._run()
+    assert service.reloads == 1
+
+
+def test_reload_while_serving():
+    loaded = []
+
+    def _load(mess_id):
+        model = SimpleNamespace(mess_id=mess_id, online_model=None)
+        loaded.append(model)
+        return model
+
+    saved = prediction_model_tf.create_or_load_mess_model
+    prediction_model_tf.create_or_load_mess_model = _load
+    try:
+        service = PredictionService()
+        first = service.get_prediction_model('alder')
+        assert service.get_prediction_model('alder') is first
+
+        errors = []
+        stop = threading.Event()
+
+        def _serve():
+            try:
+                while not stop.is_set():
+                    assert service.get_prediction_model('alder') is not None
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=_serve) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for _ in range(200):
+            service.reload_models()
+        stop.set()
+        for thread in threads:
+            thread.join()
+
+        assert errors == []
+        assert service.get_prediction_model('alder') is not first
+    finally:
+        prediction_model_tf.create_or_load_mess_model = saved
+
+
+def _point_global_at(models_dir, version):
+    directory = model_bundle.bundle_dir(models_dir, mess_prediction_model.GLOBAL_MODEL_NAME)
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, model_bundle.CURRENT_POINTER), 'w') as f:
+        f.write(version + '\n')
+
+
+def test_global_model_follows_current_pointer():
+    saved = (mess_prediction_model.MODELS_DIR, mess_prediction_model._global_model,
+             prediction_model_tf.create_or_load_mess_model)
+    with tempfile.TemporaryDirectory() as models_dir:
+        mess_prediction_model.MODELS_DIR = models_dir
+        _point_global_at(models_dir, 'v1')
+        live = SimpleNamespace(version='v1', model_path='global/v1.bundle', metadata={'trained_at': 'monday'})
+        mess_prediction_model._global_model = live
+        prediction_model_tf.create_or_load_mess_model = lambda mess_id: SimpleNamespace(
+            global_model=live, model_path=live.model_path, metadata=live.metadata, online_model=None)
+        try:
+            service = PredictionService()
+            assert service.model_version('alder') == ('global/v1.bundle', 'monday')
+            service.reload_models()
+            assert mess_prediction_model._global_model is live  # still current: kept
+
+            # A retrain publishes v2; the meal-start reload drops v1, and the
+            # version reported for messes it serves follows the live model
+            _point_global_at(models_dir, 'v2')
+            service.reload_models()
+            assert mess_prediction_model._global_model is None
+            mess_prediction_model._global_model = SimpleNamespace(
+                version='v2', model_path='global/v2.bundle', metadata={'trained_at': 'tuesday'})
+            assert service.model_version('alder') == ('global/v2.bundle', 'tuesday')
+        finally:
+            (mess_prediction_model.MODELS_DIR, mess_prediction_model._global_model,
+             prediction_model_tf.create_or_load_mess_model) = saved
+
+
+if __name__ == '__main__':
+    test_refresh_caches_upcoming_rows()
+    test_instances_share_payloads()
+    test_forecast_reuses_later_days()
+    test_meal_start_reloads_models()
+    test_reload_while_serving()
+    test_global_model_follows_current_pointer()
+    print("[OK] Prediction scheduler tests passed")
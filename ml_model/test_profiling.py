@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+Test the profiling hooks: sampling, one profile at a time, pruning old
+profiles and validating runtime settings
+"""
+
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend'))
+
+import profiling
+
+
+def _with_settings(test, **overrides):
+    saved = profiling.settings()
+    with tempfile.TemporaryDirectory() as directory:
+        profiling._settings.update(directory=directory, **overrides)
+        try:
+            test(directory)
+        finally:
+            profiling._settings.clear()
+            profiling._settings.update(saved)
+
+
+def test_sample_rate_zero_and_one():
+    def _never(directory):
+        for _ in range(20):
+            with profiling.profile('predict', 'alder') as prefix:
+                assert prefix is None
+        assert os.listdir(directory) == []
+    _with_settings(_never, sample_rate=0.0)
+
+    def _always(directory):
+        with profiling.profile('predict', 'alder/oak') as prefix:
+            sum(range(1000))
+        assert prefix.startswith(directory) and '_predict_alder_oak_' in prefix
+        assert os.path.exists(prefix + '.prof') and os.path.exists(prefix + '.txt')
+        # Training runs follow the training flag, not the sample rate
+        with profiling.profile('train', 'alder', training=True) as prefix:
+            assert prefix is None
+    _with_settings(_always, sample_rate=1.0, training=False)
+
+
+def test_profiles_do_not_nest():
+    def _nested(directory):
+        with profiling.profile('predict', 'alder') as outer:
+            with profiling.profile('train', 'alder', training=True) as inner:
+                assert outer is not None and inner is None
+        assert len(profiling.recent_profiles()) == 1
+        # The lock is released afterwards
+        with profiling.profile('predict', 'oak') as prefix:
+            assert prefix is not None
+    _with_settings(_nested, sample_rate=1.0, training=True)
+
+
+def test_prune_keeps_the_newest():
+    def _prune(directory):
+        names = [f'20260301T12000{i}000000_predict_alder_1' for i in range(4)]
+        for name in names:
+            for suffix in ('.prof', '.txt'):
+                open(os.path.join(directory, name + suffix), 'w').close()
+        profiling._prune(directory)
+        assert sorted(os.listdir(directory)) == sorted(name + suffix for name in names[2:] for suffix in ('.prof', '.txt'))
+        assert profiling.recent_profiles() == [names[3] + '.prof', names[2] + '.prof']
+    _with_settings(_prune, max_files=2)
+
+
+def test_configure_rejects_non_booleans():
+    def _configure(directory):
+        for kwargs in ({'training': 'false'}, {'training': 0}, {'sample_rate': '0.5'},
+                       {'sample_rate': True}, {'sample_rate': float('nan')},
+                       {'sample_rate': 0.5, 'training': 'yes'}):
+            try:
+                profiling.configure(**kwargs)
+                assert False, f'expected ValueError for {kwargs}'
+            except ValueError:
+                pass
+        # Nothing changed, not even the valid half of a rejected call
+        assert profiling.settings()['training'] is False and profiling.settings()['sample_rate'] == 0.0
+        assert profiling.configure(sample_rate=2, training=True)['sample_rate'] == 1.0
+        assert profiling.settings()['training'] is True
+    _with_settings(_configure, sample_rate=0.0, training=False)
+
+
+def test_endpoint_returns_400_for_bad_settings():
+    import main
+    client = main.app.test_client()
+    saved_token = os.environ.get('ADMIN_TOKEN')
+    os.environ['ADMIN_TOKEN'] = 'secret'
+
+    def _endpoint(directory):
+        headers = {'X-Admin-Token': 'secret'}
+        response = client.post('/admin/profiling', json={'training': 'false'}, headers=headers)
+        assert response.status_code == 400 and 'training' in response.get_json()['error']
+        assert profiling.settings()['training'] is False
+        response = client.post('/admin/profiling', json={'sampleRate': 0.25, 'training': True}, headers=headers)
+        assert response.status_code == 200 and response.get_json()['settings']['training'] is True
+    try:
+        _with_settings(_endpoint, sample_rate=0.0, training=False)
+    finally:
+        if saved_token is None:
+            os.environ.pop('ADMIN_TOKEN', None)
+        else:
+            os.environ['ADMIN_TOKEN'] = saved_token
+
+
+if __name__ == '__main__':
+    test_sample_rate_zero_and_one()
+    test_profiles_do_not_nest()
+    test_prune_keeps_the_newest()
+    test_configure_rejects_non_booleans()
+    test_endpoint_returns_400_for_bad_settings()
+    print("[OK] Profiling tests passed")
@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+"""
+Test the retrain policy: per-weekday slot baselines, drift and the reset
+after training, and how the auto-trainer loads data and records its runs
+"""
+
+import os
+import sys
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend'))
+
+import firestore_metrics
+import retrain_policy
+from firestore_fakes import FakeClient
+from shared_cache import LocalBackend, SharedCache
+
+
+def _fold_weeks(stats, weeks, weekday_count, weekend_count, start=datetime(2026, 3, 2)):
+    """Fold whole weeks of one slot: weekday_count Mon-Fri, weekend_count Sat-Sun"""
+    for offset in range(weeks * 7):
+        day = start + timedelta(days=offset)
+        retrain_policy.fold_day(stats, day, {'12:30': weekend_count if day.weekday() >= 5 else weekday_count})
+    return start + timedelta(days=weeks * 7)
+
+
+def test_weekend_is_not_drift():
+    stats = retrain_policy.new_stats()
+    _fold_weeks(stats, 6, weekday_count=80, weekend_count=20)
+    assert set(stats['slots']) == {f"{weekday} 12:30" for weekday in retrain_policy.WEEKDAYS}
+    assert retrain_policy.slot_shift(stats) == 0.0
+
+
+def test_baseline_keeps_rolling():
+    stats = retrain_policy.new_stats()
+    after = _fold_weeks(stats, 3, weekday_count=80, weekend_count=20)
+    # A lasting change: the shift shows up, and the baseline follows it over time
+    after = _fold_weeks(stats, 3, weekday_count=40, weekend_count=20, start=after)
+    early_shift = retrain_policy.slot_shift(stats)
+    assert early_shift > retrain_policy.SLOT_SHIFT_THRESHOLD
+    _fold_weeks(stats, 40, weekday_count=40, weekend_count=20, start=after)
+    monday = stats['slots']['Mon 12:30']
+    assert monday['n'] == retrain_policy.BASELINE_DAYS
+    assert abs(monday['mean'] - 40) < 1.0
+    assert retrain_policy.slot_shift(stats) < early_shift
+
+
+def test_reset_restarts_baseline_from_held_back_days():
+    stats = retrain_policy.new_stats()
+    for offset, count in enumerate([10, 50, 10, 50, 30, 36, 42]):
+        retrain_policy.fold_day(stats, datetime(2026, 3, 2) + timedelta(weeks=offset), {'08:00': count})
+    slot = stats['slots']['Mon 08:00']
+    assert slot['n'] == 4 and slot['lagged'] == [30, 36, 42]
+    assert retrain_policy.slot_shift(stats) > 0
+
+    retrain_policy.reset_after_training(stats)
+    # The old spread (10 vs 50) is gone: the baseline is the held-back days alone
+    assert slot['n'] == 3 and slot['mean'] == 36 and slot['m2'] == 72
+    assert slot['lagged'] == [] and slot['recent'] is None and slot['recentDays'] == 0
+    assert stats['newRecords'] == 0
+
+
+def test_old_statistics_are_rebuilt():
+    stats = {'newRecords': 10, 'slots': {'12:30': {'n': 3, 'mean': 5.0, 'm2': 1.0, 'recent': 9.0, 'recentDays': 4}}}
+    retrain_policy.fold_day(stats, datetime(2026, 3, 7), {'12:30': 4})
+    assert list(stats['slots']) == ['Sat 12:30'] and stats['version'] == retrain_policy.STATS_VERSION
+
+
+def _trainer(store):
+    import data_retention_and_autotraining as autotraining
+    trainer = autotraining.AutoTrainerService.__new__(autotraining.AutoTrainerService)
+    trainer.db = FakeClient(store)
+    trainer.shared_cache = SharedCache(LocalBackend())
+    return trainer
+
+
+def test_only_full_fits_restart_the_policy():
+    import data_retention_and_autotraining as autotraining
+    store = {'model_metadata/alder': {
+        'lastTrainedAt': datetime.now() - timedelta(days=31),
+        'stats': dict(retrain_policy.new_stats(), newRecords=6000),
+    }}
+    trainer = _trainer(store)
+    trainer._load_training_data = lambda mess_id, days=None: [{'date': datetime.now(), 'meal': 'lunch', 'count': 3}]
+    saved = autotraining.train_mess_model_from_data, autotraining.MessPredictionModel, autotraining.saved_trained_at
+    autotraining.MessPredictionModel = None
+    autotraining.saved_trained_at = lambda mess_id: None
+    try:
+        # Fine-tunes after each meal leave the age and volume triggers armed
+        for mode in ('incremental', 'unchanged'):
+            autotraining.train_mess_model_from_data = lambda mess_id, records, **kwargs: mode
+            assert trainer.retrain_model('alder', incremental=True)
+            assert store['model_metadata/alder']['trainingMode'] == mode
+            assert trainer.should_retrain('alder')
+        assert store['model_metadata/alder']['stats']['newRecords'] == 6000
+        assert 'lastIncrementalAt' in store['model_metadata/alder']
+
+        # An incremental run that fell back to a full fit restarts them
+        autotraining.train_mess_model_from_data = lambda mess_id, records, **kwargs: 'full'
+        assert trainer.retrain_model('alder', incremental=True)
+        assert store['model_metadata/alder']['stats']['newRecords'] == 0
+        assert not trainer.should_retrain('alder')
+    finally:
+        autotraining.train_mess_model_from_data, autotraining.MessPredictionModel, autotraining.saved_trained_at = saved
+
+
+def test_training_data_is_counted_not_read():
+    today = datetime.now()
+    store = {}
+    for offset, scans in ((0, 3), (2, 2), (40, 5)):
+        date_str = (today - timedelta(days=offset)).strftime('%Y-%m-%d')
+        for i in range(scans):
+            store[f'attendance/alder/{date_str}/lunch/students/s{i}'] = {'markedAt': f'{date_str}T12:05:00'}
+    trainer = _trainer(store)
+    trainer.db = firestore_metrics.instrument(trainer.db)
+    with firestore_metrics.job('load', trainer.db) as stats:
+        records = trainer._load_training_data('alder')
+    assert [(record['date'].date(), record['count']) for record in records] == [
+        ((today - timedelta(days=2)).date(), 2), (today.date(), 3)]
+    totals = stats.summary()['totals']
+    assert totals['streams'] == 0 and totals['reads'] == trainer.TRAINING_DAYS * 3
+    assert trainer._load_training_data('alder', days=2) == records[1:]
+
+
+def test_incremental_loads_recent_days_only():
+    import data_retention_and_autotraining as autotraining
+    trainer = _trainer({})
+    loaded, calls = [], []
+    trainer._load_training_data = lambda mess_id, days=None: loaded.append(days) or [{'count': 1}]
+
+    def train(mess_id, records, incremental=False, full_fallback=True):
+        calls.append((incremental, full_fallback))
+        return 'full_required' if not full_fallback else 'full'
+    saved = autotraining.train_mess_model_from_data, autotraining.saved_trained_at
+    autotraining.train_mess_model_from_data = train
+    autotraining.saved_trained_at = lambda mess_id: datetime.now() - timedelta(days=1)
+    try:
+        # Yesterday's model: two new days and a week to replay; drift then needs the full window
+        assert trainer.retrain_model('alder', incremental=True)
+        assert loaded == [2 + trainer.INCREMENTAL_REPLAY_DAYS, None]
+        assert calls == [(True, False), (False, True)]
+        # Without a saved model the full window is loaded once
+        autotraining.saved_trained_at = lambda mess_id: None
+        loaded.clear()
+        calls.clear()
+        assert trainer.retrain_model('alder', incremental=True)
+        assert loaded == [trainer.TRAINING_DAYS] and calls == [(True, True)]
+    finally:
+        autotraining.train_mess_model_from_data, autotraining.saved_trained_at = saved
+
+
+if __name__ == '__main__':
+    test_weekend_is_not_drift()
+    test_baseline_keeps_rolling()
+    test_reset_restarts_baseline_from_held_back_days()
+    test_old_statistics_are_rebuilt()
+    test_only_full_fits_restart_the_policy()
+    test_training_data_is_counted_not_read()
+    test_incremental_loads_recent_days_only()
+    print("[OK] Retrain policy tests passed")
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+Test mess sharding: the consistent-hash ring and the shard router
+"""
+
+import os
+import sys
+from collections import Counter
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend'))
+
+from sharding import FORWARDED_HEADER, HashRing, ShardRouter, forward_signature, parse_instances
+
+MESS_IDS = [f'mess-{i}' for i in range(3000)]
+
+
+def test_parse_instances():
+    assert parse_instances(' a=https://a.example.com/ , b ,, c=http://c:8080') == {
+        'a': 'https://a.example.com', 'b': None, 'c': 'http://c:8080'}
+    assert parse_instances(None) == {}
+
+
+def test_ring_balance_and_minimal_moves():
+    ring = HashRing(['a', 'b', 'c'])
+    before = ring.assignments(MESS_IDS)
+    assert before == HashRing(['c', 'a', 'b']).assignments(MESS_IDS)
+    shares = Counter(before.values())
+    assert all(700 < shares[instance] < 1300 for instance in 'abc')
+
+    # A fourth instance takes about a quarter, and only from the others' arcs
+    after = HashRing(['a', 'b', 'c', 'd']).assignments(MESS_IDS)
+    moved = [mess_id for mess_id in MESS_IDS if after[mess_id] != before[mess_id]]
+    assert all(after[mess_id] == 'd' for mess_id in moved)
+    assert 500 < len(moved) < 1000
+    assert HashRing([]).owner('alder') is None
+
+
+def test_router_owns_its_shard():
+    instances = {'a': 'http://a', 'b': 'http://b'}
+    router_a = ShardRouter(instances, 'a')
+    router_b = ShardRouter(instances, 'b')
+    assert router_a.enabled and router_b.enabled
+    mine = router_a.shard(MESS_IDS)
+    assert 0 < len(mine) < len(MESS_IDS)
+    assert sorted(mine + router_b.shard(MESS_IDS)) == sorted(MESS_IDS)
+    assert all(router_b.owner(mess_id) == 'a' for mess_id in mine)
+
+
+def test_router_off_without_a_valid_instance():
+    assert ShardRouter({'a': 'http://a', 'b': 'http://b'}, 'z').owns('alder')
+    assert not ShardRouter({'a': 'http://a', 'b': 'http://b'}, 'z').enabled
+    single = ShardRouter({'a': 'http://a'}, 'a')
+    assert not single.enabled and single.shard(['alder', 'oak']) == ['alder', 'oak']
+
+
+def test_forward_failures_return_none():
+    router = ShardRouter({'a': None, 'b': 'http://127.0.0.1:9'}, 'a', timeout=0.5)
+    foreign = next(mess_id for mess_id in MESS_IDS if router.owner(mess_id) == 'b')
+    local = next(mess_id for mess_id in MESS_IDS if router.owner(mess_id) == 'a')
+    assert router.forward(local, '/predict', {'messId': local}) is None  # no url
+    assert router.forward(foreign, '/predict', {'messId': foreign}) is None
+    assert router.snapshot()['counters']['forward_errors'] == 1
+
+
+def test_only_signed_forwards_are_trusted():
+    instances = {'a': 'http://a', 'b': 'http://b'}
+    router = ShardRouter(instances, 'a', secret='s3cret')
+    assert router.trusts(forward_signature('s3cret', 'b'))
+    assert not router.trusts('b')
+    assert not router.trusts(forward_signature('guess', 'b'))
+    assert not router.trusts(forward_signature('s3cret', 'a'))  # not from itself
+    assert not router.trusts(forward_signature('s3cret', 'z'))  # not a member
+    assert not router.trusts(None)
+    # Without a secret nothing is trusted
+    assert not ShardRouter(instances, 'a').trusts(forward_signature('', 'b'))
+
+
+def test_forged_header_does_not_serve_a_foreign_mess():
+    import main
+    router = ShardRouter({'a': None, 'b': None}, 'a', secret='s3cret')
+    foreign = next(mess_id for mess_id in MESS_IDS if router.owner(mess_id) == 'b')
+    served = []
+
+    class _Scheduler:
+        def predictions(self, mess_id, meal_type, capacity):
+            served.append(mess_id)
+            return [{'time': '12:00', 'predicted_count': 1, 'crowd_percentage': 1.0}]
+
+        def model_version(self, mess_id):
+            return 'v1'
+
+        def table(self, mess_id, now):
+            return None
+
+    saved = main.get_shard_router, main.get_scheduler
+    main.get_shard_router, main.get_scheduler = (lambda: router), (lambda: _Scheduler())
+    try:
+        client = main.app.test_client()
+        payload = {'messId': foreign, 'mealType': 'lunch', 'capacity': 50}
+        for header in ('b', forward_signature('guess', 'b')):
+            response = client.post('/predict', json=payload, headers={FORWARDED_HEADER: header})
+            assert response.get_json()['fallback'] and served == []
+        response = client.post('/predict', json=payload, headers={FORWARDED_HEADER: forward_signature('s3cret', 'b')})
+        assert not response.get_json()['fallback'] and served == [foreign]
+    finally:
+        main.get_shard_router, main.get_scheduler = saved
+
+
+if __name__ == '__main__':
+    test_parse_instances()
+    test_ring_balance_and_minimal_moves()
+    test_router_owns_its_shard()
+    test_router_off_without_a_valid_instance()
+    test_forward_failures_return_none()
+    test_only_signed_forwards_are_trusted()
+    test_forged_header_does_not_serve_a_foreign_mess()
+    print("[OK] Sharding tests passed")
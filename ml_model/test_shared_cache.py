@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+Test the shared cache on both backends, against the local stand-in server
+"""
+
+import threading
+import time
+
+from shared_cache import LocalBackend, RedisBackend, SharedCache, StandInServer
+
+
+def test_local_backend_ttl_and_lru():
+    now = [0.0]
+    backend = LocalBackend(max_entries=2, clock=lambda: now[0])
+    backend.set('a', b'1', ttl=5)
+    backend.set('b', b'2')
+    assert backend.set('a', b'x', only_if_absent=True) is False
+    backend.get('a')
+    backend.set('c', b'3')  # evicts b, the least recently used
+    assert backend.get('b') is None and backend.get('c') == b'3'
+    now[0] = 5
+    assert backend.get('a') is None
+
+
+def test_stand_in_server_round_trip():
+    server = StandInServer().start()
+    try:
+        cache = SharedCache(RedisBackend(server.url))
+        key = cache.key('predictions', 'alder:2026-05-01:100', version='v1')
+        assert key == 'smartmess:predictions@v1:alder:2026-05-01:100'
+        assert cache.get(key, 'missing') == 'missing'
+        cache.set(key, {'meals': {'lunch': [1, 2]}}, ttl=60)
+        cache.set(cache.key('predictions', 'oak', version='v1'), None)
+        found = cache.get_many([key, cache.key('predictions', 'oak', version='v1'), 'other'])
+        assert found == {key: {'meals': {'lunch': [1, 2]}}, cache.key('predictions', 'oak', version='v1'): None}
+        # A new model version reads from a fresh namespace
+        assert cache.get(cache.key('predictions', 'alder:2026-05-01:100', version='v2')) is None
+    finally:
+        server.stop()
+
+
+def test_single_flight_across_instances():
+    server = StandInServer().start()
+    try:
+        # Two "instances": separate caches and connections to one server
+        caches = [SharedCache(RedisBackend(server.url)) for _ in range(2)]
+        calls = []
+
+        def compute(ids):
+            calls.append(list(ids))
+            time.sleep(0.2)
+            return {item: f"value-{item}" for item in ids}
+
+        results = []
+        threads = [
+            threading.Thread(target=lambda cache=cache: results.append(
+                cache.get_or_compute_many({'alder': 'k:alder', 'oak': 'k:oak'}, compute, ttl=60)
+            ))
+            for cache in caches for _ in range(3)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert sum(len(ids) for ids in calls) == 2, calls
+        assert all(result == {'alder': 'value-alder', 'oak': 'value-oak'} for result in results)
+    finally:
+        server.stop()
+
+
+def test_unreachable_server_reads_as_miss():
+    server = StandInServer()
+    url = server.url
+    server.server_close()
+    cache = SharedCache(RedisBackend(url, timeout=0.1))
+    assert cache.get_or_compute('k', lambda: 42, ttl=60) == 42
+    assert cache.snapshot()['counters']['errors'] > 0
+
+
+if __name__ == '__main__':
+    test_local_backend_ttl_and_lru()
+    test_stand_in_server_round_trip()
+    test_single_flight_across_instances()
+    test_unreachable_server_reads_as_miss()
+    print("[OK] Shared cache tests passed")
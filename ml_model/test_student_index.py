@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+"""
+Test the per-student attendance index and who may read it
+"""
+
+import os
+import sys
+import threading
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend'))
+
+import api_auth
+import student_index
+from shared_cache import LocalBackend, SharedCache
+from student_index import StudentIndex, attended_days, merge_bits, month_document, month_stats
+from firestore_fakes import FakeClient
+
+DOC = 'student_index/21bcs001/months/2026-03'
+
+
+class _Transaction:
+    def __init__(self):
+        self.writes = []
+
+    def set(self, ref, data):
+        self.writes.append((ref, data))
+
+
+def _serialized(lock):
+    """Stand-in for _run_transaction: runs updates one at a time, writing on commit"""
+    def run(db, update):
+        with lock:
+            transaction = _Transaction()
+            update(transaction)
+            for ref, data in transaction.writes:
+                ref.set(data)
+    return run
+
+
+def _index(store):
+    return StudentIndex(FakeClient(store), interval=60, shared_cache=SharedCache(LocalBackend()))
+
+
+def test_bitmaps_and_documents():
+    assert student_index.normalize_enrollment_id(' 21BCS001 ') == '21bcs001'
+    assert student_index.normalize_enrollment_id('anon-7') is None
+    assert attended_days(0b1000101) == [1, 3, 7]
+    assert merge_bits({'alder': {'lunch': 0b01}}, {'alder': {'lunch': 0b10}, 'oak': {'dinner': 0b1}}) == {
+        'alder': {'lunch': 0b11}, 'oak': {'dinner': 0b1}}
+
+    document = month_document('21bcs001', '2026-03', {'alder': {'lunch': 0b011}, 'oak': {'lunch': 0b110, 'dinner': 0b1}})
+    assert document['meals'] == {'lunch': 0b111, 'dinner': 0b1}
+    assert document['counts'] == {'lunch': 3, 'dinner': 1}
+    assert document['total'] == 4 and document['days'] == 3
+
+    stats = month_stats(document, '2026-03', now=datetime(2026, 3, 10))
+    assert stats['daysElapsed'] == 10 and stats['daysAttended'] == 3
+    assert stats['meals']['lunch'] == {'count': 3, 'days': [1, 2, 3], 'rate': 0.3}
+    assert stats['meals']['breakfast']['count'] == 0
+    assert stats['messes'] == {'alder': {'lunch': 2}, 'oak': {'lunch': 2, 'dinner': 1}}
+    assert month_stats(None, '2026-04', now=datetime(2026, 3, 10))['meals']['lunch']['rate'] is None
+
+
+def test_flush_merges_with_stored_bits():
+    store = {DOC: month_document('21bcs001', '2026-03', {'alder': {'breakfast': 0b1}})}
+    index = _index(store)
+    saved = student_index._run_transaction
+    student_index._run_transaction = _serialized(threading.Lock())
+    try:
+        assert index.observe('alder', '2026-03-02', 'lunch', '21BCS001')
+        assert index.observe('alder', '2026-03-02', 'lunch', '21bcs001')  # same bit twice
+        assert not index.observe('alder', '2026-03-02', 'lunch', 'anon-1')
+        assert not index.observe('alder', 'not a date', 'lunch', '21bcs001')
+        assert index.flush() == 1
+    finally:
+        student_index._run_transaction = saved
+    assert store[DOC]['messes'] == {'alder': {'breakfast': 0b1, 'lunch': 0b10}}
+    assert store[DOC]['days'] == 2
+    assert index.snapshot() == {'pending': 0, 'counters': {'observed': 2, 'flushed_documents': 1, 'errors': 0}}
+
+
+def test_concurrent_flushes_keep_both_writers_bits():
+    store = {}
+    first, second = _index(store), _index(store)
+    first.observe('alder', '2026-03-01', 'lunch', '21bcs001')
+    second.observe('oak', '2026-03-02', 'dinner', '21bcs001')
+    saved = student_index._run_transaction
+    # Both writers flush at once; whichever commits second reads the first's bits
+    student_index._run_transaction = _serialized(threading.Lock())
+    try:
+        threads = [threading.Thread(target=index.flush) for index in (first, second)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        student_index._run_transaction = saved
+    assert store[DOC]['messes'] == {'alder': {'lunch': 0b1}, 'oak': {'dinner': 0b10}}
+    assert store[DOC]['total'] == 2
+
+
+def test_failed_flush_keeps_pending_bits():
+    store = {}
+    index = _index(store)
+    index.observe('alder', '2026-03-01', 'lunch', '21bcs001')
+    saved = student_index._run_transaction
+
+    def failing(db, update):
+        raise RuntimeError('unavailable')
+    student_index._run_transaction = failing
+    try:
+        assert index.flush() == 0
+        index.observe('alder', '2026-03-03', 'lunch', '21bcs001')
+        assert index.snapshot()['pending'] == 1 and index.counters['errors'] == 1
+        student_index._run_transaction = _serialized(threading.Lock())
+        assert index.flush() == 1
+    finally:
+        student_index._run_transaction = saved
+    assert store[DOC]['messes'] == {'alder': {'lunch': 0b101}}
+
+
+def test_stats_reads_one_cached_document():
+    store = {DOC: month_document('21bcs001', '2026-03', {'alder': {'lunch': 0b11}})}
+    index = _index(store)
+    stats = index.stats('21BCS001', '2026-03', now=datetime(2026, 3, 4))
+    assert stats['enrollmentId'] == '21bcs001' and stats['meals']['lunch']['count'] == 2
+    store[DOC] = month_document('21bcs001', '2026-03', {'alder': {'lunch': 0b111}})
+    assert index.stats('21bcs001', '2026-03', now=datetime(2026, 3, 4))['meals']['lunch']['count'] == 2
+    try:
+        index.stats('anon-1', '2026-03')
+        assert False, 'expected ValueError'
+    except ValueError:
+        pass
+
+
+def test_stats_endpoint_requires_the_student():
+    import main
+    client = main.app.test_client()
+    saved_token, saved_verify = os.environ.get('ADMIN_TOKEN'), api_auth._verify_id_token
+    os.environ['ADMIN_TOKEN'] = 'secret'
+    api_auth._verify_id_token = lambda id_token: {'student': {'enrollmentId': '21BCS001'},
+                                                  'manager': {'messIds': ['alder']},
+                                                  'root': {'admin': True}}[id_token]
+    try:
+        assert client.get('/students/21bcs001/stats').status_code == 401
+        assert client.get('/students/21bcs001/stats', headers={'X-Admin-Token': 'wrong'}).status_code == 401
+        for other in ('student', 'manager'):
+            response = client.get('/students/21bcs002/stats', headers={'Authorization': f'Bearer {other}'})
+            assert response.status_code == 403
+        # Authorized requests get as far as the data (no Firestore here: 503)
+        for headers in ({'Authorization': 'Bearer student'}, {'Authorization': 'Bearer root'},
+                        {'X-Admin-Token': 'secret'}):
+            assert client.get('/students/21bcs001/stats', headers=headers).status_code in (200, 503)
+    finally:
+        api_auth._verify_id_token = saved_verify
+        if saved_token is None:
+            os.environ.pop('ADMIN_TOKEN', None)
+        else:
+            os.environ['ADMIN_TOKEN'] = saved_token
+
+
+if __name__ == '__main__':
+    test_bitmaps_and_documents()
+    test_flush_merges_with_stored_bits()
+    test_concurrent_flushes_keep_both_writers_bits()
+    test_failed_flush_keeps_pending_bits()
+    test_stats_reads_one_cached_document()
+    test_stats_endpoint_requires_the_student()
+    print("[OK] Student index tests passed")
@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+"""
+Test the vectorized synthetic attendance generator
+"""
+
+import numpy as np
+import synthetic_data
+from train_tensorflow import MessCrowdRegressor
+
+MESSES = ['alder', 'oak']
+EXAM_WEEK = {'exam_weeks': [{'start': '2025-03-17', 'days': 7, 'multiplier': 1.5}]}
+
+
+def _events(seed=3):
+    return synthetic_data.generate_events(
+        MESSES, start='2025-03-03', days=21, capacities={'alder': 120, 'oak': 80}, profile=EXAM_WEEK, seed=seed
+    )
+
+
+def test_seeded_and_well_formed():
+    events = _events()
+    again = _events()
+    assert all(np.array_equal(events[name], again[name]) for name in events if name != 'mess_ids')
+    assert not np.array_equal(events['markedAt'], _events(seed=4)['markedAt'])
+
+    # Every scan falls inside its meal's window, and no student scans twice per meal
+    minutes = (events['markedAt'] - events['markedAt'].astype('datetime64[D]')).astype('timedelta64[m]').astype(int)
+    for code, name in enumerate(synthetic_data.MEAL_NAMES):
+        start, end = (synthetic_data._minutes(value) for value in synthetic_data.DEFAULT_PROFILE['meals'][name]['window'])
+        meal_minutes = minutes[events['meal'] == code]
+        assert meal_minutes.min() >= start and meal_minutes.max() < end
+    day = events['markedAt'].astype('datetime64[D]')
+    keys = set(zip(events['mess'].tolist(), day.tolist(), events['meal'].tolist(), events['student'].tolist()))
+    assert len(keys) == len(events['mess'])
+
+    # Exam week (third week) is busier than the first
+    weeks = (day - np.datetime64('2025-03-03')).astype(int) // 7
+    assert np.count_nonzero(weeks == 2) > 1.3 * np.count_nonzero(weeks == 0)
+
+
+def test_formats_agree():
+    events = _events()
+    regressor = MessCrowdRegressor('alder')
+    X_col, y_col, starts_col = regressor._bucket_arrays_columnar(synthetic_data.to_columns(events, 'alder'))
+    records = synthetic_data.to_records(events, 'alder')
+    X_rec, y_rec, starts_rec = regressor._bucket_arrays(regressor._bucket_counts(records))
+    assert np.array_equal(X_col, X_rec) and np.array_equal(y_col, y_rec) and np.array_equal(starts_col, starts_rec)
+    assert int(y_col.sum()) == len(records)
+
+    path, data = next(synthetic_data.to_firestore_documents(events, 'oak'))
+    parts = path.split('/')
+    assert parts[0] == 'attendance' and parts[1] == 'oak' and parts[4] == 'students'
+    assert parts[5] == data['enrollmentId'] and data['markedAt'].startswith(parts[2])
+
+
+if __name__ == '__main__':
+    test_seeded_and_well_formed()
+    test_formats_agree()
+    print("[OK] Synthetic data tests passed")
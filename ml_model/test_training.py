@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+"""
+Test mess model training: the time-ordered holdout, the tf.data fit,
+backend selection and warm-start incremental retraining
+Models are published to a temporary directory, never to ml_model/models
+"""
+
+import os
+import tempfile
+from datetime import date, timedelta
+
+import numpy as np
+import pandas as pd
+import synthetic_data
+import model_backends
+import model_bundle
+import train_tensorflow
+from train_tensorflow import MessCrowdRegressor
+
+
+def _records(start, days, seed):
+    events = synthetic_data.generate_events(['alder'], start=start, days=days, capacities={'alder': 40}, seed=seed)
+    return synthetic_data.to_records(events)
+
+
+def _regressor(models_dir):
+    regressor = MessCrowdRegressor('test-training')
+    regressor.models_dir = models_dir
+    return regressor
+
+
+def _with_backend(name):
+    """Run the decorated test with MODEL_BACKEND=name"""
+    def decorate(test):
+        def run():
+            saved = os.environ.get('MODEL_BACKEND')
+            os.environ['MODEL_BACKEND'] = name
+            try:
+                test()
+            finally:
+                if saved is None:
+                    os.environ.pop('MODEL_BACKEND', None)
+                else:
+                    os.environ['MODEL_BACKEND'] = saved
+        run.__name__ = test.__name__
+        return run
+    return decorate
+
+
+def test_time_holdout_keeps_newest_buckets():
+    regressor = _regressor(tempfile.gettempdir())
+    starts = np.datetime64('2026-03-02T12:00', 'm') + np.random.default_rng(0).permutation(20) * 15
+    train_index, holdout_index = regressor._time_holdout(20, starts)
+    assert len(holdout_index) == 4
+    assert starts[train_index].max() < starts[holdout_index].min()
+    assert (np.diff(starts[train_index]) > np.timedelta64(0, 'm')).all()
+    # Too few buckets to hold any out
+    train_index, holdout_index = regressor._time_holdout(5, starts[:5])
+    assert holdout_index is None and sorted(train_index) == list(range(5))
+
+
+def test_fit_validates_on_holdout():
+    regressor = _regressor(tempfile.gettempdir())
+    rng = np.random.default_rng(1)
+    X = rng.normal(size=(50, 4)).astype(np.float32)
+    y = (X[:, 0] * 3 + 10).astype(np.float32)
+    starts = np.datetime64('2026-03-02T12:00', 'm') + np.arange(50) * 15
+    model = regressor.create_model(4)
+    history = regressor._fit(model, X, y, starts, epochs=2)
+    assert 'val_loss' in history.history
+    report = regressor.training_report
+    assert report['train_samples'] == 40 and report['holdout_samples'] == 10
+    assert report['epochs'] == 2 and report['batch_size'] >= regressor.MIN_BATCH_SIZE
+
+    history = regressor._fit(regressor.create_model(4), X, y, starts, epochs=1, holdout=False)
+    assert 'val_loss' not in history.history
+    assert regressor.training_report['train_samples'] == 50
+    assert regressor.training_report['holdout_samples'] == 0
+
+
+def test_select_backend_keeps_cheapest_accurate():
+    scores = {
+        'keras': {'mae': 2.0, 'latency_ms': 3.0},
+        'ridge': {'mae': 2.1, 'latency_ms': 0.2},
+        'slot_average': {'mae': 4.0, 'latency_ms': 0.01},
+    }
+    assert model_backends.select_backend(scores, tolerance=0.1) == 'ridge'
+    assert model_backends.select_backend(scores, tolerance=0.0) == 'keras'
+
+
+@_with_backend('auto')
+def test_auto_scores_keras_through_compiled_predict():
+    with tempfile.TemporaryDirectory() as models_dir:
+        regressor = _regressor(models_dir)
+        compiled = []
+        serving_predict = train_tensorflow.compiled_predict
+
+        def _recording_compile(model, example):
+            compiled.append(model)
+            return serving_predict(model, example)
+        train_tensorflow.compiled_predict = _recording_compile
+        try:
+            assert regressor.train(_records(date.today() - timedelta(days=14), 10, seed=3))
+        finally:
+            train_tensorflow.compiled_predict = serving_predict
+
+        assert compiled == [regressor.model]
+        assert set(regressor.backend_scores) == {'keras'} | set(model_backends.BACKENDS)
+        assert regressor.backend_name == model_backends.select_backend(regressor.backend_scores)
+        metadata = model_bundle.load_current(models_dir, 'test-training').metadata
+        assert metadata['backend_scores'] == regressor.backend_scores
+
+
+@_with_backend('keras')  # incremental training needs the network
+def test_incremental_replays_older_buckets():
+    with tempfile.TemporaryDirectory() as models_dir:
+        history = _records(date.today() - timedelta(days=14), 10, seed=1)
+        first = _regressor(models_dir)
+        assert first.train(history)
+        assert first.training_mode == 'full'
+        full = model_bundle.load_current(models_dir, 'test-training').metadata
+        full_scores = {'keras': {'mae': 1.0, 'latency_ms': 0.5, 'fit_s': 1.0}}
+        model_bundle.publish(models_dir, 'test-training', model_bundle.load_current(models_dir, 'test-training').arrays,
+                             dict(full, backend_scores=full_scores))
+
+        # Buckets after trained_at (here: in the future) are the new data
+        new = _records(date.today() + timedelta(days=1), 2, seed=2)
+        second = _regressor(models_dir)
+        second._detect_drift = lambda *args: None
+        fitted = []
+        fit = second._fit
+
+        def _recording_fit(model, inputs, y, slot_starts, epochs, holdout=True):
+            fitted.append(slot_starts)
+            return fit(model, inputs, y, slot_starts, epochs, holdout)
+        second._fit = _recording_fit
+        assert second.train(history + new, incremental=True)
+        assert second.training_mode == 'incremental'
+
+        cutoff = np.datetime64(date.today() + timedelta(days=1), 'm')
+        starts = fitted[0]
+        new_buckets = int((starts >= cutoff).sum())
+        assert 0 < new_buckets < len(starts)
+        assert len(starts) - new_buckets == new_buckets  # one replayed bucket per new one
+
+        metadata = model_bundle.load_current(models_dir, 'test-training').metadata
+        assert metadata['training_mode'] == 'incremental'
+        assert metadata['training_samples'] == full['training_samples'] + new_buckets
+        assert metadata['backend_scores'] == full_scores
+        assert metadata['target_mean'] == full['target_mean']
+
+
+def test_warm_start_without_full_fallback():
+    assert train_tensorflow.train_mess_model_from_data('test-training', pd.DataFrame()) is False
+    with tempfile.TemporaryDirectory() as models_dir:
+        # No saved model: a records window meant for fine-tuning is not fit from scratch
+        regressor = _regressor(models_dir)
+        assert not regressor.train(_records(date.today(), 2, seed=3), incremental=True, full_fallback=False)
+        assert regressor.training_mode == 'full_required'
+        assert model_bundle.load_current(models_dir, 'test-training') is None
+
+
+if __name__ == '__main__':
+    test_time_holdout_keeps_newest_buckets()
+    test_fit_validates_on_holdout()
+    test_select_backend_keeps_cheapest_accurate()
+    test_auto_scores_keras_through_compiled_predict()
+    test_incremental_replays_older_buckets()
+    test_warm_start_without_full_fallback()
+    print("[OK] Training tests passed")
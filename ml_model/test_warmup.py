@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+Test the warm-up before traffic: per-mess readiness, the traced predict
+function and the /ready probe
+"""
+
+import io
+import os
+import sys
+from contextlib import redirect_stdout
+from types import SimpleNamespace
+
+import numpy as np
+import tensorflow as tf
+from sklearn.preprocessing import StandardScaler
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend'))
+
+import main
+import prediction_model_tf
+from mess_prediction_model import MessPredictionModel, WARMUP_SLOTS
+from prediction_model_tf import PredictionService
+
+
+def _fake_model(mess_id):
+    if mess_id == 'oak':
+        return None
+
+    def warm_up():
+        if mess_id == 'pine':
+            raise RuntimeError('corrupt bundle')
+        return 0.01
+    return SimpleNamespace(global_model=None, metadata={'backend': 'ridge'}, online_model=None, warm_up=warm_up)
+
+
+def test_service_reports_each_mess():
+    saved = prediction_model_tf.create_or_load_mess_model
+    prediction_model_tf.create_or_load_mess_model = _fake_model
+    try:
+        status = PredictionService().warm_up(['alder', 'oak', 'pine'])
+    finally:
+        prediction_model_tf.create_or_load_mess_model = saved
+    assert status['alder']['state'] == 'ready' and status['alder']['model'] == 'ridge'
+    assert status['alder']['warmup_seconds'] == 0.01 and 'load_seconds' in status['alder']
+    assert status['oak']['state'] == 'no_model'
+    assert status['pine'] == {'state': 'error', 'load_seconds': status['pine']['load_seconds'],
+                              'error': 'corrupt bundle'}
+
+
+def test_model_warm_up_traces_predict():
+    with redirect_stdout(io.StringIO()):
+        model = MessPredictionModel('test-warmup')
+    network = tf.keras.Sequential([tf.keras.Input(shape=(4,)), tf.keras.layers.Dense(1)])
+    model.global_model = None
+    model.backend = None
+    model.model = network
+    model.scaler = StandardScaler().fit(np.random.default_rng(0).normal(size=(20, 4)))
+    assert model._predict_fn is None
+    assert model.warm_up() >= 0
+    predict_fn = model._predict_fn
+    assert predict_fn is not None
+    # Later calls reuse the traced function
+    model._model_counts(WARMUP_SLOTS[:1])
+    assert model._predict_fn is predict_fn
+
+
+def test_ready_probe():
+    saved = dict(main._warmup)
+    client = main.app.test_client()
+    try:
+        # Already started in this process: the probe only reports
+        main._warmup.update(pid=os.getpid(), state='warming', seconds=None, error=None)
+        response = client.get('/ready')
+        assert response.status_code == 503 and response.get_json()['state'] == 'warming'
+
+        main._warmup.update(state='failed', error='no models', seconds=1.5)
+        response = client.get('/ready')
+        body = response.get_json()
+        assert response.status_code == 200 and body['ready'] and body['error'] == 'no models'
+    finally:
+        main._warmup.clear()
+        main._warmup.update(saved)
+
+
+if __name__ == '__main__':
+    test_service_reports_each_mess()
+    test_model_warm_up_traces_predict()
+    test_ready_probe()
+    print("[OK] Warm-up tests passed")
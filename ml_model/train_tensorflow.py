@@ -7,10 +7,11 @@ Trains on mess-specific attendance data from Firebase
 import os
 import sys
 import json
+import time
 import inspect
 import threading
 from collections import defaultdict
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 import firebase_admin
 from firebase_admin import credentials, firestore
 import pandas as pd
@@ -19,44 +20,38 @@ import tensorflow as tf
 from tensorflow import keras
 from tensorflow.keras import layers
 import joblib
+import model_backends
+import model_bundle
+import profiling
+import firestore_metrics
+import firestore_breaker
+import synthetic_data
+from env_config import env_float
+from mess_prediction_model import compiled_predict
 
 _STREAM_SUPPORTS_TIMEOUT = None
-_FIRESTORE_DISABLED = False
-_FIRESTORE_ERROR_TOKENS = (
-    'invalid_grant',
-    'access_token_expired',
-    'invalid authentication credentials',
-    'unauthenticated',
-    'permission denied',
-    'token must be',
-    'jwt',
-    'metadata',
-    'oauth',
-    '401',
-)
-
-def _disable_firestore_if_needed(error, label):
-    global _FIRESTORE_DISABLED
-    if _FIRESTORE_DISABLED:
-        return True
-    message = str(error).lower()
-    if any(token in message for token in _FIRESTORE_ERROR_TOKENS):
-        _FIRESTORE_DISABLED = True
-        print(f"[WARN] Firestore disabled due to credential error at {label}.")
-        print("[WARN] Check serviceAccountKey.json or system clock if this is unexpected.")
-        return True
-    return False
+# Reader thread of the last stream that timed out, while it is still running
+_stalled_stream = None
+_stalled_stream_lock = threading.Lock()
 
 def _safe_stream(ref, timeout_s, label):
+    """
+    Documents of a collection, or None on failure
+    Runs through the Firestore circuit breaker: transient failures are
+    retried with backoff, and nothing is read while the circuit is open.
+    When stream() takes no timeout it runs in a reader thread; a timeout
+    then counts as a failure without a retry, and no new reader starts
+    while the abandoned one is still running.
+    """
     global _STREAM_SUPPORTS_TIMEOUT
-    if _FIRESTORE_DISABLED:
-        return None
     if _STREAM_SUPPORTS_TIMEOUT is None:
         try:
             _STREAM_SUPPORTS_TIMEOUT = 'timeout' in inspect.signature(ref.stream).parameters
         except Exception:
             _STREAM_SUPPORTS_TIMEOUT = False
-    try:
+
+    def _stream_once():
+        global _stalled_stream
         if _STREAM_SUPPORTS_TIMEOUT:
             return list(ref.stream(timeout=timeout_s))
         result = []
@@ -68,21 +63,59 @@ def _safe_stream(ref, timeout_s, label):
             except Exception as e:
                 error_holder.append(e)
 
-        thread = threading.Thread(target=_runner, daemon=True)
-        thread.start()
+        with _stalled_stream_lock:
+            if _stalled_stream is not None and _stalled_stream.is_alive():
+                raise firestore_breaker.CallTimeout("a timed-out stream is still running")
+            thread = threading.Thread(target=_runner, daemon=True)
+            thread.start()
         thread.join(timeout_s)
         if thread.is_alive():
-            print(f"[WARN] Firestore stream timed out for {label} after {timeout_s}s")
-            return None
+            with _stalled_stream_lock:
+                _stalled_stream = thread
+            raise firestore_breaker.CallTimeout(f"stream timed out after {timeout_s}s")
         if error_holder:
             raise error_holder[0]
         return result
+
+    try:
+        return firestore_breaker.get_breaker().call(_stream_once)
+    except firestore_breaker.CircuitOpenError:
+        return None
     except Exception as e:
-        if _disable_firestore_if_needed(e, label):
-            return None
         print(f"[WARN] Firestore stream failed for {label}: {e}")
         return None
 
+def _local_tz():
+    """System local timezone, matching datetime.astimezone(tz=None)"""
+    from dateutil import tz
+    return tz.tzlocal()
+
+_CPU_THREADS_CONFIGURED = False
+
+def _configure_cpu_threads():
+    """
+    Apply the TRAIN_CPU_THREADS budget to TensorFlow's thread pools
+    Must run before TensorFlow executes its first op; later calls are no-ops
+    """
+    global _CPU_THREADS_CONFIGURED
+    if _CPU_THREADS_CONFIGURED:
+        return
+    _CPU_THREADS_CONFIGURED = True
+    threads = _cpu_thread_budget()
+    if not threads:
+        return
+    try:
+        tf.config.threading.set_intra_op_parallelism_threads(threads)
+        tf.config.threading.set_inter_op_parallelism_threads(max(1, threads // 2))
+        print(f"[INFO] TensorFlow limited to {threads} CPU threads")
+    except RuntimeError as e:
+        print(f"[WARN] Could not apply TRAIN_CPU_THREADS={threads}: {e}")
+
+def _cpu_thread_budget():
+    """TRAIN_CPU_THREADS as a positive int, or None to let TensorFlow decide"""
+    threads = int(env_float('TRAIN_CPU_THREADS', 0))
+    return threads if threads > 0 else None
+
 def _resolve_credentials_path():
     candidates = []
     env_path = os.environ.get('FIREBASE_CREDENTIALS_PATH')
@@ -129,56 +162,126 @@ def _init_firestore_client():
         traceback.print_exc()
         return None
 
-class MessCrowdRegressor:
-    """Simple regression model for predicting crowd using TensorFlow"""
-    
-    def __init__(self, mess_id):
-        self.mess_id = mess_id
-        self.model = None
-        self.scaler = None
-        models_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'models')
-        self.model_path = os.path.join(models_dir, f'{mess_id}_model.keras')
-        self.scaler_path = os.path.join(models_dir, f'{mess_id}_scaler.pkl')
-        self.metadata_path = os.path.join(models_dir, f'{mess_id}_metadata.json')
-        
-        # Create models directory if it doesn't exist
-        os.makedirs(models_dir, exist_ok=True)
-        
-    def create_model(self, input_dim):
-        """Create a simple regression neural network"""
-        model = keras.Sequential([
-            layers.Dense(32, activation='relu', input_shape=(input_dim,)),
-            layers.Dropout(0.2),
-            layers.Dense(16, activation='relu'),
-            layers.Dropout(0.2),
-            layers.Dense(8, activation='relu'),
-            layers.Dense(1)  # Output: predicted crowd count
-        ])
-        
-        model.compile(
-            optimizer=keras.optimizers.Adam(learning_rate=0.001),
-            loss='mse',
-            metrics=['mae']
+def _whole_count(value):
+    """Attendance count as an int; ValueError unless it is a whole number (17, 17.0, '17')"""
+    number = float(value)
+    if not number.is_integer():
+        raise ValueError(f"count {value!r} is not a whole number")
+    return int(number)
+
+# A time followed by 'Z', '+HH:MM', '+HHMM' or '+HH'
+_UTC_OFFSET_SUFFIX = r'[T ]\d\d:\d\d.*(?:Z|[+-]\d\d(?::?\d\d)?)$'
+
+
+def _local_offsets(utc_minutes):
+    """Local UTC offsets in minutes at the given UTC minutes since epoch"""
+    local_tz = _local_tz()
+    return np.array([
+        datetime.fromtimestamp(int(minute) * 60, tz=timezone.utc).astimezone(local_tz).utcoffset() // timedelta(minutes=1)
+        for minute in utc_minutes
+    ], dtype=np.int64)
+
+
+def _utc_to_local(utc):
+    """
+    Local naive datetime64[m] for UTC datetime64[m] values
+    Offsets are looked up once per day, and per 15 minutes on days whose
+    offset changes (DST transitions)
+    """
+    minutes = utc.astype(np.int64)
+    codes, days = pd.factorize(minutes // 1440)
+    first = _local_offsets(days * 1440)
+    offsets = first[codes]
+    changing = np.flatnonzero(first != _local_offsets(days * 1440 + 1439))
+    if len(changing):
+        rows = np.flatnonzero(np.isin(codes, changing))
+        quarter_codes, quarters = pd.factorize(minutes[rows] // 15)
+        offsets[rows] = _local_offsets(quarters * 15)[quarter_codes]
+    return (minutes + offsets).astype('datetime64[m]')
+
+
+def _parse_marked_at(values):
+    """
+    Bulk-parse markedAt values into local naive datetime64[m] (NaT = skip)
+    Mirrors the record path: ISO strings (naive ones taken as local time,
+    offset/Z ones converted to local time) and datetime objects; anything
+    else is skipped.
+    """
+    if values.dtype.kind == 'M':
+        return values.astype('datetime64[m]')
+
+    n = len(values)
+    parsed = np.full(n, np.datetime64('NaT'), dtype='datetime64[m]')
+    if values.dtype.kind in 'US' or pd.api.types.infer_dtype(values, skipna=False) == 'string':
+        is_str = np.ones(n, dtype=bool)
+    else:
+        is_str = np.fromiter((isinstance(value, str) for value in values), dtype=bool, count=n)
+
+    str_rows = np.flatnonzero(is_str)
+    if len(str_rows):
+        strings = pd.Series(values if len(str_rows) == n else values[str_rows], dtype=object)
+        try:
+            # All-naive or single-offset columns parse in one pass
+            stamps = pd.to_datetime(strings, format='ISO8601', errors='coerce')
+            aware = np.full(len(strings), stamps.dt.tz is not None)
+        except ValueError:
+            # Mixed offsets: utc=True keeps naive strings as written and turns Z/offset ones into UTC
+            stamps = pd.to_datetime(strings, format='ISO8601', utc=True, errors='coerce')
+            aware = strings.str.contains(_UTC_OFFSET_SUFFIX, na=False).to_numpy()
+        if stamps.dt.tz is not None:
+            stamps = stamps.dt.tz_convert('UTC').dt.tz_localize(None)
+        wall = stamps.to_numpy(dtype='datetime64[m]')
+        aware = aware & ~np.isnat(wall)
+        if aware.any():
+            wall[aware] = _utc_to_local(wall[aware])
+        parsed[str_rows] = wall
+
+    other_rows = np.flatnonzero(~is_str)
+    if len(other_rows):
+        objects = values[other_rows]
+        # Firestore timestamps that aren't datetimes yet (rare) are converted one by one
+        for idx in np.flatnonzero([hasattr(value, 'to_datetime') and not isinstance(value, datetime) for value in objects]):
+            try:
+                objects[idx] = objects[idx].to_datetime()
+            except Exception:
+                objects[idx] = None
+        is_datetime = np.fromiter((isinstance(value, datetime) for value in objects), dtype=bool, count=len(objects))
+        aware = is_datetime & np.fromiter(
+            (isinstance(value, datetime) and value.tzinfo is not None for value in objects), dtype=bool, count=len(objects)
         )
-        
-        return model
-    
-    def prepare_data(self, attendance_records):
-        """
-        Prepare training data from attendance records
-        Creates features: hour, day_of_week, meal_type (encoded), slot_minute
-        Target: crowd_count per 15-minute slot
-        """
-        features = []
-        targets = []
-        bucket_counts = defaultdict(int)
-        meal_midpoints = {
-            'breakfast': (8, 15),
-            'lunch': (13, 0),
-            'dinner': (20, 15),
-        }
-        
-        for record in attendance_records:
+        naive = is_datetime & ~aware
+        if naive.any():
+            parsed[other_rows[naive]] = pd.to_datetime(objects[naive]).to_numpy(dtype='datetime64[m]')
+        if aware.any():
+            utc = pd.to_datetime(objects[aware], utc=True).tz_localize(None).to_numpy(dtype='datetime64[m]')
+            parsed[other_rows[aware]] = _utc_to_local(utc)
+    return parsed
+
+class SlotBucketAggregator:
+    """
+    Streaming fold of attendance records into 15-minute slot-bucket counts
+    Records can be fed as they arrive (e.g. from iter_firebase_data), so
+    memory grows with the number of (date, slot) buckets, not with the
+    number of scans. Pass the aggregator to MessCrowdRegressor.train /
+    prepare_data in place of the records.
+    """
+
+    def __init__(self):
+        # (date, hour, slot_minute, day_of_week, meal_type) -> count
+        self.counts = defaultdict(int)
+        self.records = 0
+
+    def __len__(self):
+        return len(self.counts)
+
+    def update(self, attendance_records):
+        """Fold an iterable of record dicts in; returns self"""
+        bucket_counts = self.counts
+        meal_midpoints = MessCrowdRegressor.MEAL_MIDPOINTS
+        meal_codes = MessCrowdRegressor.MEAL_CODES
+        seen = 0
+
+        for seen, record in enumerate(attendance_records, 1):
             try:
                 count_override = record.get('count')
                 meal_hint = record.get('meal') or record.get('mealType')
@@ -197,14 +300,14 @@ class MessCrowdRegressor:
                             continue
                     hour, minute = midpoint
                     dt = base_date.replace(hour=hour, minute=minute, second=0, microsecond=0)
-                    meal_type = {'breakfast': 0, 'lunch': 1, 'dinner': 2}.get(normalized_meal, -1)
+                    meal_type = meal_codes.get(normalized_meal, -1)
                     if meal_type < 0:
                         continue
                     day_of_week = dt.weekday()
                     slot_minute = (dt.minute // 15) * 15
                     bucket_key = (dt.date(), hour, slot_minute, day_of_week, meal_type)
                     try:
-                        bucket_counts[bucket_key] += int(count_override)
+                        bucket_counts[bucket_key] += _whole_count(count_override)
                     except Exception:
                         continue
                     continue
@@ -253,18 +356,251 @@ class MessCrowdRegressor:
                 
             except Exception as e:
                 continue
+
+        self.records += seen
+        return self
+
+class MessCrowdRegressor:
+    """Simple regression model for predicting crowd using TensorFlow"""
+
+    SLOT_FEATURES = ['hour', 'day_of_week', 'meal_type', 'slot_minute']
+    INPUT_FEATURES = SLOT_FEATURES
+    MEAL_CODES = {'breakfast': 0, 'lunch': 1, 'dinner': 2}
+    # Slot used for per-meal count records (no scan timestamps available)
+    MEAL_MIDPOINTS = {
+        'breakfast': (8, 15),
+        'lunch': (13, 0),
+        'dinner': (20, 15),
+    }
+
+    # Warm-start settings for incremental retraining
+    INCREMENTAL_EPOCHS = 5
+    INCREMENTAL_LEARNING_RATE = 0.0003
+    INCREMENTAL_REPLAY_RATIO = 1.0  # older buckets replayed per new bucket, against forgetting
+    DRIFT_MEAN_SHIFT = 1.5   # target mean shift, in target stds of the last full fit
+    DRIFT_ERROR_RATIO = 2.0  # MAE on new buckets vs. final MAE at training time
+
+    # Input pipeline settings
+    TRAIN_EPOCHS = 10
+    HOLDOUT_FRACTION = 0.2   # newest share of slot buckets held out for validation
+    MIN_HOLDOUT_BUCKETS = 10  # below this many buckets there is no holdout
+    MIN_BATCH_SIZE = 4
+    MAX_BATCH_SIZE = 256
+    TARGET_STEPS_PER_EPOCH = 32
+    SHUFFLE_BUFFER = 10000
+    
+    def __init__(self, mess_id):
+        self.mess_id = mess_id
+        self.model = None
+        self.scaler = None
+        self.training_report = {}
+        # Classical backend serving this mess instead of the network (see model_backends)
+        self.backend = None
+        self.backend_name = 'keras'
+        self.backend_scores = {}
+        # What the last train() did: 'full', 'incremental', 'unchanged' or 'full_required'
+        self.training_mode = None
+        _configure_cpu_threads()
+        models_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'models')
+        self.model_path = os.path.join(models_dir, f'{mess_id}_model.keras')
+        self.scaler_path = os.path.join(models_dir, f'{mess_id}_scaler.pkl')
+        self.metadata_path = os.path.join(models_dir, f'{mess_id}_metadata.json')
+        # Models are published as versioned bundles; the loose files above
+        # are only read for models trained before bundles existed
+        self.models_dir = models_dir
+        self.bundle_path = None
+        
+        # Create models directory if it doesn't exist
+        os.makedirs(models_dir, exist_ok=True)
+        
+    def create_model(self, input_dim):
+        """Create a simple regression neural network"""
+        model = keras.Sequential([
+            layers.Dense(32, activation='relu', input_shape=(input_dim,)),
+            layers.Dropout(0.2),
+            layers.Dense(16, activation='relu'),
+            layers.Dropout(0.2),
+            layers.Dense(8, activation='relu'),
+            layers.Dense(1)  # Output: predicted crowd count
+        ])
+        
+        model.compile(
+            optimizer=keras.optimizers.Adam(learning_rate=0.001),
+            loss='mse',
+            metrics=['mae']
+        )
         
+        return model
+    
+    def _bucket_counts(self, attendance_records):
+        """Fold attendance records into per-slot counts keyed by
+        (date, hour, slot_minute, day_of_week, meal_type)"""
+        if isinstance(attendance_records, SlotBucketAggregator):
+            return attendance_records.counts
+        return SlotBucketAggregator().update(attendance_records).counts
+
+    def _bucket_arrays(self, bucket_counts):
+        """
+        Convert slot bucket counts into raw (unscaled) training arrays
+        Returns features, targets and the start time of each slot bucket
+        """
+        features = []
+        targets = []
+        slot_starts = []
         for (slot_date, hour, slot_minute, day_of_week, meal_type), count in bucket_counts.items():
             feature_vector = [hour, day_of_week, meal_type, slot_minute]
             features.append(feature_vector)
             targets.append(count)
+            slot_starts.append(datetime(slot_date.year, slot_date.month, slot_date.day, hour, slot_minute))
 
-        if len(features) < 5:
-            print(f"[WARN] Insufficient data for {self.mess_id}: {len(features)} slot buckets")
-            return None, None
-        
-        X = np.array(features, dtype=np.float32)
+        X = np.array(features, dtype=np.float32).reshape(-1, len(self.SLOT_FEATURES))
         y = np.array(targets, dtype=np.float32)
+        return X, y, np.array(slot_starts, dtype='datetime64[m]')
+
+    def _bucket_arrays_columnar(self, columns):
+        """
+        Vectorized equivalent of _bucket_arrays(_bucket_counts(records))
+        columns: DataFrame or mapping of equal-length arrays with 'markedAt'
+        and optionally 'meal'/'mealType', 'date' and 'count'. Missing values
+        (None/NaN/NaT) mean the field is absent from the record.
+        Produces the same features, targets and bucket order as the record path.
+        """
+        def _column(name):
+            if name not in columns:
+                return None
+            values = columns[name]
+            return values if isinstance(values, pd.Series) else pd.Series(values)
+
+        def _present(series):
+            # Vectorized bool(value) for None/NaN/empty-string values
+            if series is None:
+                return np.zeros(n, dtype=bool)
+            present = series.notna()
+            if series.dtype.kind not in 'biufcmM':
+                present &= series.astype(str) != ''
+            return present.to_numpy()
+
+        if isinstance(columns, pd.DataFrame):
+            n = len(columns)
+        else:
+            n = len(next(iter(columns.values()))) if columns else 0
+
+        # Slot index since the epoch (days * 96 + slot of day); -1 marks dropped rows
+        slot_index = np.full(n, -1, dtype=np.int64)
+        weights = np.ones(n, dtype=np.int64)
+
+        # --- Per-meal count records: bucketed at the meal midpoint ---
+        count = _column('count')
+        is_count = count.notna().to_numpy().copy() if count is not None else np.zeros(n, dtype=bool)
+        if is_count.any():
+            candidates = np.flatnonzero(is_count)
+            meal = _column('meal')
+            meal_type_hint = _column('mealType')
+            meal = meal.iloc[candidates].reset_index(drop=True) if meal is not None else None
+            if meal_type_hint is not None:
+                meal_type_hint = meal_type_hint.iloc[candidates].reset_index(drop=True)
+                meal = meal_type_hint if meal is None else meal.where(_present(meal)[:len(candidates)], meal_type_hint)
+            date = _column('date')
+            date = date.iloc[candidates].reset_index(drop=True) if date is not None else None
+            if meal is None or date is None:
+                is_count[candidates] = False
+            else:
+                is_count[candidates] = _present(meal)[:len(candidates)] & _present(date)[:len(candidates)]
+
+            keep = is_count[candidates]
+            rows = candidates[keep]
+            if len(rows):
+                meal_names = meal[keep].astype(str).str.strip().str.lower()
+                midpoint_minutes = meal_names.map({
+                    name: hour * 60 + minute for name, (hour, minute) in self.MEAL_MIDPOINTS.items()
+                }).to_numpy(dtype=np.float64)
+
+                dates = date[keep]
+                if dates.dtype.kind == 'M':
+                    day = dates.dt.tz_localize(None) if dates.dt.tz is not None else dates
+                    day = day.dt.normalize()
+                else:
+                    # Only the calendar date of the hint matters for the bucket
+                    day = pd.to_datetime(dates.astype(str).str.slice(0, 10), format='%Y-%m-%d', errors='coerce')
+                valid = ~np.isnan(midpoint_minutes) & day.notna().to_numpy()
+                day_numbers = day.to_numpy(dtype='datetime64[D]').astype(np.int64)
+
+                counts = pd.to_numeric(count.iloc[rows], errors='coerce').to_numpy(dtype=np.float64)
+                # An unparseable or fractional count still creates its (empty)
+                # bucket, like the record path
+                whole = np.isfinite(counts) & (counts == np.trunc(counts))
+                weights[rows] = np.where(whole, counts, 0).astype(np.int64)
+                minutes = np.nan_to_num(midpoint_minutes).astype(np.int64)
+                slot_index[rows[valid]] = day_numbers[valid] * 96 + (minutes[valid] // 15)
+
+        # --- Scan records: bucketed by markedAt ---
+        scan_rows = np.flatnonzero(~is_count)
+        if len(scan_rows) and 'markedAt' in columns:
+            marked = columns['markedAt']
+            marked = marked.to_numpy() if isinstance(marked, pd.Series) else np.asarray(marked)
+            if len(scan_rows) < n:
+                marked = marked[scan_rows]
+            stamps = _parse_marked_at(marked)
+            ok = ~np.isnat(stamps)
+            minute_stamps = stamps.astype(np.int64)
+            day_numbers = np.floor_divide(minute_stamps, 1440)
+            minute_of_day = minute_stamps - day_numbers * 1440
+            in_meal = (
+                ((minute_of_day >= 450) & (minute_of_day < 570))      # Breakfast 7:30-9:30
+                | ((minute_of_day >= 720) & (minute_of_day <= 840))   # Lunch 12:00-14:00 (14:00 included)
+                | ((minute_of_day >= 1170) & (minute_of_day < 1290))  # Dinner 19:30-21:30
+            )
+            keep = ok & in_meal
+            slot_index[scan_rows[keep]] = day_numbers[keep] * 96 + minute_of_day[keep] // 15
+
+        # --- Group by slot in first-seen order (matches dict insertion order) ---
+        kept = slot_index >= 0
+        codes, unique_slots = pd.factorize(slot_index[kept], sort=False)
+        totals = np.bincount(codes, weights=weights[kept], minlength=len(unique_slots))
+
+        unique_slots = np.asarray(unique_slots, dtype=np.int64)
+        day_numbers = np.floor_divide(unique_slots, 96)
+        slot_of_day = unique_slots - day_numbers * 96
+        hour = slot_of_day // 4
+        slot_minute = (slot_of_day % 4) * 15
+        day_of_week = (day_numbers + 3) % 7  # 1970-01-01 was a Thursday
+        minute_of_day = hour * 60 + slot_minute
+        meal_type = np.where(minute_of_day < 720, 0, np.where(minute_of_day <= 840, 1, 2))
+
+        X = np.column_stack([hour, day_of_week, meal_type, slot_minute]).astype(np.float32)
+        y = totals.astype(np.float32)
+        slot_starts = (day_numbers * 1440 + minute_of_day).astype('datetime64[m]')
+        return X.reshape(-1, len(self.SLOT_FEATURES)), y, slot_starts
+
+    def prepare_data_columnar(self, columns):
+        """
+        Columnar version of prepare_data for large histories
+        Parses timestamps in bulk and aggregates slot buckets with a group-by;
+        returns the same (X_scaled, y, scaler) as prepare_data
+        """
+        X, y, _ = self._bucket_arrays_columnar(columns)
+
+        if len(X) < 5:
+            print(f"[WARN] Insufficient data for {self.mess_id}: {len(X)} slot buckets")
+            return None, None
+
+        from sklearn.preprocessing import StandardScaler
+        scaler = StandardScaler()
+        X_scaled = scaler.fit_transform(X)
+
+        return X_scaled, y, scaler
+
+    def prepare_data(self, attendance_records):
+        """
+        Prepare training data from attendance records
+        Creates features: hour, day_of_week, meal_type (encoded), slot_minute
+        Target: crowd_count per 15-minute slot
+        """
+        X, y, _ = self._bucket_arrays(self._bucket_counts(attendance_records))
+
+        if len(X) < 5:
+            print(f"[WARN] Insufficient data for {self.mess_id}: {len(X)} slot buckets")
+            return None, None
         
         # Normalize features
         from sklearn.preprocessing import StandardScaler
@@ -273,15 +609,137 @@ class MessCrowdRegressor:
         
         return X_scaled, y, scaler
     
-    def train(self, attendance_records):
-        """Train the model on mess-specific attendance data"""
+    def train(self, attendance_records, incremental=False, full_fallback=True):
+        """
+        Train the model on mess-specific attendance data
+        attendance_records may be an iterable of record dicts, a
+        SlotBucketAggregator, or columns (DataFrame / dict of arrays) for the
+        vectorized path.
+        With incremental=True the saved model and scaler are fine-tuned on
+        slot buckets newer than trained_at in the metadata. A full retrain is
+        run instead when no compatible model exists or drift is detected;
+        with full_fallback=False (the records only cover the recent days)
+        nothing is trained then and training_mode is 'full_required'.
+        """
         print(f"\n[{self.mess_id}] Preparing training data...")
-        
-        result = self.prepare_data(attendance_records)
-        if result[0] is None:
+
+        if isinstance(attendance_records, (pd.DataFrame, dict)):
+            X_raw, y, slot_starts = self._bucket_arrays_columnar(attendance_records)
+        else:
+            X_raw, y, slot_starts = self._bucket_arrays(self._bucket_counts(attendance_records))
+
+        if incremental:
+            outcome = self._train_incremental(X_raw, y, slot_starts)
+            if outcome is not None:
+                return outcome
+            if not full_fallback:
+                self.training_mode = 'full_required'
+                return False
+
+        return self._train_full(X_raw, y, slot_starts)
+
+    def _auto_batch_size(self, num_samples):
+        """Power-of-two batch size giving roughly TARGET_STEPS_PER_EPOCH steps"""
+        target = max(1, num_samples // self.TARGET_STEPS_PER_EPOCH)
+        batch_size = 1 << max(0, int(target).bit_length() - 1)
+        return int(min(self.MAX_BATCH_SIZE, max(self.MIN_BATCH_SIZE, batch_size)))
+
+    def _time_holdout(self, num_samples, slot_starts):
+        """
+        Split indices into (train, holdout) by slot start time
+        The newest HOLDOUT_FRACTION of buckets validate a model fit on older
+        ones, mirroring how the model is used to predict the future
+        """
+        order = np.argsort(slot_starts, kind='stable')
+        if num_samples < self.MIN_HOLDOUT_BUCKETS:
+            return order, None
+        split = int(round(num_samples * (1 - self.HOLDOUT_FRACTION)))
+        return order[:split], order[split:]
+
+    def _make_dataset(self, inputs, y, batch_size, training):
+        """Cached, shuffled (when training), batched and prefetched tf.data pipeline"""
+        dataset = tf.data.Dataset.from_tensor_slices((inputs, y)).cache()
+        if training:
+            dataset = dataset.shuffle(min(len(y), self.SHUFFLE_BUFFER), reshuffle_each_iteration=True)
+        dataset = dataset.batch(batch_size).prefetch(tf.data.AUTOTUNE)
+
+        threads = _cpu_thread_budget()
+        if threads:
+            options = tf.data.Options()
+            options.threading.private_threadpool_size = threads
+            dataset = dataset.with_options(options)
+        return dataset
+
+    def _fit(self, model, inputs, y, slot_starts, epochs, holdout=True):
+        """
+        Fit through the tf.data pipeline and record throughput
+        inputs: feature array or dict of arrays (same leading dimension as y)
+        """
+        def _take(index):
+            if isinstance(inputs, dict):
+                return {name: values[index] for name, values in inputs.items()}
+            return inputs[index]
+
+        train_index, holdout_index = self._time_holdout(len(y), slot_starts) if holdout else (np.arange(len(y)), None)
+        batch_size = self._auto_batch_size(len(train_index))
+        train_data = self._make_dataset(_take(train_index), y[train_index], batch_size, training=True)
+        validation_data = None
+        if holdout_index is not None and len(holdout_index):
+            validation_data = self._make_dataset(_take(holdout_index), y[holdout_index], batch_size, training=False)
+
+        callbacks = [keras.callbacks.EarlyStopping(
+            monitor='val_loss' if validation_data is not None else 'loss',
+            patience=3,
+            restore_best_weights=True,
+        )]
+
+        started = time.perf_counter()
+        history = model.fit(
+            train_data,
+            validation_data=validation_data,
+            epochs=epochs,
+            callbacks=callbacks,
+            shuffle=False,  # the pipeline shuffles
+            verbose=0
+        )
+        wall_time = time.perf_counter() - started
+
+        epochs_run = len(history.history['loss'])
+        samples_per_sec = len(train_index) * epochs_run / wall_time if wall_time > 0 else 0.0
+        self.training_report = {
+            'batch_size': batch_size,
+            'epochs': epochs_run,
+            'train_samples': int(len(train_index)),
+            'holdout_samples': int(len(holdout_index)) if holdout_index is not None else 0,
+            'wall_time_s': round(wall_time, 3),
+            'samples_per_sec': round(samples_per_sec, 1),
+        }
+        print(f"[{self.mess_id}] {len(train_index)} samples x {epochs_run} epochs in {wall_time:.2f}s "
+              f"({samples_per_sec:.0f} samples/sec, batch {batch_size})")
+        return history
+
+    def _train_full(self, X_raw, y, slot_starts):
+        """
+        Fit a fresh model on the whole training window
+        With MODEL_BACKEND=auto the network is trained, then scored against the
+        classical backends on the time-ordered holdout (see _select_backend)
+        """
+        if len(X_raw) < 5:
+            print(f"[WARN] Insufficient data for {self.mess_id}: {len(X_raw)} slot buckets")
             return False
-        
-        X_scaled, y, scaler = result
+
+        choice = model_backends.configured_backend()
+        if choice in model_backends.BACKENDS:
+            # Forced classical backend: no network to train
+            print(f"[{self.mess_id}] Training {choice} backend with {len(X_raw)} records...")
+            self.backend = model_backends.create_backend(choice).fit(X_raw, y)
+            self.backend_name = choice
+            self._save_artifacts(None, y, mode='full')
+            return True
+
+        from sklearn.preprocessing import StandardScaler
+        scaler = StandardScaler()
+        X_scaled = scaler.fit_transform(X_raw)
         
         print(f"[{self.mess_id}] Training with {len(X_scaled)} records...")
         
@@ -290,39 +748,235 @@ class MessCrowdRegressor:
         self.model = self.create_model(input_dim)
         self.scaler = scaler
         
-        # Train with small batch and few epochs for quick training
-        history = self.model.fit(
-            X_scaled, y,
-            epochs=10,
-            batch_size=4,
-            validation_split=0.2,
-            callbacks=[keras.callbacks.EarlyStopping(monitor='loss', patience=3, restore_best_weights=True)],
-            verbose=0
+        history = self._fit(self.model, X_scaled.astype(np.float32), y, slot_starts, epochs=self.TRAIN_EPOCHS)
+
+        if choice == 'auto':
+            self._select_backend(X_raw, y, slot_starts)
+
+        self._save_artifacts(history, y, mode='full')
+        return True
+
+    def _select_backend(self, X_raw, y, slot_starts):
+        """
+        Score the trained network and every classical backend on the same
+        time-ordered holdout, then keep the lowest-latency backend whose MAE
+        is within BACKEND_MAE_TOLERANCE of the best
+        """
+        train_index, holdout_index = self._time_holdout(len(y), slot_starts)
+        if holdout_index is None:
+            print(f"[INFO] [{self.mess_id}] Too few slot buckets to compare backends; keeping keras")
+            return
+
+        X_train, y_train = X_raw[train_index], y[train_index]
+        X_holdout, y_holdout = X_raw[holdout_index], y[holdout_index]
+
+        # Scored through the same compiled call MessPredictionModel serves with
+        predict_fn = compiled_predict(self.model, X_holdout[:1].astype(np.float32))
+
+        def keras_predict(X):
+            return predict_fn(self.scaler.transform(X).astype(np.float32)).numpy().reshape(-1)
+
+        keras_mae = float(np.mean(np.abs(np.maximum(keras_predict(X_holdout), 0) - y_holdout)))
+        scores = {'keras': {
+            'mae': keras_mae,
+            'latency_ms': model_backends.measure_latency_ms(keras_predict, X_holdout),
+            'fit_s': self.training_report.get('wall_time_s'),
+        }}
+        for name in model_backends.BACKENDS:
+            _, mae, latency_ms, fit_seconds = model_backends.score_backend(name, X_train, y_train, X_holdout, y_holdout)
+            scores[name] = {'mae': mae, 'latency_ms': latency_ms, 'fit_s': round(fit_seconds, 3)}
+
+        selected = model_backends.select_backend(scores)
+        for name, score in scores.items():
+            marker = '*' if name == selected else ' '
+            print(f"  {marker} {name:<13} MAE {score['mae']:.3f}  latency {score['latency_ms']:.2f} ms")
+
+        if selected != 'keras':
+            # Refit on the whole window now that the holdout has done its job
+            self.backend = model_backends.create_backend(selected).fit(X_raw, y)
+        self.backend_name = selected
+        self.backend_scores = scores
+
+    def _load_existing(self):
+        """Load the saved model, scaler and metadata for a warm start"""
+        try:
+            bundle = model_bundle.load_current(self.models_dir, self.mess_id)
+        except model_bundle.BundleError as e:
+            print(f"[WARN] [{self.mess_id}] Could not load saved bundle for warm start: {e}")
+            return None, None, {}
+        if bundle is not None:
+            model = model_bundle.keras_model(bundle)
+            if model is None:
+                return None, None, {}
+            return model, model_bundle.standard_scaler(bundle), dict(bundle.metadata)
+
+        if not (os.path.exists(self.model_path) and os.path.exists(self.scaler_path)
+                and os.path.exists(self.metadata_path)):
+            return None, None, {}
+        try:
+            model = keras.models.load_model(self.model_path)
+            scaler = joblib.load(self.scaler_path)
+            with open(self.metadata_path, 'r') as f:
+                metadata = json.load(f)
+        except Exception as e:
+            print(f"[WARN] [{self.mess_id}] Could not load saved model for warm start: {e}")
+            return None, None, {}
+        return model, scaler, metadata
+
+    def _detect_drift(self, model, X_new, y_new, metadata):
+        """Return a reason string when new data no longer matches the saved model"""
+        target_mean = metadata.get('target_mean')
+        if target_mean is not None:
+            target_std = max(float(metadata.get('target_std') or 0.0), 1.0)
+            shift = abs(float(np.mean(y_new)) - float(target_mean)) / target_std
+            if shift > self.DRIFT_MEAN_SHIFT:
+                return f"target mean shifted by {shift:.2f} std"
+
+        final_mae = metadata.get('final_mae')
+        if final_mae is not None:
+            predicted = model.predict(X_new, verbose=0).reshape(-1)
+            current_mae = float(np.mean(np.abs(predicted - y_new)))
+            if current_mae > self.DRIFT_ERROR_RATIO * max(float(final_mae), 1.0):
+                return f"MAE on new data {current_mae:.2f} vs {float(final_mae):.2f} at training"
+
+        return None
+
+    def _train_incremental(self, X_raw, y, slot_starts):
+        """
+        Fine-tune the saved model on slot buckets newer than its trained_at
+        Returns True/False when the warm start handled training, or None when
+        a full retrain is required instead
+        """
+        model, scaler, metadata = self._load_existing()
+        if model is None:
+            print(f"[INFO] [{self.mess_id}] No saved model to warm start from; running full retrain")
+            return None
+
+        try:
+            model_features = model.input_shape[-1]
+        except Exception:
+            model_features = None
+        if (metadata.get('input_features') != self.INPUT_FEATURES
+                or getattr(scaler, 'n_features_in_', None) != len(self.INPUT_FEATURES)
+                or model_features != len(self.INPUT_FEATURES)):
+            print(f"[WARN] [{self.mess_id}] Feature mismatch in saved model; running full retrain")
+            return None
+
+        if metadata.get('backend', 'keras') != 'keras':
+            print(f"[INFO] [{self.mess_id}] Saved model uses the {metadata['backend']} backend; running full retrain")
+            return None
+
+        try:
+            trained_at = datetime.fromisoformat(metadata['trained_at'])
+        except Exception:
+            print(f"[WARN] [{self.mess_id}] Saved model has no usable trained_at; running full retrain")
+            return None
+
+        # Buckets are complete counts, so the slot containing trained_at is
+        # refit in full rather than from the scans that arrived after it.
+        cutoff = trained_at.replace(minute=(trained_at.minute // 15) * 15, second=0, microsecond=0)
+        mask = slot_starts >= np.datetime64(cutoff, 'm')
+        if not mask.any():
+            print(f"[INFO] [{self.mess_id}] No new slot buckets since {metadata['trained_at']}")
+            self.training_mode = 'unchanged'
+            return True
+
+        X_new = scaler.transform(X_raw[mask])
+        y_new = y[mask]
+
+        drift = self._detect_drift(model, X_new, y_new, metadata)
+        if drift:
+            print(f"[WARN] [{self.mess_id}] Drift detected ({drift}); running full retrain")
+            return None
+
+        fit_index = np.concatenate([np.flatnonzero(mask), self._replay_index(mask)])
+        print(f"[{self.mess_id}] Fine-tuning with {len(X_new)} new records "
+              f"and {len(fit_index) - len(X_new)} replayed ones...")
+
+        model.compile(
+            optimizer=keras.optimizers.Adam(learning_rate=self.INCREMENTAL_LEARNING_RATE),
+            loss='mse',
+            metrics=['mae']
         )
-        
-        # Save model and scaler
-        self.model.save(self.model_path)
-        joblib.dump(scaler, self.scaler_path)
+        # New buckets are few and all recent, so there is no holdout here
+        history = self._fit(
+            model, scaler.transform(X_raw[fit_index]).astype(np.float32), y[fit_index], slot_starts[fit_index],
+            epochs=self.INCREMENTAL_EPOCHS, holdout=False,
+        )
+
+        self.model = model
+        self.scaler = scaler
+        self.backend_scores = metadata.get('backend_scores') or {}
+        self._save_artifacts(history, y_new, mode='incremental', previous=metadata)
+        return True
+
+    def _replay_index(self, new_mask):
+        """Seeded sample of older buckets mixed into a fine-tune (INCREMENTAL_REPLAY_RATIO per new bucket)"""
+        old_index = np.flatnonzero(~new_mask)
+        size = min(len(old_index), int(np.ceil(self.INCREMENTAL_REPLAY_RATIO * int(new_mask.sum()))))
+        if size <= 0:
+            return old_index[:0]
+        return np.sort(np.random.default_rng(0).choice(old_index, size=size, replace=False))
+
+    def _save_artifacts(self, history, y, mode, previous=None):
+        """Publish model, scaler and metadata as one versioned bundle"""
+        arrays = {}
+        blobs = {}
+        keras_config = None
+        if history is not None:
+            arrays, keras_config = model_bundle.keras_arrays(self.model)
+            arrays.update(model_bundle.scaler_arrays(self.scaler))
+        if self.backend is not None:
+            blobs['backend'] = model_bundle.pickle_blob(self.backend)
+
+        previous = previous or {}
+        if mode == 'incremental':
+            # Drift checks compare against the distribution of the last full fit
+            target_mean = previous.get('target_mean')
+            target_std = previous.get('target_std')
+            full_trained_at = previous.get('full_trained_at', previous.get('trained_at'))
+            training_samples = int(previous.get('training_samples') or 0) + len(y)
+        else:
+            target_mean = float(np.mean(y))
+            target_std = float(np.std(y))
+            full_trained_at = None
+            training_samples = len(y)
         
         # Save metadata
+        trained_at = datetime.now().isoformat()
         metadata = {
             'mess_id': self.mess_id,
-            'trained_at': datetime.now().isoformat(),
-            'training_samples': len(X_scaled),
-            'input_features': ['hour', 'day_of_week', 'meal_type', 'slot_minute'],
-            'final_loss': float(history.history['loss'][-1]),
-            'final_mae': float(history.history['mae'][-1])
+            'trained_at': trained_at,
+            'full_trained_at': full_trained_at or trained_at,
+            'training_mode': mode,
+            'training_samples': training_samples,
+            'input_features': self.INPUT_FEATURES,
+            'target_mean': target_mean,
+            'target_std': target_std,
+            'final_loss': float(history.history['loss'][-1]) if history is not None else None,
+            'final_mae': float(history.history['mae'][-1]) if history is not None else None,
+            'training_report': self.training_report,
+            'backend': self.backend_name,
+            'backend_scores': self.backend_scores,
         }
+        if history is not None and 'val_mae' in history.history:
+            metadata['holdout_mae'] = float(history.history['val_mae'][-1])
+        metadata.update(self._extra_metadata())
+        metadata['keras_config'] = keras_config
         
-        with open(self.metadata_path, 'w') as f:
-            json.dump(metadata, f, indent=2)
-        
-        print(f"[OK] [{self.mess_id}] Model trained and saved")
-        print(f"  Loss: {history.history['loss'][-1]:.4f}")
-        print(f"  MAE: {history.history['mae'][-1]:.4f}")
+        version = model_bundle.publish(self.models_dir, self.mess_id, arrays, metadata, blobs)
+        self.training_mode = mode
+        self.bundle_path = model_bundle.bundle_path(self.models_dir, self.mess_id, version)
         
-        return True
+        print(f"[OK] [{self.mess_id}] Model trained and saved ({mode}, backend {self.backend_name})")
+        if history is not None:
+            print(f"  Loss: {history.history['loss'][-1]:.4f}")
+            print(f"  MAE: {history.history['mae'][-1]:.4f}")
     
+    def _extra_metadata(self):
+        """Model-specific metadata keys saved alongside the common ones"""
+        return {}
+
     def predict(self, hour, day_of_week, meal_type, slot_minute):
         """Predict crowd for given time"""
         if self.model is None:
@@ -340,215 +994,363 @@ class MessCrowdRegressor:
         # Ensure positive count
         return max(0, int(prediction))
 
+class GlobalCrowdRegressor(MessCrowdRegressor):
+    """
+    One model for all messes
+    Each mess gets a learned embedding and the mess capacity is an input,
+    so small messes borrow strength from large ones and serving loads a
+    single artifact however many messes there are. The target is the share
+    of capacity per slot; predictions are scaled back by capacity.
+    """
+
+    MODEL_NAME = 'global'
+    INPUT_FEATURES = MessCrowdRegressor.SLOT_FEATURES + ['log_capacity']
+    DEFAULT_CAPACITY = 100
+    EMBEDDING_DIM = 4
+    # Index 0 is the "unknown mess" embedding; this share of training rows
+    # is routed to it so messes onboarded after training get an average profile
+    UNKNOWN_MESS_SHARE = 0.1
+
+    def __init__(self):
+        super().__init__(self.MODEL_NAME)
+        self.mess_index = {}
+        self.capacities = {}
+
+    @classmethod
+    def capacity_feature(cls, capacity):
+        """Log capacity relative to the default; stays well-scaled when every mess has the same capacity"""
+        return np.log(np.maximum(capacity, 1.0) / cls.DEFAULT_CAPACITY)
+
+    def create_model(self, input_dim, num_messes):
+        """Shared dense network over [scaled features, mess embedding]"""
+        features = keras.Input(shape=(input_dim,), name='features')
+        mess = keras.Input(shape=(1,), dtype='int32', name='mess')
+        embedding = layers.Flatten()(layers.Embedding(num_messes + 1, self.EMBEDDING_DIM, name='mess_embedding')(mess))
+        x = layers.Concatenate()([features, embedding])
+        x = layers.Dense(32, activation='relu')(x)
+        x = layers.Dropout(0.2)(x)
+        x = layers.Dense(16, activation='relu')(x)
+        x = layers.Dropout(0.2)(x)
+        x = layers.Dense(8, activation='relu')(x)
+        output = layers.Dense(1)(x)  # Output: predicted share of capacity
+
+        model = keras.Model(inputs={'features': features, 'mess': mess}, outputs=output)
+        model.compile(
+            optimizer=keras.optimizers.Adam(learning_rate=0.001),
+            loss='mse',
+            metrics=['mae']
+        )
+        return model
+
+    def train(self, records_by_mess, capacities=None):
+        """
+        Train on every mess at once
+        records_by_mess: {mess_id: records or columns}, as for MessCrowdRegressor.train
+        capacities: optional {mess_id: capacity}; DEFAULT_CAPACITY otherwise
+        """
+        capacities = capacities or {}
+        features, targets, mess_codes, starts, used = [], [], [], [], {}
+
+        for mess_id, records in records_by_mess.items():
+            if isinstance(records, (pd.DataFrame, dict)):
+                X_raw, y, slot_starts = self._bucket_arrays_columnar(records)
+            else:
+                X_raw, y, slot_starts = self._bucket_arrays(self._bucket_counts(records or []))
+            if not len(X_raw):
+                print(f"[WARN] [global] No usable slot buckets for {mess_id}")
+                continue
+
+            try:
+                capacity = float(capacities.get(mess_id) or self.DEFAULT_CAPACITY)
+            except (TypeError, ValueError):
+                capacity = float(self.DEFAULT_CAPACITY)
+            used[mess_id] = (len(used) + 1, capacity)
+            features.append(np.column_stack([X_raw, np.full(len(X_raw), self.capacity_feature(capacity), dtype=np.float32)]))
+            targets.append(y / capacity)
+            mess_codes.append(np.full(len(X_raw), used[mess_id][0], dtype=np.int32))
+            starts.append(slot_starts)
+
+        total = sum(len(y) for y in targets)
+        if total < 5:
+            print(f"[WARN] Insufficient data for the global model: {total} slot buckets")
+            return False
+
+        X_raw = np.concatenate(features).astype(np.float32)
+        y = np.concatenate(targets).astype(np.float32)
+        slot_starts = np.concatenate(starts)
+        codes = np.concatenate(mess_codes)
+        rng = np.random.default_rng(0)
+        codes = np.where(rng.random(len(codes)) < self.UNKNOWN_MESS_SHARE, 0, codes).astype(np.int32)
+
+        from sklearn.preprocessing import StandardScaler
+        scaler = StandardScaler()
+        X_scaled = scaler.fit_transform(X_raw)
+
+        print(f"[global] Training with {len(X_scaled)} records from {len(used)} messes...")
+
+        self.model = self.create_model(X_scaled.shape[1], len(used))
+        self.scaler = scaler
+        self.mess_index = {mess_id: code for mess_id, (code, _) in used.items()}
+        self.capacities = {mess_id: capacity for mess_id, (_, capacity) in used.items()}
+
+        # The time-ordered holdout spans every mess
+        history = self._fit(
+            self.model,
+            {'features': X_scaled.astype(np.float32), 'mess': codes.reshape(-1, 1)},
+            y, slot_starts, epochs=self.TRAIN_EPOCHS,
+        )
+
+        self._save_artifacts(history, y, mode='full')
+        return True
+
+    def _extra_metadata(self):
+        return {
+            'mess_index': self.mess_index,
+            'capacities': self.capacities,
+            'target': 'capacity_share',
+        }
+
+
 def load_firebase_data(mess_id, days_back=7):
     """
     Load attendance data from Firebase for specific mess
     Path: attendance/{mess_id}/{date}/{meal}/students
+    Materializes every record; training should fold iter_firebase_data()
+    into a SlotBucketAggregator instead.
+    """
+    return list(iter_firebase_data(mess_id, days_back=days_back))
+
+def iter_firebase_data(mess_id, days_back=7):
+    """
+    Yield attendance records for a specific mess as they are read
+    Path: attendance/{mess_id}/{date}/{meal}/students
+    Only one meal's student documents are held at a time.
     """
     try:
-        db = _init_firestore_client()
+        db = firestore_metrics.instrument(_init_firestore_client())
         if db is None:
-            return []
-        if _FIRESTORE_DISABLED:
-            return []
-
-        try:
-            query_timeout_s = int(os.environ.get('FIRESTORE_QUERY_TIMEOUT', '30'))
-        except Exception:
-            query_timeout_s = 30
-        try:
-            max_errors = int(os.environ.get('FIRESTORE_MAX_ERRORS', '5'))
-        except Exception:
-            max_errors = 5
-        attendance_records = []
+            return
+        breaker = firestore_breaker.get_breaker()
+        if breaker.is_open():
+            print(f"[WARN] Firestore circuit open; skipping load for {mess_id} (retry in {breaker.retry_in():.0f}s)")
+            return
 
-        try:
-            # Query mess-specific data: attendance/{mess_id}/{date}/{meal}/students
-            print(f"[QUERY] Querying Firebase for {mess_id} (days_back={days_back}, timeout={query_timeout_s}s)...")
-            mess_ref = db.collection('attendance').document(mess_id)
+        with firestore_metrics.job('load_firebase_data', db, mess=mess_id, days_back=days_back):
+            query_timeout_s = int(env_float('FIRESTORE_QUERY_TIMEOUT', 30))
+            max_errors = int(env_float('FIRESTORE_MAX_ERRORS', 5))
+            try:
+                # Query mess-specific data: attendance/{mess_id}/{date}/{meal}/students
+                print(f"[QUERY] Querying Firebase for {mess_id} (days_back={days_back}, timeout={query_timeout_s}s)...")
+                mess_ref = db.collection('attendance').document(mess_id)
             
-            # Get all dates for this mess
-            # Note: Firestore doesn't support wildcards, so we need to iterate
-            # Try common date formats from now backwards
-            collected_records = 0
+                # Get all dates for this mess
+                # Note: Firestore doesn't support wildcards, so we need to iterate
+                # Try common date formats from now backwards
+                collected_records = 0
             
-            meal_types = ('breakfast', 'lunch', 'dinner')
-            error_count = 0
-
-            for day_offset in range(days_back):
-                if _FIRESTORE_DISABLED:
-                    break
-                check_date = datetime.now() - timedelta(days=day_offset)
-                date_str = check_date.strftime('%Y-%m-%d')
-                if day_offset == 0 or day_offset % 7 == 0:
-                    print(f"[QUERY] Scanning date: {date_str}")
-                
-                try:
-                    date_ref = mess_ref.collection(date_str)
+                meal_types = ('breakfast', 'lunch', 'dinner')
+                error_count = 0
 
-                    for meal_type in meal_types:
-                        if _FIRESTORE_DISABLED:
-                            break
-                        try:
-                            students_ref = date_ref.document(meal_type).collection('students')
-                            students = _safe_stream(
-                                students_ref,
-                                query_timeout_s,
-                                f"{mess_id}/{date_str}/{meal_type}/students",
-                            )
-                            if students is None:
-                                error_count += 1
-                                if error_count >= max_errors:
-                                    print("[WARN] Too many Firestore errors; stopping scan.")
-                                    return attendance_records
-                                continue
+                for day_offset in range(days_back):
+                    if breaker.is_open():
+                        break
+                    check_date = datetime.now() - timedelta(days=day_offset)
+                    date_str = check_date.strftime('%Y-%m-%d')
+                    if day_offset == 0 or day_offset % 7 == 0:
+                        print(f"[QUERY] Scanning date: {date_str}")
+                
+                    try:
+                        date_ref = mess_ref.collection(date_str)
 
-                            for student_doc in students:
-                                student_data = student_doc.to_dict() or {}
-
-                                # Extract record info
-                                enrollment_id = student_doc.id
-                                marked_at = student_data.get('markedAt')
-                                if hasattr(marked_at, 'to_datetime'):
-                                    try:
-                                        marked_at = marked_at.to_datetime()
-                                    except Exception:
-                                        pass
-                                if hasattr(marked_at, 'isoformat'):
-                                    marked_at = marked_at.isoformat()
-                                student_name = student_data.get('studentName', 'Unknown')
-                                marked_by = student_data.get('markedBy', 'unknown')
-
-                                attendance_records.append({
-                                    'enrollmentId': enrollment_id,
-                                    'markedAt': marked_at,
-                                    'studentName': student_name,
-                                    'markedBy': marked_by,
-                                    'messId': mess_id,
-                                    'meal': meal_type,
-                                    'date': date_str
-                                })
-                                collected_records += 1
-                        except Exception as e:
-                            if _disable_firestore_if_needed(e, f"{mess_id}/{date_str}/{meal_type}"):
+                        for meal_type in meal_types:
+                            if breaker.is_open():
                                 break
-                            continue
+                            try:
+                                students_ref = date_ref.document(meal_type).collection('students')
+                                students = _safe_stream(
+                                    students_ref,
+                                    query_timeout_s,
+                                    f"{mess_id}/{date_str}/{meal_type}/students",
+                                )
+                                if students is None:
+                                    error_count += 1
+                                    if error_count >= max_errors:
+                                        print("[WARN] Too many Firestore errors; stopping scan.")
+                                        return
+                                    continue
+
+                                for student_doc in students:
+                                    student_data = student_doc.to_dict() or {}
+
+                                    # Extract record info
+                                    enrollment_id = student_doc.id
+                                    marked_at = student_data.get('markedAt')
+                                    if hasattr(marked_at, 'to_datetime'):
+                                        try:
+                                            marked_at = marked_at.to_datetime()
+                                        except Exception:
+                                            pass
+                                    if hasattr(marked_at, 'isoformat'):
+                                        marked_at = marked_at.isoformat()
+                                    student_name = student_data.get('studentName', 'Unknown')
+                                    marked_by = student_data.get('markedBy', 'unknown')
+
+                                    yield {
+                                        'enrollmentId': enrollment_id,
+                                        'markedAt': marked_at,
+                                        'studentName': student_name,
+                                        'markedBy': marked_by,
+                                        'messId': mess_id,
+                                        'meal': meal_type,
+                                        'date': date_str
+                                    }
+                                    collected_records += 1
+                            except Exception as e:
+                                if breaker.is_open():
+                                    break
+                                continue
                 
-                except Exception as e:
-                    # Date collection might not exist
-                    continue
+                    except Exception as e:
+                        # Date collection might not exist
+                        continue
             
-            print(f"[OK] Loaded {len(attendance_records)} attendance records for {mess_id}")
-            return attendance_records
+                print(f"[OK] Loaded {collected_records} attendance records for {mess_id}")
             
-        except Exception as e:
-            print(f"[ERROR] Error querying attendance: {e}")
-            import traceback
-            traceback.print_exc()
-            return []
+            except Exception as e:
+                print(f"[ERROR] Error querying attendance: {e}")
+                import traceback
+                traceback.print_exc()
             
     except Exception as e:
         print(f"[ERROR] Firebase error: {e}")
         import traceback
         traceback.print_exc()
-        return []
 
-def generate_dummy_attendance_data(mess_id, days=7, records_per_day=40):
+def generate_dummy_attendance_data(mess_id, days=7, records_per_day=40, seed=None):
     """
     Generate dummy attendance data for testing/development
-    Simulates realistic attendance patterns
+    Simulates realistic attendance patterns with the vectorized generator in
+    synthetic_data.py (records_per_day is the mess capacity per meal)
     """
     print(f"[INFO] Generating dummy data for {mess_id}...")
-    
-    records = []
-    now = datetime.now()
-    
-    meal_times = {
-        'breakfast': (7, 30, 9, 30),     # 7:30-9:30
-        'lunch': (12, 0, 14, 0),         # 12:00-14:00
-        'dinner': (19, 30, 21, 30)       # 19:30-21:30
-    }
-    
-    for day_offset in range(days):
-        current_date = now - timedelta(days=day_offset)
-        date_str = current_date.strftime('%Y-%m-%d')
-        
-        for meal_name, (start_h, start_m, end_h, end_m) in meal_times.items():
-            # Generate students for this meal
-            num_students = np.random.randint(10, records_per_day)
-            
-            for student_num in range(num_students):
-                # Random time within meal window
-                minutes_into_meal = np.random.randint(0, (end_h - start_h) * 60 + (end_m - start_m))
-                
-                student_hour = start_h + (start_m + minutes_into_meal) // 60
-                student_minute = (start_m + minutes_into_meal) % 60
-                
-                student_time = current_date.replace(
-                    hour=student_hour,
-                    minute=student_minute,
-                    second=np.random.randint(0, 60),
-                    microsecond=0
-                )
-                
-                records.append({
-                    'enrollmentId': f'STUDENT_{day_offset}_{meal_name}_{student_num}',
-                    'markedAt': student_time.isoformat(),
-                    'studentName': f'Student {day_offset}_{student_num}',
-                    'markedBy': 'manual' if np.random.random() > 0.7 else 'qr',
-                    'messId': mess_id,
-                    'meal': meal_name,
-                    'date': date_str
-                })
-    
+    events = synthetic_data.generate_events(
+        [mess_id], days=days, capacities={mess_id: records_per_day}, seed=seed
+    )
+    records = synthetic_data.to_records(events)
     print(f"[OK] Generated {len(records)} dummy records for {mess_id}")
     return records
 
-def train_mess_model_from_data(mess_id, attendance_records):
-    """Train a model directly from provided attendance records."""
-    if not attendance_records:
+def saved_trained_at(mess_id):
+    """When the published model of a mess was trained (None when there is none)"""
+    regressor = MessCrowdRegressor(mess_id)
+    try:
+        bundle = model_bundle.load_current(regressor.models_dir, mess_id)
+        if bundle is not None:
+            metadata = bundle.metadata
+        else:
+            with open(regressor.metadata_path, 'r') as f:
+                metadata = json.load(f)
+        return datetime.fromisoformat(metadata['trained_at'])
+    except (OSError, ValueError, KeyError, TypeError, model_bundle.BundleError):
+        return None
+
+def train_mess_model_from_data(mess_id, attendance_records, incremental=False, full_fallback=True):
+    """
+    Train a model directly from provided attendance records.
+    Returns the training mode that ran ('full', 'incremental', or 'unchanged'
+    when an incremental run found no new data), 'full_required' when
+    full_fallback=False kept a full retrain from running, or False on failure.
+    """
+    if len(attendance_records) == 0:
         print(f"[WARN] No training data provided for {mess_id}")
         return False
     regressor = MessCrowdRegressor(mess_id)
-    return regressor.train(attendance_records)
+    if not regressor.train(attendance_records, incremental=incremental, full_fallback=full_fallback):
+        return 'full_required' if regressor.training_mode == 'full_required' else False
+    return regressor.training_mode
+
+def train_global_model_from_data(records_by_mess, capacities=None):
+    """Train the shared multi-mess model from {mess_id: attendance records}."""
+    if not records_by_mess:
+        print("[WARN] No training data provided for the global model")
+        return False
+    regressor = GlobalCrowdRegressor()
+    return regressor.train(records_by_mess, capacities=capacities)
+
+def train_global(mess_ids):
+    """Train the shared multi-mess model for the given messes"""
+    print(f"[TARGET] Training global model for messes: {', '.join(mess_ids)}")
+
+    print(f"\n[STEP 1/2] Loading attendance data...")
+    records_by_mess = {}
+    for mess_id in mess_ids:
+        buckets = SlotBucketAggregator().update(iter_firebase_data(mess_id, days_back=30))
+        if not buckets.records:
+            print(f"[WARN] No Firebase data found for {mess_id}")
+            buckets.update(generate_dummy_attendance_data(mess_id, days=7))
+        records_by_mess[mess_id] = buckets
+
+    print(f"\n[STEP 2/2] Training global regression model...")
+    regressor = GlobalCrowdRegressor()
+    if regressor.train(records_by_mess):
+        print("\n" + "=" * 70)
+        print(f"[OK] Global training completed for {len(regressor.mess_index)} messes!")
+        print(f"  Bundle saved: {regressor.bundle_path}")
+        print("=" * 70)
+        return 0
+    print("\n" + "=" * 70)
+    print("[ERROR] Global training failed")
+    print("=" * 70)
+    return 1
 
 def main():
-    """Main training pipeline"""
+    """Main training pipeline (profiled when PROFILE_TRAINING=1)"""
+    args = [arg for arg in sys.argv[1:] if not arg.startswith('--')]
+    stage = 'train_global' if '--global' in sys.argv[1:] else 'train'
+    with profiling.profile(stage, '+'.join(args) or 'alder', training=True):
+        return _train_main()
+
+def _train_main():
     print("=" * 70)
     print("SmartMess TensorFlow Mess-Specific Crowd Prediction Model Training")
     print("=" * 70)
     
     # Get mess ID from command line or use default
-    mess_id = sys.argv[1] if len(sys.argv) > 1 else 'alder'
+    args = [arg for arg in sys.argv[1:] if not arg.startswith('--')]
+    mess_id = args[0] if args else 'alder'
+    incremental = '--incremental' in sys.argv[1:]
+    if '--global' in sys.argv[1:]:
+        return train_global(args or ['alder'])
     
     print(f"[TARGET] Training model for mess: {mess_id}")
+    if incremental:
+        print("[INFO] Incremental mode: fine-tuning the saved model on new data")
     
-    # Step 1: Load data from Firebase
+    # Step 1: Stream data from Firebase straight into slot buckets
     print(f"\n[STEP 1/3] Loading attendance data for {mess_id}...")
-    attendance_records = load_firebase_data(mess_id, days_back=30)
+    buckets = SlotBucketAggregator().update(iter_firebase_data(mess_id, days_back=30))
     
     # If no Firebase data, generate dummy data
-    if not attendance_records:
+    if not buckets.records:
         print(f"[WARN] No Firebase data found for {mess_id}")
         print(f"[INFO] Expected path: attendance/{mess_id}/{{date}}/{{meal}}/students")
-        attendance_records = generate_dummy_attendance_data(mess_id, days=7)
+        buckets.update(generate_dummy_attendance_data(mess_id, days=7))
     
-    if not attendance_records:
+    if not buckets:
         print(f"[ERROR] No training data available")
         return 1
+    print(f"[INFO] Folded {buckets.records} records into {len(buckets)} slot buckets")
     
     # Step 2: Train model
     print(f"\n[STEP 2/3] Training regression model for {mess_id}...")
     regressor = MessCrowdRegressor(mess_id)
     
-    success = regressor.train(attendance_records)
+    success = regressor.train(buckets, incremental=incremental)
     
     if success:
         print("\n" + "=" * 70)
         print(f"[OK] Training completed successfully for {mess_id}!")
-        print(f"  Model saved: {regressor.model_path}")
-        print(f"  Scaler saved: {regressor.scaler_path}")
-        print(f"  Metadata saved: {regressor.metadata_path}")
+        print(f"  Bundle saved: {regressor.bundle_path}")
         print("=" * 70)
         return 0
     else: